@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+# Usage: python src/analysis.py <run_dir> [<run_dir> ...]
+
+#
+# Loads ping and streaming logs from experiment runs into NumPy arrays and
+# summarizes the delays. Parsed files are cached next to them as .npz files
+# (keyed by the file's mtime and size), so re-analyzing or re-plotting many
+# runs only parses what changed.
+#
+
+
+import os
+import sys
+import glob
+import numpy as np
+from logtail import last_timestamp
+
+
+# Bytes read from a file at a time while parsing.
+CHUNK_SIZE = 1 << 20
+
+# z for a 95% confidence interval (normal approximation).
+Z_95 = 1.96
+
+PING_DTYPE = [('seq', np.int64), ('rtt', np.float64)]
+
+
+def _scan(path, parse, chunk_size=CHUNK_SIZE):
+    """
+    Parse a file of any length into an array.
+
+    The file is read a chunk at a time, split on line boundaries, and each
+    chunk is handed to parse whole.
+
+    Args:
+        path: File to parse.
+        parse: Function from a uint8 array of whole lines to a NumPy array.
+    """
+    parts = []
+    rest = ""
+    with open(path, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            end = chunk.rfind('\n') + 1
+            rest = chunk[end:]
+            if end:
+                parts.append(parse(np.frombuffer(chunk, np.uint8, end)))
+    if rest:
+        parts.append(parse(np.frombuffer(rest, np.uint8)))
+    if not parts:
+        return parse(np.zeros(0, np.uint8))
+    return np.concatenate(parts)
+
+
+def _fields(buf, eq, key):
+    """
+    Return the indices just past every "<key>=" in buf.
+
+    Args:
+        eq: Indices of all the '=' in buf.
+    """
+    at = eq[eq >= len(key)]
+    # Last character first, since that rules out most of them.
+    for i, c in enumerate(reversed(key)):
+        at = at[buf[at - i - 1] == ord(c)]
+    return at + 1
+
+
+def _numbers(buf, starts):
+    """
+    Parse the unsigned decimal numbers which start at the given indices.
+
+    All the numbers are parsed together, one character position at a time,
+    so the work is per digit column rather than per number.
+
+    Returns (values, ends), where ends are the indices just past each
+    number. A number with no digits is zero long.
+    """
+    value = np.zeros(len(starts))
+    scale = np.ones(len(starts))
+    seen_dot = np.zeros(len(starts), dtype=bool)
+    live = np.ones(len(starts), dtype=bool)
+    ends = starts.copy()
+    pos = starts.copy()
+    while True:
+        live &= pos < len(buf)
+        c = buf[np.where(live, pos, 0)]
+        digit = c - ord('0')        # Wraps around for bytes below '0'.
+        is_digit = live & (digit <= 9)
+        is_dot = live & (c == ord('.'))
+        live = is_digit | is_dot
+        if not live.any():
+            break
+        value = np.where(is_digit, value * 10 + digit, value)
+        seen_dot |= is_dot
+        scale[is_digit & seen_dot] *= 10
+        ends[live] = pos[live] + 1
+        pos += 1
+    return value / scale, ends
+
+
+def _parse_ping(buf):
+    """
+    Pull (icmp_seq, time) out of the reply lines of ping output.
+
+    Lines with an icmp_seq but no time (e.g., unreachable) are skipped.
+    """
+    eq = np.flatnonzero(buf == ord('='))
+    seq_at = _fields(buf, eq, "icmp_seq")
+    time_at = _fields(buf, eq, "time")
+    newlines = np.flatnonzero(buf == ord('\n'))
+    # Pair each time with the icmp_seq before it on the same line.
+    i = np.searchsorted(seq_at, time_at) - 1
+    ok = i >= 0
+    ok[ok] = (np.searchsorted(newlines, seq_at[i[ok]]) ==
+              np.searchsorted(newlines, time_at[ok]))
+    seq_at, time_at = seq_at[i[ok]], time_at[ok]
+    seq, seq_end = _numbers(buf, seq_at)
+    rtt, rtt_end = _numbers(buf, time_at)
+    ok = (seq_end > seq_at) & (rtt_end > time_at)
+    r = np.zeros(ok.sum(), dtype=PING_DTYPE)
+    r['seq'] = seq[ok]
+    r['rtt'] = rtt[ok]
+    return r
+
+
+def _cached(path, parse):
+    """
+    Return parse(path), using <path>.npz if it matches the file.
+
+    Args:
+        path: Data file.
+        parse: Function from a path to a NumPy array.
+    """
+    st = os.stat(path)
+    stamp = np.array([st.st_mtime, st.st_size], dtype=np.float64)
+    cache = path + ".npz"
+    try:
+        with np.load(cache) as f:
+            if np.array_equal(f['stamp'], stamp):
+                return f['data']
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    data = parse(path)
+    try:
+        tmp = cache + ".%d.npz" % (os.getpid(),)
+        np.savez(tmp, stamp=stamp, data=data)
+        os.rename(tmp, cache)
+    except (IOError, OSError):
+        pass    # Read-only results; we'll just parse again next time.
+    return data
+
+
+def read_ping(path):
+    """
+    Read a ping output file.
+
+    Returns a structured array with 'seq' (icmp_seq) and 'rtt' (ms) fields.
+    Lost pings simply have no entry.
+    """
+    return _cached(path, lambda p: _scan(p, _parse_ping))
+
+
+def one_way_delays(*pings):
+    """
+    Add up the one-way delays (RTT / 2) of ping trains hop by hop.
+
+    Samples are matched up by icmp_seq, and only sequence numbers present
+    in every train are kept.
+
+    Returns (seq, delay in ms) arrays.
+    """
+    seq = pings[0]['seq']
+    for p in pings[1:]:
+        seq = np.intersect1d(seq, p['seq'])
+    delay = np.zeros(len(seq))
+    for p in pings:
+        order = np.argsort(p['seq'], kind='mergesort')
+        idx = order[np.searchsorted(p['seq'], seq, sorter=order)]
+        delay += p['rtt'][idx] / 2.0
+    return seq, delay
+
+
+def delay_stats(delays):
+    """
+    Summarize a delay distribution.
+
+    Returns a dict with the sample count, mean, the 95% confidence interval
+    of the mean, and the p50/p95/p99 delays.
+    """
+    delays = np.asarray(delays, dtype=np.float64)
+    n = len(delays)
+    if n == 0:
+        return dict(n=0)
+    mean = delays.mean()
+    half = Z_95 * delays.std(ddof=1) / np.sqrt(n) if n > 1 else np.nan
+    p50, p95, p99 = np.percentile(delays, [50, 95, 99])
+    return dict(n=n, mean=mean, ci=(mean - half, mean + half),
+                p50=p50, p95=p95, p99=p99)
+
+
+def compare(cdn, bypass):
+    """
+    Compare CDN and bypass delay samples.
+
+    Returns a dict with the difference of the means (CDN - bypass) and its
+    95% confidence interval, and the differences of the percentiles.
+    """
+    a = delay_stats(cdn)
+    b = delay_stats(bypass)
+    if not a['n'] or not b['n']:
+        return dict(cdn=a, bypass=b)
+    cdn = np.asarray(cdn, dtype=np.float64)
+    bypass = np.asarray(bypass, dtype=np.float64)
+    diff = a['mean'] - b['mean']
+    se = np.sqrt(cdn.var(ddof=1) / len(cdn) +
+                 bypass.var(ddof=1) / len(bypass))
+    r = dict(cdn=a, bypass=b, diff=diff,
+             ci=(diff - Z_95 * se, diff + Z_95 * se))
+    for k in ('p50', 'p95', 'p99'):
+        r[k] = a[k] - b[k]
+    return r
+
+
+def load_run(run_dir):
+    """
+    Load whatever results a run directory has.
+
+    Understands both live.py's output directory (b2s.ping, s2v-<ip>.ping,
+    b2v-<ip>.ping and the *.log files) and the results directory that
+    run.sh fills (direct-b2s.ping, direct-s2v.ping, bypass-b2v.ping).
+
+    Returns a dict which may have:
+        cdn: (seq, delay) of broadcaster -> CDN -> viewer from pings.
+        bypass: (seq, delay) of broadcaster -> viewer from pings.
+        cdn_stream: ms from the broadcaster's CDN stream ending to each
+            viewer's ending (vfs-*.log - b2s.log).
+        bypass_stream: Likewise for P2P streams (vfp-<ip>.log -
+            b2v-<ip>.log).
+    """
+    def find(*patterns):
+        for p in patterns:
+            found = sorted(glob.glob(os.path.join(run_dir, p)))
+            if found:
+                return found
+        return []
+
+    run = {}
+    b2s = find("b2s.ping", "direct-b2s.ping")
+    s2v = find("s2v-*.ping", "direct-s2v.ping")
+    b2v = find("b2v-*.ping", "bypass-b2v.ping")
+    if b2s and s2v:
+        run['cdn'] = one_way_delays(read_ping(b2s[0]), read_ping(s2v[0]))
+    if b2v:
+        run['bypass'] = one_way_delays(read_ping(b2v[0]))
+
+    b2s_log = os.path.join(run_dir, "b2s.log")
+    if os.path.exists(b2s_log):
+        tb = last_timestamp(b2s_log)
+        run['cdn_stream'] = np.array([last_timestamp(p) - tb
+                                      for p in find("vfs-*.log")])
+    stream = []
+    for vfp in find("vfp-*.log"):
+        b2v_log = os.path.join(run_dir,
+                               "b2v-" + os.path.basename(vfp)[4:])
+        if os.path.exists(b2v_log):
+            stream.append(last_timestamp(vfp) - last_timestamp(b2v_log))
+    if stream:
+        run['bypass_stream'] = np.array(stream)
+    return run
+
+
+def _format_stats(s):
+    if not s['n']:
+        return "no samples"
+    return ("n=%d mean=%.1f (95%% CI %.1f..%.1f) p50=%.1f p95=%.1f p99=%.1f"
+            % (s['n'], s['mean'], s['ci'][0], s['ci'][1],
+               s['p50'], s['p95'], s['p99']))
+
+
+def main(run_dirs):
+    """
+    Print per-run delay distributions and the CDN vs. bypass comparison
+    over all runs.
+    """
+    cdn, bypass = [], []
+    for d in run_dirs:
+        run = load_run(d)
+        print "### %s ###" % (d,)
+        if 'cdn' in run:
+            cdn.append(run['cdn'][1])
+            print "  CDN ping delay (ms):    " + _format_stats(
+                delay_stats(run['cdn'][1]))
+        if 'bypass' in run:
+            bypass.append(run['bypass'][1])
+            print "  Bypass ping delay (ms): " + _format_stats(
+                delay_stats(run['bypass'][1]))
+        for k in ('cdn_stream', 'bypass_stream'):
+            if k in run:
+                print "  %s end delay (ms): %s" % (k.split('_')[0],
+                                                  list(run[k]))
+
+    if cdn and bypass:
+        c = compare(np.concatenate(cdn), np.concatenate(bypass))
+        print "### CDN - bypass over %d run(s) ###" % (len(run_dirs),)
+        print ("  mean %.1f ms (95%% CI %.1f..%.1f), p50 %.1f, p95 %.1f, "
+               "p99 %.1f" % (c['diff'], c['ci'][0], c['ci'][1],
+                             c['p50'], c['p95'], c['p99']))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: python src/analysis.py <run_dir> [<run_dir> ...]"
+        exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+# Usage: python src/analysis_test.py
+
+#
+# Tests for analysis.py and logtail.py. They need NumPy but not Mininet.
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import analysis
+from logtail import last_timestamp
+
+
+def _reply(seq, rtt):
+    return "64 bytes from 10.0.0.3: icmp_seq=%d ttl=64 time=%s ms\n" % (
+        seq, rtt)
+
+
+class AnalysisTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as fd:
+            fd.write(text)
+        return path
+
+    def test_parse_ping(self):
+        path = self._write("a.ping",
+                           "PING 10.0.0.3 (10.0.0.3) 56(84) bytes of data.\n" +
+                           _reply(1, "0.045") +
+                           "From 10.0.0.1 icmp_seq=2 Destination Host "
+                           "Unreachable\n" +
+                           _reply(3, "1042") +
+                           _reply(4, "12.5") +
+                           "\n--- 10.0.0.3 ping statistics ---\n"
+                           "rtt min/avg/max/mdev = 0.045/351.5/1042/490.1 ms"
+                           "\n" +
+                           _reply(5, "7.25").rstrip())
+        p = analysis.read_ping(path)
+        self.assertEqual(list(p['seq']), [1, 3, 4, 5])
+        self.assertEqual(list(p['rtt']), [0.045, 1042, 12.5, 7.25])
+
+    def test_chunks(self):
+        # Lines cut across chunks come out the same.
+        text = "".join(_reply(n, "%d.%03d" % (n, n)) for n in range(1, 300))
+        path = self._write("a.ping", text)
+        whole = analysis._scan(path, analysis._parse_ping)
+        for size in (7, 50, 1000):
+            p = analysis._scan(path, analysis._parse_ping, size)
+            self.assertTrue(np.array_equal(p, whole))
+        self.assertEqual(list(whole['seq']), range(1, 300))
+        self.assertAlmostEqual(whole['rtt'][-1], 299.299)
+
+    def test_lost_pings(self):
+        # Pings lost on either hop drop that seq instead of shifting the
+        # rest out of step.
+        b2s = np.array([(1, 2.0), (2, 4.0), (4, 6.0), (5, 8.0)],
+                       dtype=analysis.PING_DTYPE)
+        s2v = np.array([(5, 20.0), (1, 10.0), (3, 30.0), (4, 40.0)],
+                       dtype=analysis.PING_DTYPE)
+        seq, delay = analysis.one_way_delays(b2s, s2v)
+        self.assertEqual(list(seq), [1, 4, 5])
+        self.assertEqual(list(delay), [6.0, 23.0, 14.0])
+
+    def test_cache(self):
+        path = self._write("a.ping", _reply(1, "2.0"))
+        calls = []
+
+        def parse(p):
+            calls.append(p)
+            return analysis._scan(p, analysis._parse_ping)
+
+        self.assertEqual(list(analysis._cached(path, parse)['seq']), [1])
+        self.assertTrue(os.path.exists(path + ".npz"))
+        self.assertEqual(list(analysis._cached(path, parse)['seq']), [1])
+        self.assertEqual(len(calls), 1)
+
+        # A changed file (here, a different size) is parsed again.
+        with open(path, 'ab') as fd:
+            fd.write(_reply(2, "3.0"))
+        self.assertEqual(list(analysis._cached(path, parse)['seq']), [1, 2])
+        self.assertEqual(len(calls), 2)
+
+        # A cache that can't be read is ignored.
+        with open(path + ".npz", 'wb') as fd:
+            fd.write("junk")
+        self.assertEqual(list(analysis._cached(path, parse)['seq']), [1, 2])
+        self.assertEqual(len(calls), 3)
+
+    def test_last_timestamp(self):
+        self.assertEqual(last_timestamp(self._write("a.log", "1234\n")),
+                         1234)
+        # The final line, past a long log and trailing blank lines.
+        path = self._write("b.log", "x" * 10000 + "\r" + "y" * 20000 +
+                           "\n1500000000123\r\n\n")
+        self.assertEqual(last_timestamp(path), 1500000000123)
+        # A last line longer than the first block read.
+        path = self._write("c.log", "frame\n" + "9" * 5000 + "\n")
+        self.assertEqual(last_timestamp(path), int("9" * 5000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,7 @@ from mininet.link import TCLink
 from mininet.node import RemoteController, OVSSwitch
 from mininet.util import dumpNodeConnections
 from topo import LivestreamingSingleTopo
+from logtail import last_timestamp
 
 
 ROOT_DIR = os.path.abspath(os.path.dirname(sys.argv[0])) + "/.."
@@ -85,11 +86,9 @@ def _parse_delay(net):
     Parse delay in milliseconds, assuming correct logging.
     """
     hv = net.get('hv1')
-    with open(OUTPUT_DIR+"/b2v-"+hv.IP()+".log") as fb, \
-         open(OUTPUT_DIR+"/vfp-"+hv.IP()+".log") as fv:
-        tb = int([l.strip() for l in fb.read().split('\n') if l][-1])
-        tv = int([l.strip() for l in fv.read().split('\n') if l][-1])
-        return tv - tb
+    tb = last_timestamp(OUTPUT_DIR+"/b2v-"+hv.IP()+".log")
+    tv = last_timestamp(OUTPUT_DIR+"/vfp-"+hv.IP()+".log")
+    return tv - tb
 
 
 def livestremaing_test(video_file, dump_file):
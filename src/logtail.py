@@ -0,0 +1,31 @@
+#!/usr/bin/python
+
+#
+# Reads the final timestamp of a streaming log. Kept apart from analysis.py
+# so that live.py, which runs under Mininet, doesn't need NumPy.
+#
+
+
+import os
+import re
+
+
+def last_timestamp(path):
+    """
+    Return the last line of a streaming log as an integer.
+
+    The hosts append a millisecond timestamp when ffmpeg/mplayer exits.
+    Only the end of the file is read, however long the log is.
+    """
+    with open(path, 'rb') as fd:
+        fd.seek(0, os.SEEK_END)
+        size = fd.tell()
+        block = 4096
+        while True:
+            start = max(0, size - block)
+            fd.seek(start)
+            tail = fd.read(size - start)
+            lines = [l for l in re.split(r"[\r\n]", tail) if l.strip()]
+            if len(lines) > 1 or start == 0:
+                return int(lines[-1].strip())
+            block *= 4
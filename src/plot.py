@@ -5,6 +5,7 @@ import os
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
+from analysis import read_ping, one_way_delays
 
 
 ROOT_DIR = os.path.abspath(os.path.dirname(sys.argv[0])) + "/.."
@@ -17,35 +18,17 @@ def plot_delays():
     """
     stream_interval = (15, 45)
 
-    # Read 60 secs from direct-b2s.
-    direct_delays = []
-    with open(RESULT_DIR+"/direct-b2s.ping", 'r') as fd:
-        fd.readline()
-        for i in range(60):
-            line = fd.readline().strip()
-            rtt = int(line[line.rfind('=')+1:line.rfind('ms')-1])
-            direct_delays.append(rtt/2)
-            
-    # Read 60 secs from direct-s2v, and add to the direct delays.
-    with open(RESULT_DIR+"/direct-s2v.ping", 'r') as fd:
-        fd.readline()
-        for i in range(60):
-            line = fd.readline().strip()
-            rtt = int(line[line.rfind('=')+1:line.rfind('ms')-1])
-            direct_delays[i] += (rtt/2)
-
-    # Read 60 secs from bypass-b2v.
-    bypass_delays = []
-    with open(RESULT_DIR+"/bypass-b2v.ping", 'r') as fd:
-        fd.readline()
-        for i in range(60):
-            line = fd.readline().strip()
-            rtt = int(line[line.rfind('=')+1:line.rfind('ms')-1])
-            bypass_delays.append(rtt/2)
+    # Direct delays add up direct-b2s and direct-s2v, matched by icmp_seq.
+    # Pings go out every second, so icmp_seq n was sent n-1 seconds in.
+    direct_seq, direct_delays = one_way_delays(
+        read_ping(RESULT_DIR+"/direct-b2s.ping"),
+        read_ping(RESULT_DIR+"/direct-s2v.ping"))
+    bypass_seq, bypass_delays = one_way_delays(
+        read_ping(RESULT_DIR+"/bypass-b2v.ping"))
 
     # Plotting.
-    plt.plot(direct_delays, c='b', label="Original")
-    plt.plot(bypass_delays, c='r', label="Bypassed")
+    plt.plot(direct_seq - 1, direct_delays, c='b', label="Original")
+    plt.plot(bypass_seq - 1, bypass_delays, c='r', label="Bypassed")
     plt.axvline(x=stream_interval[0], linestyle='--', c='0.5')
     plt.axvline(x=stream_interval[1], linestyle='--', c='0.5',
                 label="Streaming interval")
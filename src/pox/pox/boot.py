@@ -133,6 +133,13 @@ def _do_import (name):
   return do_import2(name, ["pox." + name, name])
 
 
+# component name -> [seconds importing, seconds in launch()]
+_startup_times = {}
+
+# When boot() was called
+_boot_time = None
+
+
 def _do_imports (components):
   """
   Import each of the listed components
@@ -143,16 +150,110 @@ def _do_imports (components):
   done = {}
   for name in components:
     if name in done: continue
+    start = time.time()
     r = _do_import(name)
     if r is False:
       return False
     members = dict(inspect.getmembers(sys.modules[r]))
     done[name] = (r,sys.modules[r],members)
+    _startup_times.setdefault(r, [0, 0])[0] += time.time() - start
 
   return done
 
 
-def _do_launch (argv):
+def _check_params (f, params):
+  """
+  Checks whether launch function f can be called with params
+
+  Returns None if so, or a message saying why not.
+  """
+  code = f.__code__
+  argnames = code.co_varnames[:code.co_argcount]
+  if not (code.co_flags & inspect.CO_VARKEYWORDS):
+    for k in params:
+      if k not in argnames:
+        return ("This component does not have a parameter named "
+                + "'{0}'.".format(k))
+  defaults = f.func_defaults or ()
+  for k in argnames[:len(argnames) - len(defaults)]:
+    if k not in params:
+      return "You must specify a value for the '{0}' parameter.".format(k)
+  return None
+
+
+def _show_launch_help (name, launch, f, params):
+  """
+  Shows documentation and parameters for a launch function
+
+  params are the ones it was given.  If they're the problem, says so.
+  Returns False (i.e., abort startup).
+  """
+  params = dict(params)
+  EMPTY = "<Unspecified>"
+  code = f.__code__
+  argcount = code.co_argcount
+  argnames = code.co_varnames[:argcount]
+  defaults = list((f.func_defaults) or [])
+  defaults = [EMPTY] * (argcount - len(defaults)) + defaults
+  args = {}
+  for n, a in enumerate(argnames):
+    args[a] = [EMPTY,EMPTY]
+    if n < len(defaults):
+      args[a][0] = defaults[n]
+    if a in params:
+      args[a][1] = params[a]
+      del params[a]
+  if '__INSTANCE__' in args:
+    del args['__INSTANCE__']
+
+  if f.__doc__ is not None:
+    print("Documentation for {0}:".format(name))
+    doc = f.__doc__.split("\n")
+    #TODO: only strip the same leading space as was on the first
+    #      line
+    doc = map(str.strip, doc)
+    print('',("\n ".join(doc)).strip())
+
+  #print(params)
+  #print(args)
+
+  print("Parameters for {0}:".format(name))
+  if len(args) == 0:
+    print(" None.")
+  else:
+    print(" {0:25} {1:25} {2:25}".format("Name", "Default",
+                                        "Active"))
+    print(" {0:25} {0:25} {0:25}".format("-" * 15))
+
+    for k,v in args.iteritems():
+      print(" {0:25} {1:25} {2:25}".format(k,str(v[0]),
+            str(v[1] if v[1] is not EMPTY else v[0])))
+
+  if len(params) and not (code.co_flags & inspect.CO_VARKEYWORDS):
+    print("This component does not have a parameter named "
+          + "'{0}'.".format(params.keys()[0]))
+    return False
+  missing = [k for k,x in args.iteritems()
+             if x[1] is EMPTY and x[0] is EMPTY]
+  if len(missing):
+    print("You must specify a value for the '{0}' "
+          "parameter.".format(missing[0]))
+    return False
+
+  return False
+
+
+def _make_launch_plan (argv):
+  """
+  Works out what needs launching with what parameters
+
+  This imports all the components and checks all the parameters before
+  any component is launched, so that a mistake anywhere on the
+  commandline stops startup before anything has started.
+
+  Returns a list of (component name, launch function name, function,
+  params), or False on failure.
+  """
   component_order = []
   components = {}
 
@@ -187,6 +288,7 @@ def _do_launch (argv):
   if modules is False:
     return False
 
+  plan = []
   inst = {}
   for name in component_order:
     cname = name
@@ -239,87 +341,79 @@ def _do_launch (argv):
         print(name, "does not accept multiple instances")
         return False
 
-      try:
-        if f(**params) is False:
-          # Abort startup
-          return False
-      except TypeError as exc:
+      if _check_params(f, params) is not None:
         instText = ''
         if inst[cname] > 0:
           instText = "instance {0} of ".format(inst[cname] + 1)
         print("Error executing {2}{0}.{1}:".format(name,launch,instText))
-        if inspect.currentframe() is sys.exc_info()[2].tb_frame:
-          # Error is with calling the function
-          # Try to give some useful feedback
-          if _options.verbose:
-            traceback.print_exc()
-          else:
-            exc = sys.exc_info()[0:2]
-            print(''.join(traceback.format_exception_only(*exc)), end='')
-          print()
-          EMPTY = "<Unspecified>"
-          code = f.__code__
-          argcount = code.co_argcount
-          argnames = code.co_varnames[:argcount]
-          defaults = list((f.func_defaults) or [])
-          defaults = [EMPTY] * (argcount - len(defaults)) + defaults
-          args = {}
-          for n, a in enumerate(argnames):
-            args[a] = [EMPTY,EMPTY]
-            if n < len(defaults):
-              args[a][0] = defaults[n]
-            if a in params:
-              args[a][1] = params[a]
-              del params[a]
-          if '__INSTANCE__' in args:
-            del args['__INSTANCE__']
-
-          if f.__doc__ is not None:
-            print("Documentation for {0}:".format(name))
-            doc = f.__doc__.split("\n")
-            #TODO: only strip the same leading space as was on the first
-            #      line
-            doc = map(str.strip, doc)
-            print('',("\n ".join(doc)).strip())
-
-          #print(params)
-          #print(args)
-
-          print("Parameters for {0}:".format(name))
-          if len(args) == 0:
-            print(" None.")
-          else:
-            print(" {0:25} {1:25} {2:25}".format("Name", "Default",
-                                                "Active"))
-            print(" {0:25} {0:25} {0:25}".format("-" * 15))
-
-            for k,v in args.iteritems():
-              print(" {0:25} {1:25} {2:25}".format(k,str(v[0]),
-                    str(v[1] if v[1] is not EMPTY else v[0])))
-
-          if len(params):
-            print("This component does not have a parameter named "
-                  + "'{0}'.".format(params.keys()[0]))
-            return False
-          missing = [k for k,x in args.iteritems()
-                     if x[1] is EMPTY and x[0] is EMPTY]
-          if len(missing):
-            print("You must specify a value for the '{0}' "
-                  "parameter.".format(missing[0]))
-            return False
-
-          return False
-        else:
-          # Error is inside the function
-          raise
+        return _show_launch_help(name, launch, f, params)
+
+      plan.append((name, launch, f, params))
     elif len(params) > 0 or launch is not "launch":
       print("Module %s has no %s(), but it was specified or passed " \
             "arguments" % (name, launch))
       return False
 
+  return plan
+
+
+def _do_launch (argv):
+  plan = _make_launch_plan(argv)
+  if plan is False:
+    return False
+
+  for name,launch,f,params in plan:
+    start = time.time()
+    try:
+      if f(**params) is False:
+        # Abort startup
+        return False
+    except TypeError as exc:
+      instText = ''
+      if params.get('__INSTANCE__', (0,))[0] > 0:
+        instText = "instance {0} of ".format(params['__INSTANCE__'][0] + 1)
+      print("Error executing {2}{0}.{1}:".format(name,launch,instText))
+      if inspect.currentframe() is sys.exc_info()[2].tb_frame:
+        # Error is with calling the function
+        # Try to give some useful feedback
+        if _options.verbose:
+          traceback.print_exc()
+        else:
+          exc = sys.exc_info()[0:2]
+          print(''.join(traceback.format_exception_only(*exc)), end='')
+        print()
+        return _show_launch_help(name, launch, f, params)
+      else:
+        # Error is inside the function
+        raise
+    finally:
+      _startup_times.setdefault(name, [0, 0])[1] += time.time() - start
+
   return True
 
 
+def _report_startup ():
+  """
+  Logs how long startup took and where the time went
+  """
+  log = logging.getLogger("boot")
+  up = time.time()
+  if not log.isEnabledFor(logging.DEBUG): return
+  log.debug("Up %0.3f seconds after boot", up - _boot_time)
+  times = sorted(_startup_times.items(), key=lambda x: -sum(x[1]))
+  for name,(imp,launch) in times:
+    log.debug(" %-30s import %6.1fms  launch %6.1fms", name,
+              imp * 1000, launch * 1000)
+
+  if core.hasComponent("openflow"):
+    def first_connection (event):
+      log.debug("First switch connected %0.3f seconds after boot "
+                "(%0.3f seconds after up)",
+                time.time() - _boot_time, time.time() - up)
+    core.openflow.addListenerByName("ConnectionUp", first_connection,
+                                    once=True)
+
+
 class Options (object):
   def set (self, given_name, value):
     name = given_name.replace("-", "_")
@@ -511,6 +605,9 @@ def boot (argv = None):
   sys.path.insert(0, os.path.abspath(os.path.join(base, 'pox')))
   sys.path.insert(0, os.path.abspath(os.path.join(base, 'ext')))
 
+  global _boot_time
+  _boot_time = time.time()
+
   thread_count = threading.active_count()
 
   quiet = False
@@ -532,6 +629,7 @@ def boot (argv = None):
     if _do_launch(argv):
       _post_startup()
       core.goUp()
+      _report_startup()
     else:
       #return
       quiet = True
@@ -29,8 +29,9 @@ import inspect
 import time
 import os
 import signal
+import sys
 
-_path = inspect.stack()[0][1]
+_path = sys._getframe().f_code.co_filename
 _ext_path = _path[0:_path.rindex(os.sep)]
 _ext_path = os.path.dirname(_ext_path) + os.sep
 _path = os.path.dirname(_path) + os.sep
@@ -41,14 +42,17 @@ _squelch = ''
 _squelchTime = 0
 _squelchCount = 0
 
+# (code, line, class of self) -> "[Class.function:line] " for print()
+_call_sites = {}
+
 def getLogger (name=None, moreFrames=0):
   """
   In general, you don't need to call this directly, and will use
   core.getLogger() instead.
   """
   if name is None:
-    s = inspect.stack()[1+moreFrames]
-    name = s[1]
+    # (inspect.stack() would be much slower, since it reads source files)
+    name = sys._getframe(1+moreFrames).f_code.co_filename
     if name.endswith('.py'):
       name = name[0:-3]
     elif name.endswith('.pyc'):
@@ -78,12 +82,19 @@ def getLogger (name=None, moreFrames=0):
   if not hasattr(l, "print"):
     def printmsg (*args, **kw):
       #squelch = kw.get('squelch', True)
+      if not l.isEnabledFor(logging.DEBUG): return
       msg = ' '.join((str(s) for s in args))
-      s = inspect.stack()[1]
-      o = '['
-      if 'self' in s[0].f_locals:
-        o += s[0].f_locals['self'].__class__.__name__ + '.'
-      o += s[3] + ':' + str(s[2]) + '] '
+      f = sys._getframe(1)
+      f_locals = f.f_locals
+      cls = f_locals['self'].__class__ if 'self' in f_locals else None
+      site = (f.f_code, f.f_lineno, cls)
+      o = _call_sites.get(site)
+      if o is None:
+        o = '['
+        if cls is not None:
+          o += cls.__name__ + '.'
+        o += f.f_code.co_name + ':' + str(f.f_lineno) + '] '
+        _call_sites[site] = o
       o += msg
       if o == _squelch:
         if time.time() >= _squelchTime:
@@ -471,6 +471,8 @@ class SoftwareSwitchBase (object):
     packet: an instance of ethernet
     in_port: the integer port number
     packet_data: packed version of packet if available
+
+    Returns the flow table entry which matched the packet, if any.
     """
     assert assert_type("packet", packet, ethernet, none_ok=False)
     assert assert_type("in_port", in_port, int, none_ok=False)
@@ -510,10 +512,13 @@ class SoftwareSwitchBase (object):
       self.port_stats[in_port].rx_bytes += len(packet.pack()) # Expensive
 
     self._lookup_count += 1
-    entry = self.table.entry_for_packet(packet, in_port)
+    entry = self.table.entry_for_packet(packet, in_port, packet_data)
     if entry is not None:
       self._matched_count += 1
-      entry.touch_packet(len(packet))
+      if packet_data is not None:
+        entry.touch_packet(len(packet_data))
+      else:
+        entry.touch_packet(len(packet))
       self._process_actions_for_packet(entry.actions, packet, in_port)
     else:
       # no matching entry
@@ -524,6 +529,7 @@ class SoftwareSwitchBase (object):
         packet_data = packet.pack()
       self.send_packet_in(in_port, buffer_id, packet_data,
                           reason=OFPR_NO_MATCH, data_length=self.miss_send_len)
+    return entry
 
   def delete_port (self, port):
     """
@@ -620,6 +626,31 @@ class SoftwareSwitchBase (object):
     """
     self.log.info("Sending packet %s out port %s", str(packet), port_no)
 
+  def _can_output (self, port_no, in_port, allow_in_port=False):
+    """
+    Checks whether a packet may be sent out a given port
+
+    Logs the reason and returns False if the packet should be dropped.
+    """
+    if port_no == in_port and not allow_in_port:
+      self.log.warn("Dropping packet sent on port %i: Input port", port_no)
+      return False
+    port = self.ports.get(port_no)
+    if port is None:
+      self.log.warn("Dropping packet sent on port %i: Invalid port", port_no)
+      return False
+    if port.config & OFPPC_NO_FWD:
+      self.log.warn("Dropping packet sent on port %i: Forwarding disabled",
+                    port_no)
+      return False
+    if port.config & OFPPC_PORT_DOWN:
+      self.log.warn("Dropping packet sent on port %i: Port down", port_no)
+      return False
+    if port.state & OFPPS_LINK_DOWN:
+      self.log.debug("Dropping packet sent on port %i: Link down", port_no)
+      return False
+    return True
+
   def _output_packet (self, packet, out_port, in_port, max_len=None):
     """
     send a packet out some port
@@ -635,22 +666,7 @@ class SoftwareSwitchBase (object):
     def real_send (port_no, allow_in_port=False):
       if type(port_no) == ofp_phy_port:
         port_no = port_no.port_no
-      if port_no == in_port and not allow_in_port:
-        self.log.warn("Dropping packet sent on port %i: Input port", port_no)
-        return
-      if port_no not in self.ports:
-        self.log.warn("Dropping packet sent on port %i: Invalid port", port_no)
-        return
-      if self.ports[port_no].config & OFPPC_NO_FWD:
-        self.log.warn("Dropping packet sent on port %i: Forwarding disabled",
-                      port_no)
-        return
-      if self.ports[port_no].config & OFPPC_PORT_DOWN:
-        self.log.warn("Dropping packet sent on port %i: Port down", port_no)
-        return
-      if self.ports[port_no].state & OFPPS_LINK_DOWN:
-        self.log.debug("Dropping packet sent on port %i: Link down", port_no)
-        return
+      if not self._can_output(port_no, in_port, allow_in_port): return
       self.port_stats[port_no].tx_packets += 1
       self.port_stats[port_no].tx_bytes += len(packet.pack()) #FIXME: Expensive
       self._output_packet_physical(packet, port_no)
@@ -23,18 +23,28 @@ keep more state in the controller (that is, your flow tables),
 and/or you should make your topology more static.  However, this
 does (mostly) work. :)
 
+Media flows (e.g., livestreams) can be routed separately, on the paths
+with the lowest latency (as measured by discovery) and enough spare
+capacity (as measured by openflow.link_utilization, if it's running).
+When a link gets congested, the media flows crossing it are rerouted.
+To enable this, use --media (for RTMP and P2P livestreaming flows) or
+--media=<comma-separated TCP/UDP ports>.
+
 Depends on openflow.discovery
-Works with openflow.spanning_tree
+Works with openflow.spanning_tree, openflow.link_utilization
 """
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.openflow.match_key import packet_in_match
 from pox.lib.revent import *
 from pox.lib.recoco import Timer
 from collections import defaultdict
 from pox.openflow.discovery import Discovery
 from pox.lib.util import dpid_to_str
+from pox.lib.graph.shortest_paths import ShortestPaths
 import time
+import itertools
 
 log = core.getLogger()
 
@@ -47,12 +57,27 @@ switches = {}
 # ethaddr -> (switch, port)
 mac_map = {}
 
-# [sw1][sw2] -> (distance, intermediate)
-path_map = defaultdict(lambda:defaultdict(lambda:(None,None)))
+# Shortest paths between switches (kept in sync with adjacency)
+shortest_paths = ShortestPaths()
+
+# Shortest paths for media flows, weighted by latency and load
+media_paths = ShortestPaths()
 
 # Waiting path.  (dpid,xid)->WaitingPath
 waiting_paths = {}
 
+# Installed paths.  cookie -> InstalledPath
+installed_paths = {}
+
+# Installed paths crossing each link.  frozenset((sw1,sw2)) -> set(cookie)
+link_paths = defaultdict(set)
+
+# Installed paths ending at each port.  (sw,port) -> set(cookie)
+port_paths = defaultdict(set)
+
+# Cookies for the flows of installed paths
+_cookies = itertools.count(1)
+
 # Time to not flood in seconds
 FLOOD_HOLDDOWN = 5
 
@@ -63,62 +88,74 @@ FLOW_HARD_TIMEOUT = 30
 # How long is allowable to set up a path?
 PATH_SETUP_TIME = 4
 
+# TCP/UDP ports of media flows (None disables media routing)
+MEDIA_PORTS = None
 
-def _calc_paths ():
-  """
-  Essentially Floyd-Warshall algorithm
-  """
+# Default media ports (RTMP and the livestreaming P2P peer port)
+DEFAULT_MEDIA_PORTS = (1935, 2000)
 
-  def dump ():
-    for i in sws:
-      for j in sws:
-        a = path_map[i][j][0]
-        #a = adjacency[i][j]
-        if a is None: a = "*"
-        print a,
-      print
-
-  sws = switches.values()
-  path_map.clear()
-  for k in sws:
-    for j,port in adjacency[k].iteritems():
-      if port is None: continue
-      path_map[k][j] = (1,None)
-    path_map[k][k] = (0,None) # distance, intermediate
+# Latency to assume for links which haven't been measured (seconds)
+DEFAULT_LINK_LATENCY = 0.001
+
+# Extra weight for congested links (seconds)
+CONGESTED_LINK_PENALTY = 10
+
+# Media link weights are only updated when they change by this fraction
+WEIGHT_CHANGE_THRESHOLD = 0.1
+
+# How often to update media link weights (seconds)
+WEIGHT_UPDATE_INTERVAL = 2
 
-  #dump()
 
-  for k in sws:
-    for i in sws:
-      for j in sws:
-        if path_map[i][k][0] is not None:
-          if path_map[k][j][0] is not None:
-            # i -> k -> j exists
-            ikj_dist = path_map[i][k][0]+path_map[k][j][0]
-            if path_map[i][j][0] is None or ikj_dist < path_map[i][j][0]:
-              # i -> k -> j is better than existing
-              path_map[i][j] = (ikj_dist, k)
+def _update_paths (sw1, sw2):
+  """
+  Updates shortest_paths after adjacency between sw1 and sw2 changed
+  """
+  for a,b in ((sw1,sw2),(sw2,sw1)):
+    if adjacency[a][b] is None:
+      shortest_paths.remove_link(a, b)
+      media_paths.remove_link(a, b)
+    else:
+      shortest_paths.set_link(a, b)
+      if MEDIA_PORTS is not None:
+        media_paths.set_link(a, b, _media_weight(a, b))
 
-  #print "--------------------"
-  #dump()
 
+def _media_weight (sw1, sw2):
+  """
+  Weight of the link from sw1 to sw2 for media paths
 
-def _get_raw_path (src, dst):
+  This is the link's latency, inflated as the link fills up (roughly the
+  way queueing delay grows), plus a big penalty if it's congested.
+  """
+  port = adjacency[sw1][sw2]
+  link = Discovery.Link(sw1.dpid, port, sw2.dpid, adjacency[sw2][sw1])
+  w = core.openflow_discovery.link_latency.get(link, DEFAULT_LINK_LATENCY)
+  if core.hasComponent("link_utilization"):
+    load = core.link_utilization.ports.get((sw1.dpid, port))
+    if load is not None:
+      u = load.utilization
+      if u is not None: w /= max(1 - u, 0.05)
+      if load.congested: w += CONGESTED_LINK_PENALTY
+  return w
+
+
+def _update_media_weights ():
   """
-  Get a raw path (just a list of nodes to traverse)
+  Updates media_paths with current link latency and load
   """
-  if len(path_map) == 0: _calc_paths()
-  if src is dst:
-    # We're here!
-    return []
-  if path_map[src][dst][0] is None:
-    return None
-  intermediate = path_map[src][dst][1]
-  if intermediate is None:
-    # Directly connected
-    return []
-  return _get_raw_path(src, intermediate) + [intermediate] + \
-         _get_raw_path(intermediate, dst)
+  for sw1,neighbors in adjacency.items():
+    for sw2,port in neighbors.items():
+      if port is None: continue
+      w = _media_weight(sw1, sw2)
+      old = media_paths.weight(sw1, sw2)
+      if old is None or abs(w - old) > old * WEIGHT_CHANGE_THRESHOLD:
+        media_paths.set_link(sw1, sw2, w)
+
+
+def _is_media (match):
+  if match.nw_proto != 6 and match.nw_proto != 17: return False
+  return match.tp_src in MEDIA_PORTS or match.tp_dst in MEDIA_PORTS
 
 
 def _check_path (p):
@@ -135,17 +172,13 @@ def _check_path (p):
   return True
 
 
-def _get_path (src, dst, first_port, final_port):
+def _get_path (src, dst, first_port, final_port, paths = shortest_paths):
   """
   Gets a cooked path -- a list of (node,in_port,out_port)
   """
   # Start with a raw path...
-  if src == dst:
-    path = [src]
-  else:
-    path = _get_raw_path(src, dst)
-    if path is None: return None
-    path = [src] + path + [dst]
+  path = paths.path(src, dst)
+  if path is None: return None
 
   # Now add the ports
   r = []
@@ -218,6 +251,89 @@ class WaitingPath (object):
       log.error("%i paths failed to install" % (killed,))
 
 
+class InstalledPath (object):
+  """
+  A path whose flows we've installed (in both directions)
+
+  All of the path's flows get the same cookie, and the path is indexed by
+  the links it crosses and the ports at its ends so that we can get rid
+  of just the affected flows when the topology changes.
+  """
+  def __init__ (self, path, match, media = False):
+    """
+    path is a cooked path (as from _get_path())
+    match is the match for the forward direction (without in_port)
+    media is True if this path is for a media flow
+    """
+    self.cookie = next(_cookies)
+    self.path = path
+    self.match = match.clone()
+    self.media = media
+    self.expires_at = time.time() + FLOW_HARD_TIMEOUT
+    self.links = [frozenset((a[0],b[0])) for a,b in zip(path[:-1],path[1:])]
+    self.ports = [(path[0][0],path[0][1]), (path[-1][0],path[-1][2])]
+
+    installed_paths[self.cookie] = self
+    for l in self.links: link_paths[l].add(self.cookie)
+    for p in self.ports: port_paths[p].add(self.cookie)
+
+  @property
+  def is_expired (self):
+    return time.time() >= self.expires_at
+
+  def forget (self):
+    """
+    Removes this path from the indexes
+    """
+    installed_paths.pop(self.cookie, None)
+    for index,keys in ((link_paths,self.links), (port_paths,self.ports)):
+      for k in keys:
+        cookies = index.get(k)
+        if cookies is None: continue
+        cookies.discard(self.cookie)
+        if not cookies: del index[k]
+
+  def uninstall (self):
+    """
+    Deletes this path's flows from the switches and forgets it
+
+    Returns the number of flow entries deleted.
+    """
+    self.forget()
+    if self.is_expired: return 0
+    rmatch = self.match.flip()
+    count = 0
+    for sw,in_port,out_port in self.path:
+      if sw.connection is None: continue
+      for match,port in ((self.match,in_port), (rmatch,out_port)):
+        # (OpenFlow 1.0 ignores the cookie here, but it tells us whose it is)
+        msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
+                              cookie=self.cookie)
+        msg.match = match.clone()
+        msg.match.in_port = port
+        sw.connection.send(msg)
+        count += 1
+    return count
+
+  @staticmethod
+  def expire_installed_paths ():
+    for p in [p for p in installed_paths.itervalues() if p.is_expired]:
+      p.forget()
+
+
+def _invalidate_paths (cookies):
+  """
+  Uninstalls the given installed paths
+
+  Returns (number of paths, number of flow entries deleted)
+  """
+  paths = [installed_paths[c] for c in cookies if c in installed_paths]
+  flows = 0
+  for p in paths:
+    flows += p.uninstall()
+  return len(paths),flows
+
+
 class PathInstalled (Event):
   """
   Fired when a path is installed
@@ -226,6 +342,18 @@ class PathInstalled (Event):
     self.path = path
 
 
+class PathsInvalidated (Event):
+  """
+  Fired when installed paths are removed due to a topology change
+
+  paths and flows are the number of paths and flow entries removed.
+  """
+  def __init__ (self, link, paths, flows):
+    self.link = link
+    self.paths = paths
+    self.flows = flows
+
+
 class Switch (EventMixin):
   def __init__ (self):
     self.connection = None
@@ -237,8 +365,10 @@ class Switch (EventMixin):
   def __repr__ (self):
     return dpid_to_str(self.dpid)
 
-  def _install (self, switch, in_port, out_port, match, buf = None):
+  def _install (self, switch, in_port, out_port, match, buf = None,
+                cookie = 0):
     msg = of.ofp_flow_mod()
+    msg.cookie = cookie
     msg.match = match
     msg.match.in_port = in_port
     msg.idle_timeout = FLOW_IDLE_TIMEOUT
@@ -247,10 +377,10 @@ class Switch (EventMixin):
     msg.buffer_id = buf
     switch.connection.send(msg)
 
-  def _install_path (self, p, match, packet_in=None):
+  def _install_path (self, p, match, packet_in=None, cookie=0):
     wp = WaitingPath(p, packet_in)
     for sw,in_port,out_port in p:
-      self._install(sw, in_port, out_port, match)
+      self._install(sw, in_port, out_port, match, cookie=cookie)
       msg = of.ofp_barrier_request()
       sw.connection.send(msg)
       wp.add_xid(sw.dpid,msg.xid)
@@ -259,7 +389,9 @@ class Switch (EventMixin):
     """
     Attempts to install a path between this switch and some destination
     """
-    p = _get_path(self, dst_sw, event.port, last_port)
+    media = MEDIA_PORTS is not None and _is_media(match)
+    p = _get_path(self, dst_sw, event.port, last_port,
+                  media_paths if media else shortest_paths)
     if p is None:
       log.warning("Can't get from %s to %s", match.dl_src, match.dl_dst)
 
@@ -299,16 +431,18 @@ class Switch (EventMixin):
 
       return
 
-    log.debug("Installing path for %s -> %s %04x (%i hops)",
-        match.dl_src, match.dl_dst, match.dl_type, len(p))
+    log.debug("Installing %spath for %s -> %s %04x (%i hops)",
+        "media " if media else "", match.dl_src, match.dl_dst,
+        match.dl_type, len(p))
 
     # We have a path -- install it
-    self._install_path(p, match, event.ofp)
+    cookie = InstalledPath(p, match, media).cookie
+    self._install_path(p, match, event.ofp, cookie)
 
     # Now reverse it and install it backwards
     # (we'll just assume that will work)
     p = [(sw,out_port,in_port) for sw,in_port,out_port in p]
-    self._install_path(p, match.flip())
+    self._install_path(p, match.flip(), cookie=cookie)
 
 
   def _handle_PacketIn (self, event):
@@ -380,7 +514,7 @@ class Switch (EventMixin):
         flood()
       else:
         dest = mac_map[packet.dst]
-        match = of.ofp_match.from_packet(packet)
+        match = packet_in_match(event, in_port=False)
         self.install_path(dest[0], dest[1], match, event)
 
   def disconnect (self):
@@ -417,6 +551,7 @@ class l2_multi (EventMixin):
 
   _eventMixin_events = set([
     PathInstalled,
+    PathsInvalidated,
   ])
 
   def __init__ (self):
@@ -431,17 +566,19 @@ class l2_multi (EventMixin):
     sw1 = switches[l.dpid1]
     sw2 = switches[l.dpid2]
 
-    # Invalidate all flows and path info.
-    # For link adds, this makes sure that if a new link leads to an
-    # improved path, we use it.
-    # For link removals, this makes sure that we don't use a
-    # path that may have been broken.
-    #NOTE: This could be radically improved! (e.g., not *ALL* paths break)
-    clear = of.ofp_flow_mod(command=of.OFPFC_DELETE)
-    for sw in switches.itervalues():
-      if sw.connection is None: continue
-      sw.connection.send(clear)
-    path_map.clear()
+    # Only flows which used the link (or which end at one of its ports)
+    # are invalidated.  Flows which would do better with a new link just
+    # pick it up when they expire and get set up again.
+    if event.removed:
+      cookies = link_paths.get(frozenset((sw1,sw2)), ())
+    else:
+      cookies = port_paths.get((sw1,l.port1), set()).union(
+                port_paths.get((sw2,l.port2), ()))
+    paths,flows = _invalidate_paths(cookies)
+    if paths:
+      log.info("Link %s %s: removed %i flow entries on %i paths",
+               l, "down" if event.removed else "up", flows, paths)
+      self.raiseEvent(PathsInvalidated(l, paths, flows))
 
     if event.removed:
       # This link no longer okay
@@ -458,6 +595,7 @@ class l2_multi (EventMixin):
             adjacency[sw2][sw1] = ll.port2
             # Fixed -- new link chosen to connect these
             break
+      _update_paths(sw1, sw2)
     else:
       # If we already consider these nodes connected, we can
       # ignore this link up.
@@ -469,6 +607,7 @@ class l2_multi (EventMixin):
           # Yup, link goes both ways -- connected!
           adjacency[sw1][sw2] = l.port1
           adjacency[sw2][sw1] = l.port2
+          _update_paths(sw1, sw2)
 
       # If we have learned a MAC on this port which we now know to
       # be connected to a switch, unlearn it.
@@ -480,6 +619,27 @@ class l2_multi (EventMixin):
         log.debug("Unlearned %s", mac)
         del mac_map[mac]
 
+  def _handle_Congestion (self, event):
+    """
+    Reroutes media flows away from a congested link
+    """
+    _update_media_weights()
+    if not event.congested: return # Flows move back as they expire
+    sw1 = switches.get(event.dpid)
+    if sw1 is None: return
+    for sw2,port in adjacency[sw1].items():
+      if port == event.port: break
+    else:
+      return # Not a switch-to-switch port
+    link = Discovery.Link(sw1.dpid, port, sw2.dpid, adjacency[sw2][sw1])
+    cookies = [c for c in link_paths.get(frozenset((sw1,sw2)), ())
+               if installed_paths[c].media]
+    paths,flows = _invalidate_paths(cookies)
+    if paths:
+      log.info("Link %s congested: removed %i flow entries on %i media "
+               "paths", link, flows, paths)
+      self.raiseEvent(PathsInvalidated(link, paths, flows))
+
   def _handle_openflow_ConnectionUp (self, event):
     sw = switches.get(event.dpid)
     if sw is None:
@@ -499,8 +659,23 @@ class l2_multi (EventMixin):
     wp.notify(event)
 
 
-def launch ():
+def launch (media = False):
+  global MEDIA_PORTS
+  if media is True:
+    MEDIA_PORTS = set(DEFAULT_MEDIA_PORTS)
+  elif media:
+    MEDIA_PORTS = set(int(p) for p in media.replace(",", " ").split())
+
   core.registerNew(l2_multi)
 
   timeout = min(max(PATH_SETUP_TIME, 5) * 2, 15)
   Timer(timeout, WaitingPath.expire_waiting_paths, recurring=True)
+  Timer(FLOW_HARD_TIMEOUT, InstalledPath.expire_installed_paths,
+        recurring=True)
+
+  if MEDIA_PORTS is not None:
+    Timer(WEIGHT_UPDATE_INTERVAL, _update_media_weights, recurring=True)
+    def start ():
+      core.link_utilization.addListenerByName("Congestion",
+                                              core.l2_multi._handle_Congestion)
+    core.call_when_ready(start, "link_utilization", __name__)
@@ -35,6 +35,7 @@ from pox.lib.addresses import IPAddr,EthAddr,parse_cidr
 from pox.lib.addresses import IP_BROADCAST, IP_ANY
 from pox.lib.revent import *
 from pox.lib.util import dpid_to_str
+from pox.lib.graph.shortest_paths import ShortestPaths
 from pox.proto.dhcpd import DHCPLease, DHCPD
 from collections import defaultdict
 from pox.openflow.discovery import Discovery
@@ -50,69 +51,23 @@ adjacency = defaultdict(lambda:defaultdict(lambda:None))
 switches_by_dpid = {}
 switches_by_id = {}
 
-# [sw1][sw2] -> (distance, intermediate)
-path_map = defaultdict(lambda:defaultdict(lambda:(None,None)))
+# Shortest paths between switches (kept in sync with adjacency)
+shortest_paths = ShortestPaths()
 
 
 def dpid_to_mac (dpid):
   return EthAddr("%012x" % (dpid & 0xffFFffFFffFF,))
 
 
-def _calc_paths ():
+def _update_paths (sw1, sw2):
   """
-  Essentially Floyd-Warshall algorithm
+  Updates shortest_paths after adjacency between sw1 and sw2 changed
   """
-
-  def dump ():
-    for i in sws:
-      for j in sws:
-        a = path_map[i][j][0]
-        #a = adjacency[i][j]
-        if a is None: a = "*"
-        print a,
-      print
-
-  sws = switches_by_dpid.values()
-  path_map.clear()
-  for k in sws:
-    for j,port in adjacency[k].iteritems():
-      if port is None: continue
-      path_map[k][j] = (1,None)
-    path_map[k][k] = (0,None) # distance, intermediate
-
-  #dump()
-
-  for k in sws:
-    for i in sws:
-      for j in sws:
-        if path_map[i][k][0] is not None:
-          if path_map[k][j][0] is not None:
-            # i -> k -> j exists
-            ikj_dist = path_map[i][k][0]+path_map[k][j][0]
-            if path_map[i][j][0] is None or ikj_dist < path_map[i][j][0]:
-              # i -> k -> j is better than existing
-              path_map[i][j] = (ikj_dist, k)
-
-  #print "--------------------"
-  #dump()
-
-
-def _get_raw_path (src, dst):
-  """
-  Get a raw path (just a list of nodes to traverse)
-  """
-  if len(path_map) == 0: _calc_paths()
-  if src is dst:
-    # We're here!
-    return []
-  if path_map[src][dst][0] is None:
-    return None
-  intermediate = path_map[src][dst][1]
-  if intermediate is None:
-    # Directly connected
-    return []
-  return _get_raw_path(src, intermediate) + [intermediate] + \
-         _get_raw_path(intermediate, dst)
+  for a,b in ((sw1,sw2),(sw2,sw1)):
+    if adjacency[a][b] is None:
+      shortest_paths.remove_link(a, b)
+    else:
+      shortest_paths.set_link(a, b)
 
 
 def _get_path (src, dst):
@@ -120,12 +75,8 @@ def _get_path (src, dst):
   Gets a cooked path -- a list of (node,out_port)
   """
   # Start with a raw path...
-  if src == dst:
-    path = [src]
-  else:
-    path = _get_raw_path(src, dst)
-    if path is None: return None
-    path = [src] + path + [dst]
+  path = shortest_paths.path(src, dst)
+  if path is None: return None
 
   # Now add the ports
   r = []
@@ -416,17 +367,17 @@ class topo_addressing (object):
     sw1 = switches_by_dpid[l.dpid1]
     sw2 = switches_by_dpid[l.dpid2]
 
-    # Invalidate all flows and path info.
+    # Invalidate all flows.
     # For link adds, this makes sure that if a new link leads to an
     # improved path, we use it.
     # For link removals, this makes sure that we don't use a
     # path that may have been broken.
+    # (Path info is updated incrementally below.)
     #NOTE: This could be radically improved! (e.g., not *ALL* paths break)
     clear = of.ofp_flow_mod(command=of.OFPFC_DELETE)
     for sw in switches_by_dpid.itervalues():
       if sw.connection is None: continue
       sw.connection.send(clear)
-    path_map.clear()
 
     if event.removed:
       # This link no longer okay
@@ -442,6 +393,7 @@ class topo_addressing (object):
             adjacency[sw2][sw1] = ll.port2
             # Fixed -- new link chosen to connect these
             break
+      _update_paths(sw1, sw2)
     else:
       # If we already consider these nodes connected, we can
       # ignore this link up.
@@ -453,6 +405,7 @@ class topo_addressing (object):
           # Yup, link goes both ways -- connected!
           adjacency[sw1][sw2] = l.port1
           adjacency[sw2][sw1] = l.port2
+          _update_paths(sw1, sw2)
 
     for sw in switches_by_dpid.itervalues():
       sw.send_table()
@@ -26,7 +26,7 @@ import logging
 log.setLevel(logging.INFO)
 from pox.lib.addresses import EthAddr
 
-def launch (src_mac = None, no_flow = False, **kw):
+def launch (src_mac = None, no_flow = False, probe_limit = None, **kw):
   for k, v in kw.iteritems():
     if k in host_tracker.timeoutSec:
       host_tracker.timeoutSec[k] = int(v)
@@ -36,5 +36,7 @@ def launch (src_mac = None, no_flow = False, **kw):
       log.debug("Changing ping limit to %s",v)
     else:
       log.error("Unknown option: %s(=%s)",k,v)
+  if probe_limit is None:
+    probe_limit = host_tracker.DEFAULT_PROBE_LIMIT
   core.registerNew(host_tracker.host_tracker, ping_src_mac = src_mac,
-      install_flow = not no_flow)
+      install_flow = not no_flow, probe_limit = int(probe_limit))
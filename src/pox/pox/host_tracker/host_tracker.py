@@ -38,6 +38,14 @@ Good values for testing:
 
 You can also specify how many ARP pings we try before deciding it failed:
   --pingLim=2
+
+Entries are indexed by MAC, by IP and by switch port, so lookups with
+getMacEntry(), getMacEntryByIP() and getHostsAt() don't depend on how many
+hosts are being tracked.  Rather than walking every entry on each timer
+tick, entry deadlines are kept in a heap and only due entries are looked
+at.  ARP pings are queued per switch and each switch gets at most
+probe_limit of them per tick, sent together in a single write:
+  --probe_limit=100
 """
 
 from pox.core import core
@@ -57,6 +65,9 @@ import pox.openflow.discovery as discovery
 from pox.lib.revent.revent import *
 
 import time
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
 
 import pox
 log = core.getLogger()
@@ -70,6 +81,9 @@ timeoutSec = dict(
   entryMove=60     # Minimum expected time to move a physical entry
   )
 
+# Maximum number of ARP pings sent to a single switch per timer tick
+DEFAULT_PROBE_LIMIT = 100
+
 # Address to send ARP pings from.
 # The particular one here is just an arbitrary locally administered address.
 DEFAULT_ARP_PING_SRC_MAC = '02:00:00:00:be:ef'
@@ -119,10 +133,14 @@ class Alive (object):
   def __init__ (self, livelinessInterval=timeoutSec['arpAware']):
     self.lastTimeSeen = time.time()
     self.interval=livelinessInterval
+    self._due = None # Deadline of this entry's slot in the timeout heap
 
   def expired (self):
     return time.time() > self.lastTimeSeen + self.interval
 
+  def deadline (self):
+    return self.lastTimeSeen + self.interval
+
   def refresh (self):
     self.lastTimeSeen = time.time()
 
@@ -211,7 +229,7 @@ class host_tracker (EventMixin):
   _eventMixin_events = set([HostEvent])
 
   def __init__ (self, ping_src_mac = None, install_flow = True,
-      eat_packets = True):
+      eat_packets = True, probe_limit = DEFAULT_PROBE_LIMIT):
 
     if ping_src_mac is None:
       ping_src_mac = DEFAULT_ARP_PING_SRC_MAC
@@ -219,9 +237,23 @@ class host_tracker (EventMixin):
     self.ping_src_mac = EthAddr(ping_src_mac)
     self.install_flow = install_flow
     self.eat_packets = eat_packets
+    self.probe_limit = probe_limit
 
     # The following tables should go to Topology later
     self.entryByMAC = {}
+    self.entryByIP = {}     # IP -> MacEntry which most recently claimed it
+    self.entriesByPort = {} # (dpid,port) -> {MAC:MacEntry}
+
+    # Each MacEntry and IpEntry has one live slot in this heap, holding
+    # (deadline,seq,macEntry,ipAddr) with ipAddr None for the MacEntry
+    # itself.  Slots are not moved when entries are refreshed; a popped
+    # slot is just rescheduled if the entry turns out to still be alive.
+    self._timeouts = []
+    self._seq = count()
+
+    self._probes = {} # dpid -> deque of (macEntry,ipAddr) to ARP ping
+    self._queued = set() # (MAC,ipAddr) with a ping in _probes
+
     self._t = Timer(timeoutSec['timerInterval'],
                     self._check_timeouts, recurring=True)
 
@@ -234,17 +266,28 @@ class host_tracker (EventMixin):
   def _all_dependencies_met (self):
     log.info("host_tracker ready")
 
-  # The following two functions should go to Topology also
+  # The following functions should go to Topology also
   def getMacEntry (self, macaddr):
-    try:
-      result = self.entryByMAC[macaddr]
-    except KeyError as e:
-      result = None
-    return result
+    return self.entryByMAC.get(macaddr)
 
-  def sendPing (self, macEntry, ipAddr):
+  def getMacEntryByIP (self, ipaddr):
+    """
+    Returns the MacEntry which has ipaddr, or None
+
+    If several hosts claim the same IP, this is the one which claimed it
+    most recently.
+    """
+    return self.entryByIP.get(ipaddr)
+
+  def getHostsAt (self, dpid, port):
+    """
+    Returns a list of the MacEntries located at the given switch port
     """
-    Builds an ETH/IP any-to-any ARP packet (an "ARP ping")
+    return self.entriesByPort.get((dpid,port), {}).values()
+
+  def _create_ping (self, macEntry, ipAddr):
+    """
+    Builds a packed packet_out with an ETH/IP any-to-any ARP ("ARP ping")
     """
     r = arp()
     r.opcode = arp.REQUEST
@@ -258,16 +301,97 @@ class host_tracker (EventMixin):
               macEntry.dpid, macEntry.port, str(r.hwdst), str(r.protodst))
     msg = of.ofp_packet_out(data = e.pack(),
                             action = of.ofp_action_output(port=macEntry.port))
-    if core.openflow.sendToDPID(macEntry.dpid, msg.pack()):
+    return msg.pack()
+
+  def sendPing (self, macEntry, ipAddr):
+    """
+    Sends an ARP ping right away
+
+    The timeout handling doesn't use this; it queues pings with
+    _queue_ping() so that they get batched and rate limited.
+    """
+    if core.openflow.sendToDPID(macEntry.dpid,
+                                self._create_ping(macEntry, ipAddr)):
       ipEntry = macEntry.ipAddrs[ipAddr]
       ipEntry.pings.sent()
     else:
       # macEntry is stale, remove it.
       log.debug("%i %i ERROR sending ARP REQ to %s %s",
-                macEntry.dpid, macEntry.port, str(r.hwdst), str(r.protodst))
-      del macEntry.ipAddrs[ipAddr]
+                macEntry.dpid, macEntry.port, str(macEntry.macaddr),
+                str(ipAddr))
+      self._del_ip(macEntry, ipAddr)
     return
 
+  def _queue_ping (self, macEntry, ipAddr):
+    key = (macEntry.macaddr, ipAddr)
+    if key in self._queued: return
+    self._queued.add(key)
+    q = self._probes.get(macEntry.dpid)
+    if q is None:
+      q = self._probes[macEntry.dpid] = deque()
+    q.append((macEntry, ipAddr))
+
+  def _send_pings (self):
+    """
+    Sends up to probe_limit queued ARP pings to each switch
+
+    Pings for the same switch go out in a single write.  Whatever is left
+    over waits for the next timer tick.
+    """
+    for dpid, q in self._probes.items():
+      sent = []
+      while q and len(sent) < self.probe_limit:
+        macEntry, ipAddr = q.popleft()
+        self._queued.discard((macEntry.macaddr, ipAddr))
+        if self.entryByMAC.get(macEntry.macaddr) is not macEntry: continue
+        if ipAddr not in macEntry.ipAddrs: continue
+        # If the host moved, this ping is dropped; the next check of the
+        # IP entry queues another one for the new location.
+        if macEntry.dpid != dpid: continue
+        sent.append((macEntry, ipAddr))
+      if not q:
+        del self._probes[dpid]
+      if not sent: continue
+
+      data = b''.join(self._create_ping(m, ip) for m, ip in sent)
+      if core.openflow.sendToDPID(dpid, data):
+        for macEntry, ipAddr in sent:
+          macEntry.ipAddrs[ipAddr].pings.sent()
+      else:
+        # The switch is gone, so these entries are stale
+        for macEntry, ipAddr in sent:
+          log.debug("%i %i ERROR sending ARP REQ to %s %s",
+                    macEntry.dpid, macEntry.port, str(macEntry.macaddr),
+                    str(ipAddr))
+          self._del_ip(macEntry, ipAddr)
+
+  def _schedule (self, macEntry, ipAddr, entry, when):
+    """
+    Gives entry (macEntry itself or one of its IpEntries) a heap slot
+    """
+    entry._due = when
+    heappush(self._timeouts, (when, next(self._seq), macEntry, ipAddr))
+
+  def _add_port_index (self, macEntry):
+    k = (macEntry.dpid, macEntry.port)
+    hosts = self.entriesByPort.get(k)
+    if hosts is None:
+      hosts = self.entriesByPort[k] = {}
+    hosts[macEntry.macaddr] = macEntry
+
+  def _del_port_index (self, macEntry):
+    k = (macEntry.dpid, macEntry.port)
+    hosts = self.entriesByPort.get(k)
+    if hosts is None: return
+    hosts.pop(macEntry.macaddr, None)
+    if not hosts:
+      del self.entriesByPort[k]
+
+  def _del_ip (self, macEntry, ipAddr):
+    del macEntry.ipAddrs[ipAddr]
+    if self.entryByIP.get(ipAddr) is macEntry:
+      del self.entryByIP[ipAddr]
+
   def getSrcIPandARP (self, packet):
     """
     Gets source IPv4 address for packets that have one (IPv4 and ARP)
@@ -308,6 +432,8 @@ class host_tracker (EventMixin):
       # new mapping
       ipEntry = IpEntry(hasARP)
       macEntry.ipAddrs[pckt_srcip] = ipEntry
+      self.entryByIP[pckt_srcip] = macEntry
+      self._schedule(macEntry, pckt_srcip, ipEntry, ipEntry.deadline())
       log.info("Learned %s got IP %s", str(macEntry), str(pckt_srcip) )
     if hasARP:
       ipEntry.pings.received()
@@ -361,6 +487,8 @@ class host_tracker (EventMixin):
       # should we raise a NewHostFound event (at the end)?
       macEntry = MacEntry(dpid,inport,packet.src)
       self.entryByMAC[packet.src] = macEntry
+      self._add_port_index(macEntry)
+      self._schedule(macEntry, None, macEntry, macEntry.deadline())
       log.info("Learned %s", str(macEntry))
       self.raiseEventNoErrors(HostEvent, macEntry, join=True)
     elif macEntry != (dpid, inport, packet.src):
@@ -376,8 +504,10 @@ class host_tracker (EventMixin):
       # for now, we keep it: IP info, answers pings, etc.
       e = HostEvent(macEntry, move=True, new_dpid = dpid, new_port = inport)
       self.raiseEventNoErrors(e)
+      self._del_port_index(macEntry)
       macEntry.dpid = e._new_dpid
-      macEntry.inport = e._new_port
+      macEntry.port = e._new_port
+      self._add_port_index(macEntry)
 
     macEntry.refresh()
 
@@ -390,27 +520,49 @@ class host_tracker (EventMixin):
 
   def _check_timeouts (self):
     """
-    Checks for timed out entries
+    Checks entries whose deadlines have passed and sends queued ARP pings
     """
-    for macEntry in self.entryByMAC.values():
-      entryPinged = False
-      for ip_addr, ipEntry in macEntry.ipAddrs.items():
-        if ipEntry.expired():
-          if ipEntry.pings.failed():
-            del macEntry.ipAddrs[ip_addr]
-            log.info("Entry %s: IP address %s expired",
-                     str(macEntry), str(ip_addr) )
-          else:
-            self.sendPing(macEntry,ip_addr)
-            ipEntry.pings.sent()
-            entryPinged = True
-      if macEntry.expired() and not entryPinged:
-        log.info("Entry %s expired", str(macEntry))
-        # sanity check: there should be no IP addresses left
-        if len(macEntry.ipAddrs) > 0:
-          for ip in macEntry.ipAddrs.keys():
-            log.warning("Entry %s expired but still had IP address %s",
-                        str(macEntry), str(ip_addr) )
-            del macEntry.ipAddrs[ip_addr]
-        self.raiseEventNoErrors(HostEvent, macEntry, leave=True)
-        del self.entryByMAC[macEntry.macaddr]
+    now = time.time()
+    heap = self._timeouts
+    while heap and heap[0][0] <= now:
+      when, _, macEntry, ip_addr = heappop(heap)
+      if self.entryByMAC.get(macEntry.macaddr) is not macEntry: continue
+      if ip_addr is None:
+        if macEntry._due == when:
+          self._check_mac_timeout(macEntry, now)
+      else:
+        ipEntry = macEntry.ipAddrs.get(ip_addr)
+        if ipEntry is not None and ipEntry._due == when:
+          self._check_ip_timeout(macEntry, ip_addr, ipEntry, now)
+    self._send_pings()
+
+  def _check_ip_timeout (self, macEntry, ip_addr, ipEntry, now):
+    if not ipEntry.expired():
+      self._schedule(macEntry, ip_addr, ipEntry, ipEntry.deadline())
+    elif ipEntry.pings.failed():
+      self._del_ip(macEntry, ip_addr)
+      log.info("Entry %s: IP address %s expired",
+               str(macEntry), str(ip_addr) )
+    else:
+      self._queue_ping(macEntry, ip_addr)
+      self._schedule(macEntry, ip_addr, ipEntry,
+                     now + timeoutSec['arpReply'])
+
+  def _check_mac_timeout (self, macEntry, now):
+    if not macEntry.expired():
+      self._schedule(macEntry, None, macEntry, macEntry.deadline())
+      return
+    if any(e.expired() for e in macEntry.ipAddrs.itervalues()):
+      # We're still pinging some of its addresses; wait for the outcome
+      self._schedule(macEntry, None, macEntry, now + timeoutSec['arpReply'])
+      return
+
+    log.info("Entry %s expired", str(macEntry))
+    # sanity check: there should be no IP addresses left
+    for ip_addr in macEntry.ipAddrs.keys():
+      log.warning("Entry %s expired but still had IP address %s",
+                  str(macEntry), str(ip_addr) )
+      self._del_ip(macEntry, ip_addr)
+    self.raiseEventNoErrors(HostEvent, macEntry, leave=True)
+    del self.entryByMAC[macEntry.macaddr]
+    self._del_port_index(macEntry)
@@ -19,6 +19,7 @@ Classes and utilities for addresses of various types.
 from __future__ import print_function
 import struct
 import socket
+import weakref
 
 # Slightly tested attempt at Python 3 friendliness
 import sys
@@ -27,17 +28,70 @@ if 'long' not in sys.modules['__builtin__'].__dict__:
 
 
 
-_eth_oui_to_name = {} # OUI (3 bytes) -> name
+_eth_oui_to_name = None # OUI (3 bytes) -> name (see _get_oui_names())
 
-def _load_oui_names ():
+def _get_oui_names ():
+  """
+  Returns the OUI name table, loading it the first time
+  """
+  global _eth_oui_to_name
+  if _eth_oui_to_name is None:
+    _eth_oui_to_name = _load_oui_names()
+  return _eth_oui_to_name
+
+def _oui_cache_names ():
+  """
+  Returns where the OUI name cache may be kept, best first
+
+  That's pox/oui.cache in the user's cache directory, or else a file of
+  the user's own in the temp directory.
+  """
+  import os
+  import tempfile
+  cache_home = os.environ.get("XDG_CACHE_HOME")
+  if not cache_home:
+    cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+  uid = os.getuid() if hasattr(os, "getuid") else 0
+  return [os.path.join(cache_home, "pox", "oui.cache"),
+          os.path.join(tempfile.gettempdir(), "pox-oui-%s.cache" % (uid,))]
+
+def _load_oui_names (cachenames = None):
   """
   Load OUI names from textfile
 
-  Assumes the textfile is adjacent to this source file.
+  Assumes the textfile is adjacent to this source file.  Parsing it takes
+  a while, so the table is also saved to a cache file (the first of
+  cachenames we can write; see _oui_cache_names()) and loaded from that
+  while the textfile is unchanged.
   """
-  import inspect
-  import os.path
-  filename = os.path.join(os.path.dirname(inspect.stack()[0][1]), 'oui.txt')
+  import os
+  import marshal
+  d = os.path.dirname(sys._getframe().f_code.co_filename)
+  filename = os.path.join(d, 'oui.txt')
+  if cachenames is None: cachenames = _oui_cache_names()
+  names = {}
+  try:
+    st = os.stat(filename)
+  except OSError:
+    import logging
+    logging.getLogger().warn("Could not load OUI list")
+    return names
+  stamp = (os.path.abspath(filename), st.st_size, int(st.st_mtime),
+           sys.version_info[:2])
+
+  for cachename in cachenames:
+    try:
+      with open(cachename, 'rb') as f:
+        # Only trust our own files (the temp directory is shared)
+        if (hasattr(os, "getuid")
+            and os.fstat(f.fileno()).st_uid != os.getuid()):
+          continue
+        cached = marshal.load(f)
+      if cached[0] == stamp:
+        return cached[1]
+    except Exception:
+      pass
+
   f = None
   try:
     f = open(filename)
@@ -56,22 +110,71 @@ def _load_oui_names ():
       end = end.split('\t')
       end.remove('(hex)')
       oui_name = ' '.join(end)
-      _eth_oui_to_name[oui] = oui_name.strip()
+      names[oui] = oui_name.strip()
   except:
     raise
     import logging
     logging.getLogger().warn("Could not load OUI list")
   if f: f.close()
-_load_oui_names()
+
+  for cachename in cachenames:
+    tmp = "%s.%i" % (cachename, os.getpid())
+    try:
+      if not os.path.isdir(os.path.dirname(cachename)):
+        os.makedirs(os.path.dirname(cachename))
+      with open(tmp, 'wb') as f:
+        marshal.dump((stamp, names), f)
+      os.rename(tmp, cachename)
+      break
+    except Exception:
+      # Probably not writable; try the next place (or just parse it again
+      # next time)
+      try:
+        os.unlink(tmp)
+      except Exception:
+        pass
+  return names
 
 
+# Used to set attributes on the (otherwise immutable) address objects
+_set = object.__setattr__
+
 
 class EthAddr (object):
   """
   An Ethernet (MAC) address type.
 
   Internal storage is six raw bytes.
+
+  The cache of interned addresses (_interned) is a class attribute, so
+  subclasses share it with EthAddr unless they set their own: from_raw()
+  on a subclass may otherwise hand back an EthAddr, and the reverse.
   """
+  __slots__ = ('_value', '_hash', '__weakref__')
+
+  # Addresses created with from_raw() are interned (i.e., shared) in a weak
+  # cache of at most this many entries.  0 disables interning.
+  max_interned = 0x4000
+  _interned = weakref.WeakValueDictionary()
+
+  @classmethod
+  def from_raw (cls, raw):
+    """
+    Factory that creates an EthAddr from six raw bytes
+
+    This is much quicker than the constructor and, for addresses which are
+    already around, doesn't create a new object at all.
+    """
+    interned = cls._interned
+    o = interned.get(raw)
+    if o is not None: return o
+    o = object.__new__(cls)
+    _set(o, '_value', raw)
+    _set(o, '_hash', hash(raw))
+    if len(interned) < cls.max_interned:
+      interned[raw] = o
+    return o
+
   def __init__ (self, addr):
     """
     Constructor
@@ -103,20 +206,22 @@ class EthAddr (object):
       else:
         raise RuntimeError("Expected ethernet address string to be 6 raw "
                            "bytes or some hex")
-      self._value = addr
+      value = addr
     elif isinstance(addr, EthAddr):
-      self._value = addr.toRaw()
+      value = addr._value
     elif isinstance(addr, (list,tuple,bytearray)):
-      self._value = b''.join( (chr(x) for x in addr) )
+      value = b''.join( (chr(x) for x in addr) )
     elif (hasattr(addr, '__len__') and len(addr) == 6
           and hasattr(addr, '__iter__')):
       # Pretty much same as above case, but for sequences we don't know.
-      self._value = b''.join( (chr(x) for x in addr) )
+      value = b''.join( (chr(x) for x in addr) )
     elif addr is None:
-      self._value = b'\x00' * 6
+      value = b'\x00' * 6
     else:
       raise RuntimeError("Expected ethernet address to be a string of 6 raw "
                          "bytes or some hex")
+    _set(self, '_value', value)
+    _set(self, '_hash', hash(value))
 
   def isBridgeFiltered (self):
     """
@@ -200,7 +305,7 @@ class EthAddr (object):
     """
     if resolve_names and self.is_global:
       # Don't even bother for local (though it should never match and OUI!)
-      name = _eth_oui_to_name.get(self._value[:3])
+      name = _get_oui_names().get(self._value[:3])
       if name:
         rest = separator.join('%02x' % (ord(x),) for x in self._value[3:])
         return name + separator + rest
@@ -223,19 +328,30 @@ class EthAddr (object):
     except:
       return -cmp(other, self)
 
+  def __eq__ (self, other):
+    if type(other) is EthAddr:
+      return self._value == other._value
+    return self.__cmp__(other) == 0
+
+  def __ne__ (self, other):
+    if type(other) is EthAddr:
+      return self._value != other._value
+    return self.__cmp__(other) != 0
+
   def __hash__ (self):
-    return self._value.__hash__()
+    return self._hash
 
   def __repr__ (self):
     return type(self).__name__ + "('" + self.to_str() + "')"
 
+  def __reduce__ (self):
+    return (type(self), (self._value,))
+
   def __len__ (self):
     return 6
 
   def __setattr__ (self, a, v):
-    if hasattr(self, '_value'):
-      raise TypeError("This object is immutable")
-    object.__setattr__(self, a, v)
+    raise TypeError("This object is immutable")
 
 
 
@@ -243,8 +359,40 @@ class IPAddr (object):
   """
   Represents an IPv4 address.
 
-  Internal storage is a signed int in network byte order.
+  Internal storage is a signed int in network byte order.  The unsigned
+  host order value is kept too, since that's what most everything wants.
+
+  The cache of interned addresses (_interned) is a class attribute, so
+  subclasses share it with IPAddr unless they set their own: from_num()
+  on a subclass may otherwise hand back an IPAddr, and the reverse.
   """
+  __slots__ = ('_value', '_unsigned', '__weakref__')
+
+  # Addresses created with from_num() are interned (i.e., shared) in a weak
+  # cache of at most this many entries.  0 disables interning.
+  max_interned = 0x4000
+  _interned = weakref.WeakValueDictionary()
+
+  @classmethod
+  def from_num (cls, num):
+    """
+    Factory that creates an IPAddr from an unsigned host order int
+
+    This is equivalent to IPAddr(num), but is much quicker and, for
+    addresses which are already around, doesn't create a new object at all.
+    """
+    interned = cls._interned
+    o = interned.get(num)
+    if o is not None: return o
+    o = object.__new__(cls)
+    v = socket.htonl(num)
+    if v & 0x80000000: v -= 0x100000000
+    _set(o, '_value', int(v))
+    _set(o, '_unsigned', num)
+    if len(interned) < cls.max_interned:
+      interned[num] = o
+    return o
+
   def __init__ (self, addr, networkOrder = False):
     """
     Initialize using several possible formats
@@ -260,17 +408,21 @@ class IPAddr (object):
     if isinstance(addr, (basestring, bytes, bytearray)):
       if len(addr) != 4:
         # dotted quad
-        self._value = struct.unpack('i', socket.inet_aton(addr))[0]
+        value = struct.unpack('i', socket.inet_aton(addr))[0]
       else:
-        self._value = struct.unpack('i', addr)[0]
+        value = struct.unpack('i', addr)[0]
     elif isinstance(addr, IPAddr):
-      self._value = addr._value
+      _set(self, '_value', addr._value)
+      _set(self, '_unsigned', addr._unsigned)
+      return
     elif isinstance(addr, int) or isinstance(addr, long):
       addr = addr & 0xffFFffFF # unsigned long
-      self._value = struct.unpack("!i",
+      value = struct.unpack("!i",
           struct.pack(('!' if networkOrder else '') + "I", addr))[0]
     else:
       raise RuntimeError("Unexpected IP address format")
+    _set(self, '_value', value)
+    _set(self, '_unsigned', socket.htonl(value & 0xffFFffFF))
 
   def toSignedN (self):
     """ A shortcut """
@@ -303,7 +455,7 @@ class IPAddr (object):
     default) byte order.
     """
     if not networkOrder:
-      return socket.htonl(self._value & 0xffFFffFF)
+      return self._unsigned
     return self._value & 0xffFFffFF
 
   def toStr (self):
@@ -322,16 +474,25 @@ class IPAddr (object):
     returned by parse_cidr().
     """
     if type(network) is not tuple:
-      if netmask is not None:
-        network = str(network)
-        network += "/" + str(netmask)
-      n,b = parse_cidr(network)
+      key = (network, netmask)
+      net = _network_cache.get(key)
+      if net is None:
+        if netmask is not None:
+          network = str(network)
+          network += "/" + str(netmask)
+        n,b = parse_cidr(network)
+        net = (n._unsigned, 0xffFFffFF ^ ((1 << (32-b))-1))
+        if len(_network_cache) < _max_network_cache:
+          _network_cache[key] = net
+      n,mask = net
     else:
       n,b = network
       if type(n) is not IPAddr:
         n = IPAddr(n)
+      n = n._unsigned
+      mask = 0xffFFffFF ^ ((1 << (32-b))-1)
 
-    return (self.toUnsigned() & ~((1 << (32-b))-1)) == n.toUnsigned()
+    return (self._unsigned & mask) == n
 
   @property
   def is_multicast (self):
@@ -357,23 +518,39 @@ class IPAddr (object):
     try:
       if not isinstance(other, IPAddr):
         other = IPAddr(other)
-      return cmp(self.toUnsigned(), other.toUnsigned())
+      return cmp(self._unsigned, other._unsigned)
     except:
       return -other.__cmp__(self)
 
+  def __eq__ (self, other):
+    if type(other) is IPAddr:
+      return self._value == other._value
+    return self.__cmp__(other) == 0
+
+  def __ne__ (self, other):
+    if type(other) is IPAddr:
+      return self._value != other._value
+    return self.__cmp__(other) != 0
+
   def __hash__ (self):
-    return self._value.__hash__()
+    return self._value
 
   def __repr__ (self):
     return self.__class__.__name__ + "('" + self.toStr() + "')"
 
+  def __reduce__ (self):
+    return (type(self), (self._unsigned,))
+
   def __len__ (self):
     return 4
 
   def __setattr__ (self, a, v):
-    if hasattr(self, '_value'):
-      raise TypeError("This object is immutable")
-    object.__setattr__(self, a, v)
+    raise TypeError("This object is immutable")
+
+
+# Parsed networks for IPAddr.inNetwork(): (network, netmask) -> (addr, mask)
+_network_cache = {}
+_max_network_cache = 1024
 
 
 IP_ANY       = IPAddr("0.0.0.0")
@@ -13,6 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""
+Graphs of nodes connected on (node,port) pairs, with queries over them
+
+There's a benchmark of the indexed queries against scanning the graph:
+./pox.py --no-openflow lib.graph.graph:benchmark --nodes=10000
+"""
+
 #import networkx as nx
 import pox.lib.graph.minigraph as nx
 from collections import defaultdict
@@ -405,26 +412,123 @@ class Member (BinaryOp):
 
 
 class Graph (object):
-  def __init__ (self):
+  """
+  A multigraph of nodes connected on (node,port) pairs
+
+  Queries (find(), get(), find_links() and friends) are answered with
+  the help of a few indexes that are kept up to date as nodes are
+  added, removed, linked and unlinked:
+   * nodes by exact type
+   * nodes by the value of any field passed to add_index()
+   * links by node and port
+  Before testing nodes one at a time, the query is inspected for an
+  equality, identity, type, or neighbor test that can be answered from
+  an index, and only the nodes it yields are tested.  Queries with no
+  such term still scan the whole graph.
+
+  Field indexes are opt-in because they trust the index: a node whose
+  indexed field changes without a reindex() is missed by queries on the
+  new value (and can still be tested for the old one).
+  """
+  def __init__ (self, indexes=()):
     self._g = nx.MultiGraph()
     self.node_port = {}
 
+    self._links = {} # node -> port -> (edge key, Link)
+    self._by_type = {} # type -> set(node)
+    self._indexes = {} # field -> value -> set(node)
+    self._unhashable = {} # field -> set(node) with unhashable value
+    self._indexed = {} # node -> field -> indexed value
+    self._next_key = 0
+
+    for field in indexes:
+      self.add_index(field)
+
   def __contains__ (self, n):
     return n in self._g
 
+  def add_index (self, field):
+    """
+    Index nodes by the value of the given field
+
+    Lookups go through a dict, so an indexed field only matches values
+    which hash equal to it.  The value is read when the node is added,
+    linked or unlinked.  Only index fields which don't change while the
+    node is in the graph, or call reindex() whenever they do; queries on
+    the field only look at the nodes indexed under the value asked for,
+    so a node with a stale entry won't be found.
+    """
+    if field in self._indexes: return
+    self._indexes[field] = {}
+    self._unhashable[field] = set()
+    for n in self._g.nodes():
+      self._index_field(n, field)
+
+  def reindex (self, node):
+    """
+    Refresh the field indexes for the given node
+    """
+    if node not in self._indexed: return
+    for field in self._indexes:
+      self._unindex_field(node, field)
+      self._index_field(node, field)
+
+  def _index_field (self, node, field):
+    if not hasattr(node, field): return
+    v = getattr(node, field)
+    try:
+      self._indexes[field].setdefault(v, set()).add(node)
+    except TypeError:
+      self._unhashable[field].add(node)
+      return
+    self._indexed[node][field] = v
+
+  def _unindex_field (self, node, field):
+    self._unhashable[field].discard(node)
+    indexed = self._indexed[node]
+    if field not in indexed: return
+    v = indexed.pop(field)
+    s = self._indexes[field][v]
+    s.discard(node)
+    if not s: del self._indexes[field][v]
+
+  def _index_node (self, node):
+    if node in self._indexed: return
+    self._indexed[node] = {}
+    self._by_type.setdefault(type(node), set()).add(node)
+    for field in self._indexes:
+      self._index_field(node, field)
+
+  def _unindex_node (self, node):
+    if node not in self._indexed: return
+    for field in self._indexes:
+      self._unindex_field(node, field)
+    del self._indexed[node]
+    s = self._by_type[type(node)]
+    s.discard(node)
+    if not s: del self._by_type[type(node)]
+
   def add (self, node):
     self._g.add_node(node)
-    self.node_port[node] = {}
+    self.node_port.setdefault(node, {})
+    self._links.setdefault(node, {})
+    self._index_node(node)
 
   def remove (self, node):
+    for port in self._links.get(node, {}).keys():
+      self.disconnect_port((node, port))
     self._g.remove_node(node)
+    self.node_port.pop(node, None)
+    self._links.pop(node, None)
+    self._unindex_node(node)
 
   def neighbors (self, n):
     return self._g.neighbors(n)
 
   def find_port (self, node1, node2):
-    for n1, n2, k, d in self._g.edges([node1, node2], data=True, keys=True):
-      return (d[LINK][node1][1], d[LINK][node2][1])
+    for port,(k,l) in self._links.get(node1, {}).iteritems():
+      if l.other(node1)[0] is node2:
+        return (port, l.other(node1)[1])
     return None
 
   def connected(self, node1, node2):
@@ -435,31 +539,27 @@ class Graph (object):
     Disconnects the given (node,port)
     """
     assert type(np) is tuple
-    remove = []
-    if self.port_for_node(np[0], np[1]) is None:
+    entry = self._links.get(np[0], {}).get(np[1])
+    if entry is None:
       return 0
-    for n1,n2,k,d in self._g.edges([np[0], self.node_port[np[0]][np[1]][0]], data=True, keys=True):
-      if np in d[LINK]:
-        remove.append((n1,n2,k))
-        del self.node_port[n1][d[LINK][n1][1]]
-        del self.node_port[n2][d[LINK][n2][1]]
-    for e in remove:
-      #print "remove",e
-      self._g.remove_edge(*e)
-    return len(remove)
+    k,l = entry
+    self._g.remove_edge(l[0][0], l[1][0], k)
+    for n,p in (l[0], l[1]):
+      del self.node_port[n][p]
+      del self._links[n][p]
+      self.reindex(n)
+    return 1
 
   def unlink (self, np1, np2):
     count = 0
     if isinstance(np1, tuple):
-      count = disconnect_port(np1)
+      count = self.disconnect_port(np1)
     elif isinstance(np2, tuple):
-      count = disconnect_port(np2)
+      count = self.disconnect_port(np2)
     else:
-      for n1, n2, k, d in self._g.edges([np1, np2], data=True, keys=True):
-        self._g.remove_edge(n1,n2,k)
-        del self.node_port[n1][d[LINK][n1][1]]
-        del self.node_port[n2][d[LINK][n2][1]]
-        count = count + 1
+      for port,(k,l) in self._links.get(np1, {}).items():
+        if l.other(np1)[0] is np2:
+          count += self.disconnect_port((np1, port))
     return count
 
   def link (self, np1, np2):
@@ -486,22 +586,53 @@ class Graph (object):
         if free not in np2.ports:
           np2 = (np2,free)
           break
-    self._g.add_node(np1[0])
-    self._g.add_node(np2[0])
+    self.add(np1[0])
+    self.add(np2[0])
     self.disconnect_port(np1)
     self.disconnect_port(np2)
-    self._g.add_edge(np1[0],np2[0],link=Link(np1,np2))
+    l = Link(np1,np2)
+    k = self._next_key
+    self._next_key += 1
+    self._g.add_edge(np1[0],np2[0],key=k,link=l)
     self.node_port[np1[0]][np1[1]] = np2
     self.node_port[np2[0]][np2[1]] = np1
+    self._links[np1[0]][np1[1]] = (k,l)
+    self._links[np2[0]][np2[1]] = (k,l)
+    self.reindex(np1[0])
+    self.reindex(np2[0])
+
+  def _links_for (self, nodes):
+    """
+    Yields each link touching any of the given nodes once
+    """
+    seen = set()
+    for n in nodes:
+      for k,l in self._links.get(n, {}).itervalues():
+        if k in seen: continue
+        seen.add(k)
+        yield l
 
   def find_links (self, query1=None, query2=()):
     # No idea if new link query stuff works.
     if query2 is None: query2 = query1
     if query1 == (): query1 = None
     if query2 == (): query2 = None
+
+    # Any matching link has one end passing each query, so it's enough
+    # to look at the links of whichever query narrows things down most.
+    best = None
+    for q in (query1, query2):
+      if q is None: continue
+      c = self._plan((q,))
+      if c is not None and (best is None or len(c) < len(best)):
+        best = c
+    if best is None:
+      links = [d[LINK] for n1,n2,d in self._g.edges(data=True)]
+    else:
+      links = self._links_for(best)
+
     o = set()
-    for n1,n2,k,d in self._g.edges(data=True, keys=True):
-      l = d[LINK]
+    for l in links:
       ok = False
       if query1 is None or self._test_node(l[0][0], args=(query1,), link=l):
         if query2 is None or self._test_node(l[1][0], args=(query2,), link=l):
@@ -520,11 +651,7 @@ class Graph (object):
     Map of local port -> (other, other_port)
     """
     ports = defaultdict(_void)
-    for n1, n2, k, d in self._g.edges([node], data=True, keys=True):
-      p = d[LINK]
-      assert n1 is node
-      assert ports.get(p[node]) is None
-      ports[p[node][1]] = p.other(node)
+    ports.update(self.node_port.get(node, {}))
     return ports
 
   def port_for_node(self, node, port):
@@ -577,6 +704,105 @@ class Graph (object):
     # Really bad implementation.  We can easily scape early.
     return len(self.find_links(query1, query2)) > 0
 
+  def _subtypes (self, t):
+    r = set()
+    for tt,nodes in self._by_type.iteritems():
+      if issubclass(tt, t):
+        r.update(nodes)
+    return r
+
+  def _plan (self, args=(), kw={}):
+    """
+    Returns a set of nodes which includes every node that can match the
+    query, or None if the query can't be answered from an index
+
+    The set may contain nodes which don't match, so it's still up to
+    the caller to test each one.
+    """
+    best = None
+    for k,v in kw.iteritems():
+      c = self._plan_kw(k, v)
+      if c is not None and (best is None or len(c) < len(best)):
+        best = c
+    for a in args:
+      c = self._plan_op(a)
+      if c is not None and (best is None or len(c) < len(best)):
+        best = c
+    return best
+
+  def _plan_kw (self, k, v):
+    if k == "is_a":
+      return self._subtypes(v)
+    elif k == "type":
+      return self._by_type.get(v, set())
+    return self._lookup(k, v)
+
+  def _lookup (self, field, v):
+    index = self._indexes.get(field)
+    if index is None: return None
+    try:
+      r = index.get(v, ())
+    except TypeError:
+      return None
+    return self._unhashable[field].union(r)
+
+  def _plan_op (self, op):
+    if isinstance(op, And):
+      l = self._plan_op(op._left)
+      r = self._plan_op(op._right)
+      if l is None: return r
+      if r is None: return l
+      return l if len(l) < len(r) else r
+    if isinstance(op, Or):
+      l = self._plan_op(op._left)
+      if l is None: return None
+      r = self._plan_op(op._right)
+      if r is None: return None
+      return l.union(r)
+    if not isinstance(op, NodeOp): return None
+
+    left,right = op._left,op._right
+    if isinstance(left, Literal) and isinstance(right, Literal):
+      # Constant; e.g., Equal('DPID', ID)
+      try:
+        if op(None, None): return None
+      except Exception:
+        return None
+      return set()
+
+    if not isinstance(right, Literal):
+      if isinstance(op, (Equal, Is)) and isinstance(left, Literal):
+        left,right = right,left
+      else:
+        return None
+    v = right._v
+
+    if isinstance(left, Self):
+      if isinstance(op, (Equal, Is)):
+        try:
+          if v in self._indexed: return set([v])
+        except TypeError:
+          return None
+        return set() if isinstance(op, Is) else None
+      if isinstance(op, IsType):
+        if isinstance(v, str):
+          return set(n for t,nodes in self._by_type.iteritems()
+                     if t.__name__ == v for n in nodes)
+        return self._by_type.get(v, set())
+      if isinstance(op, IsInstance):
+        return self._subtypes(v)
+      if isinstance(op, ConnectedTo):
+        if v in self._g: return set(self._g.neighbors(v))
+        return set()
+      return None
+
+    if isinstance(op, Equal) and isinstance(left, Field):
+      if not isinstance(left._left, Self): return None
+      if not isinstance(left._right, Literal): return None
+      return self._lookup(left._right._v, v)
+
+    return None
+
   def _test_node (self, n, args=(), kw={}, link=None):
     #TODO: Should use a special value for unspecified n2
     for k,v in kw.iteritems():
@@ -599,7 +825,10 @@ class Graph (object):
     r = []
     def test (n):
       return self._test_node(n, args, kw)
-    for n in self._g.nodes():
+    nodes = self._plan(args, kw)
+    if nodes is None:
+      nodes = self._g.nodes()
+    for n in nodes:
       if test(n):
         r.append(n)
     return r
@@ -641,6 +870,90 @@ class Graph (object):
   def __len__ (self):
     return len(self._g)
 
+def benchmark (nodes = 10000, switches = 2000, links = 15000,
+               rounds = 200, seed = 0):
+  """
+  Times queries on a random graph with and without the indexes
+
+  The graph has the given number of nodes, of which "switches" are one
+  type and the rest another, joined by random links.  Each query is run
+  through the planner and then again with the planner disabled (which is
+  how every query used to be answered), and the time per query is
+  reported for both.
+  """
+  import random
+  import time
+  from pox.core import core
+  log = core.getLogger()
+
+  nodes = int(nodes)
+  switches = int(switches)
+  links = int(links)
+  rounds = int(rounds)
+  r = random.Random(int(seed))
+
+  class Sw (Node):
+    def __init__ (self, ID):
+      self.ID = ID
+      self.DPID = ID
+  class Host (Node):
+    def __init__ (self, ID):
+      self.ID = ID
+
+  start = time.time()
+  g = Graph(indexes=('ID',))
+  all_nodes = [Sw(i) if i < switches else Host(i) for i in range(nodes)]
+  for n in all_nodes:
+    g.add(n)
+  for i in range(links):
+    a,b = r.sample(all_nodes, 2)
+    g.link((a,r.randint(1,48)), (b,r.randint(1,48)))
+  log.info("Built %i nodes and %i links in %.2fs", nodes, links,
+           time.time() - start)
+
+  def id_query ():
+    return Equal(F('ID'), r.randrange(nodes))
+  def nom_query ():
+    ID = r.randrange(nodes)
+    return Or(Equal('DPID', ID), Equal(F('ID'), ID))
+  tests = [
+    ("find(Equal(F('ID'),x))", lambda: g.find(id_query())),
+    ("find(ID=x)", lambda: g.find(ID=r.randrange(nodes))),
+    ("NOM getEntityByID", lambda: g.find(nom_query())),
+    ("find(type=Sw)", lambda: g.find(type=Sw)),
+    ("find(IsType(Sw))", lambda: g.find(IsType(Sw))),
+    ("find_links(Equal(F('ID'),x))", lambda: g.find_links(id_query())),
+  ]
+
+  def run (f, count):
+    t = time.time()
+    for _ in range(count):
+      f()
+    return (time.time() - t) / count * 1000000
+
+  plan = g._plan
+  for name,f in tests:
+    indexed = run(f, rounds)
+    g._plan = lambda *args, **kw: None
+    try:
+      # Scanning is slow, so don't run it as many times
+      scanned = run(f, max(1, rounds // 20))
+    finally:
+      g._plan = plan
+    log.info("%-30s %10.1f us indexed %10.1f us scanned (%.0fx)", name,
+             indexed, scanned, scanned / indexed if indexed else 0)
+
+  pairs = [(l[0][0], l[1][0]) for l in g.find_links()]
+  pairs = [r.choice(pairs) for _ in range(rounds)]
+  t = time.time()
+  for a,b in pairs:
+    g.find_port(a, b)
+  log.info("%-30s %10.1f us", "find_port(a,b)",
+           (time.time() - t) / len(pairs) * 1000000)
+
+  core.quit()
+
+
 def test():
   class Node1 (object):
     _next_num = 0
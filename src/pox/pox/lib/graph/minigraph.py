@@ -53,10 +53,15 @@ class MultiGraph (object):
 
     edges = {}
 
-    for e1,otherEnd in self._edges.iteritems():
+    if nbunch is None:
+      sources = self._edges.iteritems()
+    else:
+      # Only visit the nodes asked about rather than every edge
+      sources = [(n,self._edges[n]) for n in nbunch if n in self._edges]
+
+    for e1,otherEnd in sources:
       for e2,rest in otherEnd.iteritems():
         if nbunch is not None:
-          if e1 not in nbunch: continue
           if len(nbunch) > 1 and e2 not in nbunch: continue
 
         e = fix(e1,e2)
@@ -130,6 +135,10 @@ class MultiGraph (object):
       key = self._edges[node1][node2].keys()[0] # First one is fine
     del self._edges[node1][node2][key]
     del self._edges[node2][node1][key]
+    if not self._edges[node1][node2]:
+      # Don't leave nodes looking like neighbors once they're not
+      del self._edges[node1][node2]
+      del self._edges[node2][node1]
 
   def add_path (self, nodes, **attr):
     for n in nodes:
@@ -137,6 +146,12 @@ class MultiGraph (object):
     for n1,n2 in zip(nodes[:-1],nodes[1:]):
       self.add_edge(n1,n2)
 
+  def __contains__ (self, node):
+    return node in self._nodes
+
+  def __len__ (self):
+    return len(self._nodes)
+
   def __getitem__ (self, node):
     o = {}
     for k0,v0 in self._edges[node].iteritems():
@@ -97,8 +97,13 @@ class NOM (Graph, EventMixin):
     Update
   ]
 
-  def __init__ (self):
-    Graph.__init__(self)
+  def __init__ (self, indexes=()):
+    """
+    indexes are fields to index as in Graph.  Passing ('ID',) makes
+    getEntityByID() fast, but is only safe if entity IDs never change
+    while they're in the NOM (or the NOM is reindex()ed when they do).
+    """
+    Graph.__init__(self, indexes=indexes)
     EventMixin.__init__(self)
     self._eventMixin_addEvents(self.__eventMixin_events)
     self._entities = {}
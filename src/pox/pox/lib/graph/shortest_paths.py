@@ -0,0 +1,242 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incrementally maintained shortest paths
+
+ShortestPaths holds a weighted directed graph and answers shortest path
+queries over it.  It keeps a shortest path tree for each source node that
+has been asked about (built with Dijkstra the first time it's needed), and
+when links come and go, it fixes up the existing trees rather than starting
+over:
+
+ * A new link (or a cheaper one) only touches the part of each tree that
+   it actually makes shorter.
+ * Removing a link (or making it more expensive) only matters for trees
+   that were using it, and then only the subtree hanging off of it is
+   recomputed.
+
+Reconstructed paths are cached per tree until the tree changes.
+
+Nodes can be anything hashable (e.g., DPIDs or switch objects).
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+
+_INF = float('inf')
+
+
+class _Tree (object):
+  """
+  A shortest path tree rooted at one source
+  """
+  def __init__ (self, src):
+    self.src = src
+    self.dist = {src:0}     # node -> distance from src
+    self.parent = {src:None}  # node -> previous hop
+    self.children = {}      # node -> set of nodes whose parent it is
+    self.paths = {}         # node -> cached path tuple
+
+
+class ShortestPaths (object):
+  """
+  Shortest paths over a weighted directed graph
+  """
+  def __init__ (self):
+    self._out = {} # a -> b -> weight
+    self._in = {}  # b -> a -> weight
+    self._trees = {} # src -> _Tree
+    self._seq = count()
+
+  def __contains__ (self, node):
+    return node in self._out or node in self._in
+
+  def clear (self):
+    self._out.clear()
+    self._in.clear()
+    self._trees.clear()
+
+  def weight (self, a, b):
+    """
+    Returns the weight of the link a->b (or None if there isn't one)
+    """
+    return self._out.get(a, {}).get(b)
+
+  def neighbors (self, node):
+    """
+    Returns a dict of node's outgoing links (neighbor -> weight)
+    """
+    return self._out.get(node, {})
+
+  def set_link (self, a, b, weight = 1):
+    """
+    Adds the link a->b or changes its weight
+    """
+    assert weight >= 0
+    old = self._out.get(a, {}).get(b)
+    if old == weight: return
+    self._out.setdefault(a, {})[b] = weight
+    self._in.setdefault(b, {})[a] = weight
+    for t in self._trees.itervalues():
+      if old is None or weight < old:
+        self._relax(t, a, b, weight)
+      elif t.parent.get(b) == a and b in t.dist:
+        # A link in the tree got more expensive
+        self._rebuild(t, b)
+
+  def remove_link (self, a, b):
+    """
+    Removes the link a->b (if there is one)
+    """
+    n = self._out.get(a)
+    if n is None or b not in n: return
+    del n[b]
+    del self._in[b][a]
+    for t in self._trees.itervalues():
+      if t.parent.get(b) == a and b in t.dist:
+        self._rebuild(t, b)
+
+  def remove_node (self, node):
+    """
+    Removes a node and all of its links
+    """
+    for b in list(self._out.get(node, ())):
+      self.remove_link(node, b)
+    for a in list(self._in.get(node, ())):
+      self.remove_link(a, node)
+    self._out.pop(node, None)
+    self._in.pop(node, None)
+    self._trees.pop(node, None)
+
+  def distance (self, src, dst):
+    """
+    Returns the length of the shortest path (or None if unreachable)
+    """
+    if src == dst: return 0
+    return self._tree(src).dist.get(dst)
+
+  def path (self, src, dst):
+    """
+    Returns the shortest path from src to dst
+
+    The path is a tuple of nodes starting with src and ending with dst,
+    or None if dst isn't reachable.
+    """
+    if src == dst: return (src,)
+    t = self._tree(src)
+    p = t.paths.get(dst)
+    if p is not None: return p
+    if dst not in t.dist: return None
+    parent = t.parent
+    p = [dst]
+    n = parent[dst]
+    while n is not None:
+      p.append(n)
+      n = parent[n]
+    p.reverse()
+    p = tuple(p)
+    t.paths[dst] = p
+    return p
+
+  def _tree (self, src):
+    t = self._trees.get(src)
+    if t is None:
+      t = _Tree(src)
+      self._trees[src] = t
+      self._dijkstra(t, [(0, next(self._seq), src)])
+    return t
+
+  def _set_parent (self, t, node, parent):
+    old = t.parent.get(node)
+    if old is not None:
+      t.children[old].discard(node)
+    t.parent[node] = parent
+    c = t.children.get(parent)
+    if c is None:
+      c = t.children[parent] = set()
+    c.add(node)
+
+  def _dijkstra (self, t, heap):
+    """
+    Runs Dijkstra on t starting from the (distance,seq,node)s in heap
+
+    Nodes not in the heap are assumed to already be settled.
+    """
+    dist = t.dist
+    out = self._out
+    seq = self._seq
+    empty = {}
+    while heap:
+      d,_,u = heappop(heap)
+      if d > dist.get(u, _INF): continue # Stale
+      for v,w in out.get(u, empty).iteritems():
+        nd = d + w
+        if nd < dist.get(v, _INF):
+          dist[v] = nd
+          self._set_parent(t, v, u)
+          heappush(heap, (nd, next(seq), v))
+
+  def _relax (self, t, a, b, weight):
+    """
+    Propagates a new or cheaper a->b link through t
+    """
+    da = t.dist.get(a)
+    if da is None: return
+    nd = da + weight
+    if nd >= t.dist.get(b, _INF): return
+    t.dist[b] = nd
+    self._set_parent(t, b, a)
+    self._dijkstra(t, [(nd, next(self._seq), b)])
+    t.paths.clear()
+
+  def _rebuild (self, t, node):
+    """
+    Recomputes the subtree of t rooted at node
+    """
+    dist = t.dist
+    parent = t.parent
+    children = t.children
+
+    # Detach everything below node (inclusive)
+    affected = []
+    stack = [node]
+    while stack:
+      n = stack.pop()
+      affected.append(n)
+      stack.extend(children.pop(n, ()))
+    for n in affected:
+      del dist[n]
+      p = parent.pop(n)
+      c = children.get(p)
+      if c is not None: c.discard(n)
+
+    # Reattach each detached node by its best link from the rest of the tree,
+    # and let Dijkstra sort out the remainder.
+    heap = []
+    seq = self._seq
+    for n in affected:
+      best = _INF
+      bp = None
+      for u,w in self._in.get(n, {}).iteritems():
+        du = dist.get(u)
+        if du is not None and du + w < best:
+          best = du + w
+          bp = u
+      if bp is not None:
+        dist[n] = best
+        parent[n] = bp
+        children.setdefault(bp, set()).add(n)
+        heap.append((best, next(seq), n))
+    heap.sort()
+    self._dijkstra(t, heap)
+    t.paths.clear()
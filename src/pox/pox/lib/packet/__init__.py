@@ -94,3 +94,12 @@ __all__ = [
   'MPLS',
   'LLC',
 ]
+
+
+def lazy_parse ():
+  """
+  Sets default ethernet parsing behavior to be lazy
+
+  e.g., ./pox.py lib.packet:lazy_parse
+  """
+  ethernet.lazy_parse = True
@@ -105,8 +105,8 @@ class arp (packet_base):
             self.msg('(arp parse) unknown hw len %u' % self.hwlen)
             return
         else:
-            self.hwsrc = EthAddr(raw[8:14])
-            self.hwdst = EthAddr(raw[18:24])
+            self.hwsrc = EthAddr.from_raw(raw[8:14])
+            self.hwdst = EthAddr.from_raw(raw[18:24])
         if self.prototype != arp.PROTO_TYPE_IP:
             self.msg('(arp parse) proto type unknown %u' % self.prototype)
             return
@@ -114,8 +114,8 @@ class arp (packet_base):
             self.msg('(arp parse) unknown proto len %u' % self.protolen)
             return
         else:
-            self.protosrc = IPAddr(struct.unpack('!I',raw[14:18])[0])
-            self.protodst = IPAddr(struct.unpack('!I',raw[24:28])[0])
+            self.protosrc = IPAddr.from_num(struct.unpack('!I',raw[14:18])[0])
+            self.protodst = IPAddr.from_num(struct.unpack('!I',raw[24:28])[0])
 
         self.next = raw[28:]
         self.parsed = True
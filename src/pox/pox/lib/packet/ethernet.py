@@ -37,11 +37,16 @@ PAE_MULTICAST        = EthAddr(b'\x01\x80\xc2\x00\x00\x03') # 802.1x Port
 NDP_MULTICAST        = EthAddr(b'\x01\x23\x20\x00\x00\x01') # Nicira discovery
                                                             #  multicast
 
+_hdr = struct.Struct('!6s6sH')
+
 class ethernet(packet_base):
   "Ethernet packet struct"
 
   resolve_names = False
 
+  # If True, parse lazily by default (see packet_base)
+  lazy_parse = False
+
   MIN_LEN = 14
 
   IP_TYPE    = 0x0800
@@ -71,7 +76,10 @@ class ethernet(packet_base):
 
   type_parsers = {}
 
-  def __init__(self, raw=None, prev=None, **kw):
+  def __init__(self, raw=None, prev=None, lazy=None, **kw):
+    """
+    lazy: parse raw lazily (defaults to ethernet.lazy_parse)
+    """
     packet_base.__init__(self)
 
     if len(ethernet.type_parsers) == 0:
@@ -103,7 +111,14 @@ class ethernet(packet_base):
     self.next = b''
 
     if raw is not None:
-      self.parse(raw)
+      if lazy is None:
+        lazy = self.lazy_parse
+      if lazy:
+        if not isinstance(raw, memoryview):
+          raw = memoryview(raw)
+        self._parse_lazy(raw, 0, len(raw))
+      else:
+        self.parse(raw)
 
     self._init(kw)
 
@@ -117,9 +132,9 @@ class ethernet(packet_base):
                % (alen,))
       return
 
-    self.dst = EthAddr(raw[:6])
-    self.src = EthAddr(raw[6:12])
-    self.type = struct.unpack('!H', raw[12:ethernet.MIN_LEN])[0]
+    dst,src,self.type = _hdr.unpack_from(raw)
+    self.dst = EthAddr.from_raw(dst)
+    self.src = EthAddr.from_raw(src)
 
     self.hdr_len = ethernet.MIN_LEN
     self.payload_len = alen - self.hdr_len
@@ -127,6 +142,29 @@ class ethernet(packet_base):
     self.next = ethernet.parse_next(self, self.type, raw, ethernet.MIN_LEN)
     self.parsed = True
 
+  def _parse_lazy (self, buf, offset, end):
+    self.next = None
+    alen = end - offset
+    if alen < ethernet.MIN_LEN:
+      self.msg('warning eth packet data too short to parse header: data len %u'
+               % (alen,))
+      self._set_lazy(buf, offset, end, False)
+      return
+
+    dst,src,self.type = _hdr.unpack_from(buf, offset)
+    self.dst = EthAddr.from_raw(dst)
+    self.src = EthAddr.from_raw(src)
+
+    self.hdr_len = ethernet.MIN_LEN
+    self.payload_len = alen - self.hdr_len
+
+    self._set_lazy(buf, offset, end)
+    self.parsed = True
+
+  def _parse_next_lazy (self):
+    return ethernet.parse_next_lazy(self, self.type, self._buf,
+                                    self._off + ethernet.MIN_LEN, self._end)
+
   @staticmethod
   def parse_next (prev, typelen, raw, offset=0, allow_llc=True):
     parser = ethernet.type_parsers.get(typelen)
@@ -137,6 +175,19 @@ class ethernet(packet_base):
     else:
       return raw[offset:]
 
+  @staticmethod
+  def parse_next_lazy (prev, typelen, buf, offset, end, allow_llc=True):
+    """
+    Like parse_next(), but for lazily parsing from buf[offset:end]
+    """
+    parser = ethernet.type_parsers.get(typelen)
+    if parser is not None:
+      return prev._lazy_child(parser, buf, offset, end)
+    elif typelen < 1536 and allow_llc:
+      return prev._lazy_child(ethernet._llc, buf, offset, end)
+    else:
+      return buf[offset:end].tobytes()
+
   @staticmethod
   def getNameForType (ethertype):
     """ Returns a string name for a numeric ethertype """
@@ -50,6 +50,8 @@ from packet_base import packet_base
 
 from pox.lib.addresses import IPAddr, IP_ANY, IP_BROADCAST
 
+_hdr = struct.Struct('!BBHHHBBHII')
+
 class ipv4(packet_base):
     "IP packet struct"
 
@@ -66,6 +68,9 @@ class ipv4(packet_base):
 
     ip_id = int(time.time())
 
+    # (srcip, dstip) as unsigned ints when parsed from the wire
+    _wire_ips = None
+
     def __init__(self, raw=None, prev=None, **kw):
         packet_base.__init__(self)
 
@@ -109,9 +114,41 @@ class ipv4(packet_base):
             self.msg('warning IP packet data too short to parse header: data len %u' % (dlen,))
             return
 
+        if not self._unpack_hdr(raw, 0, dlen):
+            return
+
+        # At this point, we are reasonably certain that we have an IP
+        # packet
+        self.parsed = True
+
+        length = self.iplen
+        if length > dlen:
+            length = dlen # Clamp to what we've got
+        if self.protocol == ipv4.UDP_PROTOCOL:
+            self.next = udp(raw=raw[self.hl*4:length], prev=self)
+        elif self.protocol == ipv4.TCP_PROTOCOL:
+            self.next = tcp(raw=raw[self.hl*4:length], prev=self)
+        elif self.protocol == ipv4.ICMP_PROTOCOL:
+            self.next = icmp(raw=raw[self.hl*4:length], prev=self)
+        elif self.protocol == ipv4.IGMP_PROTOCOL:
+            self.next = igmp(raw=raw[self.hl*4:length], prev=self)
+        elif dlen < self.iplen:
+            self.msg('(ip parse) warning IP packet data shorter than IP len: %u < %u' % (dlen, self.iplen))
+        else:
+            self.next =  raw[self.hl*4:length]
+
+        if isinstance(self.next, packet_base) and not self.next.parsed:
+            self.next = raw[self.hl*4:length]
+
+    def _unpack_hdr(self, buf, offset, dlen):
+        """
+        Unpacks and sanity checks the header
+
+        Returns False if this doesn't look like a usable IPv4 header.
+        """
         (vhl, self.tos, self.iplen, self.id, self.frag, self.ttl,
             self.protocol, self.csum, self.srcip, self.dstip) \
-             = struct.unpack('!BBHHHBBHII', raw[:ipv4.MIN_LEN])
+             = _hdr.unpack_from(buf, offset)
 
         self.v = vhl >> 4
         self.hl = vhl & 0x0f
@@ -119,49 +156,64 @@ class ipv4(packet_base):
         self.flags = self.frag >> 13
         self.frag  = self.frag & 0x1fff
 
-        self.dstip = IPAddr(self.dstip)
-        self.srcip = IPAddr(self.srcip)
+        # Addresses as they were on the wire, for incrementally updating
+        # transport checksums if they get rewritten (see tcp/udp hdr())
+        self._wire_ips = (self.srcip, self.dstip)
+
+        self.dstip = IPAddr.from_num(self.dstip)
+        self.srcip = IPAddr.from_num(self.srcip)
 
         if self.v != ipv4.IPv4:
             self.msg('(ip parse) warning: IP version %u not IPv4' % self.v)
-            return
+            return False
         if self.hl < 5:
             self.msg('(ip parse) warning: IP header length shorter than MIN_LEN (IHL=%u => header len=%u)' \
                         % (self.hl, 4 * self.hl))
-            return
+            return False
         if self.iplen < ipv4.MIN_LEN:
             self.msg('(ip parse) warning: Invalid IP len %u' % self.iplen)
-            return
+            return False
         if (self.hl * 4) > self.iplen:
             self.msg('(ip parse) warning: IP header longer than IP length including payload (%u vs %u)' \
                         % (self.hl, self.iplen))
-            return
+            return False
         if (self.hl * 4) > dlen:
             self.msg('(ip parse) warning: IP header is truncated')
+            return False
+        return True
+
+    def _parse_lazy(self, buf, offset, end):
+        self.next = None
+        dlen = end - offset
+        if dlen < ipv4.MIN_LEN:
+            self.msg('warning IP packet data too short to parse header: data len %u' % (dlen,))
+            self._set_lazy(buf, offset, end, False)
             return
 
-        # At this point, we are reasonably certain that we have an IP
-        # packet
+        if not self._unpack_hdr(buf, offset, dlen):
+            self._set_lazy(buf, offset, end, False)
+            return
+
+        self._set_lazy(buf, offset, end)
         self.parsed = True
 
+    def _parse_next_lazy(self):
+        buf = self._buf
+        dlen = self._end - self._off
         length = self.iplen
         if length > dlen:
             length = dlen # Clamp to what we've got
-        if self.protocol == ipv4.UDP_PROTOCOL:
-            self.next = udp(raw=raw[self.hl*4:length], prev=self)
-        elif self.protocol == ipv4.TCP_PROTOCOL:
-            self.next = tcp(raw=raw[self.hl*4:length], prev=self)
-        elif self.protocol == ipv4.ICMP_PROTOCOL:
-            self.next = icmp(raw=raw[self.hl*4:length], prev=self)
-        elif self.protocol == ipv4.IGMP_PROTOCOL:
-            self.next = igmp(raw=raw[self.hl*4:length], prev=self)
+        start = self._off + self.hl*4
+        end = self._off + length
+        cls = _protocol_parsers.get(self.protocol)
+        if cls is not None:
+            p = self._lazy_child(cls, buf, start, end)
+            if p.parsed:
+                return p
         elif dlen < self.iplen:
             self.msg('(ip parse) warning IP packet data shorter than IP len: %u < %u' % (dlen, self.iplen))
-        else:
-            self.next =  raw[self.hl*4:length]
-
-        if isinstance(self.next, packet_base) and not self.next.parsed:
-            self.next = raw[self.hl*4:length]
+            return None
+        return buf[start:end].tobytes()
 
     def checksum(self):
         data = struct.pack('!BBHHHBBHII', (self.v << 4) + self.hl, self.tos,
@@ -180,3 +232,11 @@ class ipv4(packet_base):
                            (self.flags << 13) | self.frag, self.ttl,
                            self.protocol, self.csum, self.srcip.toUnsigned(),
                            self.dstip.toUnsigned())
+
+
+_protocol_parsers = {
+    ipv4.UDP_PROTOCOL  : udp,
+    ipv4.TCP_PROTOCOL  : tcp,
+    ipv4.ICMP_PROTOCOL : icmp,
+    ipv4.IGMP_PROTOCOL : igmp,
+}
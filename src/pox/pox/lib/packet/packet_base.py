@@ -60,13 +60,88 @@ class packet_base (object):
 
         def __str__(self):
             # optionally convert to human readable string
+
+    Lazy parsing:
+
+    Some classes (ethernet, vlan, ipv4, tcp, udp) can also be parsed
+    lazily.  In that case, the header fields are unpacked straight out of
+    a memoryview of the original frame, and the next layer is only parsed
+    the first time .next/.payload (or find()) is used.  .raw is likewise
+    only copied out of the original buffer if somebody asks for it.
+    Such a class implements _parse_lazy(buf, offset, end), which sets up
+    the fields and calls _set_lazy(), and _parse_next_lazy(), which returns
+    the next layer.
     """
+
+    # Set while the next layer has yet to be parsed (see _set_lazy())
+    _lazy_next = False
+
+    # Shared buffer and the extent of this layer within it (lazy mode only)
+    _buf = None
+    _off = 0
+    _end = 0
+
     def __init__ (self):
         self.next = None
         self.prev = None
         self.parsed = False
         self.raw = None
 
+    @property
+    def next (self):
+        if self._lazy_next:
+            self._lazy_next = False
+            self._next = self._parse_next_lazy()
+        return self._next
+
+    @next.setter
+    def next (self, value):
+        self._lazy_next = False
+        self._next = value
+
+    @property
+    def raw (self):
+        r = self._raw
+        if r is None and self._buf is not None:
+            r = self._raw = self._buf[self._off:self._end].tobytes()
+        return r
+
+    @raw.setter
+    def raw (self, value):
+        self._buf = None
+        self._raw = value
+
+    def _set_lazy (self, buf, offset, end, lazy_next=True):
+        """
+        Records where this layer lives in buf and defers parsing the rest
+
+        If lazy_next is False, only .raw is deferred (e.g., because the
+        header was bad and there's no next layer to parse).
+        """
+        self._raw = None
+        self._buf = buf
+        self._off = offset
+        self._end = end
+        self._lazy_next = lazy_next
+
+    def _parse_next_lazy (self):
+        """
+        Parses and returns the next layer when lazily parsing
+        """
+        raise NotImplementedError("_parse_next_lazy() not implemented")
+
+    def _lazy_child (self, cls, buf, offset, end):
+        """
+        Parses buf[offset:end] as a cls whose previous layer is this one
+
+        If cls doesn't support lazy parsing, it gets a copy of the bytes.
+        """
+        if hasattr(cls, '_parse_lazy'):
+            p = cls(prev=self)
+            p._parse_lazy(buf, offset, end)
+            return p
+        return cls(raw=buf[offset:end].tobytes(), prev=self)
+
     def _init (self, kw):
         if 'payload' in kw:
           self.set_payload(kw['payload'])
@@ -24,6 +24,20 @@ import array
 import struct
 from socket import ntohs
 
+# NumPy takes a while to import, so we only do it once we need it
+numpy = None
+_numpy_tried = False
+
+def _import_numpy ():
+  global numpy, _numpy_tried
+  if not _numpy_tried:
+    _numpy_tried = True
+    try:
+      import numpy
+    except ImportError:
+      pass
+  return numpy
+
 _ethtype_to_str = {}
 _ipproto_to_str = {}
 
@@ -77,6 +91,10 @@ class TruncatedException (RuntimeError):
   pass
 
 
+# Data at least this long is summed with NumPy (if available)
+numpy_checksum_threshold = 2048
+
+
 def checksum (data, start = 0, skip_word = None):
   """
   Calculate standard internet checksum over data starting at start'th byte
@@ -87,31 +105,56 @@ def checksum (data, start = 0, skip_word = None):
              verify -- you want to skip that word since it was zero when
              the checksum was initially calculated.
   """
-  if len(data) % 2 != 0:
-    arr = array.array('H', data[:-1])
+  dlen = len(data)
+  odd = dlen & 1
+  if dlen >= numpy_checksum_threshold and _import_numpy() is not None:
+    arr = numpy.frombuffer(data, dtype=numpy.uint16, count=dlen >> 1)
+    start += int(arr.sum(dtype=numpy.uint64))
   else:
-    arr = array.array('H', data)
+    if odd:
+      arr = array.array('H', data[:-1])
+    else:
+      arr = array.array('H', data)
+    start += sum(arr)
 
-  if skip_word is not None:
-    for i in range(0, len(arr)):
-      if i == skip_word:
-        continue
-      start +=  arr[i]
-  else:
-    for i in range(0, len(arr)):
-      start +=  arr[i]
+  if skip_word is not None and skip_word < len(arr):
+    start -= int(arr[skip_word])
 
-  if len(data) % 2 != 0:
+  if odd:
     start += struct.unpack('H', data[-1]+'\0')[0] # Specify order?
 
-  start  = (start >> 16) + (start & 0xffff)
-  start += (start >> 16)
-  #while start >> 16:
-  #  start = (start >> 16) + (start & 0xffff)
+  while start >> 16:
+    start = (start >> 16) + (start & 0xffff)
 
   return ntohs(~start & 0xffff)
 
 
+def checksum_adjust (csum, old, new):
+  """
+  Incrementally update an internet checksum for a changed 16 bit word
+
+  csum is the old checksum (as found in the header, i.e., in host order
+  as unpacked with "!H"), old and new are the old and new values of the
+  word.  Returns the new checksum without touching the rest of the data
+  (RFC 1624, eqn. 3).
+  """
+  s = (~csum & 0xffff) + (~old & 0xffff) + new
+  s = (s >> 16) + (s & 0xffff)
+  s += s >> 16
+  return ~s & 0xffff
+
+
+def checksum_adjust32 (csum, old, new):
+  """
+  Like checksum_adjust(), but for a changed 32 bit value (e.g., an IP)
+  """
+  s = ((~csum & 0xffff) + (~old >> 16 & 0xffff) + (~old & 0xffff)
+       + (new >> 16) + (new & 0xffff))
+  s = (s >> 16) + (s & 0xffff)
+  s += s >> 16
+  return ~s & 0xffff
+
+
 def ethtype_to_str (t):
   """
   Given numeric ethernet type or length, return human-readable representation
@@ -52,6 +52,8 @@ from packet_base import packet_base
 import logging
 lg = logging.getLogger('packet')
 
+_hdr = struct.Struct('!HHIIBBHHH')
+
 
 class tcp_opt (object):
   """
@@ -524,6 +526,11 @@ class tcp (packet_base):
   def _setflag (self, flag, value):
     self.flags = (self.flags & ~flag) | (flag if value else 0)
 
+  _lazy_options = False
+
+  # Set by parsing (see _set_csum_basis())
+  _csum_basis = None
+
   def __init__ (self, raw=None, prev=None, **kw):
     packet_base.__init__(self)
 
@@ -600,18 +607,33 @@ class tcp (packet_base):
 
     return i
 
-  def parse (self, raw):
-    assert isinstance(raw, bytes)
-    self.next = None # In case of unfinished parsing
-    self.raw = raw
-    dlen = len(raw)
-    if dlen < tcp.MIN_LEN:
-      self.msg('(tcp parse) warning TCP packet data too short to parse header: data len %u' % (dlen,))
-      return
+  @property
+  def options (self):
+    if self._lazy_options:
+      self._lazy_options = False
+      raw = self._buf[self._off:self._off+self.hdr_len].tobytes()
+      try:
+        self.parse_options(raw)
+      except Exception as e:
+        # Unlike eager parsing, this can't unset .parsed any more.
+        self.msg(e)
+        self._options = []
+    return self._options
+
+  @options.setter
+  def options (self, value):
+    self._lazy_options = False
+    self._options = value
+
+  def _unpack_hdr (self, buf, offset, dlen):
+    """
+    Unpacks and sanity checks the fixed header
 
+    Returns False if this doesn't look like a usable TCP header.
+    """
     (self.srcport, self.dstport, self.seq, self.ack, offres, self.flags,
     self.win, self.csum, self.urg) \
-        = struct.unpack('!HHIIBBHHH', raw[:tcp.MIN_LEN])
+        = _hdr.unpack_from(buf, offset)
 
     self.off = offres >> 4
     self.res = offres & 0x0f
@@ -622,9 +644,46 @@ class tcp (packet_base):
     self.tcplen = dlen
     if dlen < self.tcplen:
       self.msg('(tcp parse) warning TCP packet data shorter than TCP len: %u < %u' % (dlen, self.tcplen))
-      return
+      return False
     if (self.off * 4) < self.MIN_LEN or (self.off * 4) > dlen :
       self.msg('(tcp parse) warning TCP data offset too long or too short %u' % (self.off,))
+      return False
+    return True
+
+  def _parse_lazy (self, buf, offset, end):
+    self.next = None
+    dlen = end - offset
+    if dlen < tcp.MIN_LEN:
+      self.msg('(tcp parse) warning TCP packet data too short to parse header: data len %u' % (dlen,))
+      self._set_lazy(buf, offset, end, False)
+      return
+
+    if not self._unpack_hdr(buf, offset, dlen):
+      self._set_lazy(buf, offset, end, False)
+      return
+
+    self._set_lazy(buf, offset, end)
+    self._lazy_options = self.hdr_len > tcp.MIN_LEN
+    self.parsed = True
+    # The payload gets filled in by _parse_next_lazy()
+    self._set_csum_basis(buf[offset+tcp.MIN_LEN:offset+self.hdr_len].tobytes(),
+                         None)
+
+  def _parse_next_lazy (self):
+    payload = self._buf[self._off+self.hdr_len:self._end].tobytes()
+    self._csum_basis = self._csum_basis[:-1] + (payload,)
+    return payload
+
+  def parse (self, raw):
+    assert isinstance(raw, bytes)
+    self.next = None # In case of unfinished parsing
+    self.raw = raw
+    dlen = len(raw)
+    if dlen < tcp.MIN_LEN:
+      self.msg('(tcp parse) warning TCP packet data too short to parse header: data len %u' % (dlen,))
+      return
+
+    if not self._unpack_hdr(raw, 0, dlen):
       return
 
     try:
@@ -635,26 +694,78 @@ class tcp (packet_base):
 
     self.next   = raw[self.hdr_len:]
     self.parsed = True
+    self._set_csum_basis(raw[tcp.MIN_LEN:self.hdr_len], self.next)
+
+  def _set_csum_basis (self, options, payload):
+    """
+    Remembers what the checksum on the wire was calculated over
+
+    This lets hdr() update it incrementally later if only the ports and/or
+    IP addresses get rewritten.
+    """
+    self._csum_basis = (self.csum, self.srcport, self.dstport,
+                        (self.seq, self.ack, self.res, self.flags, self.win,
+                         self.urg),
+                        options, payload)
+
+  def _adjusted_checksum (self, payload, options_packed):
+    """
+    Returns the wire checksum updated for rewritten ports and addresses
+
+    Returns None if anything else has changed (in which case the checksum
+    needs to be recalculated from scratch).
+    """
+    b = self._csum_basis
+    if b is None: return None
+    wire_ips = getattr(self.prev, '_wire_ips', None)
+    if wire_ips is None: return None
+    csum,srcport,dstport,fields,options,data = b
+    if fields != (self.seq, self.ack, self.res, self.flags, self.win,
+                  self.urg):
+      return None
+    if options != options_packed: return None
+    if data is None: return None
+    if payload is not data and payload != data: return None
+
+    if self.srcport != srcport:
+      csum = checksum_adjust(csum, srcport, self.srcport)
+    if self.dstport != dstport:
+      csum = checksum_adjust(csum, dstport, self.dstport)
+    ip = self.prev.srcip.toUnsigned()
+    if ip != wire_ips[0]:
+      csum = checksum_adjust32(csum, wire_ips[0], ip)
+    ip = self.prev.dstip.toUnsigned()
+    if ip != wire_ips[1]:
+      csum = checksum_adjust32(csum, wire_ips[1], ip)
+    return csum
 
   def hdr (self, payload, calc_checksum = True, calc_off = True):
-    if calc_checksum:
-      self.csum = self.checksum(payload=payload)
-      csum = self.csum
+    if self._lazy_options:
+      # Nobody has looked at the options, so use them as they were
+      hdr_len = self.hdr_len
+      options_packed = self._buf[self._off+self.MIN_LEN:
+                                 self._off+hdr_len].tobytes()
     else:
-      csum = 0
-
-    options_packed = b"".join(opt.pack() for opt in self.options)
-    hdr_len = self.MIN_LEN
-    hdr_len += len(options_packed)
-    if hdr_len % 4:
-        options_pad_len = 4 - (hdr_len % 4) # number of bytes to pad
-        options_packed += b"\000" * options_pad_len
-        hdr_len += options_pad_len
+      options_packed = b"".join(opt.pack() for opt in self.options)
+      hdr_len = self.MIN_LEN
+      hdr_len += len(options_packed)
+      if hdr_len % 4:
+          options_pad_len = 4 - (hdr_len % 4) # number of bytes to pad
+          options_packed += b"\000" * options_pad_len
+          hdr_len += options_pad_len
     assert hdr_len % 4 == 0
 
     if calc_off:
         self.off = hdr_len / 4
 
+    if calc_checksum:
+      csum = self._adjusted_checksum(payload, options_packed)
+      if csum is None:
+        csum = self.checksum(payload=payload)
+      self.csum = csum
+    else:
+      csum = 0
+
     offres = self.off << 4 | self.res
     header = struct.pack('!HHIIBBHHH',
         self.srcport, self.dstport, self.seq, self.ack,
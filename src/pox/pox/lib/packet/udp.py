@@ -40,6 +40,8 @@ from rip  import *
 
 from packet_base import packet_base
 
+_hdr = struct.Struct('!HHHH')
+
 # We grab ipv4 later to prevent cyclic dependency
 #_ipv4 = None
 
@@ -48,6 +50,9 @@ class udp(packet_base):
 
     MIN_LEN = 8
 
+    # Set by parsing (see _set_csum_basis())
+    _csum_basis = None
+
     def __init__(self, raw=None, prev=None, **kw):
         #global _ipv4
         #if not _ipv4:
@@ -81,8 +86,18 @@ class udp(packet_base):
             self.msg('(udp parse) warning UDP packet data too short to parse header: data len %u' % dlen)
             return
 
+        if not self._unpack_hdr(raw, 0):
+            return
+
+        payload = raw[udp.MIN_LEN:]
+        p = self._parse_payload(payload)
+        if p is not None:
+            self.next = p
+            self._set_csum_basis(payload, len(payload))
+
+    def _unpack_hdr(self, buf, offset):
         (self.srcport, self.dstport, self.len, self.csum) \
-            = struct.unpack('!HHHH', raw[:udp.MIN_LEN])
+            = _hdr.unpack_from(buf, offset)
 
         self.hdr_len = udp.MIN_LEN
         self.payload_len = self.len - self.hdr_len
@@ -90,34 +105,102 @@ class udp(packet_base):
 
         if self.len < udp.MIN_LEN:
             self.msg('(udp parse) warning invalid UDP len %u' % self.len)
-            return
+            return False
+        return True
 
+    def _parse_payload(self, payload):
+        """
+        Parses the payload (the bytes following the UDP header)
+
+        Returns None (after complaining) if the payload is truncated.
+        """
         #TODO: DHCPv6, etc.
 
         if (self.dstport == dhcp.SERVER_PORT
                     or self.dstport == dhcp.CLIENT_PORT):
-            self.next = dhcp(raw=raw[udp.MIN_LEN:],prev=self)
+            return dhcp(raw=payload,prev=self)
         elif (self.dstport == dns.SERVER_PORT
                     or self.srcport == dns.SERVER_PORT):
-            self.next = dns(raw=raw[udp.MIN_LEN:],prev=self)
+            return dns(raw=payload,prev=self)
         elif (self.dstport == dns.MDNS_PORT
                     or self.srcport == dns.MDNS_PORT):
-            self.next = dns(raw=raw[udp.MIN_LEN:],prev=self)
+            return dns(raw=payload,prev=self)
         elif ( (self.dstport == rip.RIP_PORT
                 or self.srcport == rip.RIP_PORT) ):
 #               and isinstance(self.prev, _ipv4)
 #               and self.prev.dstip == rip.RIP2_ADDRESS ):
-            self.next = rip(raw=raw[udp.MIN_LEN:],prev=self)
-        elif dlen < self.len:
-            self.msg('(udp parse) warning UDP packet data shorter than UDP len: %u < %u' % (dlen, self.len))
+            return rip(raw=payload,prev=self)
+        elif len(payload) + udp.MIN_LEN < self.len:
+            self.msg('(udp parse) warning UDP packet data shorter than UDP len: %u < %u' % (len(payload) + udp.MIN_LEN, self.len))
+            return None
+        else:
+            return payload
+
+    def _parse_lazy(self, buf, offset, end):
+        dlen = end - offset
+        if dlen < udp.MIN_LEN:
+            self.msg('(udp parse) warning UDP packet data too short to parse header: data len %u' % dlen)
+            self._set_lazy(buf, offset, end, False)
             return
+
+        if self._unpack_hdr(buf, offset):
+            self._set_lazy(buf, offset, end)
+            # The payload gets filled in by _parse_next_lazy()
+            self._set_csum_basis(None, dlen - udp.MIN_LEN)
         else:
-            self.payload = raw[udp.MIN_LEN:]
+            self._set_lazy(buf, offset, end, False)
+
+    def _parse_next_lazy(self):
+        payload = self._buf[self._off + udp.MIN_LEN:self._end].tobytes()
+        p = self._parse_payload(payload)
+        if p is not None and self._csum_basis is not None:
+            self._csum_basis = self._csum_basis[:-1] + (payload,)
+        return p
+
+    def _set_csum_basis(self, payload, payload_len):
+        """
+        Remembers what the checksum on the wire was calculated over
 
+        This lets hdr() update it incrementally later if only the ports
+        and/or IP addresses get rewritten.
+        """
+        if self.csum != 0 and self.len == udp.MIN_LEN + payload_len:
+            self._csum_basis = (self.csum, self.srcport, self.dstport,
+                                payload)
+
+    def _adjusted_checksum(self, payload):
+        """
+        Returns the wire checksum updated for rewritten ports and addresses
+
+        Returns None if the payload has changed (in which case the
+        checksum needs to be recalculated from scratch).
+        """
+        b = self._csum_basis
+        if b is None: return None
+        wire_ips = getattr(self.prev, '_wire_ips', None)
+        if wire_ips is None: return None
+        csum,srcport,dstport,data = b
+        if data is None: return None
+        if payload is not data and payload != data: return None
+
+        if self.srcport != srcport:
+            csum = checksum_adjust(csum, srcport, self.srcport)
+        if self.dstport != dstport:
+            csum = checksum_adjust(csum, dstport, self.dstport)
+        ip = self.prev.srcip.toUnsigned()
+        if ip != wire_ips[0]:
+            csum = checksum_adjust32(csum, wire_ips[0], ip)
+        ip = self.prev.dstip.toUnsigned()
+        if ip != wire_ips[1]:
+            csum = checksum_adjust32(csum, wire_ips[1], ip)
+        return 0xffff if csum == 0 else csum
 
     def hdr(self, payload):
         self.len = len(payload) + udp.MIN_LEN
-        self.csum = self.checksum()
+        csum = self._adjusted_checksum(payload)
+        if csum is None:
+            csum = self.checksum()
+        self.csum = csum
         return struct.pack('!HHHH', self.srcport, self.dstport, self.len, self.csum)
 
     def checksum(self, unparsed=False):
@@ -35,6 +35,7 @@ from ethernet import ethernet
 
 from packet_utils       import *
 
+_hdr = struct.Struct("!HH")
 
 class vlan(packet_base):
     "802.1q vlan header"
@@ -72,7 +73,7 @@ class vlan(packet_base):
                      + 'parse header: data len %u' % (dlen,))
             return
 
-        (pcpid, self.eth_type) = struct.unpack("!HH", raw[:vlan.MIN_LEN])
+        (pcpid, self.eth_type) = _hdr.unpack_from(raw)
 
         self.pcp = pcpid >> 13
         self.cfi = pcpid  & 0x1000
@@ -82,6 +83,27 @@ class vlan(packet_base):
 
         self.next = ethernet.parse_next(self,self.eth_type,raw,vlan.MIN_LEN)
 
+    def _parse_lazy(self, buf, offset, end):
+        dlen = end - offset
+        if dlen < vlan.MIN_LEN:
+            self.msg('(vlan parse) warning VLAN packet data too short to '
+                     + 'parse header: data len %u' % (dlen,))
+            self._set_lazy(buf, offset, end, False)
+            return
+
+        (pcpid, self.eth_type) = _hdr.unpack_from(buf, offset)
+
+        self.pcp = pcpid >> 13
+        self.cfi = pcpid  & 0x1000
+        self.id  = pcpid  & 0x0fff
+
+        self._set_lazy(buf, offset, end)
+        self.parsed = True
+
+    def _parse_next_lazy(self):
+        return ethernet.parse_next_lazy(self, self.eth_type, self._buf,
+                                        self._off + vlan.MIN_LEN, self._end)
+
     @property
     def effective_ethertype (self):
       return ethernet._get_effective_ethertype(self)
@@ -34,6 +34,9 @@ from threading import Thread, Lock
 import pox.lib.packet as pkt
 import copy
 
+# Sends a whole list of frames in one call (not in older builds)
+_inject_many = getattr(pcapc, "inject_many", None) if enabled else None
+
 # pcap's filter compiling function isn't threadsafe, so we use this
 # lock when compiling filters.
 _compile_lock = Lock()
@@ -263,6 +266,20 @@ class PCap (object):
       data = bytes(data) # Give it a try...
     return pcapc.inject(self.pcap, data)
 
+  def inject_many (self, frames):
+    """
+    Sends a sequence of raw frames (bytes)
+
+    Returns the number of frames sent.
+    """
+    if _inject_many is not None:
+      return _inject_many(self.pcap, frames)
+    # Old build of the C module
+    sent = 0
+    for data in frames:
+      if pcapc.inject(self.pcap, data) >= 0: sent += 1
+    return sent
+
   def set_filter (self, filter, optimize = True):
     if self.pcap is None:
       self.deferred_filter = (filter, optimize)
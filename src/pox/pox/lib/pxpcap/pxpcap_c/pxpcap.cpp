@@ -595,6 +595,53 @@ static PyObject * p_inject (PyObject *self, PyObject *args)
   return Py_BuildValue("i", rv);
 }
 
+static PyObject * p_inject_many (PyObject *self, PyObject *args)
+{
+  pcap_t * ppcap;
+  PyObject * frames;
+  if (!PyArg_ParseTuple(args, "lO", (long int*)&ppcap, &frames)) return NULL;
+  PyObject * seq = PySequence_Fast(frames, "Expected a sequence of frames");
+  if (!seq) return NULL;
+  Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+  Py_buffer * bufs;
+  bufs = (Py_buffer *)PyMem_Malloc(sizeof(Py_buffer) * (n ? n : 1));
+  if (!bufs)
+  {
+    Py_DECREF(seq);
+    return PyErr_NoMemory();
+  }
+
+  // Get at all the data first, so the sends can run without the GIL
+  Py_ssize_t got = 0;
+  for (; got < n; got++)
+  {
+    PyObject * item = PySequence_Fast_GET_ITEM(seq, got);
+    if (PyObject_GetBuffer(item, &bufs[got], PyBUF_SIMPLE)) break;
+  }
+
+  int sent = 0;
+  if (got == n)
+  {
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < n; i++)
+    {
+#ifdef WIN32
+      if (pcap_sendpacket(ppcap, (u_char*)bufs[i].buf, bufs[i].len) == 0)
+        sent++;
+#else
+      if (pcap_inject(ppcap, bufs[i].buf, bufs[i].len) >= 0) sent++;
+#endif
+    }
+    Py_END_ALLOW_THREADS
+  }
+
+  for (Py_ssize_t i = 0; i < got; i++) PyBuffer_Release(&bufs[i]);
+  PyMem_Free(bufs);
+  Py_DECREF(seq);
+  if (got != n) return NULL;
+  return Py_BuildValue("i", sent);
+}
+
 static PyObject * p_close (PyObject *self, PyObject *args)
 {
   pcap_t * ppcap;
@@ -631,6 +678,7 @@ static PyMethodDef pxpcapmethods[] =
   {"setfilter", p_setfilter, METH_VARARGS, "Set filter.\nPass it ppcap, pprogram (from compile())."},
   {"freecode", p_freecode, METH_VARARGS, "Free compiled filter.\nPass it pprogram from compile()."},
   {"inject", p_inject, METH_VARARGS, "Sends a packet.\nPass it a ppcap and data (bytes) to send.\nReturns number of bytes sent."},
+  {"inject_many", p_inject_many, METH_VARARGS, "Sends several packets.\nPass it a ppcap and a sequence of data (bytes) to send.\nThe GIL is released once for the whole batch.\nReturns number of packets sent."},
   {"setdirection", p_setdirection, METH_VARARGS, "Sets the capture direction.\nTakes a ppcap and two boolean args: Incoming and Outgoing.\nSupport varies by platform."},
   {"set_datalink", p_set_datalink, METH_VARARGS, "Sets the datalink type to capture.\nTakes a ppcap and a datalink type."},
   {NULL, NULL, 0, NULL}
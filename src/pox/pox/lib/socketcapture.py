@@ -14,9 +14,14 @@
 
 from pox.lib.addresses import *
 import pox.lib.packet as pkt
+from pox.lib.packet.packet_utils import checksum
 
-from struct import pack
+from struct import pack, pack_into
+from collections import deque
+import threading
+import atexit
 import time
+import os
 
 
 class SocketWedge (object):
@@ -37,6 +42,51 @@ class SocketWedge (object):
     return getattr(self._socket, n)
 
 
+class _TCPTemplate (object):
+  """
+  Headers for one direction of a faked TCP connection
+
+  The Ethernet/IP/TCP headers are packed once, and each frame just fills
+  in the lengths, sequence numbers and checksums.
+  """
+  def __init__ (self, e1, e2, i1, i2, t1, t2):
+    e = pkt.ethernet(
+        src = e1,
+        dst = e2,
+        type = pkt.ethernet.IP_TYPE)
+    i = pkt.ipv4(
+        srcip = i1,
+        dstip = i2,
+        protocol = pkt.ipv4.TCP_PROTOCOL)
+    t = pkt.tcp(
+        srcport = t1,
+        dstport = t2,
+        off = 5,
+        win = 1)
+    t.ACK = True
+    i.payload = t
+    e.payload = i
+    self.header = bytearray(e.pack())
+    self.seq = 0
+    self.ack = 0
+    # Pseudo-header for the TCP checksum, less the length
+    self._pseudo = pack("!4s4sBB", i.srcip.raw, i.dstip.raw, 0,
+                        pkt.ipv4.TCP_PROTOCOL)
+
+  def frame (self, payload):
+    h = self.header
+    l = len(payload)
+    pack_into("!H", h, 16, 40 + l) # IP length
+    pack_into("!H", h, 24, 0)
+    pack_into("!H", h, 24, checksum(bytes(h[14:34])))
+    pack_into("!II", h, 38, self.seq & 0xffFFffFF, self.ack & 0xffFFffFF)
+    pack_into("!H", h, 50, 0)
+    tcp = bytes(h[34:])
+    csum = checksum(self._pseudo + pack("!H", 20 + l) + tcp + payload)
+    pack_into("!H", h, 50, csum)
+    return bytes(h) + payload
+
+
 class PCapWriter (object):
   def __init__ (self, outstream, socket = None, flush = False,
                 local_addrs = (None,None,None),
@@ -58,26 +108,7 @@ class PCapWriter (object):
       remote = ("1.1.1.1",1)
       local = ("0.0.0.0",0)
 
-    def create_packet (e1,e2,i1,i2,t1,t2):
-      e = pkt.ethernet(
-          src = e1,
-          dst = e2,
-          type = pkt.ethernet.IP_TYPE)
-      i = pkt.ipv4(
-          srcip = i1,
-          dstip = i2,
-          protocol = pkt.ipv4.TCP_PROTOCOL)
-      t = pkt.tcp(
-          srcport = t1,
-          dstport = t2,
-          off = 5,
-          win = 1)
-      t.ACK = True
-      i.payload = t
-      e.payload = i
-      return e
-
-    self._c_to_s = create_packet(
+    self._c_to_s = _TCPTemplate(
       local_addrs[0] or EthAddr("\x02" + "\x00" * 5),
       remote_addrs[0] or EthAddr("\x02" + "\x11" * 5),
       local_addrs[1] or IPAddr(local[0]),
@@ -86,7 +117,7 @@ class PCapWriter (object):
       remote_addrs[2] or remote[1],
       )
 
-    self._s_to_c = create_packet(
+    self._s_to_c = _TCPTemplate(
       remote_addrs[0] or EthAddr("\x02" + "\x11" * 5),
       local_addrs[0] or EthAddr("\x02" + "\x00" * 5),
       remote_addrs[1] or IPAddr(remote[0]),
@@ -95,6 +126,10 @@ class PCapWriter (object):
       local_addrs[2] or local[1],
       )
 
+    self._write_file_header(outstream)
+
+  @staticmethod
+  def _write_file_header (outstream):
     outstream.write(pack("IHHiIII",
       0xa1b2c3d4,    # Magic
       2,4,           # Version
@@ -104,29 +139,229 @@ class PCapWriter (object):
       1              # Ethernet
       ))
 
-  def write (self, outgoing, buf):
-    if len(buf) == 0: return
+  def _record (self, outgoing, buf, t):
+    """
+    Returns the pcap record for buf sent (or received) at time t
+    """
     e = self._c_to_s if outgoing else self._s_to_c
     e2 = self._c_to_s if not outgoing else self._s_to_c
     l = len(buf)
-    e.payload.payload.payload = buf
-    buf = e.pack()
+    buf = e.frame(buf)
+    e.seq += l
+    e2.ack += l
 
-    t = time.time()
     ut = t - int(t)
     t = int(t)
     ut = int(ut * 1000000)
-    self._out.write(pack("IIII",
+    return pack("IIII",
       t,ut,          # Timestamp
       len(buf),      # Saved size
       len(buf),      # Original size
-      ))
+      ) + buf
 
-    self._out.write(buf)
+  def write (self, outgoing, buf):
+    if len(buf) == 0: return
+    self._out.write(self._record(outgoing, buf, time.time()))
     if self._flush: self._out.flush()
 
-    e.next.next.seq += l
-    e2.next.next.ack += l
+  def close (self):
+    self._out.close()
+
+
+class BackgroundPCapWriter (PCapWriter):
+  """
+  A PCapWriter which does its writing on a background thread
+
+  write() just timestamps the buffer and appends it to a deque (which is
+  safe without a lock), so it costs the capturing side very little.  One
+  thread shared by all BackgroundPCapWriters turns what's queued into
+  pcap records and writes them in batches.  If more than max_buffer bytes
+  are waiting, new data is dropped and counted in .dropped, and the writer
+  thread is told where the hole in the stream is (see _lost()).
+
+  If outstream is a filename, the trace can also be rotated to a new file
+  once the current one has rotate_size bytes and/or is rotate_time
+  seconds old.  Later files are named like foo-1.pcap, foo-2.pcap, ...
+  """
+  # Seconds the writer thread sleeps when there's nothing to write
+  interval = 0.1
+
+  def __init__ (self, outstream, socket = None,
+                local_addrs = (None,None,None),
+                remote_addrs = (None,None,None),
+                max_buffer = 16 * 1024 * 1024,
+                rotate_size = None, rotate_time = None):
+    self._filename = None
+    if isinstance(outstream, basestring):
+      self._filename = outstream
+      outstream = open(outstream, "wb")
+    elif rotate_size or rotate_time:
+      raise ValueError("Rotation requires a filename")
+    self.max_buffer = max_buffer
+    self.rotate_size = rotate_size
+    self.rotate_time = rotate_time
+    self.dropped = 0
+    self._ring = deque() # (time, outgoing, buf or [bytes lost])
+    # outgoing -> the [bytes lost] queued for the current run of drops
+    self._gaps = {True:None, False:None}
+    # Bytes ever queued/taken off the ring.  Each is only changed by one
+    # side, so the difference is what's waiting.
+    self._queued = 0
+    self._taken = 0
+    self._lock = threading.Lock() # Held while draining
+    self._closed = False
+    self._file_count = 0
+    self._file_size = 0
+    self._file_time = time.time()
+    super(BackgroundPCapWriter,self).__init__(outstream, socket=socket,
+                                              local_addrs=local_addrs,
+                                              remote_addrs=remote_addrs)
+    _writer_thread.add(self)
+
+  def write (self, outgoing, buf):
+    if not buf or self._closed: return
+    if self._queued - self._taken > self.max_buffer:
+      self.dropped += 1
+      gap = self._gaps[outgoing]
+      if gap is None:
+        gap = self._gaps[outgoing] = [0]
+        self._ring.append((time.time(), outgoing, gap))
+      gap[0] += len(buf)
+      return
+    self._gaps[outgoing] = None
+    self._queued += len(buf)
+    self._ring.append((time.time(), outgoing, buf))
+
+  def _split (self, outgoing, buf):
+    """
+    Splits what was sent or received into what should go in each packet
+
+    Runs on the writer thread.
+    """
+    return (buf,)
+
+  def _lost (self, outgoing, size):
+    """
+    Called when at least size bytes going one way were dropped
+
+    Runs on the writer thread, in order with the data around the hole.
+    """
+    pass
+
+  def flush (self):
+    """
+    Writes whatever is waiting
+    """
+    with self._lock:
+      ring = self._ring
+      if not ring: return False
+      records = []
+      record = self._record
+      split = self._split
+      while ring:
+        t,outgoing,buf = ring.popleft()
+        if type(buf) is list:
+          self._lost(outgoing, buf[0])
+          continue
+        self._taken += len(buf)
+        for part in split(outgoing, buf):
+          if part:
+            records.append(record(outgoing, part, t))
+      data = b''.join(records)
+      self._out.write(data)
+      self._out.flush()
+      self._file_size += len(data)
+      self._maybe_rotate()
+      return True
+
+  def _maybe_rotate (self):
+    if self._filename is None: return
+    full = self.rotate_size and self._file_size >= self.rotate_size
+    old = (self.rotate_time
+           and time.time() - self._file_time >= self.rotate_time)
+    if not (full or old): return
+    self._out.close()
+    self._file_count += 1
+    root,ext = os.path.splitext(self._filename)
+    self._out = open("%s-%i%s" % (root, self._file_count, ext), "wb")
+    self._write_file_header(self._out)
+    self._file_size = 0
+    self._file_time = time.time()
+
+  def close (self):
+    """
+    Writes whatever is waiting and closes the output
+    """
+    if self._closed: return
+    self._closed = True
+    _writer_thread.remove(self)
+    self.flush()
+    with self._lock:
+      self._out.close()
+
+
+class _WriterThread (object):
+  """
+  The thread which writes for all BackgroundPCapWriters
+  """
+  def __init__ (self):
+    self._writers = set()
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._thread = None
+
+  def add (self, writer):
+    with self._lock:
+      self._writers.add(writer)
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run,
+                                        name="PCapWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+  def remove (self, writer):
+    with self._lock:
+      self._writers.discard(writer)
+      if not self._writers:
+        self._wake.set() # So that the thread can finish
+
+  def stop (self):
+    """
+    Closes all the writers and waits for the thread to finish
+    """
+    with self._lock:
+      writers = list(self._writers)
+      thread = self._thread
+    for w in writers:
+      try:
+        w.close()
+      except Exception:
+        pass
+    if thread is not None:
+      thread.join()
+
+  def _run (self):
+    while True:
+      with self._lock:
+        writers = list(self._writers)
+        if not writers:
+          self._thread = None
+          return
+      wrote = False
+      for w in writers:
+        try:
+          if w.flush(): wrote = True
+        except Exception:
+          import logging
+          logging.getLogger("socketcapture").exception("Capture failed")
+          w._closed = True
+          self.remove(w)
+      if not wrote:
+        self._wake.wait(BackgroundPCapWriter.interval)
+        self._wake.clear()
+
+_writer_thread = _WriterThread()
+atexit.register(_writer_thread.stop)
 
 
 class CaptureSocket (SocketWedge):
@@ -135,7 +370,8 @@ class CaptureSocket (SocketWedge):
   """
   def __init__ (self, socket, outstream, close = True,
                 local_addrs = (None,None,None),
-                remote_addrs = (None,None,None)):
+                remote_addrs = (None,None,None),
+                writer_class = PCapWriter, **kw):
     """
     socket is the socket to be wrapped.
     outstream is the stream to write the PCAP trace to.
@@ -143,12 +379,14 @@ class CaptureSocket (SocketWedge):
     fake IP and TCP addresses as well.  Thus, you can specify local_addrs
     or remote_addrs.  These are tuples of (EthAddr, IPAddr, TCPPort).
     Any item that is None gets a default value.
+    writer_class is the PCapWriter (sub)class to use.  Extra keyword
+    arguments are passed along to it.
     """
     super(CaptureSocket, self).__init__(socket)
     self._close = close
-    self._writer = PCapWriter(outstream, socket=socket,
-                              local_addrs=local_addrs,
-                              remote_addrs=remote_addrs)
+    self._writer = writer_class(outstream, socket=socket,
+                                local_addrs=local_addrs,
+                                remote_addrs=remote_addrs, **kw)
 
 
   def _recv_out (self, buf):
@@ -166,7 +404,7 @@ class CaptureSocket (SocketWedge):
   def close (self, *args, **kw):
     if self._close:
       try:
-        self._writer._out.close()
+        self._writer.close()
       except Exception:
         pass
     return self._socket.close(*args, **kw)
@@ -29,11 +29,16 @@ exact-match rules for each flow.
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.openflow.match_key import packet_in_match
+from pox.livestreaming.util import lookup_port
 from pox.lib.util import dpid_to_str, str_to_dpid
 from pox.lib.util import str_to_bool
+from pox.log.sampled import getLogger
+import logging
 import time
 
-log = core.getLogger()
+# Much of what we log happens per packet, so this one can rate limit
+log = getLogger()
 
 
 # Hardcoding RTMP constants.
@@ -138,6 +143,8 @@ class RTMPControlPacket(object):
         """
         Dump the fields for debugging.
         """
+        if not log.isEnabledFor(logging.DEBUG):
+            return
         dump = "[RTMP]"
         if self.chunk_header_type is not None:
             dump += " chunk_header_type:" + bin(self.chunk_header_type)
@@ -267,20 +274,21 @@ class LearningSwitch(object):
             msg.in_port = event.port
             self.connection.send(msg)
 
-        if packet.dst not in self.macToPort:    # 2
+        out_port = lookup_port(self.connection.dpid, packet.dst,
+                               self.macToPort)
+        if out_port is None:    # 2
             flood()     # 2a
         else:
-            out_port = self.macToPort[packet.dst]
             if out_port == event.port:  # 3
                 log.warning("[L2] Same port for packet from %s -> %s on %s.%s."
-                            "Dropping..." % (packet.src, packet.dst,
-                                             dpid_to_str(event.dpid), out_port))
+                            "Dropping...", packet.src, packet.dst,
+                            dpid_to_str(event.dpid), out_port, rate=1)
                 return  # 3a
             # 4
-            log.debug("[L2] Installing flow for %s.%i -> %s.%i" %
-                      (packet.src, event.port, packet.dst, out_port))
+            log.debug("[L2] Installing flow for %s.%i -> %s.%i",
+                      packet.src, event.port, packet.dst, out_port, rate=10)
             msg = of.ofp_flow_mod()
-            msg.match = of.ofp_match.from_packet(packet, event.port)
+            msg.match = packet_in_match(event)
             msg.actions.append(of.ofp_action_output(port=out_port))
             msg.data = event.ofp # 6a
             self.connection.send(msg)
@@ -310,8 +318,10 @@ class LearningSwitch(object):
             """
             Send the packet out in normal way w/o installing a flow table entry.
             """
-            out_port = self.macToPort[packet.dst] if packet.dst in self.macToPort \
-                                                  else of.OFPP_FLOOD
+            out_port = lookup_port(self.connection.dpid, packet.dst,
+                                   self.macToPort)
+            if out_port is None:
+                out_port = of.OFPP_FLOOD
             msg = of.ofp_packet_out()
             msg.actions.append(of.ofp_action_output(port=out_port))
             msg.data = event.ofp
@@ -322,16 +332,17 @@ class LearningSwitch(object):
             """
             Dump RTMP-related records for debugging.
             """
-            log.debug("  vport:%s v_dl_addr:%s v_nw_addr:%s v_tp_port:%s" % \
-                      (self.vport, self.v_dl_addr, self.v_nw_addr, self.v_tp_port))
-            log.debug("  bport:%s b_dl_addr:%s b_nw_addr:%s b_tp_port:%s" % \
-                      (self.bport, self.b_dl_addr, self.b_nw_addr, self.b_tp_port))
-            log.debug("  sport:%s s_dl_addr:%s s_nw_addr:%s s_tp_port:%s" % \
-                      (self.sport, self.s_dl_addr, self.s_nw_addr, RTMP_PORT))
-            log.debug("  vstatus:" + str(self.status_vplay)[:1] + \
-                      "-" + str(self.status_vready)[:1] +
-                      "  bstatus:" + str(self.status_bpublish)[:1] + \
-                      "-" + str(self.status_bready)[:1])
+            if not log.isEnabledFor(logging.DEBUG):
+                return
+            log.debug("  vport:%s v_dl_addr:%s v_nw_addr:%s v_tp_port:%s",
+                      self.vport, self.v_dl_addr, self.v_nw_addr, self.v_tp_port)
+            log.debug("  bport:%s b_dl_addr:%s b_nw_addr:%s b_tp_port:%s",
+                      self.bport, self.b_dl_addr, self.b_nw_addr, self.b_tp_port)
+            log.debug("  sport:%s s_dl_addr:%s s_nw_addr:%s s_tp_port:%s",
+                      self.sport, self.s_dl_addr, self.s_nw_addr, RTMP_PORT)
+            log.debug("  vstatus:%.1s-%.1s  bstatus:%.1s-%.1s",
+                      self.status_vplay, self.status_vready,
+                      self.status_bpublish, self.status_bready)
 
         #
         # Parse the RTMP pakcets. If not an actual RTMP packet (only a TCP meta
@@ -576,15 +587,18 @@ class LearningSwitch(object):
             """
             Send the packet out in normal way w/o installing a flow table entry.
             """
-            out_port = self.macToPort[packet.dst] if packet.dst in self.macToPort \
-                                                  else of.OFPP_FLOOD
+            out_port = lookup_port(self.connection.dpid, packet.dst,
+                                   self.macToPort)
+            if out_port is None:
+                out_port = of.OFPP_FLOOD
             msg = of.ofp_packet_out()
             msg.actions.append(of.ofp_action_output(port=out_port))
             msg.data = event.ofp
             msg.in_port = event.port
             self.connection.send(msg)
 
-        log.debug("<NOTIFY> heartbeat %s -> %s" % (ip_packet.srcip, ip_packet.dstip))
+        log.debug("<NOTIFY> heartbeat %s -> %s", ip_packet.srcip, ip_packet.dstip,
+                  rate=1)
 
         #
         # If P2P stage is enabled, hack through this notification packet and modify
@@ -597,8 +611,10 @@ class LearningSwitch(object):
             assert ip_packet.srcip == self.s_nw_addr
 
             msg_out = of.ofp_packet_out()
-            out_port = self.macToPort[packet.dst] if packet.dst in self.macToPort \
-                                                  else of.OFPP_FLOOD
+            out_port = lookup_port(self.connection.dpid, packet.dst,
+                                   self.macToPort)
+            if out_port is None:
+                out_port = of.OFPP_FLOOD
             msg_out.actions.append(of.ofp_action_output(port=out_port))
 
             # Rewrite TCP payload to the peer's IP address.
@@ -614,11 +630,11 @@ class LearningSwitch(object):
             msg_out.data = packet
             msg_out.in_port = event.port
             self.connection.send(msg_out)
-            log.info("<NOTIFY> Pushed \'%s\'' to %s" % (new_payload, ip_packet.dstip))
+            log.info("<NOTIFY> Pushed \'%s\'' to %s", new_payload, ip_packet.dstip)
 
             # Install a drop entry for further notification heartbeats.
             msg_mod = of.ofp_flow_mod()
-            msg_mod.match = of.ofp_match.from_packet(packet, event.port)
+            msg_mod.match = packet_in_match(event)
             self.connection.send(msg_mod)
             log.info("<NOTIFY> Drop entry installed!")
 
@@ -659,7 +675,7 @@ class BypassLivestreaming(object):
         core.openflow.addListeners(self)
 
     def _handle_ConnectionUp(self, event):
-        log.debug("Connection %s" % (event.connection,))
+        log.debug("Connection %s", event.connection)
         LearningSwitch(event.connection)
 
 
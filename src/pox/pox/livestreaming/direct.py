@@ -29,6 +29,8 @@ exact-match rules for each flow.
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.openflow.match_key import packet_in_match
+from pox.livestreaming.util import lookup_port
 from pox.lib.util import dpid_to_str, str_to_dpid
 from pox.lib.util import str_to_bool
 import time
@@ -114,7 +116,7 @@ class LearningSwitch(object):
                 if not isinstance(duration, tuple):
                     duration = (duration,duration)
                 msg = of.ofp_flow_mod()
-                msg.match = of.ofp_match.from_packet(packet)
+                msg.match = packet_in_match(event, in_port=False)
                 msg.idle_timeout = duration[0]
                 msg.hard_timeout = duration[1]
                 msg.buffer_id = event.ofp.buffer_id
@@ -135,10 +137,11 @@ class LearningSwitch(object):
         if packet.dst.is_multicast:
             flood() # 3a
         else:
-            if packet.dst not in self.macToPort: # 4
+            port = lookup_port(self.connection.dpid, packet.dst,
+                               self.macToPort)
+            if port is None: # 4
                 flood("Port for %s unknown -- flooding" % (packet.dst,)) # 4a
             else:
-                port = self.macToPort[packet.dst]
                 if port == event.port: # 5
                     # 5a
                     log.warning("Same port for packet from %s -> %s on %s.%s."
@@ -150,7 +153,7 @@ class LearningSwitch(object):
                 log.debug("installing flow for %s.%i -> %s.%i" %
                           (packet.src, event.port, packet.dst, port))
                 msg = of.ofp_flow_mod()
-                msg.match = of.ofp_match.from_packet(packet, event.port)
+                msg.match = packet_in_match(event)
                 msg.idle_timeout = 10
                 msg.hard_timeout = 30
                 msg.actions.append(of.ofp_action_output(port=port))
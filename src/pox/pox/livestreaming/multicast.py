@@ -0,0 +1,553 @@
+# Livestreaming packet steering controller.
+# MIT Fall 2019 6.829 project team: Vishrant, Allison, and Guanzhou.
+
+"""
+Proactive distribution trees for livestreams.
+
+Without this, every viewer pulls its own TCP stream from the CDN node, so
+the CDN uplinks carry one copy of the stream per viewer. This component
+watches RTMP control traffic the same way `livestreaming.bypass` does.
+When it sees a broadcaster publish a stream, it installs a distribution
+tree for that stream in the fabric:
+
+  - The tree is rooted at the broadcaster's switch. It reaches the CDN's
+    switch, so the CDN still gets the stream. It also reaches every switch
+    with a viewer that has a local relay.
+  - Each switch on the tree gets one flow entry for the broadcaster's
+    media flow. The entry has one output action per branch, the OpenFlow
+    1.0 stand-in for a group entry. One copy of each media packet crosses
+    each link.
+  - A relay receives the broadcaster's TCP segments unmodified on its
+    switch port (it should capture them promiscuously). It then serves
+    the stream to the viewers on that switch over their own TCP
+    connections.
+
+Viewers keep asking for the stream from the CDN node. At a switch with a
+relay, their RTMP connections are steered to the relay instead, the same
+way misc.ip_loadbalancer steers clients to a server: the destination is
+rewritten to the relay on the way in, and the source is rewritten back to
+the CDN node on the way out. A viewer steered this way counts as a viewer
+on that switch, so the tree reaches its relay, and it never uses the
+CDN uplink.
+
+The tree is a Steiner tree approximation built over the links found by
+`openflow.discovery`. It is rebuilt when links change and when viewers
+come and go.
+
+It only observes RTMP packets; forwarding is left to whatever switch
+component runs alongside it, e.g.:
+
+  ./pox.py openflow.discovery livestreaming.bypass \
+           livestreaming.multicast --relays=1.4,2.3
+
+Relays are given as <dpid>.<port> pairs. A relay's addresses are learned
+from the first IP or ARP packet it sends, so it should send one (e.g., a
+ping) before viewers join.
+"""
+
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.graph.shortest_paths import ShortestPaths
+from pox.lib.util import dpid_to_str, str_to_dpid
+from pox.livestreaming.bypass import RTMPControlPacket, RTMP_PORT
+
+log = core.getLogger()
+
+
+# Flow entries for the tree must win over the per-flow entries installed
+# by the switch component.
+TREE_PRIORITY = of.OFP_DEFAULT_PRIORITY + 100
+
+# Viewer steering entries use the same priority.  The entries which send
+# new viewer connections to us sit just below, so those win.
+CATCH_PRIORITY = TREE_PRIORITY - 1
+
+# Steering entries for a viewer are removed after this long idle, and put
+# back when its next connection starts.
+STEER_IDLE_TIMEOUT = 10
+
+# A stream whose tree entry at the broadcaster's switch idles this long
+# is considered over.
+STREAM_IDLE_TIMEOUT = 30
+
+
+def steiner_tree(paths, root, terminals):
+    """
+    Approximate a minimal tree from root that reaches all terminals.
+
+    This is the Takahashi-Matsuyama heuristic. It repeatedly grafts the
+    terminal nearest to the tree so far onto the tree, along a shortest
+    path. The result is within a factor of two of the optimum.
+
+    Args:
+        paths - a ShortestPaths over the switch graph
+        root - the node the tree hangs from
+        terminals - nodes the tree must reach
+
+    Returns a (parent, unreachable) pair. parent maps every tree node to
+    the node before it (the root maps to None). unreachable is the set of
+    terminals that could not be reached.
+    """
+    parent = {root: None}
+    remaining = set(terminals)
+    remaining.discard(root)
+    while remaining:
+        best = None
+        for t in sorted(remaining):
+            for x in parent:
+                d = paths.distance(x, t)
+                if d is not None and (best is None or d < best[0]):
+                    best = (d, x, t)
+        if best is None:
+            break
+        d, x, t = best
+        p = paths.path(x, t)
+        for a, b in zip(p[:-1], p[1:]):
+            if b not in parent:
+                parent[b] = a
+        remaining.difference_update(parent)
+    return parent, remaining
+
+
+class Stream(object):
+    """
+    One published stream and the tree installed for it.
+
+    The stream is identified by the broadcaster's TCP connection to the
+    CDN node.
+    """
+
+    def __init__(self, b_dl_addr, b_nw_addr, b_tp_port, s_dl_addr, s_nw_addr):
+        self.b_dl_addr = b_dl_addr
+        self.b_nw_addr = b_nw_addr
+        self.b_tp_port = b_tp_port
+        self.s_dl_addr = s_dl_addr
+        self.s_nw_addr = s_nw_addr
+        self.installed = {}     # dpid -> (in_port, out ports) installed there.
+
+    @property
+    def key(self):
+        return (self.b_nw_addr, self.b_tp_port, self.s_nw_addr)
+
+    def match(self, in_port):
+        """
+        Match for the media flow as it arrives on in_port.
+        """
+        return of.ofp_match(in_port=in_port,
+                            dl_type=0x0800,     # Match IPv4.
+                            nw_proto=6,         # Match TCP.
+                            nw_src=self.b_nw_addr,
+                            nw_dst=self.s_nw_addr,
+                            tp_src=self.b_tp_port,
+                            tp_dst=RTMP_PORT)
+
+    def __str__(self):
+        return "%s:%s->%s" % self.key
+
+
+class LivestreamMulticast(object):
+    """
+    Detects streams and their viewers and keeps a tree installed for each.
+    """
+
+    def __init__(self, relays=()):
+        """
+        Args:
+            relays - iterable of (dpid, port) where relays are attached
+        """
+        self.relays = {}        # dpid -> [relay ports]
+        for dpid, port in relays:
+            self.relays.setdefault(dpid, []).append(port)
+        self.relay_addrs = {}   # (dpid, port) -> (MAC, IP) of the relay
+
+        # (dpid, CDN IP) -> ports with an entry catching new viewer
+        # connections to that CDN node.
+        self.steering = {}
+
+        self.streams = {}       # Stream.key -> Stream
+        self.viewers = {}       # CDN IP -> MACs of viewers playing from it
+        self.hosts = {}         # MAC -> (dpid, port) seen on an edge port.
+
+        self.paths = ShortestPaths()
+        self.link_ports = {}    # (dpid1, dpid2) -> (port on dpid1, on dpid2)
+
+        # Per TCP connection buffer for RTMP's 12-byte leading chunks.
+        self.prepend_bufs = {}
+
+        core.listen_to_dependencies(self)
+
+
+    def _locate(self, mac):
+        """
+        Returns the (dpid, port) where a host is attached, or None.
+
+        Like util.lookup_port(), host_tracker is preferred when it is
+        running, and our own table of edge sightings is the fallback.
+        """
+        if core.hasComponent('host_tracker'):
+            entry = core.host_tracker.getMacEntry(mac)
+            if entry is not None:
+                return (entry.dpid, entry.port)
+        return self.hosts.get(mac)
+
+
+    def _relay_at(self, dpid):
+        """
+        Returns (port, (MAC, IP)) for a relay at dpid whose addresses are
+        known, or None.
+        """
+        for port in sorted(self.relays.get(dpid, ())):
+            if (dpid, port) in self.relay_addrs:
+                return port, self.relay_addrs[(dpid, port)]
+        return None
+
+
+    def _handle_openflow_discovery_LinkEvent(self, event):
+        l = event.link
+        if event.added:
+            self.link_ports[(l.dpid1, l.dpid2)] = (l.port1, l.port2)
+            self.paths.set_link(l.dpid1, l.dpid2)
+        else:
+            self.link_ports.pop((l.dpid1, l.dpid2), None)
+            self.paths.remove_link(l.dpid1, l.dpid2)
+        self._update_all()
+
+
+    def _handle_openflow_ConnectionDown(self, event):
+        for s in self.streams.itervalues():
+            s.installed.pop(event.dpid, None)
+        self.paths.remove_node(event.dpid)
+        for k in [k for k in self.link_ports if event.dpid in k]:
+            del self.link_ports[k]
+        for k in [k for k in self.steering if k[0] == event.dpid]:
+            del self.steering[k]
+        self._update_all()
+
+
+    def _handle_openflow_FlowRemoved(self, event):
+        """
+        The root entry idling out means the broadcaster has stopped.
+        """
+        if not event.idleTimeout or event.ofp.priority != TREE_PRIORITY:
+            return
+        m = event.ofp.match
+        s = self.streams.get((m.nw_src, m.tp_src, m.nw_dst))
+        if s is None or s.installed.get(event.dpid, (None,))[0] != m.in_port:
+            return
+        log.info("[TREE] Stream %s ended", s)
+        s.installed.pop(event.dpid)
+        self._uninstall(s, s.installed.keys())
+        del self.streams[s.key]
+        self._update_steering()
+
+
+    def _handle_openflow_PacketIn(self, event):
+        packet = event.parsed
+        if not packet.parsed:
+            return
+
+        if core.openflow_discovery.is_edge_port(event.dpid, event.port):
+            if packet.src not in self.hosts:
+                self.hosts[packet.src] = (event.dpid, event.port)
+        if event.port in self.relays.get(event.dpid, ()):
+            self._learn_relay(event, packet)
+
+        tcp_packet = packet.find('tcp')
+        if tcp_packet is None or tcp_packet.dstport != RTMP_PORT:
+            return
+        ip_packet = packet.find('ipv4')
+        if self._steer(event, packet, ip_packet):
+            return
+        if not tcp_packet.payload:
+            return
+
+        # Same chunk reassembly as bypass. A packet seen at several
+        # switches is parsed at each, which is harmless.
+        conn = (ip_packet.srcip, tcp_packet.srcport, event.dpid)
+        content = tcp_packet.payload
+        if len(content) == 12:
+            self.prepend_bufs[conn] = content
+            return
+        content = self.prepend_bufs.pop(conn, "") + content
+
+        while content:
+            rtmp_packet = RTMPControlPacket(content)
+            if not rtmp_packet.parsed:
+                return
+            content = rtmp_packet.remain
+            if rtmp_packet.is_publish_req():
+                self._add_stream(packet, ip_packet, tcp_packet)
+            elif rtmp_packet.is_play_req():
+                self._add_viewer(packet, ip_packet)
+
+
+    def _learn_relay(self, event, packet):
+        ip_packet = packet.find('ipv4')
+        arp_packet = packet.find('arp')
+        if ip_packet is not None:
+            addrs = (packet.src, ip_packet.srcip)
+        elif arp_packet is not None:
+            addrs = (packet.src, arp_packet.protosrc)
+        else:
+            return
+        where = (event.dpid, event.port)
+        if self.relay_addrs.get(where) == addrs:
+            return
+        self.relay_addrs[where] = addrs
+        log.info("[TREE] Relay %s at %s.%s", addrs[1],
+                 dpid_to_str(event.dpid), event.port)
+        self._update_all()
+
+
+    def _steer(self, event, packet, ip_packet):
+        """
+        Sends a viewer's connection to the CDN node to the local relay.
+
+        Only packets caught by a steering catch entry are steered. Returns
+        True if the packet was taken care of.
+        """
+        if event.port not in self.steering.get((event.dpid, ip_packet.dstip),
+                                               ()):
+            return False
+        port, (mac, ip) = self._relay_at(event.dpid)
+
+        # Relay heading back to the viewer
+        rev = of.ofp_flow_mod(priority=TREE_PRIORITY,
+                              idle_timeout=STEER_IDLE_TIMEOUT)
+        rev.match = of.ofp_match(in_port=port,
+                                 dl_type=0x0800,
+                                 nw_proto=6,
+                                 nw_src=ip,
+                                 nw_dst=ip_packet.srcip,
+                                 tp_src=RTMP_PORT)
+        rev.actions.append(of.ofp_action_dl_addr.set_src(packet.dst))
+        rev.actions.append(of.ofp_action_nw_addr.set_src(ip_packet.dstip))
+        rev.actions.append(of.ofp_action_output(port=event.port))
+
+        # Viewer heading to the relay; this one takes the packet along.
+        fwd = of.ofp_flow_mod(priority=TREE_PRIORITY,
+                              idle_timeout=STEER_IDLE_TIMEOUT,
+                              data=event.ofp)
+        fwd.match = of.ofp_match(in_port=event.port,
+                                 dl_type=0x0800,
+                                 nw_proto=6,
+                                 nw_src=ip_packet.srcip,
+                                 nw_dst=ip_packet.dstip,
+                                 tp_dst=RTMP_PORT)
+        fwd.actions.append(of.ofp_action_dl_addr.set_dst(mac))
+        fwd.actions.append(of.ofp_action_nw_addr.set_dst(ip))
+        fwd.actions.append(of.ofp_action_output(port=port))
+
+        core.openflow.sendToDPID(event.dpid, rev)
+        core.openflow.sendToDPID(event.dpid, fwd)
+        log.debug("[TREE] Steering %s to relay %s", ip_packet.srcip, ip)
+        self._add_viewer(packet, ip_packet)
+        return True
+
+
+    def _add_stream(self, packet, ip_packet, tcp_packet):
+        s = Stream(packet.src, ip_packet.srcip, tcp_packet.srcport,
+                   packet.dst, ip_packet.dstip)
+        if s.key in self.streams:
+            return
+        self.streams[s.key] = s
+        log.info("[TREE] Stream %s published", s)
+        self._update(s)
+        self._update_steering()
+
+
+    def _add_viewer(self, packet, ip_packet):
+        # Viewers may show up before the broadcaster does.
+        viewers = self.viewers.setdefault(ip_packet.dstip, set())
+        if packet.src in viewers:
+            return
+        viewers.add(packet.src)
+        log.info("[TREE] Viewer %s joined %s", ip_packet.srcip, ip_packet.dstip)
+        for s in self.streams.values():
+            if s.s_nw_addr == ip_packet.dstip:
+                self._update(s)
+
+
+    def _all_dependencies_met(self):
+        # host_tracker may have come up before we started listening to core.
+        if core.hasComponent('host_tracker'):
+            self._watch_host_tracker(core.host_tracker)
+
+
+    def _handle_core_ComponentRegistered(self, event):
+        if event.name == "host_tracker":
+            self._watch_host_tracker(event.component)
+
+
+    def _watch_host_tracker(self, host_tracker):
+        host_tracker.addListenerByName("HostEvent",
+                                       self.__handle_host_tracker_HostEvent)
+
+
+    def __handle_host_tracker_HostEvent(self, event):
+        # Name is mangled so host_tracker stays optional.
+        if not event.leave:
+            return
+        for cdn, viewers in self.viewers.iteritems():
+            if event.entry.macaddr in viewers:
+                viewers.discard(event.entry.macaddr)
+                for s in self.streams.values():
+                    if s.s_nw_addr == cdn:
+                        self._update(s)
+
+
+    def _update_all(self):
+        for s in self.streams.values():
+            self._update(s)
+        self._update_steering()
+
+
+    def _update_steering(self):
+        """
+        Keeps catch entries for new viewer connections installed.
+
+        For every CDN node with a live stream, each relay switch whose relay
+        has been located gets one entry per host port. The relay's port,
+        switch-to-switch ports and the broadcaster's port are left alone.
+        """
+        want = {}
+        for s in self.streams.itervalues():
+            src = self._locate(s.b_dl_addr)
+            for dpid in self.relays:
+                con = core.openflow.getConnection(dpid)
+                if con is None or self._relay_at(dpid) is None:
+                    continue
+                ports = want.setdefault((dpid, s.s_nw_addr), set())
+                for port in con.ports:
+                    if port >= of.OFPP_MAX or port in self.relays[dpid]:
+                        continue
+                    if src == (dpid, port):
+                        continue
+                    if core.openflow_discovery.is_edge_port(dpid, port):
+                        ports.add(port)
+
+        for key in set(want) | set(self.steering):
+            dpid, cdn = key
+            old = self.steering.get(key, set())
+            new = want.get(key, set())
+            for port in old - new:
+                msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
+                                      priority=CATCH_PRIORITY,
+                                      match=self._catch_match(port, cdn))
+                core.openflow.sendToDPID(dpid, msg)
+            for port in new - old:
+                msg = of.ofp_flow_mod(priority=CATCH_PRIORITY,
+                                      match=self._catch_match(port, cdn))
+                msg.actions.append(of.ofp_action_output(
+                    port=of.OFPP_CONTROLLER))
+                core.openflow.sendToDPID(dpid, msg)
+            if new:
+                self.steering[key] = new
+            else:
+                self.steering.pop(key, None)
+
+
+    @staticmethod
+    def _catch_match(in_port, cdn):
+        return of.ofp_match(in_port=in_port,
+                            dl_type=0x0800,
+                            nw_proto=6,
+                            nw_dst=cdn,
+                            tp_dst=RTMP_PORT)
+
+
+    def _tree_ports(self, s):
+        """
+        Works out the tree for a stream.
+
+        Returns a dict of dpid -> (in_port, out ports), or None if the
+        broadcaster or CDN node hasn't been located yet.
+        """
+        src = self._locate(s.b_dl_addr)
+        cdn = self._locate(s.s_dl_addr)
+        if src is None or cdn is None:
+            return None
+
+        # Edge outputs per switch: the CDN's port and any relay ports.
+        edge = {cdn[0]: set([cdn[1]])}
+        for mac in self.viewers.get(s.s_nw_addr, ()):
+            where = self._locate(mac)
+            if where is None or where[0] not in self.relays:
+                continue
+            edge.setdefault(where[0], set()).update(self.relays[where[0]])
+
+        parent, unreachable = steiner_tree(self.paths, src[0], edge.keys())
+        for dpid in unreachable:
+            log.warning("[TREE] No path from %s to %s for %s",
+                        dpid_to_str(src[0]), dpid_to_str(dpid), s)
+            if dpid == cdn[0]:
+                return None     # Don't cut the CDN off.
+
+        r = {}
+        for dpid, up in parent.iteritems():
+            if up is None:
+                in_port = src[1]
+            else:
+                in_port = self.link_ports[(up, dpid)][1]
+            r[dpid] = (in_port, set(edge.get(dpid, ())))
+        for dpid, up in parent.iteritems():
+            if up is not None:
+                r[up][1].add(self.link_ports[(up, dpid)][0])
+        for dpid, (in_port, outs) in r.iteritems():
+            outs.discard(in_port)
+            r[dpid] = (in_port, frozenset(outs))
+        return r
+
+
+    def _update(self, s):
+        """
+        Installs the stream's current tree, touching only switches whose
+        entry changed.
+        """
+        tree = self._tree_ports(s)
+        if tree is None:
+            return
+
+        src = self._locate(s.b_dl_addr)
+        stale = [dpid for dpid in s.installed
+                 if s.installed[dpid][0] != tree.get(dpid, (None,))[0]]
+        self._uninstall(s, stale)
+
+        for dpid, (in_port, outs) in tree.iteritems():
+            if s.installed.get(dpid) == (in_port, outs):
+                continue
+            msg = of.ofp_flow_mod()
+            msg.match = s.match(in_port)
+            msg.priority = TREE_PRIORITY
+            if dpid == src[0]:
+                msg.idle_timeout = STREAM_IDLE_TIMEOUT
+                msg.flags = of.OFPFF_SEND_FLOW_REM
+            for port in sorted(outs):
+                msg.actions.append(of.ofp_action_output(port=port))
+            if core.openflow.sendToDPID(dpid, msg):
+                s.installed[dpid] = (in_port, outs)
+        log.debug("[TREE] %s spans %s", s,
+                  ' '.join(dpid_to_str(d) for d in sorted(tree)))
+
+
+    def _uninstall(self, s, dpids):
+        for dpid in dpids:
+            in_port = s.installed.pop(dpid)[0]
+            msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
+                                  priority=TREE_PRIORITY,
+                                  match=s.match(in_port))
+            core.openflow.sendToDPID(dpid, msg)
+
+
+def launch(relays=""):
+    """
+    Main entrance of this component.
+
+    relays is a comma-separated list of <dpid>.<port> relay attachments.
+    """
+    r = []
+    for spec in relays.replace(",", " ").split():
+        dpid, port = spec.rsplit(".", 1)
+        r.append((str_to_dpid(dpid), int(port)))
+    core.registerNew(LivestreamMulticast, r)
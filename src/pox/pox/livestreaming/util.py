@@ -0,0 +1,25 @@
+# Livestreaming packet steering controller.
+# MIT Fall 2019 6.829 project team: Vishrant, Allison, and Guanzhou.
+
+"""
+Helpers shared by the livestreaming switches.
+"""
+
+
+from pox.core import core
+
+
+def lookup_port(dpid, mac, mac_to_port):
+    """
+    Returns the port on switch dpid leading to the given MAC, or None.
+
+    If host_tracker is running and the host is attached to this switch,
+    host_tracker's entry is used (it follows moves and expires hosts that
+    went away). Otherwise we fall back to the switch's own learned table,
+    mac_to_port, which also covers hosts reached through other switches.
+    """
+    if core.hasComponent('host_tracker'):
+        entry = core.host_tracker.getMacEntry(mac)
+        if entry is not None and entry.dpid == dpid:
+            return entry.port
+    return mac_to_port.get(mac)
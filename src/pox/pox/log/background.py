@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Writes log messages from a background thread
+
+Normally, whoever logs a message waits while it's formatted and written
+to the console, files, syslog and so on.  With this component, they only
+wait for the message text to be produced; the rest happens on a separate
+thread.  If logging can't keep up, messages are dropped (and counted)
+rather than slowing down the rest of POX.
+
+It works on the handlers the root logger already has, so list it after
+the other log components:
+
+  ./pox.py log --file=pox.log log.color log.background
+"""
+
+from pox.core import core
+import logging
+import threading
+from Queue import Queue, Full
+
+log = core.getLogger()
+
+
+class QueueHandler (logging.Handler):
+  """
+  A handler which passes records to other handlers on a background thread
+  """
+  def __init__ (self, handlers, size = 10000):
+    logging.Handler.__init__(self)
+    self.handlers = list(handlers)
+    self.dropped = 0
+    self._queue = Queue(size)
+    self._thread = threading.Thread(target=self._run,
+                                    name="BackgroundLogging")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def emit (self, record):
+    # The arguments may change (or stop existing) by the time the record is
+    # written, so produce the message text now.
+    try:
+      record.msg = record.getMessage()
+      record.args = None
+    except Exception:
+      self.handleError(record)
+      return
+    try:
+      self._queue.put_nowait(record)
+    except Full:
+      self.dropped += 1
+
+  def _run (self):
+    q = self._queue
+    while True:
+      record = q.get()
+      if record is None: break
+      self._write(record)
+      if self.dropped:
+        dropped,self.dropped = self.dropped,0
+        self._write(logging.makeLogRecord(dict(name=log.name,
+            levelno=logging.WARNING, levelname="WARNING",
+            msg="Dropped %i log messages" % (dropped,))))
+
+  def _write (self, record):
+    for h in self.handlers:
+      if record.levelno >= h.level:
+        h.handle(record)
+
+  def close (self):
+    """
+    Writes whatever is queued and stops the thread
+    """
+    if self._thread.isAlive():
+      self._queue.put(None)
+      self._thread.join()
+    logging.Handler.close(self)
+
+
+def launch (size = 10000):
+  """
+  Moves the root logger's handlers to a background thread
+
+  --size is how many messages may be waiting to be written.
+  """
+  root = logging.getLogger()
+  handlers = list(root.handlers)
+  h = QueueHandler(handlers, int(size))
+  for old in handlers:
+    root.removeHandler(old)
+  root.addHandler(h)
+
+  def down (event):
+    root.removeHandler(h)
+    h.close()
+    for old in handlers:
+      root.addHandler(old)
+  core.addListenerByName("DownEvent", down)
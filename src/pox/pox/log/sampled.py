@@ -0,0 +1,173 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Loggers for hot paths
+
+A SampledLogger wraps a normal logger for code which logs per packet.  It
+costs very little when its level is disabled, and each call site can limit
+how much it logs:
+
+  from pox.log.sampled import getLogger, Lazy
+  log = getLogger() # Named like core.getLogger() would name it
+
+  log.debug("Installing flow for %s.%i", src, port, rate=5) # <= 5/second
+  log.debug("Got %s", packet, sample=100) # First and every 100th
+
+As usual with logging, pass the arguments instead of formatting the
+message yourself so that it's only formatted if it's emitted.  Arguments
+which take work to produce can be wrapped in Lazy, and are only produced
+then too:
+
+  log.debug("%s", Lazy(rtmp_packet.describe))
+
+Records have the right file, line and function, but they're cached for
+each call site instead of being found by walking the stack for every
+message as logging does.  When a call site has had messages dropped by
+rate limiting or sampling, the next message it emits says how many.
+"""
+
+import logging
+import sys
+import time
+
+import pox.core
+
+
+class Lazy (object):
+  """
+  A log message argument which is only produced if the message is emitted
+
+  It's func(*args) (as a string).
+  """
+  __slots__ = ('func', 'args')
+
+  def __init__ (self, func, *args):
+    self.func = func
+    self.args = args
+
+  def __str__ (self):
+    return str(self.func(*self.args))
+
+
+class _CallSite (object):
+  __slots__ = ('filename', 'lineno', 'func', 'count', 'tokens', 'last',
+               'dropped')
+
+  def __init__ (self, frame):
+    self.filename = frame.f_code.co_filename
+    self.lineno = frame.f_lineno
+    self.func = frame.f_code.co_name
+    self.count = 0 # For sampling
+    self.tokens = None # For rate limiting
+    self.last = None
+    self.dropped = 0
+
+
+class SampledLogger (object):
+  """
+  Wraps a logging.Logger with rate limiting and sampling per call site
+
+  The logging methods take two extra keyword arguments:
+   rate is how many messages per second the call site may log (on
+     average; it can burst up to that many at once).
+   sample logs only the first and then every Nth message from the call
+     site.
+  Anything else (e.g., setLevel()) goes to the wrapped logger.
+  """
+  def __init__ (self, logger):
+    self.logger = logger
+    self._sites = {} # (code, line) -> _CallSite
+
+  def __getattr__ (self, name):
+    return getattr(self.logger, name)
+
+  def _log (self, level, msg, args, exc_info = None, extra = None,
+            rate = None, sample = None):
+    # The caller is two frames up (past debug() or whatever)
+    f = sys._getframe(2)
+    key = (f.f_code, f.f_lineno)
+    site = self._sites.get(key)
+    if site is None:
+      site = self._sites[key] = _CallSite(f)
+
+    if sample is not None and sample > 1:
+      site.count += 1
+      if (site.count - 1) % sample:
+        site.dropped += 1
+        return
+
+    if rate is not None:
+      now = time.time()
+      if site.tokens is None:
+        site.tokens = max(rate, 1)
+      else:
+        site.tokens = min(max(rate, 1),
+                          site.tokens + (now - site.last) * rate)
+      site.last = now
+      if site.tokens < 1:
+        site.dropped += 1
+        return
+      site.tokens -= 1
+
+    if site.dropped:
+      msg = "%s [%i similar messages dropped]" % (msg, site.dropped)
+      site.dropped = 0
+
+    if exc_info and not isinstance(exc_info, tuple):
+      exc_info = sys.exc_info()
+    logger = self.logger
+    record = logger.makeRecord(logger.name, level, site.filename,
+                               site.lineno, msg, args, exc_info, site.func,
+                               extra)
+    logger.handle(record)
+
+  def debug (self, msg, *args, **kw):
+    if self.logger.isEnabledFor(logging.DEBUG):
+      self._log(logging.DEBUG, msg, args, **kw)
+
+  def info (self, msg, *args, **kw):
+    if self.logger.isEnabledFor(logging.INFO):
+      self._log(logging.INFO, msg, args, **kw)
+
+  def warning (self, msg, *args, **kw):
+    if self.logger.isEnabledFor(logging.WARNING):
+      self._log(logging.WARNING, msg, args, **kw)
+
+  warn = warning
+
+  def error (self, msg, *args, **kw):
+    if self.logger.isEnabledFor(logging.ERROR):
+      self._log(logging.ERROR, msg, args, **kw)
+
+  def exception (self, msg, *args, **kw):
+    if self.logger.isEnabledFor(logging.ERROR):
+      kw['exc_info'] = True
+      self._log(logging.ERROR, msg, args, **kw)
+
+  def critical (self, msg, *args, **kw):
+    if self.logger.isEnabledFor(logging.CRITICAL):
+      self._log(logging.CRITICAL, msg, args, **kw)
+
+  def log (self, level, msg, *args, **kw):
+    if self.logger.isEnabledFor(level):
+      self._log(level, msg, args, **kw)
+
+
+def getLogger (name = None):
+  """
+  Returns a SampledLogger
+
+  Without a name, it's named after the calling module just as
+  core.getLogger() would name it.
+  """
+  return SampledLogger(pox.core.getLogger(name, moreFrames=1))
@@ -42,11 +42,26 @@ no name.
 
 Channels can either be permanent or temporary.  Temporary channels are
 automatically destroyed when they no longer contain any members.
+
+Stream transports (e.g., TCP) start out sending JSON messages back to
+back.  Finding where one message ends means trying to decode it, which
+gets expensive for big messages that arrive in pieces.  Such connections
+can instead switch to a framed mode, where each message is a four byte
+big-endian body length followed by the body.  The welcome message lists
+the body encodings on offer under "framing" (e.g., ["json","msgpack"];
+"msgpack" is only offered if the msgpack module is installed).  To
+switch, a client sends:
+  {"CHANNEL":"","cmd":"framing","encoding":"json"}
+..and everything it sends after that is framed.  The server answers with
+the same message as the last unframed thing it sends, and everything
+after that is framed too.
 """
 
 from pox.lib.revent.revent import *
 from pox.core import core as core
 import json
+import re
+import struct
 import time
 import random
 import hashlib
@@ -57,6 +72,38 @@ log = core.getLogger()
 # JSON decoder used by default
 defaultDecoder = json.JSONDecoder()
 
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+_whitespace = re.compile(r'\s*')
+
+# Framed mode header (the length of the body which follows)
+_frame_header = struct.Struct("!I")
+
+# Longer frames mean the stream is corrupt.  This also keeps the first
+# header byte zero, so it can't be mistaken for whitespace.
+MAX_FRAME_SIZE = 0xffffff
+
+
+def _json_encode (msg):
+  return json.dumps(msg, default=str)
+
+def _json_decode (data):
+  return defaultDecoder.raw_decode(data)[0]
+
+def _msgpack_encode (msg):
+  return msgpack.packb(msg, default=str)
+
+def _msgpack_decode (data):
+  return msgpack.unpackb(data)
+
+# Framed mode body encodings: name -> (encoder, decoder)
+framed_encodings = {"json":(_json_encode, _json_decode)}
+if msgpack is not None:
+  framed_encodings["msgpack"] = (_msgpack_encode, _msgpack_decode)
+
 
 class ChannelJoin (Event):
   """ Fired on a channel when a client joins. """
@@ -156,13 +203,48 @@ def _get_nexus (nexus):
 
 
 class Transport (object):
+  # Framed mode encodings this transport's connections offer
+  _framings = ()
+
   def __init__ (self, nexus):
     self._nexus = _get_nexus(nexus)
 
+  def _set_framings (self, framings):
+    """
+    Sets the framed mode encodings to offer
+
+    framings is a list or comma-separated string of names; True means
+    all available ones.
+    """
+    if framings is True:
+      framings = sorted(framed_encodings)
+    elif isinstance(framings, basestring):
+      framings = framings.replace(",", " ").split()
+    for f in framings:
+      if f not in framed_encodings:
+        raise RuntimeError("Framed encoding %s is not available" % (f,))
+    self._framings = tuple(framings)
+
   def _forget (self, connection):
     """ Forget about a connection """
     raise RuntimeError("Not implemented")
 
+  def _send_to_members (self, channel, members, msg):
+    """
+    Sends a channel's message to those of its members using this transport
+
+    The message is only encoded once for all the members that want it
+    encoded the same way.  Transports which can share one copy of a
+    message between all the members some other way can override this.
+    """
+    encoded = {} # wire format -> encoded msg
+    for con in members:
+      fmt = con._wire_format
+      data = encoded.get(fmt)
+      if data is None:
+        data = encoded[fmt] = con._encode(msg)
+      con._send_channel(channel, data)
+
 
 class Connection (EventMixin):
   """
@@ -192,8 +274,15 @@ class Connection (EventMixin):
     self._remote_session_id = None
 
     # Transports that don't do their own encapsulation can use _recv_raw(),
-    # which uses this.  (Such should probably be broken into a subclass.)
-    self._buf = bytes()
+    # which uses these.  (Such should probably be broken into a subclass.)
+    self._buf = bytes()       # Unframed data
+    self._rbuf = bytearray()  # Framed data
+    self._rpos = 0            # Start of the first unconsumed frame in _rbuf
+
+    # (encoder, decoder) once each direction is framed
+    self._tx_codec = None
+    self._rx_codec = None
+    self._framing_pending = None # Encoding we asked the other side for
 
     key,num = self._transport._nexus.generate_session()
     self._session_id,self._session_num = key,num
@@ -204,12 +293,55 @@ class Connection (EventMixin):
     """
     self._remote_session_id = event.msg.get('session_id')
     log.debug("%s welcomed as %s.", self, self._remote_session_id)
+    want = getattr(self._transport, '_framing_request', None)
+    if want and want in event.msg.get('framing', ()):
+      self.request_framing(want)
 
   def _send_welcome (self):
     """
     Send a message to a client so they know they're connected
     """
-    self.send({"CHANNEL":"","cmd":"welcome","session_id":self._session_id})
+    msg = {"CHANNEL":"","cmd":"welcome","session_id":self._session_id}
+    if self._transport._framings:
+      msg['framing'] = list(self._transport._framings)
+    self.send(msg)
+
+  def request_framing (self, encoding = "json"):
+    """
+    Asks the other side to switch this connection to framed mode
+
+    Only use this if the other side offered the encoding when it
+    welcomed us.
+    """
+    codec = framed_encodings[encoding]
+    self._framing_pending = encoding
+    self.send({"CHANNEL":"","cmd":"framing","encoding":encoding})
+    self._tx_codec = codec
+
+  def _rx_framing (self, msg):
+    """
+    Called by the default channelbot for framing requests and answers
+    """
+    encoding = msg.get('encoding')
+    if self._framing_pending is not None:
+      # The answer to our request; everything after it is framed
+      if encoding != self._framing_pending:
+        log.warn("%s answered framing request with %s", self, encoding)
+        self._close()
+        return
+      self._framing_pending = None
+      self._rx_codec = framed_encodings[encoding]
+      return
+
+    if encoding not in self._transport._framings:
+      # They've already started sending frames we can't read
+      log.warn("%s requested unavailable framing %s", self, encoding)
+      self._close()
+      return
+    codec = framed_encodings[encoding]
+    self._rx_codec = codec
+    self.send({"CHANNEL":"","cmd":"framing","encoding":encoding})
+    self._tx_codec = codec
 
   def _close (self):
     """
@@ -232,11 +364,37 @@ class Connection (EventMixin):
     be sent.
     """
     if self._is_connected is False: return False
-    s = json.dumps(whatever, default=str)
-    if self._newlines: s += "\n"
-    self.send_raw(s)
+    self.send_raw(self._encode(whatever))
     return True
 
+  @property
+  def _wire_format (self):
+    """
+    Connections with the same wire format encode messages identically
+    """
+    return (self._tx_codec, self._newlines)
+
+  def _encode (self, msg):
+    """
+    Returns msg encoded the way it goes out over this connection
+    """
+    if self._tx_codec is not None:
+      s = self._tx_codec[0](msg)
+      return _frame_header.pack(len(s)) + s
+    s = json.dumps(msg, default=str)
+    if self._newlines: s += "\n"
+    return s
+
+  def _send_channel (self, channel, data):
+    """
+    Sends an encoded message for a channel we're a member of
+
+    If the channel coalesces and there's still an earlier message from it
+    waiting to go out, connections which buffer their output can replace
+    that message with this one.
+    """
+    self.send_raw(data)
+
   def send_raw (self, data):
     """
     This method should actually send data out over the connection.
@@ -269,6 +427,10 @@ class Connection (EventMixin):
     it has full messages.
     """
     if len(data) == 0: return
+    if self._rx_codec is not None:
+      self._rx_frames(data)
+      return
+
     if len(self._buf) == 0:
       if data[0].isspace():
         self._buf = data.lstrip()
@@ -277,19 +439,67 @@ class Connection (EventMixin):
     else:
       self._buf += data
 
-    while len(self._buf) > 0:
+    buf = self._buf
+    pos = 0
+    while pos < len(buf):
       try:
-        msg, l = defaultDecoder.raw_decode(self._buf)
+        msg, pos = defaultDecoder.raw_decode(buf, pos)
       except:
         # Need more data before it's a valid message
         # (.. or the stream is corrupt and things will never be okay
         # ever again)
-        return
+        break
 
-      self._buf = self._buf[l:]
-      if len(self._buf) != 0 and self._buf[0].isspace():
-        self._buf = self._buf.lstrip()
+      pos = _whitespace.match(buf, pos).end()
+      self._rx_message(msg)
+      if self._rx_codec is not None:
+        # Switched to framed mode; the rest is frames
+        self._buf = bytes()
+        if pos < len(buf):
+          self._rx_frames(buf[pos:])
+        return
+    self._buf = buf[pos:]
+
+  def _rx_frames (self, data):
+    """
+    Framed mode version of _rx_raw()
+
+    Data accumulates in a bytearray, and a message is only decoded once
+    its whole frame is there.  Consumed frames are trimmed off the front
+    in bulk, so the buffer isn't copied once per message.
+    """
+    buf = self._rbuf
+    buf.extend(data)
+    pos = self._rpos
+    hlen = _frame_header.size
+    decode = self._rx_codec[1]
+    while len(buf) - pos >= hlen:
+      l, = _frame_header.unpack_from(buf, pos)
+      if l > MAX_FRAME_SIZE:
+        log.error("%s sent a %s byte frame; closing", self, l)
+        self._close()
+        return
+      end = pos + hlen + l
+      if end > len(buf): break
+      body = bytes(buf[pos+hlen:end])
+      pos = end
+      self._rpos = pos
+      try:
+        msg = decode(body)
+      except Exception:
+        log.exception("%s sent an undecodable frame; closing", self)
+        self._close()
+        return
       self._rx_message(msg)
+      if not self._is_connected: return
+
+    if pos == len(buf):
+      del buf[:]
+      pos = 0
+    elif pos > len(buf) // 2:
+      del buf[:pos]
+      pos = 0
+    self._rpos = pos
 
   def __str__ (self):
     """
@@ -304,6 +514,12 @@ class Connection (EventMixin):
     """
     self._close()
 
+  def _left_channel (self, channel):
+    """
+    Called when this connection is removed from a channel
+    """
+    pass
+
 
 class Channel (EventMixin):
   """
@@ -312,6 +528,11 @@ class Channel (EventMixin):
 
   Generally you will not create these classes directly, but by calling
   getChannel() on the ChannelNexus.
+
+  If coalesce is set, each message sent to the channel supersedes the
+  previous ones (e.g., it's the latest value of some statistic).  Members
+  which haven't kept up then only get the latest message rather than
+  queueing up all of them.
   """
   _eventMixin_events = set([
     MessageReceived,
@@ -321,7 +542,8 @@ class Channel (EventMixin):
     ChannelDestroyed,
   ])
 
-  def __init__ (self, name, nexus = None, temporary = False):
+  def __init__ (self, name, nexus = None, temporary = False,
+                coalesce = False):
     """
     name is the name for the channel (i.e., the value for the messages'
     CHANNEL key).
@@ -336,6 +558,7 @@ class Channel (EventMixin):
     self._nexus._channels[name] = self
 
     self.temporary = temporary
+    self.coalesce = coalesce
 
     self._members = set() # Member Connections
 
@@ -375,6 +598,7 @@ class Channel (EventMixin):
   def _remove_member (self, con, allow_destroy = True):
     if con not in self._members: return
     self._members.remove(con)
+    con._left_channel(self)
     self.raiseEvent(ChannelLeave, con, self)
 
     if not allow_destroy: return
@@ -386,9 +610,12 @@ class Channel (EventMixin):
   def send (self, msg):
     d = dict(msg)
     d['CHANNEL'] = self._name
-    for r in list(self._members):
+    by_transport = {}
+    for r in self._members:
       if not r.is_connected: continue
-      r.send(d)
+      by_transport.setdefault(r._transport, []).append(r)
+    for transport,members in by_transport.iteritems():
+      transport._send_to_members(self, members, d)
 
   def __str__ (self):
     return "<Channel " + self.name + ">"
@@ -599,6 +826,9 @@ class DefaultChannelBot (ChannelBot):
     # We get this if we're connecting to another messenger.
     event.con._rx_welcome(event)
 
+  def _exec_cmd_framing (self, event):
+    event.con._rx_framing(event.msg)
+
 
 class MessengerNexus (EventMixin):
   """
@@ -650,12 +880,13 @@ class MessengerNexus (EventMixin):
   def register_session (self, session):
     self.raiseEventNoErrors(ConnectionOpened, session)
 
-  def get_channel (self, name, create = True, temporary = False):
+  def get_channel (self, name, create = True, temporary = False,
+                   coalesce = False):
     if name is None: name = ""
     if name in self._channels:
       return self._channels[name]
     elif create:
-      c = Channel(name, self, temporary = temporary)
+      c = Channel(name, self, temporary = temporary, coalesce = coalesce)
       self.raiseEvent(ChannelCreate, c)
       return c
     else:
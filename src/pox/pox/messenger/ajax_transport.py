@@ -25,6 +25,9 @@ A disclaimer:
 import time
 import select
 import threading
+from collections import deque
+from itertools import count, islice
+from heapq import merge
 
 from pox.core import core
 from pox.web.jsonrpc import JSONRPCHandler, make_error, ABORT
@@ -36,6 +39,77 @@ log = core.getLogger()
 SESSION_TIMEOUT = 60#120 # Seconds
 CONNECTION_TIMEOUT = 30 # Seconds
 MAX_TX_COUNT = 20 # Max messages to send at once
+MAX_TX_BACKLOG = 1000 # Max messages kept per connection
+MAX_CHANNEL_BACKLOG = 1000 # Max messages kept per channel
+
+
+class _TxLog (object):
+  """
+  Consecutively numbered messages
+
+  Once there are more than maxlen, the oldest ones are dropped.
+  """
+  def __init__ (self, maxlen = None):
+    self._q = deque()
+    self.base = 0 # Sequence number of the oldest message we still have
+    self.maxlen = maxlen
+
+  def __len__ (self):
+    return len(self._q)
+
+  @property
+  def next_seq (self):
+    return self.base + len(self._q)
+
+  def append (self, item):
+    """
+    Adds an item and returns its sequence number
+    """
+    q = self._q
+    q.append(item)
+    if self.maxlen is not None and len(q) > self.maxlen:
+      q.popleft()
+      self.base += 1
+    return self.base + len(q) - 1
+
+  def trim (self, seq):
+    """
+    Drops everything before seq
+    """
+    q = self._q
+    while self.base < seq and q:
+      q.popleft()
+      self.base += 1
+
+  def get (self, seq, n = None):
+    """
+    Returns up to n (seq, item) pairs starting at seq (or the oldest)
+    """
+    start = max(seq - self.base, 0)
+    end = len(self._q) if n is None else min(start + n, len(self._q))
+    if end <= start: return []
+    if start > len(self._q) - end:
+      # Closer to the end; walk from there
+      items = list(islice(reversed(self._q), len(self._q) - end,
+                          len(self._q) - start))
+      items.reverse()
+    else:
+      items = list(islice(self._q, start, end))
+    return zip(xrange(self.base + start, self.base + end), items)
+
+
+class _ChannelLog (_TxLog):
+  """
+  One copy of the messages sent to a channel, shared by its Ajax members
+
+  Each member keeps a cursor into it and pulls messages into its own
+  log when it's polled.  If the channel coalesces, a member which is
+  behind only pulls the latest one.
+  """
+  def __init__ (self, channel):
+    _TxLog.__init__(self, MAX_CHANNEL_BACKLOG)
+    self.channel = channel
+    self.subscribers = 0 # Number of connections with a cursor in here
 
 
 class AjaxTransport (Transport):
@@ -47,6 +121,12 @@ class AjaxTransport (Transport):
     self._connections = {}
     self._t = Timer(SESSION_TIMEOUT, self._check_timeouts, recurring=True)
 
+    # Guards all the connections' and channels' logs.  Sends come from
+    # POX while polls come from the webserver's threads.
+    self._lock = threading.Lock()
+    self._channel_logs = {} # Channel -> _ChannelLog
+    self._stamp = count() # Orders channel messages across channels
+
   def _check_timeouts (self):
     for c in self._connections.values():
       c._check_timeout()
@@ -59,6 +139,22 @@ class AjaxTransport (Transport):
       #print "Failed to forget", connection
       pass
 
+  def _send_to_members (self, channel, members, msg):
+    # From Transport
+    # The message is stored once for the channel, and each member only
+    # gets woken up.
+    with self._lock:
+      clog = self._channel_logs.get(channel)
+      if clog is None:
+        clog = self._channel_logs[channel] = _ChannelLog(channel)
+      seq = clog.append((next(self._stamp), msg))
+      for con in members:
+        if clog not in con._cursors:
+          con._cursors[clog] = seq
+          clog.subscribers += 1
+        if con._waiters:
+          con._cond.notify_all()
+
   def create_session (self):
     ses = AjaxConnection(self)
     self._connections[ses._session_id] = ses
@@ -80,21 +176,32 @@ class AjaxConnection (Connection):
   Note: The sequence numbers used by this module simply increment and
         never wrap.  This should mean like nine quadrillion, but it
         depends on your browser and I definitely haven't tested this. :)
+
+  Outgoing messages wait in a log until the client acks them by polling
+  for a later sequence number.  At most MAX_TX_BACKLOG are kept; a poll
+  for one that has been dropped fails with "expired".  Channel messages
+  are pulled in from the channel's shared log when polled; if the client
+  fell so far behind that some were dropped from there, the poll result
+  has an "expired" key with how many were missed.
   """
   def __init__ (self, transport):
     Connection.__init__(self, transport)
-    self._cond = threading.Condition()
+    self._cond = threading.Condition(transport._lock)
     self._quitting = False
+    self._waiters = 0 # Polls blocked on _cond (a re-poll can overlap one)
 
     # We're really protected from attack by the session key, we hope, so
     # we currently start tx_seq at zero, which makes it easier for the
     # client.
-    self._next_tx_seq = 0  # next seq to create
     self._sent_tx_seq = -1 # last seq sent
     self._rx_seq = None
 
-    # Waiting outgoing messages as (seq, msg) pairs
-    self._tx_buffer = []
+    # Waiting outgoing messages
+    self._tx_log = _TxLog(MAX_TX_BACKLOG)
+
+    # Next message we want from each _ChannelLog we're subscribed to
+    self._cursors = {}
+    self._expired = 0 # Channel messages we missed since the last poll
 
     # Out-of-order messages we've gotten (the in-order ones are dispatched
     # immediately, so they're never buffered)
@@ -115,28 +222,71 @@ class AjaxConnection (Connection):
   def _close (self):
     super(AjaxConnection, self)._close()
     #TODO: track request sockets and cancel them?
-    self._quitting = True
+    with self._cond:
+      self._quitting = True
+      self._cond.notify_all()
+      for clog in self._cursors.keys():
+        self._unsubscribe(clog)
+
+  def _left_channel (self, channel):
+    # From Connection
+    with self._cond:
+      clog = self._transport._channel_logs.get(channel)
+      if clog is None or clog not in self._cursors: return
+      # Keep what was sent while we were a member
+      self._pull()
+      self._unsubscribe(clog)
+
+  def _unsubscribe (self, clog):
+    """
+    Drops our cursor for a channel log (lock must be held)
+    """
+    del self._cursors[clog]
+    clog.subscribers -= 1
+    if clog.subscribers == 0:
+      self._transport._channel_logs.pop(clog.channel, None)
 
   def send (self, data):
     if self._is_connected is False: return False
-    self._cond.acquire()
-    self._tx_buffer.append((self._next_tx_seq, data))
-    self._next_tx_seq += 1
-    self._cond.notify()
-    self._cond.release()
+    with self._cond:
+      # Channel messages sent before this one go before it
+      if self._cursors: self._pull()
+      self._tx_log.append(data)
+      if self._waiters:
+        self._cond.notify_all()
+
+  def _pull (self):
+    """
+    Moves new channel messages into our log in the order they were sent
+
+    Lock must be held.
+    """
+    pending = []
+    for clog,seq in self._cursors.iteritems():
+      if seq >= clog.next_seq: continue
+      if clog.channel.coalesce:
+        # Only the latest one matters
+        seq = clog.next_seq - 1
+      elif seq < clog.base:
+        self._expired += clog.base - seq
+      pending.append([m for s,m in clog.get(seq)])
+      self._cursors[clog] = clog.next_seq
+    if not pending: return
+    append = self._tx_log.append
+    if len(pending) == 1:
+      for stamp,msg in pending[0]:
+        append(msg)
+    else:
+      for stamp,msg in merge(*pending):
+        append(msg)
 
   def _get_tx_batch (self, seq, batch_size = None):
     """
-    Returns the next batch of messages to send
+    Returns the next batch of messages to send (lock must be held)
     """
     if batch_size is None: batch_size = MAX_TX_COUNT
-    o = []
-    for m in self._tx_buffer:
-      if m[0] < seq: continue
-      o.append(m)
-      if len(o) >= batch_size:
-        break
-    return o
+    if self._cursors: self._pull()
+    return self._tx_log.get(seq, batch_size)
 
   def tx (self, wfile, seq, batch_size):
     """
@@ -145,6 +295,7 @@ class AjaxConnection (Connection):
     Can block long-polling style for a while to wait
     until it has some to send.
     """
+    if batch_size is None: batch_size = MAX_TX_COUNT
     ack = True
     if seq is None:
       seq = self._sent_tx_seq + 1
@@ -156,40 +307,42 @@ class AjaxConnection (Connection):
         ack = False
         #NOTE: They get back from where we are, not from where requested
 
-    if ack:
-      # Throw away everything before what they're asking for
-      while len(self._tx_buffer):
-        if self._tx_buffer[0][0] >= seq: break
-        del self._tx_buffer[0]
-
     with self._cond:
+      if ack:
+        # Throw away everything before what they're asking for
+        self._tx_log.trim(seq)
+
       data = self._get_tx_batch(seq = seq, batch_size = batch_size)
-      if len(data) == 0:
-        # Wait for messages
-        start_time = time.time()
-        while True:
-          # Every couple seconds check if the socket is dead
-          self._cond.wait(2)
-          data = self._get_tx_batch(seq = seq, batch_size = batch_size)
-          if len(data) > 0:
-            # See if we can get a bit more data
-            self._cond.wait(.05)
+      if len(data) == 0 and not self._quitting:
+        # Wait for messages.  Senders wake us up; there's no polling.
+        deadline = time.time() + CONNECTION_TIMEOUT
+        self._waiters += 1
+        try:
+          while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+              # Let them reconnect.
+              return _result({'seq':seq,'messages':[]})
+            self._cond.wait(remaining)
+            if self._quitting: break
             data = self._get_tx_batch(seq = seq, batch_size = batch_size)
-            break
-          if self._quitting: break
-          r,w,x = select.select([wfile],[],[wfile], 0)
-          if len(r) or len(x):
-            # Other side disconnected?
-            #log.debug("Connection cancelled")
-            ##self._cond.release()
-            return ABORT
-          if time.time() - start_time > CONNECTION_TIMEOUT:
-            # Let them reconnect.
-            return _result({'seq':seq,'messages':[]})
+            if len(data) > 0:
+              if len(data) < batch_size:
+                # See if we can get a bit more data
+                self._cond.wait(.05)
+                data = self._get_tx_batch(seq = seq, batch_size = batch_size)
+              break
+        finally:
+          self._waiters -= 1
+
+        r,w,x = select.select([wfile],[],[wfile], 0)
+        if len(r) or len(x):
+          # Other side disconnected while we waited?
+          return ABORT
+
       # Okay, we have messages
       if self._quitting:
         #NOTE: we don't drain the messages first, but maybe we should?
-        ##self._cond.release()
         return _result({'messages':[],'failure':'quit',
                         'seq':self._sent_tx_seq})
 
@@ -209,9 +362,11 @@ class AjaxConnection (Connection):
 
       data = [d[1] for d in data]
 
-      #print "Sending",len(data),"of",len(self._tx_buffer)
-
-      return _result({'seq':seq, 'messages':data})
+      r = {'seq':seq, 'messages':data}
+      if self._expired:
+        r['expired'] = self._expired
+        self._expired = 0
+      return _result(r)
 
   def rx (self, msg, seq):
     """
@@ -14,16 +14,45 @@
 
 """
 Active (connect) and passive (listen) TCP transports for messenger.
+
+Passive transports offer framed mode (see pox.messenger) with the
+encodings given by --framings (all available ones by default; pass an
+empty string to offer none).  Active transports ask for framed mode with
+--framing=<encoding> if the other side offers it.
 """
 
 from pox.lib.revent import *
 from pox.lib.recoco import *
 from pox.core import core
 from pox.messenger import *
+from collections import deque
 import errno
 
 log = core.getLogger()
 
+# Connections with more than this many bytes waiting to go out are closed
+MAX_TX_BUFFER = 4 * 1024 * 1024
+
+
+class _TxTask (Task):
+  """
+  Sends a TCPConnection's buffered output as the socket is ready for it
+  """
+  def __init__ (self, connection):
+    Task.__init__(self)
+    self._con = connection
+
+  def run (self):
+    con = self._con
+    sock = con._socket
+    while con.is_connected and con._tx_queue:
+      r,w,x = yield Select([], [sock], [sock])
+      if x or not w:
+        con._close()
+        break
+      con._flush()
+    con._tx_task = None
+
 
 class TCPConnection (Connection, Task):
   def __init__ (self, transport, socket):
@@ -31,27 +60,105 @@ class TCPConnection (Connection, Task):
     # Note: we cache name of the socket because socket.getpeername()
     # is unavailable after the socket was closed!
     self._socket_name = self._get_socket_name(socket)
+    socket.setblocking(0)
     Connection.__init__(self, transport)
     Task.__init__(self)
 
+    # Output the socket wasn't ready for, as [data, channel] entries.
+    # channel is the coalescing Channel the data is a message for, until
+    # the data starts going out.  Until then, it can be replaced by a
+    # newer message for that channel.
+    self._tx_queue = deque()
+    self._tx_latest = {} # Channel -> its entry in _tx_queue
+    self._tx_size = 0
+    self._tx_task = None
+
     #self.start()
     self._send_welcome()
 
   def _close (self):
     super(TCPConnection, self)._close()
+    self._tx_queue.clear()
+    self._tx_latest.clear()
+    self._tx_size = 0
     try:
       self._socket.shutdown(socket.SHUT_RDWR)
     except:
       pass
 
   def send_raw (self, data):
-    try:
-      l = self._socket.send(data)
+    self._tx(data, None)
+
+  def _send_channel (self, channel, data):
+    if not channel.coalesce:
+      self._tx(data, None)
+      return
+    entry = self._tx_latest.get(channel)
+    if entry is not None:
+      # Hasn't started going out yet; send this one instead
+      self._tx_size += len(data) - len(entry[0])
+      entry[0] = data
+      return
+    self._tx(data, channel)
+
+  def _tx (self, data, channel):
+    if self._is_connected is False: return
+    if not self._tx_queue:
+      # Nothing ahead of it, so try sending it right away
+      try:
+        l = self._socket.send(data)
+      except socket.error as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+          self._close()
+          return
+        l = 0
+      except:
+        self._close()
+        return
       if l == len(data): return
-    except:
-      pass
-    #TODO: do something more graceful!
-    self._close()
+      if l:
+        data = data[l:]
+        channel = None
+
+    if self._tx_size + len(data) > MAX_TX_BUFFER:
+      log.warn("%s is not keeping up; disconnecting", self)
+      self._close()
+      return
+    entry = [data, channel]
+    self._tx_queue.append(entry)
+    self._tx_size += len(data)
+    if channel is not None:
+      self._tx_latest[channel] = entry
+    if self._tx_task is None:
+      self._start_tx_task()
+
+  def _start_tx_task (self):
+    self._tx_task = _TxTask(self)
+    self._tx_task.start()
+
+  def _flush (self):
+    """
+    Sends as much buffered output as the socket will take
+    """
+    q = self._tx_queue
+    while q:
+      entry = q[0]
+      data = entry[0]
+      try:
+        l = self._socket.send(data)
+      except socket.error as e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK): return
+        self._close()
+        return
+      if entry[1] is not None:
+        # Started going out, so it's too late to replace it
+        del self._tx_latest[entry[1]]
+        entry[1] = None
+      self._tx_size -= l
+      if l < len(data):
+        entry[0] = data[l:]
+        return
+      q.popleft()
 
   def run (self):
     log.debug("%s started" % (self,))
@@ -87,10 +194,13 @@ class ActiveTCPTransport (Task, Transport):
   _timeout = 5 # Seconds to wait for connection
 
   def __init__ (self, address, port = 7790, nexus = None,
-                connection_class = TCPConnection, max_backoff = 8):
+                connection_class = TCPConnection, max_backoff = 8,
+                framing = None):
     port = int(port)
     Task.__init__(self)
     Transport.__init__(self, nexus)
+    if framing: self._set_framings([framing])
+    self._framing_request = framing
     self._addr = (str(address),port)
     self._connections = set()
     self._connection_class = connection_class
@@ -176,10 +286,11 @@ class ActiveTCPTransport (Task, Transport):
 
 class TCPTransport (Task, Transport):
   def __init__ (self, address = "0.0.0.0", port = 7790, nexus = None,
-                connection_class = TCPConnection):
+                connection_class = TCPConnection, framings = True):
     port = int(port)
     Task.__init__(self)
     Transport.__init__(self, nexus)
+    self._set_framings(framings)
     self._addr = (address,port)
     self._connections = set()
     self._connection_class = connection_class
@@ -221,15 +332,15 @@ class TCPTransport (Task, Transport):
     log.debug("No longer listening for connections")
 
 
-def active (tcp_address, tcp_port = 7790):
+def active (tcp_address, tcp_port = 7790, framing = None):
   def start ():
-    t = ActiveTCPTransport(tcp_address, tcp_port)
+    t = ActiveTCPTransport(tcp_address, tcp_port, framing = framing)
     t.start()
   core.call_when_ready(start, "MessengerNexus", __name__)
 
 
-def launch (tcp_address = "0.0.0.0", tcp_port = 7790):
+def launch (tcp_address = "0.0.0.0", tcp_port = 7790, framings = True):
   def start ():
-    t = TCPTransport(tcp_address, tcp_port)
+    t = TCPTransport(tcp_address, tcp_port, framings = framings)
     t.start()
   core.call_when_ready(start, "MessengerNexus", __name__)
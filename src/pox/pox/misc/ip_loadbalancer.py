@@ -20,6 +20,17 @@ Run it with --ip=<Service IP> --servers=IP1,IP2,...
 By default, it will do load balancing on the first switch that connects.  If
 you want, you can add --dpid=<dpid> to specify a particular switch.
 
+By default, each new TCP connection is sent to a random server.  With
+--mode=hash, clients are instead split into buckets (blocks of addresses,
+/32 unless you give --bucket_bits=X) and each bucket is mapped to a server
+with a Maglev-style consistent hashing table.  A bucket gets a pair of
+wildcard flows, so there's one PacketIn per bucket rather than one per
+connection, and since the table only depends on the servers, buckets go to
+the same servers after a controller restart.  Servers are weighted by
+their load as seen by openflow.link_utilization (which is launched with
+its defaults if it isn't on the commandline).  In this mode, all TCP traffic from a server to clients
+of the service is rewritten to come from the service IP.
+
 Please submit improvements. :)
 """
 
@@ -35,12 +46,62 @@ from pox.lib.util import str_to_bool, dpid_to_str, str_to_dpid
 
 import pox.openflow.libopenflow_01 as of
 
+from pox.lib.recoco import Timer
+
 import time
 import random
+import struct
+from heapq import heappush, heappop
+from itertools import count
+from zlib import crc32
 
 FLOW_IDLE_TIMEOUT = 10
 FLOW_MEMORY_TIMEOUT = 60 * 5
 
+# For --mode=hash
+BUCKET_IDLE_TIMEOUT = 60
+MAGLEV_TABLE_SIZE = 4099 # Should be prime and well above 100 * servers
+WEIGHT_SCALE = 4 # Weight of a server with average load
+WEIGHT_PERIOD = 5 # Seconds between weight updates
+
+
+def maglev_table (names, weights = None, size = MAGLEV_TABLE_SIZE):
+  """
+  Builds a Maglev lookup table
+
+  names are byte strings identifying the backends, and weights are small
+  positive integers (all equal if not given).  Returns a list of size
+  indexes into names, where each backend has a share of the entries in
+  proportion to its weight.  The table only depends on the arguments, and
+  adding or removing a backend only moves about the entries it gains or
+  loses.
+  """
+  n = len(names)
+  if n == 0: return []
+  if weights is None: weights = [1] * n
+  offsets = [crc32(name) % size for name in names]
+  skips = [crc32(name, 0x5a5a5a5a) % (size - 1) + 1 for name in names]
+  nexts = [0] * n
+  credits = [0] * n
+  top = max(weights)
+  table = [None] * size
+  filled = 0
+  while True:
+    for i in range(n):
+      # Each round, backends get to claim weight/top entries
+      credits[i] += weights[i]
+      if credits[i] < top: continue
+      credits[i] -= top
+      offset,skip,j = offsets[i],skips[i],nexts[i]
+      c = (offset + j * skip) % size
+      while table[c] is not None:
+        j += 1
+        c = (offset + j * skip) % size
+      table[c] = i
+      nexts[i] = j + 1
+      filled += 1
+      if filled == size: return table
+
 
 
 class MemoryEntry (object):
@@ -62,6 +123,7 @@ class MemoryEntry (object):
     self.first_packet = first_packet
     self.client_port = client_port
     self.refresh()
+    self._due = None # Deadline of this entry's slot in the expiry heap
 
   def refresh (self):
     self.timeout = time.time() + FLOW_MEMORY_TIMEOUT
@@ -86,6 +148,36 @@ class MemoryEntry (object):
 
     return self.server,ipp.srcip,tcpp.dstport,tcpp.srcport
 
+  @property
+  def keys (self):
+    return self.key1,self.key2
+
+
+class BucketEntry (object):
+  """
+  Record for a bucket of clients in hash mode
+
+  Like MemoryEntry, this outlives the bucket's flows in the switch, so a
+  bucket which comes back goes to the same server if it's still up.
+  """
+  def __init__ (self, bucket, server, client_port):
+    self.bucket = bucket # (network address as int, prefix length)
+    self.server = server
+    self.client_port = client_port
+    self.refresh()
+    self._due = None
+
+  def refresh (self):
+    self.timeout = time.time() + FLOW_MEMORY_TIMEOUT
+
+  @property
+  def is_expired (self):
+    return time.time() > self.timeout
+
+  @property
+  def keys (self):
+    return (self.bucket,)
+
 
 class iplb (object):
   """
@@ -122,6 +214,11 @@ class iplb (object):
     # approach: hashing.
     self.memory = {} # (srcip,dstip,srcport,dstport) -> MemoryEntry
 
+    # One (timeout,seq,entry) slot per remembered entry.  Entries which
+    # were refreshed since their slot was pushed get pushed again.
+    self._expiry = []
+    self._seq = count()
+
     self._do_probe() # Kick off the probing
 
     # As part of a gross hack, we now do this from elsewhere
@@ -142,53 +239,71 @@ class iplb (object):
         if ip in self.live_servers:
           self.log.warn("Server %s down", ip)
           del self.live_servers[ip]
+          self._server_down(ip)
 
     # Expire old flows
-    c = len(self.memory)
-    self.memory = {k:v for k,v in self.memory.items()
-                   if not v.is_expired}
-    if len(self.memory) != c:
-      self.log.debug("Expired %i flows", c-len(self.memory))
-
-  def _do_probe (self):
+    c = 0
+    heap = self._expiry
+    while heap and heap[0][0] < t:
+      timeout,_,table,entry = heappop(heap)
+      if entry._due != timeout: continue
+      if not entry.is_expired:
+        self._remember(table, entry)
+        continue
+      for k in entry.keys:
+        if table.get(k) is entry:
+          del table[k]
+      c += 1
+    if c:
+      self.log.debug("Expired %i flows", c)
+
+  def _remember (self, table, entry):
     """
-    Send an ARP to a server to see if it's still up
+    Puts entry into table under its keys and schedules its expiry
     """
-    self._do_expire()
+    for k in entry.keys:
+      table[k] = entry
+    entry._due = entry.timeout
+    heappush(self._expiry, (entry.timeout, next(self._seq), table, entry))
 
-    server = self.servers.pop(0)
-    self.servers.append(server)
-
-    r = arp()
-    r.hwtype = r.HW_TYPE_ETHERNET
-    r.prototype = r.PROTO_TYPE_IP
-    r.opcode = r.REQUEST
-    r.hwdst = ETHER_BROADCAST
-    r.protodst = server
-    r.hwsrc = self.mac
-    r.protosrc = self.service_ip
-    e = ethernet(type=ethernet.ARP_TYPE, src=self.mac,
-                 dst=ETHER_BROADCAST)
-    e.set_payload(r)
-    #self.log.debug("ARPing for %s", server)
-    msg = of.ofp_packet_out()
-    msg.data = e.pack()
-    msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
-    msg.in_port = of.OFPP_NONE
-    self.con.send(msg)
-
-    self.outstanding_probes[server] = time.time() + self.arp_timeout
-
-    core.callDelayed(self._probe_wait_time, self._do_probe)
+  def _server_up (self, server):
+    pass
 
-  @property
-  def _probe_wait_time (self):
+  def _server_down (self, server):
+    pass
+
+  def _do_probe (self):
     """
-    Time to wait between probes
+    Send ARPs to all servers to see if they're still up
+
+    The probes all go out at once in a single write.
     """
-    r = self.probe_cycle_time / float(len(self.servers))
-    r = max(.25, r) # Cap it at four per second
-    return r
+    self._do_expire()
+
+    t = time.time()
+    data = []
+    for server in self.servers:
+      r = arp()
+      r.hwtype = r.HW_TYPE_ETHERNET
+      r.prototype = r.PROTO_TYPE_IP
+      r.opcode = r.REQUEST
+      r.hwdst = ETHER_BROADCAST
+      r.protodst = server
+      r.hwsrc = self.mac
+      r.protosrc = self.service_ip
+      e = ethernet(type=ethernet.ARP_TYPE, src=self.mac,
+                   dst=ETHER_BROADCAST)
+      e.set_payload(r)
+      msg = of.ofp_packet_out()
+      msg.data = e.pack()
+      msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
+      msg.in_port = of.OFPP_NONE
+      data.append(msg.pack())
+      if server not in self.outstanding_probes:
+        self.outstanding_probes[server] = t + self.arp_timeout
+    self.con.send(b''.join(data))
+
+    core.callDelayed(self.probe_cycle_time, self._do_probe)
 
   def _pick_server (self, key, inport):
     """
@@ -224,6 +339,7 @@ class iplb (object):
               # Ooh, new server.
               self.live_servers[arpp.protosrc] = arpp.hwsrc,inport
               self.log.info("Server %s up", arpp.protosrc)
+              self._server_up(arpp.protosrc)
         return
 
       # Not TCP and not ARP.  Don't know what to do with this.  Drop it.
@@ -283,8 +399,7 @@ class iplb (object):
         server = self._pick_server(key, inport)
         self.log.debug("Directing traffic to %s", server)
         entry = MemoryEntry(server, packet, inport)
-        self.memory[entry.key1] = entry
-        self.memory[entry.key2] = entry
+        self._remember(self.memory, entry)
 
       # Update timestamp
       entry.refresh()
@@ -307,15 +422,200 @@ class iplb (object):
       self.con.send(msg)
 
 
+class hashlb (iplb):
+  """
+  An IP load balancer which maps buckets of clients to servers
+
+  Client addresses are grouped into buckets of bucket_bits prefix length.
+  Buckets are looked up in a Maglev table of the live servers (see
+  maglev_table()), and each bucket gets a forward and a reverse wildcard
+  flow.  A bucket stays on its server for as long as the server is up,
+  even if the table changes in the meantime.
+
+  Replies to a bucket go out of the port its first packet came in on, so
+  all clients in a bucket should be behind the same port.
+  """
+  def __init__ (self, connection, service_ip, servers = [], bucket_bits = 32,
+                table_size = MAGLEV_TABLE_SIZE):
+    self.bucket_bits = bucket_bits
+    self.table_size = table_size
+    self._bucket_mask = (0xffffffff << (32 - bucket_bits)) & 0xffffffff
+    self.buckets = {} # (network,bits) -> BucketEntry
+    self._table = []
+    self._table_servers = []
+    self._weights = {} # server -> weight
+    super(hashlb,self).__init__(connection, service_ip, servers)
+    self._weight_timer = Timer(WEIGHT_PERIOD, self._update_weights,
+                               recurring = True)
+
+  def _rebuild_table (self):
+    servers = sorted(self.live_servers)
+    weights = [self._weights.get(s, WEIGHT_SCALE) for s in servers]
+    self._table_servers = servers
+    self._table = maglev_table([s.toRaw() for s in servers], weights,
+                               self.table_size)
+
+  def _server_up (self, server):
+    self._rebuild_table()
+
+  def _server_down (self, server):
+    self._rebuild_table()
+
+    # Take this server's buckets out of the switch.  Their next packets
+    # come back to us and get a new server.
+    data = []
+    for bucket,entry in self.buckets.items():
+      if entry.server != server: continue
+      del self.buckets[bucket]
+      fm = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+      fm.match.dl_type = ethernet.IP_TYPE
+      fm.match.nw_proto = ipv4.TCP_PROTOCOL
+      fm.match.nw_src = (IPAddr.from_num(bucket[0]), bucket[1])
+      fm.match.nw_dst = self.service_ip
+      data.append(fm.pack())
+    fm = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+    fm.match.dl_type = ethernet.IP_TYPE
+    fm.match.nw_proto = ipv4.TCP_PROTOCOL
+    fm.match.nw_src = server
+    data.append(fm.pack())
+    self.con.send(b''.join(data))
+
+  def _update_weights (self):
+    """
+    Weights servers by the load on their switch ports
+
+    A server with average load gets WEIGHT_SCALE, one with twice the
+    average gets half that, and so on.  Servers sharing a port share its
+    load.
+    """
+    if not core.hasComponent('link_utilization'): return
+    ports = core.link_utilization.ports
+    dpid = self.con.dpid
+    sharing = {}
+    for mac,port in self.live_servers.itervalues():
+      sharing[port] = sharing.get(port, 0) + 1
+    rates = {}
+    for server,(mac,port) in self.live_servers.iteritems():
+      load = ports.get((dpid,port))
+      if load is None or load.rate is None: return
+      rates[server] = load.rate / sharing[port]
+    if not rates: return
+    mean = sum(rates.itervalues()) / len(rates)
+    weights = {}
+    for server,rate in rates.iteritems():
+      if mean <= 0:
+        w = WEIGHT_SCALE
+      elif rate <= 0:
+        w = WEIGHT_SCALE * 2
+      else:
+        w = int(round(WEIGHT_SCALE * mean / rate))
+      weights[server] = max(1, min(WEIGHT_SCALE * 2, w))
+    if weights != self._weights:
+      self.log.debug("Server weights now %s", weights)
+      self._weights = weights
+      self._rebuild_table()
+
+  def _pick_server (self, key, inport):
+    """
+    Looks up the server for a bucket in the Maglev table
+    """
+    h = crc32(struct.pack("!LB", key[0], key[1]))
+    return self._table_servers[self._table[h % len(self._table)]]
+
+  def _handle_PacketIn (self, event):
+    packet = event.parsed
+    ipp = packet.find('ipv4')
+    if ipp is None or ipp.protocol != ipv4.TCP_PROTOCOL:
+      return super(hashlb,self)._handle_PacketIn(event)
+
+    def drop ():
+      if event.ofp.buffer_id is not None:
+        # Kill the buffer
+        self.con.send(of.ofp_packet_out(data = event.ofp))
+
+    if ipp.srcip in self.live_servers:
+      # From a server; its reverse flow must have expired.  Reinstall the
+      # bucket if we still know it.
+      bucket = (ipp.dstip.toUnsigned() & self._bucket_mask, self.bucket_bits)
+      entry = self.buckets.get(bucket)
+      if entry is None or entry.server != ipp.srcip:
+        self.log.debug("No bucket for %s", ipp.dstip)
+        return drop()
+    elif ipp.dstip == self.service_ip:
+      bucket = (ipp.srcip.toUnsigned() & self._bucket_mask, self.bucket_bits)
+      entry = self.buckets.get(bucket)
+      if entry is None or entry.server not in self.live_servers:
+        if not self.live_servers:
+          self.log.warn("No servers!")
+          return drop()
+        server = self._pick_server(bucket, event.port)
+        self.log.debug("Directing %s/%s to %s", IPAddr.from_num(bucket[0]),
+                       bucket[1], server)
+        entry = BucketEntry(bucket, server, event.port)
+        self._remember(self.buckets, entry)
+    else:
+      return super(hashlb,self)._handle_PacketIn(event)
+    entry.refresh()
+
+    mac,port = self.live_servers[entry.server]
+    nw_src = (IPAddr.from_num(bucket[0]), bucket[1])
+
+    # Server heading back to the bucket's clients
+    fm = of.ofp_flow_mod(idle_timeout = BUCKET_IDLE_TIMEOUT)
+    fm.match.in_port = port
+    fm.match.dl_type = ethernet.IP_TYPE
+    fm.match.nw_proto = ipv4.TCP_PROTOCOL
+    fm.match.nw_src = entry.server
+    fm.match.nw_dst = nw_src
+    fm.actions.append(of.ofp_action_dl_addr.set_src(self.mac))
+    fm.actions.append(of.ofp_action_nw_addr.set_src(self.service_ip))
+    fm.actions.append(of.ofp_action_output(port = entry.client_port))
+    rev = fm
+
+    # Clients heading to the server
+    fm = of.ofp_flow_mod(idle_timeout = BUCKET_IDLE_TIMEOUT)
+    fm.match.dl_type = ethernet.IP_TYPE
+    fm.match.nw_proto = ipv4.TCP_PROTOCOL
+    fm.match.nw_src = nw_src
+    fm.match.nw_dst = self.service_ip
+    fm.actions.append(of.ofp_action_dl_addr.set_dst(mac))
+    fm.actions.append(of.ofp_action_nw_addr.set_dst(entry.server))
+    fm.actions.append(of.ofp_action_output(port = port))
+    fwd = fm
+
+    # The one for the packet's own direction goes last and takes it along
+    if ipp.dstip == self.service_ip:
+      fwd.data = event.ofp
+      self.con.send(rev.pack() + fwd.pack())
+    else:
+      rev.data = event.ofp
+      self.con.send(fwd.pack() + rev.pack())
+
+
 # Remember which DPID we're operating on (first one to connect)
 _dpid = None
 
 
-def launch (ip, servers, dpid = None):
+def launch (ip, servers, dpid = None, mode = "random", bucket_bits = 32):
   global _dpid
   if dpid is not None:
     _dpid = str_to_dpid(dpid)
 
+  if mode == "random":
+    factory = iplb
+  elif mode == "hash":
+    bucket_bits = int(bucket_bits)
+    factory = lambda *args: hashlb(*args, bucket_bits = bucket_bits)
+    def start_link_utilization (event):
+      # Wait until everything on the commandline has been launched so that
+      # we don't start a second one if the user launched it too
+      if not core.hasComponent('link_utilization'):
+        from pox.openflow.link_utilization import launch as lu_launch
+        lu_launch()
+    core.addListenerByName("UpEvent", start_link_utilization)
+  else:
+    raise RuntimeError("Unknown mode: %s" % (mode,))
+
   servers = servers.replace(","," ").split()
   servers = [IPAddr(x) for x in servers]
   ip = IPAddr(ip)
@@ -348,7 +648,7 @@ def launch (ip, servers, dpid = None):
     else:
       if not core.hasComponent('iplb'):
         # Need to initialize first...
-        core.registerNew(iplb, event.connection, IPAddr(ip), servers)
+        core.register('iplb', factory(event.connection, IPAddr(ip), servers))
         log.info("IP Load Balancer Ready.")
       log.info("Load Balancing on %s", event.connection)
 
@@ -28,6 +28,10 @@ in-band control with something like:
   ovs-vsctl set bridge s1 other-config:disable-in-band=true
 
 Please submit improvements. :)
+
+There's also a benchmark which drives synthetic PacketIns straight into
+the NAT (no switch or DHCP needed):
+./pox.py --no-openflow misc.nat:benchmark --connections=10000
 """
 
 from pox.core import core
@@ -48,35 +52,136 @@ import pox.lib.recoco as recoco
 import pox.openflow.libopenflow_01 as of
 from pox.proto.dhcpd import DHCPD, SimpleAddressPool
 
+from pox.openflow.match_key import match_key, packet_in_match
+
 import time
 import random
+import logging
+import struct
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
 
 FLOW_TIMEOUT = 60
 FLOW_MEMORY_TIMEOUT = 60 * 10
 
+# Range of outside ports handed out when a connection's own source port
+# can't be used
+DYNAMIC_PORTS = (49152, 65533)
+
+_match_fmt = struct.Struct("!LH6s6sHBxHBBxxLLHH")
+_flow_mod_fmt = struct.Struct("!BBHL40sQHHHHLHH")
+_action_dl_addr_fmt = struct.Struct("!HH6s6x")
+_action_nw_addr_fmt = struct.Struct("!HHL")
+_action_tp_port_fmt = struct.Struct("!HHH2x")
+_action_output_fmt = struct.Struct("!HHHH")
+_buffer_id_fmt = struct.Struct("!L")
+_BUFFER_ID_OFFSET = 64 # Of buffer_id within a packed ofp_flow_mod
+
+# Exact matches on in_port and the fields NAT.strip_match() keeps, and the
+# same with dl_dst wildcarded
+_WILDCARDS = (of.OFPFW_DL_VLAN | of.OFPFW_DL_VLAN_PCP | of.OFPFW_NW_TOS)
+_WILDCARDS_NO_DL_DST = _WILDCARDS | of.OFPFW_DL_DST
+
+
+def _pack_match (wildcards, in_port, dl_src, dl_dst, dl_type, nw_proto,
+                 nw_src, nw_dst, tp_src, tp_dst):
+  return _match_fmt.pack(wildcards, in_port or 0, dl_src or b'\0' * 6,
+                         dl_dst or b'\0' * 6, 0, 0, dl_type, 0, nw_proto,
+                         nw_src, nw_dst, tp_src, tp_dst)
+
+def _pack_flow_mod (match, actions):
+  """
+  Packs an OFPFC_ADD ofp_flow_mod which sends us FlowRemoved messages
+  """
+  return _flow_mod_fmt.pack(of.OFP_VERSION, of.OFPT_FLOW_MOD,
+                            _flow_mod_fmt.size + len(actions),
+                            of.generate_xid(), match, 0, of.OFPFC_ADD, 0,
+                            FLOW_TIMEOUT, of.OFP_DEFAULT_PRIORITY,
+                            of.NO_BUFFER, of.OFPP_NONE,
+                            of.OFPFF_SEND_FLOW_REM) + actions
+
+def _pack_dl_addr (action_type, addr):
+  return _action_dl_addr_fmt.pack(action_type, 16, addr)
+
+def _pack_nw_addr (action_type, addr):
+  return _action_nw_addr_fmt.pack(action_type, 8, addr)
+
+def _pack_tp_port (action_type, port):
+  return _action_tp_port_fmt.pack(action_type, 8, port)
+
+def _pack_output (port):
+  return _action_output_fmt.pack(of.OFPAT_OUTPUT, 8, port, 0)
+
+
+class PortPool (object):
+  """
+  Hands out outside ports for one protocol
+
+  Ports from DYNAMIC_PORTS sit in a free list (shuffled, so that the
+  ports we pick aren't predictable).  A port which is taken directly with
+  a specific number stays in the free list and is skipped when it comes
+  up, so both taking and releasing ports is O(1) (amortized).
+  """
+  def __init__ (self, low = DYNAMIC_PORTS[0], high = DYNAMIC_PORTS[1]):
+    self.low = low
+    self.high = high
+    self.used = set()
+    free = range(low, high + 1)
+    random.shuffle(free)
+    self._free = deque(free)
+    self._in_free = set(free)
+
+  def take (self, port = None):
+    """
+    Takes port if it's free, or else any free dynamic port
+
+    Returns the port, or None if there are no ports left.
+    """
+    used = self.used
+    if port is not None and port not in used:
+      used.add(port)
+      return port
+    free = self._free
+    while free:
+      port = free.popleft()
+      self._in_free.discard(port)
+      if port not in used:
+        used.add(port)
+        return port
+    return None
+
+  def release (self, port):
+    self.used.discard(port)
+    if self.low <= port <= self.high and port not in self._in_free:
+      self._in_free.add(port)
+      self._free.append(port)
+
 
 class Record (object):
   def __init__ (self):
     self.touch()
-    self.outgoing_match = None
+    self.outgoing_match = None # Key (see NAT._strip_key()) of each direction
     self.incoming_match = None
     self.real_srcport = None
     self.fake_srcport = None
-    self.outgoing_fm = None
+    self.outgoing_fm = None # Packed ofp_flow_mods
     self.incoming_fm = None
+    self._due = None # Deadline of this record's slot in the expiry heap
 
-  @property
-  def expired (self):
-    return time.time() > self._expires_at
+  def expired (self, now = None):
+    if now is None: now = time.time()
+    return now > self._expires_at
 
   def touch (self):
     self._expires_at = time.time() + FLOW_MEMORY_TIMEOUT
 
   def __str__ (self):
-    s = "%s:%s" % (self.outgoing_match.nw_src, self.real_srcport)
+    k = self.outgoing_match
+    s = "%s:%s" % (IPAddr.from_num(k[4]), self.real_srcport)
     if self.fake_srcport != self.real_srcport:
       s += "/%s" % (self.fake_srcport,)
-    s += " -> %s:%s" % (self.outgoing_match.nw_dst, self.outgoing_match.tp_dst)
+    s += " -> %s:%s" % (IPAddr.from_num(k[5]), k[7])
     return s
 
 
@@ -97,14 +202,19 @@ class NAT (object):
     self._connection = None
 
     # Which NAT ports have we used?
-    # proto means TCP or UDP
-    self._used_ports = set() # (proto,port)
+    # proto (TCP or UDP) -> PortPool
+    self._ports = {}
 
     # Flow records indexed in both directions
-    # match -> Record
+    # key -> Record
     self._record_by_outgoing = {}
     self._record_by_incoming = {}
 
+    # One (deadline,seq,Record) slot per record.  Records which were
+    # touched since their slot was pushed are pushed again when it's popped.
+    self._expiry = []
+    self._seq = count()
+
     core.listen_to_dependencies(self)
 
   def _all_dependencies_met (self):
@@ -117,20 +227,33 @@ class NAT (object):
 
     self.expire_timer = Timer(60, self._expire, recurring = True)
 
-  def _expire (self):
-    dead = []
-    for r in self._record_by_outgoing.itervalues():
-      if r.expired:
-        dead.append(r)
+  def _expire (self, now = None):
+    """
+    Forgets records which have been idle too long
 
-    for r in dead:
+    now defaults to the current time.
+    """
+    if now is None: now = time.time()
+    heap = self._expiry
+    dead = 0
+    while heap and heap[0][0] < now:
+      when,_,r = heappop(heap)
+      if r._due != when: continue
+      if not r.expired(now):
+        self._schedule_expiry(r)
+        continue
       del self._record_by_outgoing[r.outgoing_match]
       del self._record_by_incoming[r.incoming_match]
-      self._used_ports.remove((r.outgoing_match.nw_proto,r.fake_srcport))
+      self._ports[r.outgoing_match[3]].release(r.fake_srcport)
+      dead += 1
 
     if dead and not self._record_by_outgoing:
       log.debug("All flows expired")
 
+  def _schedule_expiry (self, record):
+    record._due = record._expires_at
+    heappush(self._expiry, (record._due, next(self._seq), record))
+
   def _is_local (self, ip):
     if ip.is_multicast: return True
     if self.subnet is not None:
@@ -141,34 +264,25 @@ class NAT (object):
     if ip.in_network('172.16.0.0/12'): return True
     return False
 
-  def _pick_port (self, flow):
+  def _pick_port (self, nw_proto, port):
     """
     Gets a possibly-remapped outside port
 
-    flow is the match of the connection
-    returns port (maybe from flow, maybe not)
+    port is the source port of the connection
+    returns port (maybe the same, maybe not) or None if none are left
     """
-
-    port = flow.tp_src
+    pool = self._ports.get(nw_proto)
+    if pool is None:
+      pool = self._ports[nw_proto] = PortPool()
 
     if port < 1024:
       # Never allow these
-      port = random.randint(49152, 65534)
-
-    # Pretty sloppy!
+      port = None
 
-    cycle = 0
-    while cycle < 2:
-      if (flow.nw_proto,port) not in self._used_ports:
-        self._used_ports.add((flow.nw_proto,port))
-        return port
-      port += 1
-      if port >= 65534:
-        port = 49152
-        cycle += 1
-
-    log.warn("No ports to give!")
-    return None
+    port = pool.take(port)
+    if port is None:
+      log.warn("No ports to give!")
+    return port
 
   @property
   def _outside_eth (self):
@@ -194,13 +308,19 @@ class NAT (object):
   def make_match (o):
     return NAT.strip_match(of.ofp_match.from_packet(o))
 
+  @staticmethod
+  def _strip_key (key):
+    """
+    Returns the fields of a match key which strip_match() keeps
+
+    That's (dl_src, dl_dst, dl_type, nw_proto, nw_src, nw_dst, tp_src, tp_dst)
+    with the addresses in match key form (raw MACs and integer IPs).
+    """
+    return (key[1], key[2], key[5], key[7], key[8], key[9], key[10], key[11])
+
   def _handle_PacketIn (self, event):
     if self._outside_eth is None: return
 
-    #print
-    #print "PACKET",event.connection.ports[event.port].name,event.port,
-    #print self.outside_port, self.make_match(event.ofp)
-
     incoming = event.port == self._outside_portno
 
     if self._gateway_eth is None:
@@ -208,123 +328,149 @@ class NAT (object):
       self._arp_for_gateway()
       return
 
-    packet = event.parsed
-    dns_hack = False
+    # Frames match_key() can't handle (IP fragments, malformed headers, ...)
+    # don't carry a usable TCP/UDP header, so we ignore them.
+    key = match_key(event.data, event.port, spec_frags = False)
+    if key is None: return
+    match = self._strip_key(key)
+    dl_type, nw_proto, tp_dst = match[2], match[3], match[7]
 
     # We only handle TCP and UDP
-    tcpp = packet.find('tcp')
-    if not tcpp:
-      tcpp = packet.find('udp')
-      if not tcpp: return
-      if tcpp.dstport == 53 and tcpp.prev.dstip == self.inside_ip:
-        if self.dns_ip and not incoming:
-          # Special hack for DNS since we've lied and claimed to be the server
-          dns_hack = True
-    ipp = tcpp.prev
+    if dl_type != 0x0800: return
+    if nw_proto != 6 and nw_proto != 17: return
+    dstip = IPAddr.from_num(match[5])
+
+    dns_hack = False
+    if nw_proto == 17 and tp_dst == 53 and dstip == self.inside_ip:
+      if self.dns_ip and not incoming:
+        # Special hack for DNS since we've lied and claimed to be the server
+        dns_hack = True
 
     if not incoming:
       # Assume we only NAT public addresses
-      if self._is_local(ipp.dstip) and not dns_hack: return
+      if self._is_local(dstip) and not dns_hack: return
     else:
       # Assume we only care about ourselves
-      if ipp.dstip != self.outside_ip: return
-
-    match = self.make_match(event.ofp)
+      if dstip != self.outside_ip: return
 
     if incoming:
-      match2 = match.clone()
-      match2.dl_dst = None # See note below
+      match2 = match[:1] + (None,) + match[2:] # dl_dst isn't matched
       record = self._record_by_incoming.get(match2)
       if record is None:
         # Ignore for a while
         fm = of.ofp_flow_mod()
         fm.idle_timeout = 1
         fm.hard_timeout = 10
-        fm.match = of.ofp_match.from_packet(event.ofp)
+        fm.match = packet_in_match(event)
         event.connection.send(fm)
         return
       log.debug("%s reinstalled", record)
-      record.incoming_fm.data = event.ofp # Hacky!
     else:
       record = self._record_by_outgoing.get(match)
       if record is None:
-        record = Record()
+        record = self._new_record(match, event.port, dns_hack)
+        if record is None: return
+        log.debug("%s installed", record)
+      else:
+        log.debug("%s reinstalled", record)
 
-        record.real_srcport = tcpp.srcport
-        record.fake_srcport = self._pick_port(match)
+    record.touch()
 
-        # Outside heading in
-        fm = of.ofp_flow_mod()
-        fm.flags |= of.OFPFF_SEND_FLOW_REM
-        fm.hard_timeout = FLOW_TIMEOUT
+    # Send/resend the flow mods.  The one for the packet's own direction
+    # goes last and takes the packet along.
+    if incoming:
+      data = record.outgoing_fm + self._attach_packet(record.incoming_fm,
+                                                      event.ofp)
+    else:
+      data = record.incoming_fm + self._attach_packet(record.outgoing_fm,
+                                                      event.ofp)
+    self._connection.send(data)
 
-        fm.match = match.flip()
-        fm.match.in_port = self._outside_portno
-        fm.match.nw_dst = self.outside_ip
-        fm.match.tp_dst = record.fake_srcport
-        fm.match.dl_src = self._gateway_eth
+  @staticmethod
+  def _attach_packet (fm, packet_in):
+    """
+    Makes a packed flow_mod also apply to the packet from packet_in
 
-        # We should set dl_dst, but it can get in the way.  Why?  Because
-        # in some situations, the ARP may ARP for and get the local host's
-        # MAC, but in others it may not.
-        #fm.match.dl_dst = self._outside_eth
-        fm.match.dl_dst = None
+    This does what setting ofp_flow_mod.data does.
+    """
+    buffer_id = packet_in.buffer_id
+    if buffer_id is not None:
+      return (fm[:_BUFFER_ID_OFFSET] + _buffer_id_fmt.pack(buffer_id)
+              + fm[_BUFFER_ID_OFFSET+4:])
+    if not packet_in.is_complete:
+      log.warn("flow_mod is trying to include incomplete data")
+      return fm
+    po = of.ofp_packet_out(data = packet_in.data, in_port = packet_in.in_port,
+                           action = of.ofp_action_output(port=of.OFPP_TABLE))
+    return fm + of.ofp_barrier_request().pack() + po.pack()
+
+  def _new_record (self, match, in_port, dns_hack):
+    """
+    Creates and indexes the Record for a new outgoing connection
 
-        fm.actions.append(of.ofp_action_dl_addr.set_src(packet.dst))
-        fm.actions.append(of.ofp_action_dl_addr.set_dst(packet.src))
-        fm.actions.append(of.ofp_action_nw_addr.set_dst(ipp.srcip))
+    match is the stripped key of its first packet.  Both flow_mods are
+    packed here once and just resent whenever the connection comes back
+    to the controller.  (The switch fixes up the IP and TCP/UDP checksums
+    for the rewritten fields itself.)
+    """
+    dl_src, dl_dst, dl_type, nw_proto, nw_src, nw_dst, tp_src, tp_dst = match
 
-        if dns_hack:
-          fm.match.nw_src = self.dns_ip
-          fm.actions.append(of.ofp_action_nw_addr.set_src(self.inside_ip))
-        if record.fake_srcport != record.real_srcport:
-          fm.actions.append(of.ofp_action_tp_port.set_dst(record.real_srcport))
+    fake_srcport = self._pick_port(nw_proto, tp_src)
+    if fake_srcport is None: return None
 
-        fm.actions.append(of.ofp_action_output(port = event.port))
+    record = Record()
+    record.real_srcport = tp_src
+    record.fake_srcport = fake_srcport
 
-        record.incoming_match = self.strip_match(fm.match)
-        record.incoming_fm = fm
+    outside_ip = self.outside_ip.toUnsigned()
+    gateway_eth = self._gateway_eth.toRaw()
 
-        # Inside heading out
-        fm = of.ofp_flow_mod()
-        fm.data = event.ofp
-        fm.flags |= of.OFPFF_SEND_FLOW_REM
-        fm.hard_timeout = FLOW_TIMEOUT
-        fm.match = match.clone()
-        fm.match.in_port = event.port
-        fm.actions.append(of.ofp_action_dl_addr.set_src(self._outside_eth))
-        fm.actions.append(of.ofp_action_nw_addr.set_src(self.outside_ip))
-        if dns_hack:
-          fm.actions.append(of.ofp_action_nw_addr.set_dst(self.dns_ip))
-        if record.fake_srcport != record.real_srcport:
-          fm.actions.append(of.ofp_action_tp_port.set_src(record.fake_srcport))
-        fm.actions.append(of.ofp_action_dl_addr.set_dst(self._gateway_eth))
-        fm.actions.append(of.ofp_action_output(port = self._outside_portno))
-
-        record.outgoing_match = self.strip_match(fm.match)
-        record.outgoing_fm = fm
-
-        self._record_by_incoming[record.incoming_match] = record
-        self._record_by_outgoing[record.outgoing_match] = record
+    # Outside heading in
 
-        log.debug("%s installed", record)
-      else:
-        log.debug("%s reinstalled", record)
-        record.outgoing_fm.data = event.ofp # Hacky!
-
-    record.touch()
-
-    # Send/resend the flow mods
-    if incoming:
-      data = record.outgoing_fm.pack() + record.incoming_fm.pack()
+    # We should set dl_dst, but it can get in the way.  Why?  Because
+    # in some situations, the ARP may ARP for and get the local host's
+    # MAC, but in others it may not.
+    if dns_hack:
+      nw_src2 = self.dns_ip.toUnsigned()
     else:
-      data = record.incoming_fm.pack() + record.outgoing_fm.pack()
-    self._connection.send(data)
-
-    # We may have set one of the data fields, but they should be reset since
-    # they won't be valid in the future.  Kind of hacky.
-    record.outgoing_fm.data = None
-    record.incoming_fm.data = None
+      nw_src2 = nw_dst
+    record.incoming_match = (gateway_eth, None, dl_type, nw_proto, nw_src2,
+                             outside_ip, tp_dst, fake_srcport)
+
+    actions = _pack_dl_addr(of.OFPAT_SET_DL_SRC, dl_dst)
+    actions += _pack_dl_addr(of.OFPAT_SET_DL_DST, dl_src)
+    actions += _pack_nw_addr(of.OFPAT_SET_NW_DST, nw_src)
+    if dns_hack:
+      actions += _pack_nw_addr(of.OFPAT_SET_NW_SRC,
+                               self.inside_ip.toUnsigned())
+    if fake_srcport != tp_src:
+      actions += _pack_tp_port(of.OFPAT_SET_TP_DST, tp_src)
+    actions += _pack_output(in_port)
+
+    record.incoming_fm = _pack_flow_mod(
+        _pack_match(_WILDCARDS_NO_DL_DST, self._outside_portno,
+                    *record.incoming_match), actions)
+
+    # Inside heading out
+    record.outgoing_match = match
+
+    actions = _pack_dl_addr(of.OFPAT_SET_DL_SRC, self._outside_eth.toRaw())
+    actions += _pack_nw_addr(of.OFPAT_SET_NW_SRC, outside_ip)
+    if dns_hack:
+      actions += _pack_nw_addr(of.OFPAT_SET_NW_DST, self.dns_ip.toUnsigned())
+    if fake_srcport != tp_src:
+      actions += _pack_tp_port(of.OFPAT_SET_TP_SRC, fake_srcport)
+    actions += _pack_dl_addr(of.OFPAT_SET_DL_DST, gateway_eth)
+    actions += _pack_output(self._outside_portno)
+
+    record.outgoing_fm = _pack_flow_mod(
+        _pack_match(_WILDCARDS, in_port, *match), actions)
+
+    self._record_by_incoming[record.incoming_match] = record
+    self._record_by_outgoing[record.outgoing_match] = record
+    self._schedule_expiry(record)
+
+    return record
 
   def __handle_dpid_ConnectionUp (self, event):
     if event.dpid != self.dpid:
@@ -417,6 +563,111 @@ class NATDHCPD (DHCPD):
     return super(NATDHCPD,self)._handle_PacketIn(event)
 
 
+class _BenchmarkConnection (object):
+  """
+  Enough of a Connection for NAT which just counts what's sent to it
+  """
+  def __init__ (self, ports):
+    self.ports = ports
+    self.sent = 0
+
+  def send (self, data):
+    self.sent += 1
+
+
+class _BenchmarkPacketIn (object):
+  def __init__ (self, port, data, buffer_id):
+    self.port = port
+    self.data = data
+    self.ofp = of.ofp_packet_in(data = data, in_port = port,
+                                buffer_id = buffer_id)
+
+
+def benchmark (connections = 10000, rounds = 3):
+  """
+  Measures how fast NAT sets up, reinstalls and expires connections
+
+  Synthetic PacketIns for new outgoing TCP connections are fed straight
+  into _handle_PacketIn.  Connections either all have their own source
+  port ("unique"), or all share one low source port so that every one of
+  them needs a dynamic port ("colliding").  Then the same PacketIns are
+  fed in again (as when flows time out on the switch but the NAT still
+  remembers them), and finally every record is expired.
+  """
+  connections = int(connections)
+  rounds = int(rounds)
+
+  inside_port = 2
+  outside_port = 1
+  inside_eth = EthAddr("00:00:00:00:00:01")
+  switch_eth = EthAddr("00:00:00:00:00:fe")
+
+  def make_frames (src_port):
+    frames = []
+    for i in range(connections):
+      tcp = pkt.tcp(srcport = src_port(i), dstport = 80, off = 5)
+      ip = pkt.ipv4(srcip = IPAddr("172.16.1.100"),
+                    dstip = IPAddr(0x05000000 + i),
+                    protocol = pkt.ipv4.TCP_PROTOCOL, payload = tcp)
+      eth = pkt.ethernet(src = inside_eth, dst = switch_eth,
+                         type = pkt.ethernet.IP_TYPE, payload = ip)
+      frames.append(_BenchmarkPacketIn(inside_port, eth.pack(), i))
+    return frames
+
+  def rate (f, events):
+    best = None
+    for _ in range(rounds):
+      start = time.time()
+      f(events)
+      elapsed = time.time() - start
+      if best is None or elapsed < best: best = elapsed
+    return len(events) / best
+
+  def run (name, src_port):
+    events = make_frames(src_port)
+    state = {}
+
+    def setup (events):
+      n = NAT(IPAddr("172.16.1.1"), IPAddr("1.2.3.4"), IPAddr("1.2.3.1"),
+              None, "eth0", 1, subnet = "172.16.1.0/24")
+      n._connection = _BenchmarkConnection(
+          {outside_port:of.ofp_phy_port(port_no = outside_port,
+                                        hw_addr = EthAddr("00:00:00:00:01:fe"))})
+      n._outside_portno = outside_port
+      n._gateway_eth = EthAddr("00:00:00:00:02:01")
+      state['nat'] = n
+      for e in events:
+        n._handle_PacketIn(e)
+
+    def again (events):
+      n = state['nat']
+      for e in events:
+        n._handle_PacketIn(e)
+
+    new = rate(setup, events)
+    seen = rate(again, events)
+
+    # Expire everything by running _expire() as if it were later
+    n = state['nat']
+    start = time.time()
+    n._expire(now = start + FLOW_MEMORY_TIMEOUT + 1)
+    expire = time.time() - start
+
+    log.info("%-9s new %7.0f/s  reinstall %7.0f/s  "
+             "expire %i in %.1f ms  (%i flow_mods sent)", name, new, seen,
+             connections - len(n._record_by_outgoing), expire * 1000,
+             n._connection.sent)
+
+  level = log.getEffectiveLevel()
+  log.setLevel(logging.INFO)
+  log.info("%i connections, best of %i rounds", connections, rounds)
+  run("unique", lambda i: 1024 + i % (65536 - 1024))
+  run("colliding", lambda i: 80)
+  log.setLevel(level)
+
+  core.quit()
+
+
 def launch (dpid, outside_port, subnet = '172.16.1.0/24',
             inside_ip = '172.16.1.1'):
 
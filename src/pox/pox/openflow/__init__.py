@@ -245,6 +245,18 @@ class BarrierIn (Event):
     self.dpid = connection.dpid
     self.xid = ofp.xid
 
+class EchoReply (Event):
+  """
+  Fired in response to an echo reply
+
+  xid (int) - XID of echo request
+  """
+  def __init__ (self, connection, ofp):
+    self.connection = connection
+    self.ofp = ofp
+    self.dpid = connection.dpid
+    self.xid = ofp.xid
+
 class ConnectionIn (Event):
   def __init__ (self, connection):
     super(ConnectionIn,self).__init__()
@@ -341,6 +353,7 @@ class OpenFlowNexus (EventMixin):
     PortStatus,
     PacketIn,
     BarrierIn,
+    EchoReply,
     ErrorIn,
     RawStatsReply,
     SwitchDescReceived,
@@ -19,6 +19,10 @@ This module discovers the connectivity between OpenFlow switches by sending
 out LLDP packets. To be notified of this information, listen to LinkEvents
 on core.openflow_discovery.
 
+It also keeps a smoothed estimate of each link's latency, based on how
+long discovery packets take to come back to us (see link_latency).  Note
+that this includes the control channel latency to both switches.
+
 It's possible that some of this should be abstracted out into a generic
 Discovery module, or a Discovery superclass.
 """
@@ -30,14 +34,26 @@ from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
 
+from pox.lib.addresses import EthAddr
+
 import struct
 import time
-from collections import namedtuple
+from collections import namedtuple, deque, defaultdict
+from heapq import heappush, heappop
 from random import shuffle, random
 
 
 log = core.getLogger()
 
+NO_BUFFER = 0xffffffff
+
+_packet_out_hdr = struct.Struct("!BBHLLHHHHHH") # Header, one output action
+_tlv_hdr = struct.Struct("!HB") # TLV header and subtype
+_tlv_len = struct.Struct("!H")
+_ttl_tlv = struct.Struct("!HH")
+_ndp_multicast = pkt.ETHERNET.NDP_MULTICAST.toRaw()
+_lldp_ethertype = struct.pack("!H", pkt.ethernet.LLDP_TYPE)
+
 
 class LLDPSender (object):
   """
@@ -46,9 +62,9 @@ class LLDPSender (object):
 
   SendItem = namedtuple("LLDPSenderItem", ('dpid','port_num','packet'))
 
-  #NOTE: This class keeps the packets to send in a flat list, which makes
-  #      adding/removing them on switch join/leave or (especially) port
-  #      status changes relatively expensive. Could easily be improved.
+  # The packets to send are kept in two deques, one for the rest of this
+  # cycle and one for the next.  Removing a port just forgets its item in
+  # _items; stale entries are skipped when they reach the front.
 
   # Maximum times to run the timer per second
   _sends_per_sec = 15
@@ -66,14 +82,20 @@ class LLDPSender (object):
       other LLDP agents might.  Can't be 0 (this means revoke).
     """
     # Packets remaining to be sent in this cycle
-    self._this_cycle = []
+    self._this_cycle = deque()
 
     # Packets we've already sent in this cycle
-    self._next_cycle = []
+    self._next_cycle = deque()
+
+    # Current packet for each port.  (dpid,port_num) -> SendItem
+    self._items = {}
 
     # Packets to send in a batch
     self._send_chunk_size = 1
 
+    # When we last sent each packet.  (dpid,port_num) -> time.time()
+    self.sent_at = {}
+
     self._timer = None
     self._ttl = ttl
     self._send_cycle_time = send_cycle_time
@@ -102,31 +124,34 @@ class LLDPSender (object):
     self.del_switch(event.dpid)
 
   def del_switch (self, dpid, set_timer = True):
-    self._this_cycle = [p for p in self._this_cycle if p.dpid != dpid]
-    self._next_cycle = [p for p in self._next_cycle if p.dpid != dpid]
+    for k in [k for k in self._items if k[0] == dpid]:
+      del self._items[k]
+      self.sent_at.pop(k, None)
     if set_timer: self._set_timer()
 
   def del_port (self, dpid, port_num, set_timer = True):
     if port_num > of.OFPP_MAX: return
-    self._this_cycle = [p for p in self._this_cycle
-                        if p.dpid != dpid or p.port_num != port_num]
-    self._next_cycle = [p for p in self._next_cycle
-                        if p.dpid != dpid or p.port_num != port_num]
+    self._items.pop((dpid,port_num), None)
+    self.sent_at.pop((dpid,port_num), None)
     if set_timer: self._set_timer()
 
   def add_port (self, dpid, port_num, port_addr, set_timer = True):
     if port_num > of.OFPP_MAX: return
-    self.del_port(dpid, port_num, set_timer = False)
-    self._next_cycle.append(LLDPSender.SendItem(dpid, port_num,
-          self.create_packet_out(dpid, port_num, port_addr)))
+    item = LLDPSender.SendItem(dpid, port_num,
+        self.create_packet_out(dpid, port_num, port_addr))
+    self._items[dpid,port_num] = item
+    self._next_cycle.append(item)
     if set_timer: self._set_timer()
 
   def _set_timer (self):
     if self._timer: self._timer.cancel()
     self._timer = None
-    num_packets = len(self._this_cycle) + len(self._next_cycle)
+    num_packets = len(self._items)
 
-    if num_packets == 0: return
+    if num_packets == 0:
+      self._this_cycle.clear()
+      self._next_cycle.clear()
+      return
 
     self._send_chunk_size = 1 # One at a time
     interval = self._send_cycle_time / float(num_packets)
@@ -143,31 +168,76 @@ class LLDPSender (object):
     """
     Called by a timer to actually send packets.
 
-    Picks the first packet off this cycle's list, sends it, and then puts
-    it on the next-cycle list.  When this cycle's list is empty, starts
-    the next cycle.
+    Picks packets off the front of this cycle's deque, and puts them on
+    the next cycle's.  When this cycle's is empty, starts the next cycle.
+    The packets for each switch are sent with a single write.
     """
     num = int(self._send_chunk_size)
     fpart = self._send_chunk_size - num
     if random() < fpart: num += 1
 
-    for _ in range(num):
-      if len(self._this_cycle) == 0:
-        self._this_cycle = self._next_cycle
-        self._next_cycle = []
-        #shuffle(self._this_cycle)
-      item = self._this_cycle.pop(0)
+    items = self._items
+    batches = {} # dpid -> [packet]
+    while num > 0:
+      if not self._this_cycle:
+        if not self._next_cycle: break
+        self._this_cycle,self._next_cycle = self._next_cycle,self._this_cycle
+      item = self._this_cycle.popleft()
+      if items.get((item.dpid,item.port_num)) is not item: continue # Stale
       self._next_cycle.append(item)
-      core.openflow.sendToDPID(item.dpid, item.packet)
+      batch = batches.get(item.dpid)
+      if batch is None:
+        batches[item.dpid] = [item]
+      else:
+        batch.append(item)
+      num -= 1
+
+    now = time.time()
+    sent_at = self.sent_at
+    for dpid,batch in batches.iteritems():
+      con = core.openflow.getConnection(dpid)
+      if con is None: continue
+      con.send(b''.join(item.packet for item in batch))
+      for item in batch:
+        sent_at[dpid,item.port_num] = now
 
   def create_packet_out (self, dpid, port_num, port_addr):
     """
-    Create an ofp_packet_out containing a discovery packet
+    Create an ofp_packet_out containing a discovery packet (packed)
+    """
+    data = self._create_discovery_frame(dpid, port_num, port_addr, self._ttl)
+    return self._pack_packet_out(port_num, data)
+
+  @staticmethod
+  def _pack_packet_out (port_num, data):
+    """
+    Packs an ofp_packet_out which sends data out of port_num
+    """
+    return _packet_out_hdr.pack(of.OFP_VERSION, of.OFPT_PACKET_OUT,
+                                _packet_out_hdr.size + len(data),
+                                of.generate_xid(), NO_BUFFER, of.OFPP_NONE,
+                                8, of.OFPAT_OUTPUT, 8, port_num, 0) + data
+
+  @staticmethod
+  def _create_discovery_frame (dpid, port_num, port_addr, ttl):
+    """
+    Build a packed discovery packet
+
+    This is the same as _create_discovery_packet(...).pack(), but without
+    building the packet objects.
     """
-    eth = self._create_discovery_packet(dpid, port_num, port_addr, self._ttl)
-    po = of.ofp_packet_out(action = of.ofp_action_output(port=port_num))
-    po.data = eth.pack()
-    return po.pack()
+    dpid_str = bytes('dpid:' + hex(long(dpid))[2:-1])
+    port_str = str(port_num)
+    return b''.join((
+        _ndp_multicast, EthAddr(port_addr).toRaw(), _lldp_ethertype,
+        _tlv_hdr.pack((pkt.lldp.CHASSIS_ID_TLV << 9) | (len(dpid_str) + 1),
+                      pkt.chassis_id.SUB_LOCAL), dpid_str,
+        _tlv_hdr.pack((pkt.lldp.PORT_ID_TLV << 9) | (len(port_str) + 1),
+                      pkt.port_id.SUB_PORT), port_str,
+        _ttl_tlv.pack((pkt.lldp.TTL_TLV << 9) | 2, ttl),
+        _tlv_len.pack((pkt.lldp.SYSTEM_DESC_TLV << 9) | len(dpid_str)),
+        dpid_str,
+        b'\x00\x00')) # End TLV
 
   @staticmethod
   def _create_discovery_packet (dpid, port_num, port_addr, ttl):
@@ -201,6 +271,48 @@ class LLDPSender (object):
     return eth
 
 
+def parse_discovery_frame (data):
+  """
+  Quickly parses one of our own discovery packets
+
+  Only handles the exact layout which LLDPSender sends (no VLAN tag, and
+  chassis ID, port ID, TTL and system description TLVs with the DPID in
+  both the chassis ID and the system description).  Returns (dpid,port)
+  or None if it's not such a packet.
+  """
+  if data[:6] != _ndp_multicast or data[12:14] != _lldp_ethertype:
+    return None
+  try:
+    hdr,subtype = _tlv_hdr.unpack_from(data, 14)
+    if hdr >> 9 != pkt.lldp.CHASSIS_ID_TLV: return None
+    if subtype != pkt.chassis_id.SUB_LOCAL: return None
+    end = 16 + (hdr & 0x1ff)
+    dpid_str = data[17:end]
+    if not dpid_str.startswith('dpid:'): return None
+
+    hdr,subtype = _tlv_hdr.unpack_from(data, end)
+    if hdr >> 9 != pkt.lldp.PORT_ID_TLV: return None
+    if subtype != pkt.port_id.SUB_PORT: return None
+    off = end + 3
+    end += 2 + (hdr & 0x1ff)
+    port_str = data[off:end]
+    if not port_str.isdigit(): return None
+
+    hdr, = _tlv_len.unpack_from(data, end)
+    if hdr != (pkt.lldp.TTL_TLV << 9) | 2: return None
+    end += 4
+
+    hdr, = _tlv_len.unpack_from(data, end)
+    if hdr >> 9 != pkt.lldp.SYSTEM_DESC_TLV: return None
+    off = end + 2
+    end = off + (hdr & 0x1ff)
+    if data[off:end] != dpid_str: return None
+
+    return int(dpid_str[5:], 16),int(port_str)
+  except (struct.error, ValueError):
+    return None
+
+
 class LinkEvent (Event):
   """
   Link up/down event
@@ -254,6 +366,7 @@ class Discovery (EventMixin):
   _flow_priority = 65000     # Priority of LLDP-catching flow (if any)
   _link_timeout = 10         # How long until we consider a link dead
   _timeout_check_period = 5  # How often to check for timeouts
+  _latency_alpha = 0.25      # Weight of a new sample in link latency
 
   _eventMixin_events = set([
     LinkEvent,
@@ -271,6 +384,10 @@ class Discovery (EventMixin):
     if link_timeout: self._link_timeout = link_timeout
 
     self.adjacency = {} # From Link to time.time() stamp
+    self.link_latency = {} # From Link to smoothed latency in seconds
+    self._link_ports = defaultdict(int) # (dpid,port) -> number of links
+    self._expiry_heap = [] # (deadline,Link)
+    self._in_heap = set() # Links with an entry in _expiry_heap
     self._sender = LLDPSender(self.send_cycle_time)
 
     # Listen with a high priority (mostly so we get PacketIns early)
@@ -321,8 +438,21 @@ class Discovery (EventMixin):
     """
     now = time.time()
 
-    expired = [link for link,timestamp in self.adjacency.iteritems()
-               if timestamp + self._link_timeout < now]
+    # Each link has one entry in the heap.  It may have been refreshed
+    # since it was pushed, in which case it just gets pushed back with
+    # its new deadline.
+    heap = self._expiry_heap
+    expired = []
+    while heap and heap[0][0] < now:
+      _,link = heappop(heap)
+      timestamp = self.adjacency.get(link)
+      deadline = None if timestamp is None else timestamp + self._link_timeout
+      if deadline is None or deadline < now:
+        self._in_heap.discard(link)
+        if deadline is not None: expired.append(link)
+      else:
+        heappush(heap, (deadline, link))
+
     if expired:
       for link in expired:
         log.info('link timeout: %s', link)
@@ -334,16 +464,24 @@ class Discovery (EventMixin):
     Receive and process LLDP packets
     """
 
-    packet = event.parsed
-
-    if (packet.effective_ethertype != pkt.ethernet.LLDP_TYPE
-        or packet.dst != pkt.ETHERNET.NDP_MULTICAST):
-      if not self._eat_early_packets: return
-      if not event.connection.connect_time: return
-      enable_time = time.time() - self.send_cycle_time - 1
-      if event.connection.connect_time > enable_time:
-        return EventHalt
-      return
+    # Our own discovery packets have a fixed layout, so try that first
+    # (without parsing anything).
+    r = parse_discovery_frame(event.data)
+    if r is None:
+      ethertype = event.data[12:14]
+      if ethertype == _lldp_ethertype or ethertype == b'\x81\x00':
+        packet = event.parsed
+      else:
+        packet = None
+      if (packet is None
+          or packet.effective_ethertype != pkt.ethernet.LLDP_TYPE
+          or packet.dst != pkt.ETHERNET.NDP_MULTICAST):
+        if not self._eat_early_packets: return
+        if not event.connection.connect_time: return
+        enable_time = time.time() - self.send_cycle_time - 1
+        if event.connection.connect_time > enable_time:
+          return EventHalt
+        return
 
     if self._explicit_drop:
       if event.ofp.buffer_id is not None:
@@ -353,22 +491,64 @@ class Discovery (EventMixin):
         msg.in_port = event.port
         event.connection.send(msg)
 
+    if r is None:
+      r = self._parse_lldp(packet)
+      if r is None: return EventHalt
+    originatorDPID,originatorPort = r
+
+    if originatorDPID not in core.openflow.connections:
+      log.info('Received LLDP packet from unknown switch')
+      return EventHalt
+
+    if (event.dpid, event.port) == (originatorDPID, originatorPort):
+      log.warning("Port received its own LLDP packet; ignoring")
+      return EventHalt
+
+    link = Discovery.Link(originatorDPID, originatorPort, event.dpid,
+                          event.port)
+
+    now = time.time()
+    sent = self._sender.sent_at.get((originatorDPID, originatorPort))
+    if sent is not None and now - sent < self._link_timeout:
+      self._update_latency(link, now - sent)
+
+    if link not in self.adjacency:
+      self.adjacency[link] = now
+      if link not in self._in_heap:
+        self._in_heap.add(link)
+        heappush(self._expiry_heap, (now + self._link_timeout, link))
+      self._link_ports[link.dpid1,link.port1] += 1
+      self._link_ports[link.dpid2,link.port2] += 1
+      log.info('link detected: %s', link)
+      self.raiseEventNoErrors(LinkEvent, True, link, event)
+    else:
+      # Just update timestamp
+      self.adjacency[link] = now
+
+    return EventHalt # Probably nobody else needs this event
+
+  def _parse_lldp (self, packet):
+    """
+    Gets the originating (dpid,port) out of a general LLDP packet
+
+    Returns None (after logging why) if we can't.
+    """
     lldph = packet.find(pkt.lldp)
     if lldph is None or not lldph.parsed:
       log.error("LLDP packet could not be parsed")
-      return EventHalt
+      return None
     if len(lldph.tlvs) < 3:
       log.error("LLDP packet without required three TLVs")
-      return EventHalt
+      return None
     if lldph.tlvs[0].tlv_type != pkt.lldp.CHASSIS_ID_TLV:
       log.error("LLDP packet TLV 1 not CHASSIS_ID")
-      return EventHalt
+      return None
     if lldph.tlvs[1].tlv_type != pkt.lldp.PORT_ID_TLV:
       log.error("LLDP packet TLV 2 not PORT_ID")
-      return EventHalt
+      return None
     if lldph.tlvs[2].tlv_type != pkt.lldp.TTL_TLV:
       log.error("LLDP packet TLV 3 not TTL")
-      return EventHalt
+      return None
 
     def lookInSysDesc ():
       r = None
@@ -414,16 +594,12 @@ class Discovery (EventMixin):
 
     if originatorDPID == None:
       log.warning("Couldn't find a DPID in the LLDP packet")
-      return EventHalt
-
-    if originatorDPID not in core.openflow.connections:
-      log.info('Received LLDP packet from unknown switch')
-      return EventHalt
+      return None
 
     # Get port number from port TLV
     if lldph.tlvs[1].subtype != pkt.port_id.SUB_PORT:
       log.warning("Thought we found a DPID, but packet didn't have a port")
-      return EventHalt
+      return None
     originatorPort = None
     if lldph.tlvs[1].id.isdigit():
       # We expect it to be a decimal value
@@ -437,41 +613,35 @@ class Discovery (EventMixin):
     if originatorPort is None:
       log.warning("Thought we found a DPID, but port number didn't " +
                   "make sense")
-      return EventHalt
+      return None
 
-    if (event.dpid, event.port) == (originatorDPID, originatorPort):
-      log.warning("Port received its own LLDP packet; ignoring")
-      return EventHalt
-
-    link = Discovery.Link(originatorDPID, originatorPort, event.dpid,
-                          event.port)
+    return originatorDPID,originatorPort
 
-    if link not in self.adjacency:
-      self.adjacency[link] = time.time()
-      log.info('link detected: %s', link)
-      self.raiseEventNoErrors(LinkEvent, True, link, event)
+  def _update_latency (self, link, sample):
+    old = self.link_latency.get(link)
+    if old is None:
+      self.link_latency[link] = sample
     else:
-      # Just update timestamp
-      self.adjacency[link] = time.time()
-
-    return EventHalt # Probably nobody else needs this event
+      self.link_latency[link] = old + self._latency_alpha * (sample - old)
 
   def _delete_links (self, links):
     for link in links:
       self.raiseEventNoErrors(LinkEvent, False, link)
     for link in links:
-      self.adjacency.pop(link, None)
+      if self.adjacency.pop(link, None) is None: continue
+      self.link_latency.pop(link, None)
+      for end in link.end:
+        n = self._link_ports[end] - 1
+        if n > 0:
+          self._link_ports[end] = n
+        else:
+          del self._link_ports[end]
 
   def is_edge_port (self, dpid, port):
     """
     Return True if given port does not connect to another switch
     """
-    for link in self.adjacency:
-      if link.dpid1 == dpid and link.port1 == port:
-        return False
-      if link.dpid2 == dpid and link.port2 == port:
-        return False
-    return True
+    return (dpid,port) not in self._link_ports
 
 
 def launch (no_flow = False, explicit_drop = True, link_timeout = None,
@@ -0,0 +1,414 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Collects flow stats from every switch
+
+Polls all connected switches for their flow stats every --interval
+seconds.  The polls are spread out over the interval instead of all going
+out at once.  Each reply is turned into columns (NumPy arrays if NumPy is
+available) and compared to the switch's previous reply to get per-flow
+packet and byte deltas and rates.
+
+Flows are told apart by their cookie (--key=cookie, e.g., when each stream
+gets its own cookie; flows sharing a cookie are summed) or by their table,
+priority and match (--key=match, the default).
+
+Only flows which changed are passed on.  They're raised as FlowStatsDelta
+events on core.flow_stats and, if the messenger is running, sent on its
+"flow_stats" channel.  There, each flow gets a small id and is only
+described (its cookie or match) the first time it's sent.  Clients
+joining the channel get a full snapshot first.
+
+The deltas from the last --retention seconds are kept (see history()).
+"""
+
+from pox.core import core
+from pox.lib.revent import *
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.of_json import match_to_dict
+from collections import deque
+from itertools import count
+from operator import itemgetter
+import heapq
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+log = core.getLogger()
+
+
+def cookie_key (stats):
+  return stats.cookie
+
+def cookie_label (stats):
+  return {'cookie':stats.cookie}
+
+# Pulls the raw match fields straight out of an ofp_match's __dict__,
+# which is much quicker than packing it
+_match_fields = itemgetter('wildcards',
+                           *['_' + f for f in sorted(of.ofp_match_data)])
+
+def match_key (stats):
+  return (stats.table_id, stats.priority) + _match_fields(stats.match.__dict__)
+
+def match_label (stats):
+  return {'table_id':stats.table_id, 'priority':stats.priority,
+          'match':match_to_dict(stats.match)}
+
+# --key -> (function giving a flow's key, function describing it)
+keys = {
+  'cookie' : (cookie_key, cookie_label),
+  'match' : (match_key, match_label),
+}
+
+
+class FlowTable (object):
+  """
+  One flow stats reply as columns
+
+  Row i of packets, bytes and durations is for the flow keys[i].
+  packet_rate and byte_rate are filled in by flow_delta().
+  """
+  def __init__ (self, time, keys, packets, bytes, durations, index = None):
+    self.time = time
+    self.keys = keys
+    if index is None:
+      index = dict((k,i) for i,k in enumerate(keys))
+    self.index = index # key -> row
+    self.packets = packets
+    self.bytes = bytes
+    self.durations = durations
+    self.packet_rate = None
+    self.byte_rate = None
+
+  def __len__ (self):
+    return len(self.keys)
+
+  @classmethod
+  def from_stats (cls, stats, key = match_key, now = None, new = None):
+    """
+    Makes a FlowTable out of a list of ofp_flow_stats
+
+    If given, new(key, stats) is called for each key not seen before in
+    this reply.
+    """
+    if now is None: now = time.time()
+    keys = []
+    index = {}
+    packets = []
+    bytes = []
+    durations = []
+    for s in stats:
+      k = key(s)
+      i = index.get(k)
+      d = s.duration_sec + s.duration_nsec / 1e9
+      if i is None:
+        index[k] = len(keys)
+        keys.append(k)
+        packets.append(s.packet_count)
+        bytes.append(s.byte_count)
+        durations.append(d)
+        if new is not None: new(k, s)
+      else:
+        # Same key (e.g., cookie) as an earlier flow
+        packets[i] += s.packet_count
+        bytes[i] += s.byte_count
+        if d > durations[i]: durations[i] = d
+    if numpy is not None:
+      packets = numpy.array(packets, dtype=numpy.int64)
+      bytes = numpy.array(bytes, dtype=numpy.int64)
+      durations = numpy.array(durations, dtype=numpy.float64)
+    return cls(now, keys, packets, bytes, durations, index)
+
+
+class FlowStatsDelta (Event):
+  """
+  Flows whose counters changed since a switch's previous reply
+
+  keys, packets, bytes, packet_rate and byte_rate are parallel columns.
+  packets and bytes are the increases (or the whole counts for new
+  flows, and flows whose counters went backwards because they were
+  replaced); rates are per second.  removed has the keys of flows which
+  are gone.
+  """
+  def __init__ (self, dpid, time, keys, packets, bytes, packet_rate,
+                byte_rate, removed):
+    self.dpid = dpid
+    self.time = time
+    self.keys = keys
+    self.packets = packets
+    self.bytes = bytes
+    self.packet_rate = packet_rate
+    self.byte_rate = byte_rate
+    self.removed = removed
+
+  def __len__ (self):
+    return len(self.keys)
+
+
+def flow_delta (prev, cur, dpid = None):
+  """
+  Compares two FlowTables and returns a FlowStatsDelta
+
+  prev may be None for a switch's first reply, in which case rates are
+  over each flow's lifetime.  Also sets cur's rate columns.
+  """
+  if numpy is not None:
+    return _numpy_delta(prev, cur, dpid)
+
+  n = len(cur)
+  if prev is not None:
+    elapsed = cur.time - prev.time
+    index = prev.index
+  else:
+    index = {}
+  packet_rate = cur.packet_rate = [0.0] * n
+  byte_rate = cur.byte_rate = [0.0] * n
+  keys = []
+  packets = []
+  bytes = []
+  prates = []
+  brates = []
+  for i,k in enumerate(cur.keys):
+    p = cur.packets[i]
+    b = cur.bytes[i]
+    j = index.get(k)
+    if j is not None:
+      op = prev.packets[j]
+      ob = prev.bytes[j]
+      if p >= op and b >= ob and cur.durations[i] >= prev.durations[j]:
+        p -= op
+        b -= ob
+        if p == 0 and b == 0: continue
+    if prev is None:
+      elapsed = cur.durations[i]
+    if elapsed > 0:
+      packet_rate[i] = p / elapsed
+      byte_rate[i] = b / elapsed
+    keys.append(k)
+    packets.append(p)
+    bytes.append(b)
+    prates.append(packet_rate[i])
+    brates.append(byte_rate[i])
+
+  removed = _removed(prev, cur)
+  return FlowStatsDelta(dpid, cur.time, keys, packets, bytes, prates,
+                        brates, removed)
+
+def _numpy_delta (prev, cur, dpid):
+  n = len(cur)
+  packets = cur.packets.copy()
+  bytes = cur.bytes.copy()
+  continuing = numpy.zeros(n, dtype=bool)
+  if prev is not None and n:
+    index = prev.index
+    j = numpy.fromiter((index.get(k, -1) for k in cur.keys),
+                       dtype=numpy.int64, count=n)
+    rows = numpy.nonzero(j >= 0)[0]
+    j = j[rows]
+    op = prev.packets[j]
+    ob = prev.bytes[j]
+    ok = ((packets[rows] >= op) & (bytes[rows] >= ob)
+          & (cur.durations[rows] >= prev.durations[j]))
+    rows = rows[ok]
+    packets[rows] -= op[ok]
+    bytes[rows] -= ob[ok]
+    continuing[rows] = True
+
+  if prev is not None:
+    elapsed = numpy.empty(n, dtype=numpy.float64)
+    elapsed.fill(cur.time - prev.time)
+  else:
+    elapsed = cur.durations
+  live = elapsed > 0
+  cur.packet_rate = numpy.zeros(n, dtype=numpy.float64)
+  cur.byte_rate = numpy.zeros(n, dtype=numpy.float64)
+  cur.packet_rate[live] = packets[live] / elapsed[live]
+  cur.byte_rate[live] = bytes[live] / elapsed[live]
+
+  changed = numpy.nonzero(~continuing | (packets != 0) | (bytes != 0))[0]
+  keys = [cur.keys[i] for i in changed]
+  return FlowStatsDelta(dpid, cur.time, keys, packets[changed],
+                        bytes[changed], cur.packet_rate[changed],
+                        cur.byte_rate[changed], _removed(prev, cur))
+
+def _removed (prev, cur):
+  if prev is None: return []
+  index = cur.index
+  return [k for k in prev.keys if k not in index]
+
+
+class FlowStatsCollector (EventMixin):
+  """
+  Polls flow stats from all switches and tracks per-flow rates
+  """
+  _eventMixin_events = set([
+    FlowStatsDelta,
+  ])
+
+  _core_name = "flow_stats"
+
+  channel_name = "flow_stats"
+
+  def __init__ (self, interval = 5, key = 'match', retention = 60):
+    self.interval = interval
+    self.retention = retention
+    self._key,self._label = keys[key]
+    self.tables = {} # dpid -> latest FlowTable
+    self._history = {} # dpid -> deque of FlowStatsDelta
+    self._xids = {} # dpid -> xid of outstanding request
+    self._due = {} # dpid -> time of next poll
+    self._schedule = [] # heap of (time, dpid)
+    self._labels = {} # dpid -> {key:[id, label, sent on channel?]}
+    self._ids = count(1)
+    self._channel = None
+    core.listen_to_dependencies(self)
+    if core.hasComponent("MessengerNexus"):
+      self._start_messenger(core.MessengerNexus)
+    # Tick often enough to spread the polls out
+    self._timer = Timer(interval / 10.0, self._tick, recurring=True)
+
+  def _handle_core_ComponentRegistered (self, event):
+    if event.name == "MessengerNexus":
+      self._start_messenger(event.component)
+
+  def _start_messenger (self, nexus):
+    self._channel = nexus.get_channel(self.channel_name)
+    self._channel.addListenerByName("ChannelJoin",
+                                    self.__handle_ChannelJoin)
+
+  def _handle_openflow_ConnectionUp (self, event):
+    # Stagger switches across the interval by spreading their dpids
+    offset = (event.dpid * 0.6180339887) % 1.0
+    due = time.time() + offset * self.interval
+    self._due[event.dpid] = due
+    heapq.heappush(self._schedule, (due, event.dpid))
+
+  def _handle_openflow_ConnectionDown (self, event):
+    dpid = event.dpid
+    self._due.pop(dpid, None)
+    self._xids.pop(dpid, None)
+    self._history.pop(dpid, None)
+    table = self.tables.pop(dpid, None)
+    labels = self._labels.pop(dpid, None)
+    if table is not None and len(table):
+      self._publish(FlowStatsDelta(dpid, time.time(), [], [], [], [], [],
+                                   list(table.keys)), labels or {})
+
+  def _tick (self):
+    now = time.time()
+    schedule = self._schedule
+    while schedule and schedule[0][0] <= now:
+      due,dpid = heapq.heappop(schedule)
+      if self._due.get(dpid) != due: continue # Stale
+      due += self.interval
+      if due < now: due = now + self.interval # We fell behind
+      self._due[dpid] = due
+      heapq.heappush(schedule, (due, dpid))
+      self._poll(dpid)
+
+  def _poll (self, dpid):
+    con = core.openflow.getConnection(dpid)
+    if con is None: return
+    sr = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+    self._xids[dpid] = sr.xid = of.generate_xid()
+    con.send(sr)
+
+  def _handle_openflow_FlowStatsReceived (self, event):
+    dpid = event.dpid
+    if self._xids.get(dpid) != event.ofp[0].xid: return # Not ours
+    del self._xids[dpid]
+
+    labels = self._labels.setdefault(dpid, {})
+    label = self._label
+    ids = self._ids
+    def new (k, s):
+      if k not in labels:
+        labels[k] = [next(ids), label(s), False]
+
+    table = FlowTable.from_stats(event.stats, self._key, new=new)
+    delta = flow_delta(self.tables.get(dpid), table, dpid)
+    self.tables[dpid] = table
+
+    history = self._history.get(dpid)
+    if history is None:
+      history = self._history[dpid] = deque()
+    history.append(delta)
+    oldest = delta.time - self.retention
+    while history[0].time < oldest:
+      history.popleft()
+
+    if len(delta) or delta.removed:
+      self._publish(delta, labels)
+    for k in delta.removed:
+      del labels[k]
+
+  def _publish (self, delta, labels):
+    self.raiseEventNoErrors(delta)
+    if self._channel is None or not self._channel._members: return
+    rows = []
+    new = []
+    for i,k in enumerate(delta.keys):
+      entry = labels[k]
+      if not entry[2]:
+        # Describe it the first time it's sent
+        entry[2] = True
+        new.append(entry[:2])
+      rows.append([entry[0], int(delta.packets[i]), int(delta.bytes[i]),
+                   float(delta.packet_rate[i]), float(delta.byte_rate[i])])
+    msg = {'dpid':dpid_to_str(delta.dpid), 'time':delta.time,
+           'flows':rows, 'removed':[labels[k][0] for k in delta.removed]}
+    if new: msg['new'] = new
+    self._channel.send(msg)
+
+  def __handle_ChannelJoin (self, event):
+    # Name is intentionally mangled to keep listen_to_dependencies away
+    for dpid,table in self.tables.iteritems():
+      labels = self._labels[dpid]
+      rows = []
+      for i,k in enumerate(table.keys):
+        rows.append([labels[k][0], int(table.packets[i]),
+                     int(table.bytes[i]), float(table.packet_rate[i]),
+                     float(table.byte_rate[i])])
+      event.con.send({'CHANNEL':self.channel_name, 'full':True,
+                      'dpid':dpid_to_str(dpid), 'time':table.time,
+                      'flows':rows,
+                      'new':[labels[k][:2] for k in table.keys]})
+
+  def history (self, dpid):
+    """
+    Returns the FlowStatsDeltas for a switch from the retention window
+    """
+    return list(self._history.get(dpid, ()))
+
+  def rate (self, dpid, key):
+    """
+    Returns a flow's latest (packets/sec, bytes/sec), or None
+    """
+    table = self.tables.get(dpid)
+    if table is None: return None
+    i = table.index.get(key)
+    if i is None: return None
+    return (float(table.packet_rate[i]), float(table.byte_rate[i]))
+
+
+def launch (interval = 5, key = 'match', retention = 60):
+  if key not in keys:
+    raise RuntimeError("--key must be one of: " + ", ".join(sorted(keys)))
+  core.registerNew(FlowStatsCollector, interval=float(interval), key=key,
+                   retention=float(retention))
@@ -17,6 +17,7 @@ Implementation of an OpenFlow flow table
 """
 
 from libopenflow_01 import *
+from pox.openflow.match_key import match_key, key_matcher
 from pox.lib.revent import *
 
 import time
@@ -52,6 +53,7 @@ class TableEntry (object):
     self.match = match
     self.actions = actions
     self.buffer_id = buffer_id
+    self._key_matcher = None # (match, compiled matcher) for matches_key()
 
   @staticmethod
   def from_flow_mod (flow_mod):
@@ -99,6 +101,15 @@ class TableEntry (object):
     else:
       return port_matches and match.matches_with_wildcards(self.match)
 
+  def matches_key (self, key):
+    """
+    Tests whether a match key (see pox.openflow.match_key) matches this entry
+    """
+    m = self._key_matcher
+    if m is None or m[0] is not self.match:
+      m = self._key_matcher = (self.match, key_matcher(self.match))
+    return m[1](key)
+
   def touch_packet (self, byte_count, now=None):
     """
     Updates information of this entry based on encountering a packet.
@@ -309,13 +320,21 @@ class FlowTable (EventMixin):
     self._remove_specific_entries(remove_flows, reason=reason)
     return remove_flows
 
-  def entry_for_packet (self, packet, in_port):
+  def entry_for_packet (self, packet, in_port, packet_data=None):
     """
     Finds the flow table entry that matches the given packet.
 
     Returns the highest priority flow table entry that matches the given packet
     on the given in_port, or None if no matching entry is found.
+
+    If the raw packet_data is given, the match fields are pulled straight out
+    of it rather than building an ofp_match from the parsed packet.
     """
+    if packet_data is not None:
+      key = match_key(packet_data, in_port)
+      if key is not None:
+        return self.entry_for_key(key)
+
     packet_match = ofp_match.from_packet(packet, in_port, spec_frags = True)
 
     for entry in self._table:
@@ -325,6 +344,18 @@ class FlowTable (EventMixin):
 
     return None
 
+  def entry_for_key (self, key):
+    """
+    Finds the flow table entry that matches the given match key.
+
+    Like entry_for_packet(), but for a key from pox.openflow.match_key.
+    """
+    for entry in self._table:
+      if entry.matches_key(key):
+        return entry
+
+    return None
+
   def check_for_overlapping_entry (self, in_entry):
     """
     Tests if the input entry overlaps with another entry in this table.
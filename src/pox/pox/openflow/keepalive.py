@@ -18,6 +18,16 @@
 """
 This module sends periodic echo requests to switches.
 
+Switches are spread out across the interval rather than all being probed
+at once, and a switch which we've heard from recently isn't probed at all.
+A switch which doesn't answer (or say anything else) within the timeout
+is disconnected.
+
+The round trip times of the echoes are kept per switch as a histogram
+(core.openflow_keepalive.rtt[dpid]), and each one is raised as an EchoRTT
+event, since the controller channel's latency adds to everything the
+controller does for a switch.
+
 At the moment, it only works on the primary OF nexus.
 
 It supports the following commandline options:
@@ -27,40 +37,168 @@ It supports the following commandline options:
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.lib.revent import EventMixin, Event
 from pox.lib.recoco import Timer
+import heapq
+import math
 import time
 
 log = core.getLogger()
 
-def _handle_timer (ofnexus):
-  er = of.ofp_echo_request().pack()
-  count = len(ofnexus.connections)
-  t = time.time()
-  dead = []
 
-  for dpid,con in ofnexus.connections.iteritems():
-    if t - con.idle_time > (_interval+_switch_timeout):
-      dead.append(con)
-      continue
-    con.send(er)
+class RTTHistogram (object):
+  """
+  Echo round trip times of a switch
+
+  Bucket i counts RTTs under MIN_BUCKET * 2**i seconds, and the last
+  bucket counts everything longer.
+  """
+  MIN_BUCKET = 0.000125
+  BUCKETS = 17 # The last full one is 4 to 8 seconds
+
+  def __init__ (self):
+    self.counts = [0] * (self.BUCKETS + 1)
+    self.count = 0
+    self.total = 0.0
+    self.min = None
+    self.max = None
+    self.last = None
+
+  def add (self, rtt):
+    e = math.frexp(rtt / self.MIN_BUCKET)[1]
+    self.counts[min(max(e, 0), self.BUCKETS)] += 1
+    self.count += 1
+    self.total += rtt
+    if self.min is None or rtt < self.min: self.min = rtt
+    if self.max is None or rtt > self.max: self.max = rtt
+    self.last = rtt
+
+  @property
+  def mean (self):
+    if not self.count: return None
+    return self.total / self.count
+
+  def percentile (self, p):
+    """
+    Returns an upper bound for the p-th percentile (0-100)
+    """
+    if not self.count: return None
+    need = self.count * p / 100.0
+    seen = 0
+    for i,n in enumerate(self.counts):
+      seen += n
+      if seen >= need and n:
+        if i == self.BUCKETS: break
+        return min(self.MIN_BUCKET * 2**i, self.max)
+    return self.max
+
+  def __str__ (self):
+    if not self.count: return "no samples"
+    return "%i samples, min/mean/max %.1f/%.1f/%.1fms, p99<=%.1fms" % (
+        self.count, self.min * 1000, self.mean * 1000, self.max * 1000,
+        self.percentile(99) * 1000)
+
+
+class EchoRTT (Event):
+  """
+  Fired when a switch answers one of our echo requests
+
+  rtt is in seconds.
+  """
+  def __init__ (self, connection, rtt):
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.rtt = rtt
+
+
+class Keepalive (EventMixin):
+  """
+  Probes switches with echo requests and disconnects ones that go silent
+  """
+  _eventMixin_events = set([
+    EchoRTT,
+  ])
+
+  _core_name = "openflow_keepalive"
+
+  def __init__ (self, interval = 20, timeout = 3):
+    self.interval = interval
+    self.timeout = timeout
+    self.rtt = {} # dpid -> RTTHistogram
+    self._sent = {} # dpid -> time of outstanding echo request
+    self._due = {} # dpid -> time of next check
+    self._schedule = [] # heap of (time, dpid)
+
+    # All our requests are the same, so we pack one and send it to everyone
+    self._xid = of.generate_xid()
+    self._echo = of.ofp_echo_request(xid=self._xid).pack()
+
+    core.listen_to_dependencies(self)
+    # Tick often enough to spread the probes out
+    self._timer = Timer(min(interval, timeout) / 10.0, self._tick,
+                        recurring=True)
+
+  def _all_dependencies_met (self):
+    for con in core.openflow.connections:
+      self._start(con.dpid)
+
+  def _start (self, dpid):
+    # Stagger switches across the interval by spreading their dpids
+    offset = (dpid * 0.6180339887) % 1.0
+    self._check_at(dpid, time.time() + offset * self.interval)
+
+  def _check_at (self, dpid, due):
+    self._due[dpid] = due
+    heapq.heappush(self._schedule, (due, dpid))
+
+  def _handle_openflow_ConnectionUp (self, event):
+    self._start(event.dpid)
+
+  def _handle_openflow_ConnectionDown (self, event):
+    self._due.pop(event.dpid, None)
+    self._sent.pop(event.dpid, None)
+    self.rtt.pop(event.dpid, None)
+
+  def _handle_openflow_EchoReply (self, event):
+    if event.xid != self._xid: return # Not ours
+    sent = self._sent.pop(event.dpid, None)
+    if sent is None: return
+    rtt = time.time() - sent
+    h = self.rtt.get(event.dpid)
+    if h is None:
+      h = self.rtt[event.dpid] = RTTHistogram()
+    h.add(rtt)
+    self.raiseEventNoErrors(EchoRTT, event.connection, rtt)
 
-  for con in dead:
-    con.disconnect("timed out")
+  def _tick (self):
+    now = time.time()
+    schedule = self._schedule
+    while schedule and schedule[0][0] <= now:
+      due,dpid = heapq.heappop(schedule)
+      if self._due.get(dpid) != due: continue # Stale
+      del self._due[dpid]
+      con = core.openflow.getConnection(dpid)
+      if con is None: continue
+      self._check(con, now)
 
+  def _check (self, con, now):
+    dpid = con.dpid
+    sent = self._sent.get(dpid)
+    if sent is not None and con.idle_time < sent:
+      # We've heard nothing since our last request
+      if now - sent >= self.timeout:
+        self._sent.pop(dpid, None)
+        con.disconnect("timed out")
+        return
+      self._check_at(dpid, sent + self.timeout)
+    elif now - con.idle_time < self.interval:
+      # It's been talking anyway; no need to probe until it stops
+      self._check_at(dpid, con.idle_time + self.interval)
+    else:
+      self._sent[dpid] = now
+      con.send(self._echo)
+      self._check_at(dpid, now + self.timeout)
 
-_running = False
-_switch_timeout = None # This amount beyond interval
-_interval = None
 
 def launch (interval = 20, timeout = 3):
-  global _interval, _switch_timeout
-  _interval = float(interval)
-  _switch_timeout = float(timeout)
-  def start ():
-    global _running
-    if _running:
-      log.error("Keepalive already running")
-      return
-    _running = True
-    Timer(_interval, _handle_timer, recurring=True, args=(core.openflow,))
-  core.call_when_ready(start, "openflow", __name__)
+  core.registerNew(Keepalive, float(interval), float(timeout))
@@ -0,0 +1,186 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tracks how busy switch ports are
+
+Periodically polls port stats from all switches and keeps a smoothed
+transmit rate for each port.  When a port's utilization (rate over
+capacity) crosses the congestion threshold, a Congestion event is raised
+on core.link_utilization (and another when it drops back down).
+
+Port capacity comes from the port's advertised speed.  Emulated links
+(e.g., Mininet's tc links) usually don't advertise anything useful, so
+you can override it:
+
+ --capacity=X   Capacity of every port in Mbps
+ --interval=X   Seconds between polls (default 2)
+ --threshold=X  Utilization at which a port is congested (default 0.8)
+"""
+
+from pox.core import core
+from pox.lib.revent import *
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str
+import pox.openflow.libopenflow_01 as of
+import time
+
+log = core.getLogger()
+
+# Port feature bit -> bits per second
+_speeds = [
+  (of.OFPPF_10GB_FD, 10000000000),
+  (of.OFPPF_1GB_FD | of.OFPPF_1GB_HD, 1000000000),
+  (of.OFPPF_100MB_FD | of.OFPPF_100MB_HD, 100000000),
+  (of.OFPPF_10MB_FD | of.OFPPF_10MB_HD, 10000000),
+]
+
+
+def port_capacity (port):
+  """
+  Returns the speed of an ofp_phy_port in bits per second (or None)
+  """
+  for bits,speed in _speeds:
+    if port.curr & bits: return speed
+  return None
+
+
+class Congestion (Event):
+  """
+  Fired when a port becomes congested or stops being congested
+  """
+  def __init__ (self, dpid, port, utilization, congested):
+    self.dpid = dpid
+    self.port = port
+    self.utilization = utilization
+    self.congested = congested
+
+
+class PortLoad (object):
+  """
+  Load information for a single switch port
+  """
+  def __init__ (self, capacity):
+    self.capacity = capacity # bits/sec (or None if unknown)
+    self.rate = None         # Smoothed transmit rate in bits/sec
+    self.congested = False
+    self._tx_bytes = None
+    self._time = None
+
+  @property
+  def utilization (self):
+    if self.rate is None or not self.capacity: return None
+    return self.rate / float(self.capacity)
+
+  def update (self, tx_bytes, now, alpha):
+    if self._time is not None and now > self._time:
+      delta = tx_bytes - self._tx_bytes
+      if delta >= 0:
+        rate = delta * 8 / (now - self._time)
+        if self.rate is None:
+          self.rate = rate
+        else:
+          self.rate += alpha * (rate - self.rate)
+    self._tx_bytes = tx_bytes
+    self._time = now
+
+
+class LinkUtilization (EventMixin):
+  """
+  Polls port stats and tracks port utilization
+  """
+  _eventMixin_events = set([
+    Congestion,
+  ])
+
+  _core_name = "link_utilization"
+
+  alpha = 0.5 # Weight of a new sample in the smoothed rate
+
+  def __init__ (self, interval = 2, capacity = None, threshold = 0.8):
+    """
+    capacity overrides the capacity of all ports (in bits/sec)
+    """
+    self.interval = interval
+    self.capacity = capacity
+    self.threshold = threshold
+    self.ports = {} # (dpid,port_no) -> PortLoad
+    self._request = of.ofp_stats_request(body=of.ofp_port_stats_request())
+    core.listen_to_dependencies(self)
+    self._timer = Timer(interval, self._poll, recurring=True)
+
+  def _add_port (self, dpid, port):
+    if port.port_no > of.OFPP_MAX: return
+    capacity = self.capacity or port_capacity(port)
+    load = self.ports.get((dpid,port.port_no))
+    if load is None:
+      self.ports[dpid,port.port_no] = PortLoad(capacity)
+    else:
+      load.capacity = capacity
+
+  def _handle_openflow_ConnectionUp (self, event):
+    for port in event.ofp.ports:
+      self._add_port(event.dpid, port)
+
+  def _handle_openflow_ConnectionDown (self, event):
+    for k in [k for k in self.ports if k[0] == event.dpid]:
+      del self.ports[k]
+
+  def _handle_openflow_PortStatus (self, event):
+    if event.deleted:
+      self.ports.pop((event.dpid,event.port), None)
+    else:
+      self._add_port(event.dpid, event.ofp.desc)
+
+  def _poll (self):
+    for con in core.openflow.connections:
+      con.send(self._request)
+
+  def _handle_openflow_PortStatsReceived (self, event):
+    now = time.time()
+    dpid = event.dpid
+    for stats in event.stats:
+      load = self.ports.get((dpid,stats.port_no))
+      if load is None: continue
+      load.update(stats.tx_bytes, now, self.alpha)
+      u = load.utilization
+      if u is None: continue
+      if load.congested:
+        # Some hysteresis so we don't flap
+        congested = u >= self.threshold * 0.9
+      else:
+        congested = u >= self.threshold
+      if congested != load.congested:
+        load.congested = congested
+        log.info("%s.%s %s congested (%i%% utilized)", dpid_to_str(dpid),
+                 stats.port_no, "is" if congested else "no longer",
+                 u * 100)
+        self.raiseEventNoErrors(Congestion, dpid, stats.port_no, u,
+                                congested)
+
+  def utilization (self, dpid, port):
+    """
+    Returns the utilization of a port (0 to 1, or None if unknown)
+    """
+    load = self.ports.get((dpid,port))
+    if load is None: return None
+    return load.utilization
+
+  def is_congested (self, dpid, port):
+    load = self.ports.get((dpid,port))
+    return load is not None and load.congested
+
+
+def launch (interval = 2, capacity = None, threshold = 0.8):
+  if capacity is not None: capacity = float(capacity) * 1000000
+  core.registerNew(LinkUtilization, interval=float(interval),
+                   capacity=capacity, threshold=float(threshold))
@@ -0,0 +1,181 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact OpenFlow 1.0 match keys
+
+A match key is a plain tuple holding the twelve OpenFlow 1.0 match fields
+of a frame (in the order given by KEY_FIELDS).  It's pulled straight out of
+the raw frame without parsing it into packet objects or building an
+ofp_match, and since it's hashable, it works as a dict key for flow
+caches, per-flow counters, sessions, and so on.
+
+Fields which wouldn't be set by ofp_match.from_packet() are None.  MAC
+addresses are raw six-byte strings and IP addresses are unsigned ints.
+Use key_to_match() to get an actual ofp_match (e.g., when building a
+flow_mod), and key_matcher() to test keys against an ofp_match.
+"""
+
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.openflow.libopenflow_01 import ofp_match, OFP_VLAN_NONE
+import struct
+
+KEY_FIELDS = ('in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp',
+              'dl_type', 'nw_tos', 'nw_proto', 'nw_src', 'nw_dst',
+              'tp_src', 'tp_dst')
+
+_eth_hdr = struct.Struct("!6s6sH")
+_vlan_hdr = struct.Struct("!HH")
+_ipv4_hdr = struct.Struct("!BBHHHBBHII")
+_ports_hdr = struct.Struct("!HH")
+_icmp_hdr = struct.Struct("!BB")
+_arp_hdr = struct.Struct("!HHBBH6sI6sI")
+
+
+def match_key (data, in_port = None, spec_frags = True):
+  """
+  Extracts a match key from a raw frame
+
+  The key holds the same fields as ofp_match.from_packet() would (with the
+  given in_port and spec_frags).  Returns None for frames which need the
+  full parser (LLC, stacked VLANs, malformed or truncated headers, and
+  IP fragments when not spec_frags).
+  """
+  dlen = len(data)
+  if dlen < 14: return None
+  dl_dst,dl_src,dl_type = _eth_hdr.unpack_from(data, 0)
+  offset = 14
+  if dl_type == 0x8100:
+    if dlen < 18: return None
+    pcpid,dl_type = _vlan_hdr.unpack_from(data, 14)
+    dl_vlan = pcpid & 0x0fff
+    dl_vlan_pcp = pcpid >> 13
+    offset = 18
+    if dl_type == 0x8100: return None
+  else:
+    dl_vlan = OFP_VLAN_NONE
+    dl_vlan_pcp = 0
+  if dl_type < 1536: return None
+
+  nw_tos = nw_proto = nw_src = nw_dst = tp_src = tp_dst = None
+
+  if dl_type == 0x0800:
+    if dlen - offset < 20: return None
+    (vhl, nw_tos, iplen, _, frag, _, nw_proto, _, nw_src,
+        nw_dst) = _ipv4_hdr.unpack_from(data, offset)
+    hl = (vhl & 0x0f) * 4
+    if vhl >> 4 != 4 or hl < 20 or iplen < hl or offset + hl > dlen:
+      return None
+    if frag & 0x3fff:
+      # Fragment (MF flag or nonzero offset)
+      if not spec_frags: return None
+      tp_src = tp_dst = 0
+    else:
+      end = min(offset + iplen, dlen)
+      offset += hl
+      if nw_proto == 6:
+        if end - offset < 20: return None
+        off = (ord(data[offset+12]) >> 4) * 4
+        if off < 20 or offset + off > end: return None
+        tp_src,tp_dst = _ports_hdr.unpack_from(data, offset)
+      elif nw_proto == 17:
+        if end - offset < 8: return None
+        tp_src,tp_dst = _ports_hdr.unpack_from(data, offset)
+      elif nw_proto == 1:
+        if end - offset < 4: return None
+        tp_src,tp_dst = _icmp_hdr.unpack_from(data, offset)
+  elif dl_type == 0x0806 or dl_type == 0x8035:
+    if dlen - offset < 28: return None
+    (hwtype, prototype, hwlen, protolen, opcode, _, nw_src, _,
+        nw_dst) = _arp_hdr.unpack_from(data, offset)
+    if hwtype != 1 or hwlen != 6 or prototype != 0x0800 or protolen != 4:
+      return None
+    if opcode <= 255:
+      nw_proto = opcode
+    else:
+      nw_src = nw_dst = None
+
+  return (in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp, dl_type,
+          nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst)
+
+
+def key_to_match (key):
+  """
+  Returns an exact ofp_match for a match key
+  """
+  (in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp, dl_type,
+      nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst) = key
+  match = ofp_match()
+  if in_port is not None: match.in_port = in_port
+  match.dl_src = EthAddr.from_raw(dl_src)
+  match.dl_dst = EthAddr.from_raw(dl_dst)
+  match.dl_vlan = dl_vlan
+  match.dl_vlan_pcp = dl_vlan_pcp
+  match.dl_type = dl_type
+  if nw_tos is not None: match.nw_tos = nw_tos
+  if nw_proto is not None: match.nw_proto = nw_proto
+  if nw_src is not None: match.nw_src = IPAddr.from_num(nw_src)
+  if nw_dst is not None: match.nw_dst = IPAddr.from_num(nw_dst)
+  if tp_src is not None:
+    match.tp_src = tp_src
+    match.tp_dst = tp_dst
+  return match
+
+
+def packet_in_match (event, in_port = True):
+  """
+  Returns an exact ofp_match for a PacketIn event
+
+  This is equivalent to ofp_match.from_packet(event.parsed, event.port)
+  (or without the in_port if in_port is False), but avoids parsing.
+  """
+  port = event.port if in_port else None
+  key = match_key(event.data, port, spec_frags = False)
+  if key is None:
+    return ofp_match.from_packet(event.parsed, port)
+  return key_to_match(key)
+
+
+def key_matcher (match):
+  """
+  Returns a function which tests whether a key is matched by match
+
+  This follows match.matches_with_wildcards(key_to_match(key),
+  consider_other_wildcards=False), but only looks at the fields which
+  match doesn't wildcard.
+  """
+  exact = []
+  for i,name in enumerate(KEY_FIELDS):
+    if name == 'nw_src' or name == 'nw_dst': continue
+    v = getattr(match, name)
+    if v is None: continue
+    if isinstance(v, EthAddr): v = v.toRaw()
+    exact.append((i, v))
+
+  nets = []
+  for i,(addr,bits) in ((8, match.get_nw_src()), (9, match.get_nw_dst())):
+    if addr is None: continue
+    mask = (0xffffffff << (32 - bits)) & 0xffffffff
+    nets.append((i, IPAddr(addr).toUnsigned() & mask, mask))
+
+  exact = tuple(exact)
+  nets = tuple(nets)
+
+  def matches (key):
+    for i,v in exact:
+      if key[i] != v: return False
+    for i,net,mask in nets:
+      a = key[i]
+      if a is None or (a & mask) != net: return False
+    return True
+
+  return matches
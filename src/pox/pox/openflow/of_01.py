@@ -27,7 +27,7 @@ from pox.lib.addresses import EthAddr
 from pox.lib.revent.revent import EventMixin
 import datetime
 import time
-from pox.lib.socketcapture import CaptureSocket
+from pox.lib.socketcapture import CaptureSocket, BackgroundPCapWriter
 import pox.openflow.debug
 from pox.openflow.util import make_type_to_unpacker_table
 from pox.openflow import *
@@ -225,8 +225,9 @@ class DefaultOpenFlowHandlers (OpenFlowHandlers):
 
   @staticmethod
   def handle_ECHO_REPLY (con, msg):
-    #con.msg("Got echo reply")
-    pass
+    e = con.ofnexus.raiseEventNoErrors(EchoReply, con, msg)
+    if e is None or e.halt != True:
+      con.raiseEventNoErrors(EchoReply, con, msg)
 
   @staticmethod
   def handle_ECHO_REQUEST (con, msg): #S
@@ -536,55 +537,55 @@ _itemcloser = FileCloser()
 """
 
 
+class OFPCapWriter (BackgroundPCapWriter):
+  """
+  Writes a pcap trace with each OpenFlow message in its own packet
+  """
+  def __init__ (self, *args, **kw):
+    super(OFPCapWriter,self).__init__(*args, **kw)
+    self._bufs = {True:b'', False:b''} # outgoing -> partial message
+    self._enabled = True
+    # Directions which have lost data, and so can't be split anymore
+    self._unsplit = set()
+
+  def _lost (self, outgoing, size):
+    log.error("Capture lost %i bytes %s; writing the rest of that direction "
+              "without splitting it into messages", size,
+              "sent" if outgoing else "received")
+    self._unsplit.add(outgoing)
+    self._bufs[outgoing] = b'' # Whatever comes next doesn't follow on
+
+  def _split (self, outgoing, buf):
+    if not self._enabled: return ()
+    if outgoing in self._unsplit: return (buf,)
+    buf = self._bufs[outgoing] + buf
+    parts = []
+    off = 0
+    l = len(buf)
+    while l - off > 4:
+      packet_length = ord(buf[off+2]) << 8 | ord(buf[off+3])
+      if ord(buf[off]) != of.OFP_VERSION or packet_length < 8:
+        log.error("Bad OpenFlow header while trying to capture trace")
+        self._enabled = False
+        break
+      if packet_length > l - off: break
+      parts.append(buf[off:off+packet_length])
+      off += packet_length
+    self._bufs[outgoing] = buf[off:]
+    return parts
+
+
 class OFCaptureSocket (CaptureSocket):
   """
   Captures OpenFlow data to a pcap file
+
+  The trace is written in the background (see OFPCapWriter).
   """
   def __init__ (self, *args, **kw):
+    kw.setdefault('writer_class', OFPCapWriter)
     super(OFCaptureSocket,self).__init__(*args, **kw)
-    self._rbuf = bytes()
-    self._sbuf = bytes()
-    self._enabled = True
     #_itemcloser.items.add(self)
 
-  def _recv_out (self, buf):
-    if not self._enabled: return
-    self._rbuf += buf
-    l = len(self._rbuf)
-    while l > 4:
-      if ord(self._rbuf[0]) != of.OFP_VERSION:
-        log.error("Bad OpenFlow version while trying to capture trace")
-        self._enabled = False
-        break
-      packet_length = ord(self._rbuf[2]) << 8 | ord(self._rbuf[3])
-      if packet_length > l: break
-      try:
-        self._writer.write(False, self._rbuf[:packet_length])
-      except Exception:
-        log.exception("Exception while writing controller trace")
-        self._enabled = False
-      self._rbuf = self._rbuf[packet_length:]
-      l = len(self._rbuf)
-
-  def _send_out (self, buf, r):
-    if not self._enabled: return
-    self._sbuf += buf
-    l = len(self._sbuf)
-    while l > 4:
-      if ord(self._sbuf[0]) != of.OFP_VERSION:
-        log.error("Bad OpenFlow version while trying to capture trace")
-        self._enabled = False
-        break
-      packet_length = ord(self._sbuf[2]) << 8 | ord(self._sbuf[3])
-      if packet_length > l: break
-      try:
-        self._writer.write(True, self._sbuf[:packet_length])
-      except Exception:
-        log.exception("Exception while writing controller trace")
-        self._enabled = False
-      self._sbuf = self._sbuf[packet_length:]
-      l = len(self._sbuf)
-
 
 class PortCollection (object):
   """
@@ -716,6 +717,7 @@ class Connection (EventMixin):
     PacketIn,
     ErrorIn,
     BarrierIn,
+    EchoReply,
     RawStatsReply,
     SwitchDescReceived,
     FlowStatsReceived,
@@ -989,10 +991,11 @@ def wrap_socket (new_sock):
   fname = datetime.datetime.now().strftime("%Y-%m-%d-%I%M%p")
   fname += "_" + new_sock.getpeername()[0].replace(".", "_")
   fname += "_" + `new_sock.getpeername()[1]` + ".pcap"
-  pcapfile = file(fname, "w")
   try:
-    new_sock = OFCaptureSocket(new_sock, pcapfile,
-                               local_addrs=(None,None,6633))
+    new_sock = OFCaptureSocket(new_sock, fname,
+                               local_addrs=(None,None,6633),
+                               rotate_size=pox.openflow.debug.pcap_rotate_size,
+                               rotate_time=pox.openflow.debug.pcap_rotate_time)
   except Exception:
     import traceback
     traceback.print_exc()
@@ -28,6 +28,11 @@ Glenn Gibb's spanning tree module for NOX:
 Note that this does not have much of a relationship to Spanning Tree
 Protocol.  They have similar purposes, but this is a rather different way
 of going about it.
+
+The tree is updated incrementally as links come and go, and port changes
+are pushed after link events have been quiet for --debounce seconds
+(default 0.5), so bursts of link events are handled together.  A link
+which keeps flapping only puts the push off for up to 5 seconds.
 """
 
 from pox.core import core
@@ -41,8 +46,171 @@ import time
 
 log = core.getLogger()
 
-# Might be nice if we made this accessible on core...
-#_adj = defaultdict(lambda:defaultdict(lambda:[]))
+
+class SpanningTree (object):
+  """
+  A spanning tree (well, forest) over the switches which is updated one
+  link at a time
+
+  Links are discovery Links (which are unidirectional); two switches are
+  considered connected when there's a link in each direction between the
+  same pair of ports.  When a link is added, it only joins the tree if it
+  connects two separate parts of it.  When a tree link goes away, we look
+  for a replacement starting from the smaller of the two halves.
+
+  Ports whose flood state may have changed are collected in .changed.
+  """
+  def __init__ (self):
+    self._links = set() # Discovery Links
+    self._pair_links = defaultdict(set) # (dpid1,dpid2) -> set(Link)
+    self._ends = defaultdict(int) # (dpid,port) -> number of links
+    self.adj = defaultdict(dict) # dpid1 -> dpid2 -> port on dpid1
+    self.tree = defaultdict(dict) # Same as adj, but only for the tree
+    self._comp = {} # dpid -> component ID
+    self._members = {} # component ID -> set(dpid)
+    self._next_comp = 0
+    self.changed = set() # (dpid,port)s which may need flood changes
+
+  def is_edge_port (self, dpid, port):
+    return (dpid,port) not in self._ends
+
+  def should_flood (self, dpid, port):
+    """
+    True if the port is on the tree or doesn't lead to another switch
+    """
+    if (dpid,port) not in self._ends: return True
+    return port in self.tree[dpid].itervalues()
+
+  def get_tree (self):
+    """
+    Returns the tree in the format of _calc_spanning_tree()
+    """
+    tree = defaultdict(set)
+    for s1,neighbors in self.tree.iteritems():
+      for s2,port in neighbors.iteritems():
+        tree[s1].add((s2,port))
+    return tree
+
+  def add_link (self, link):
+    if link in self._links: return
+    self._links.add(link)
+    self._pair_links[link.dpid1,link.dpid2].add(link)
+    for end in link.end:
+      self._ends[end] += 1
+      self.changed.add(end)
+    s1,s2 = link.dpid1,link.dpid2
+    if s2 in self.adj[s1]: return # Already connected
+    if _flip(link) not in self._links: return # Not symmetric (yet)
+    self._connect(s1, link.port1, s2, link.port2)
+
+  def remove_link (self, link):
+    if link not in self._links: return
+    self._links.discard(link)
+    self._pair_links[link.dpid1,link.dpid2].discard(link)
+    for end in link.end:
+      n = self._ends[end] - 1
+      if n > 0:
+        self._ends[end] = n
+      else:
+        del self._ends[end]
+      self.changed.add(end)
+
+    s1,s2 = link.dpid1,link.dpid2
+    if self.adj[s1].get(s2) != link.port1: return # Wasn't being used
+    if self.adj[s2].get(s1) != link.port2: return
+
+    # Maybe there's another link between the same switches
+    for l in self._pair_links[s1,s2]:
+      if _flip(l) in self._links:
+        self.adj[s1][s2] = l.port1
+        self.adj[s2][s1] = l.port2
+        if s2 in self.tree[s1]:
+          self.tree[s1][s2] = l.port1
+          self.tree[s2][s1] = l.port2
+          self.changed.add((s1,l.port1))
+          self.changed.add((s2,l.port2))
+        return
+
+    del self.adj[s1][s2]
+    del self.adj[s2][s1]
+    if s2 in self.tree[s1]:
+      del self.tree[s1][s2]
+      del self.tree[s2][s1]
+      self._split(s1, s2)
+
+  def _component (self, dpid):
+    c = self._comp.get(dpid)
+    if c is None:
+      c = self._next_comp
+      self._next_comp += 1
+      self._comp[dpid] = c
+      self._members[c] = set([dpid])
+    return c
+
+  def _connect (self, s1, p1, s2, p2):
+    self.adj[s1][s2] = p1
+    self.adj[s2][s1] = p2
+    c1 = self._component(s1)
+    c2 = self._component(s2)
+    if c1 == c2: return # Would make a loop
+    self._add_tree_link(s1, s2)
+    # Merge smaller component into larger one
+    if len(self._members[c1]) < len(self._members[c2]):
+      c1,c2 = c2,c1
+    m = self._members.pop(c2)
+    for dpid in m:
+      self._comp[dpid] = c1
+    self._members[c1].update(m)
+
+  def _add_tree_link (self, s1, s2):
+    p1 = self.adj[s1][s2]
+    p2 = self.adj[s2][s1]
+    self.tree[s1][s2] = p1
+    self.tree[s2][s1] = p2
+    self.changed.add((s1,p1))
+    self.changed.add((s2,p2))
+
+  def _split (self, s1, s2):
+    """
+    Fixes up the tree after the tree link between s1 and s2 went away
+    """
+    # Explore both halves a node at a time; the first one to finish is
+    # the smaller half.
+    halves = [(set([s1]), [s1]), (set([s2]), [s2])]
+    while True:
+      for seen,todo in halves:
+        if not todo: break
+        n = todo.pop()
+        for m in self.tree[n]:
+          if m not in seen:
+            seen.add(m)
+            todo.append(m)
+      else:
+        continue
+      break
+    small = seen
+
+    # Look for another link out of the smaller half
+    comp = self._comp[s1]
+    for n in small:
+      for m in self.adj[n]:
+        if m not in small:
+          assert self._comp[m] == comp
+          self._add_tree_link(n, m)
+          return
+
+    # No way across -- it's a separate component now
+    c = self._next_comp
+    self._next_comp += 1
+    self._members[comp].difference_update(small)
+    self._members[c] = small
+    for n in small:
+      self._comp[n] = c
+
+
+def _flip (link):
+  return Discovery.Link(link[2],link[3], link[0],link[1])
+
 
 def _calc_spanning_tree ():
   """
@@ -52,69 +220,24 @@ def _calc_spanning_tree ():
   values are tuples of (DPID2, port-num), where port-num
   is the port on DPID1 connecting to DPID2.
   """
-  def flip (link):
-    return Discovery.Link(link[2],link[3], link[0],link[1])
-
-  adj = defaultdict(lambda:defaultdict(lambda:[]))
-  switches = set()
-  # Add all links and switches
-  for l in core.openflow_discovery.adjacency:
-    adj[l.dpid1][l.dpid2].append(l)
-    switches.add(l.dpid1)
-    switches.add(l.dpid2)
-
-  # Cull links -- we want a single symmetric link connecting nodes
-  for s1 in switches:
-    for s2 in switches:
-      if s2 not in adj[s1]:
-        continue
-      if not isinstance(adj[s1][s2], list):
-        continue
-      assert s1 is not s2
-      good = False
-      for l in adj[s1][s2]:
-        if flip(l) in core.openflow_discovery.adjacency:
-          # This is a good one
-          adj[s1][s2] = l.port1
-          adj[s2][s1] = l.port2
-          good = True
-          break
-      if not good:
-        del adj[s1][s2]
-        if s1 in adj[s2]:
-          # Delete the other way too
-          del adj[s2][s1]
-
-  q = []
-  more = set(switches)
-
-  done = set()
-
-  tree = defaultdict(set)
-
-  while True:
-    q = sorted(list(more)) + q
-    more.clear()
-    if len(q) == 0: break
-    v = q.pop(False)
-    if v in done: continue
-    done.add(v)
-    for w,p in adj[v].iteritems():
-      if w in tree: continue
-      more.add(w)
-      tree[v].add((w,p))
-      tree[w].add((v,adj[w][v]))
-
-  if False:
-    log.debug("*** SPANNING TREE ***")
-    for sw,ports in tree.iteritems():
-      #print " ", dpidToStr(sw), ":", sorted(list(ports))
-      #print " ", sw, ":", [l[0] for l in sorted(list(ports))]
-      log.debug((" %i : " % sw) + " ".join([str(l[0]) for l in
-                                           sorted(list(ports))]))
-    log.debug("*********************")
-
-  return tree
+  tree = SpanningTree()
+  for l in sorted(core.openflow_discovery.adjacency):
+    tree.add_link(l)
+  return tree.get_tree()
+
+
+# The spanning tree we're maintaining
+_tree = SpanningTree()
+
+# Pending (debounced) update, and when the first event it's for came in
+_update_timer = None
+_update_first_event = None
+
+# Seconds to wait for more link events before updating ports
+_debounce_period = 0.5
+
+# Most seconds an update can be put off by link events which keep coming
+_debounce_limit = 5
 
 
 # Keep a list of previous port states so that we can skip some port mods
@@ -135,8 +258,13 @@ def _handle_ConnectionUp (event):
   # When a switch connects, forget about previous port states
   _prev[event.dpid].clear()
 
+  # ..and reconsider all of its ports
+  con = event.connection
+  for p in con.ports.itervalues():
+    if p.port_no < of.OFPP_MAX:
+      _tree.changed.add((con.dpid,p.port_no))
+
   if _noflood_by_default:
-    con = event.connection
     log.debug("Disabling flooding for %i ports", len(con.ports))
     for p in con.ports.itervalues():
       if p.port_no >= of.OFPP_MAX: continue
@@ -153,29 +281,44 @@ def _handle_ConnectionUp (event):
               kw={'force_dpid':event.dpid})
 
 
+def _handle_PortStatus (event):
+  if event.added:
+    _tree.changed.add((event.dpid,event.port))
+
+
 def _handle_LinkEvent (event):
-  # When links change, update spanning tree
+  # When links change, update spanning tree (once they've been quiet for
+  # a bit, in case there are more changes coming)
+  global _update_timer, _update_first_event
 
-  (dp1,p1),(dp2,p2) = event.link.end
-  if _prev[dp1][p1] is False:
-    if _prev[dp2][p2] is False:
-      # We're disabling this link; who cares if it's up or down?
-      #log.debug("Ignoring link status for %s", event.link)
-      return
+  if event.added:
+    _tree.add_link(event.link)
+  else:
+    _tree.remove_link(event.link)
 
-  _update_tree()
+  now = time.time()
+  if _update_timer is None:
+    _update_first_event = now
+  elif now - _update_first_event < _debounce_limit:
+    _update_timer.cancel()
+  else:
+    return # Waited long enough; let the pending update go ahead
+  _update_timer = Timer(_debounce_period, _update_tree)
 
 
 def _update_tree (force_dpid = None):
   """
   Update spanning tree
 
+  Only ports which may have changed are considered.
+
   force_dpid specifies a switch we want to update even if we are supposed
   to be holding down changes.
   """
+  global _update_timer
+  if force_dpid is None:
+    _update_timer = None
 
-  # Get a spanning tree
-  tree = _calc_spanning_tree()
   log.debug("Spanning tree updated")
 
   # Connections born before this time are old enough that a complete
@@ -183,13 +326,21 @@ def _update_tree (force_dpid = None):
   # links should have been discovered).
   enable_time = time.time() - core.openflow_discovery.send_cycle_time - 1
 
+  by_switch = defaultdict(list)
+  for sw,port in _tree.changed:
+    by_switch[sw].append(port)
+  keep = set() # Ports we couldn't deal with yet
+
   # Now modify ports as needed
   try:
     change_count = 0
-    for sw, ports in tree.iteritems():
+    for sw, changed in by_switch.iteritems():
       con = core.openflow.getConnection(sw)
       if con is None: continue # Must have disconnected
-      if con.connect_time is None: continue # Not fully connected
+      if con.connect_time is None or sw not in _tree.tree:
+        # Not fully connected or not connected to anything yet
+        keep.update((sw,p) for p in changed)
+        continue
 
       if _hold_down:
         if con.connect_time > enable_time:
@@ -198,35 +349,35 @@ def _update_tree (force_dpid = None):
             # .. but we'll allow it anyway
             pass
           else:
+            keep.update((sw,p) for p in changed)
             continue
 
-      tree_ports = [p[1] for p in ports]
-      for p in con.ports.itervalues():
-        if p.port_no < of.OFPP_MAX:
-          flood = p.port_no in tree_ports
-          if not flood:
-            if core.openflow_discovery.is_edge_port(sw, p.port_no):
-              flood = True
-          if _prev[sw][p.port_no] is flood:
-            #print sw,p.port_no,"skip","(",flood,")"
-            continue # Skip
-          change_count += 1
-          _prev[sw][p.port_no] = flood
-          #print sw,p.port_no,flood
-          #TODO: Check results
-
-          pm = of.ofp_port_mod(port_no=p.port_no,
-                               hw_addr=p.hw_addr,
-                               config = 0 if flood else of.OFPPC_NO_FLOOD,
-                               mask = of.OFPPC_NO_FLOOD)
-          con.send(pm)
-
-          _invalidate_ports(con.dpid)
+      ports = dict((p.port_no,p) for p in con.ports.itervalues())
+      for port_no in changed:
+        p = ports.get(port_no)
+        if p is None or p.port_no >= of.OFPP_MAX: continue
+        flood = _tree.should_flood(sw, p.port_no)
+        if _prev[sw][p.port_no] is flood:
+          #print sw,p.port_no,"skip","(",flood,")"
+          continue # Skip
+        change_count += 1
+        _prev[sw][p.port_no] = flood
+        #print sw,p.port_no,flood
+        #TODO: Check results
+
+        pm = of.ofp_port_mod(port_no=p.port_no,
+                             hw_addr=p.hw_addr,
+                             config = 0 if flood else of.OFPPC_NO_FLOOD,
+                             mask = of.OFPPC_NO_FLOOD)
+        con.send(pm)
+
+        _invalidate_ports(con.dpid)
     if change_count:
       log.info("%i ports changed", change_count)
   except:
     _prev.clear()
     log.exception("Couldn't push spanning tree")
+  _tree.changed = keep
 
 
 _dirty_switches = {} # A map dpid_with_dirty_ports->Timer
@@ -264,15 +415,18 @@ def _check_ports (dpid):
   log.debug("Requested switch features for %s", str(con))
 
 
-def launch (no_flood = False, hold_down = False):
-  global _noflood_by_default, _hold_down
+def launch (no_flood = False, hold_down = False, debounce = None):
+  global _noflood_by_default, _hold_down, _debounce_period
   if no_flood is True:
     _noflood_by_default = True
   if hold_down is True:
     _hold_down = True
+  if debounce is not None:
+    _debounce_period = float(debounce)
 
   def start_spanning_tree ():
     core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
+    core.openflow.addListenerByName("PortStatus", _handle_PortStatus)
     core.openflow_discovery.addListenerByName("LinkEvent", _handle_LinkEvent)
     log.debug("Spanning tree component ready")
   core.call_when_ready(start_spanning_tree, "openflow_discovery")
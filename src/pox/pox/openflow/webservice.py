@@ -16,6 +16,10 @@
 A simple JSON-RPC-ish web service for interacting with OpenFlow.
 
 This is not incredibly robust or performant or anything.  It's a demo.
+Requests to switches don't block each other, though: put several in one
+JSON-RPC batch and they're all sent before waiting for any replies.
+Concurrent get_flow_stats requests for the same flows on the same switch
+share one request to the switch.
 It's derived from the of_service messenger service, so see it for some
 more details.  Also, if you add features to this, please think about
 adding them to the messenger service too.
@@ -44,51 +48,99 @@ curl -i -X POST -d '{"method":"set_table","params":{"dpid":
 """
 
 import sys
+import json
 from pox.lib.util import dpidToStr, strToDPID, fields_of
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.openflow.of_json import *
-from pox.web.jsonrpc import JSONRPCHandler, make_error
+from pox.web.jsonrpc import JSONRPCHandler, make_error, Deferred
 import threading
 
 log = core.getLogger()
 
 
-class OFConRequest (object):
+class _XIDDispatcher (object):
+  """
+  Hands a switch's replies to the outstanding request with their XID
+
+  There's one of these per connection, so replies are looked up instead
+  of being offered to every outstanding request.
+  """
+  def __init__ (self, con):
+    self.con = con
+    self.requests = {} # xid -> OFConRequest
+    self.flow_stats = {} # args key -> outstanding OFFlowStatsRequest
+    self._listeners = con.addListeners(self)
+
+  @classmethod
+  def get (cls, con):
+    d = getattr(con, '_webservice_dispatcher', None)
+    if d is None:
+      d = con._webservice_dispatcher = cls(con)
+    return d
+
+  def _dispatch (self, xid, name, event):
+    r = self.requests.get(xid)
+    if r is None: return
+    getattr(r, name, lambda e: None)(event)
+
+  def _handle_SwitchDescReceived (self, event):
+    self._dispatch(event.ofp.xid, '_handle_SwitchDescReceived', event)
+
+  def _handle_FlowStatsReceived (self, event):
+    self._dispatch(event.ofp[0].xid, '_handle_FlowStatsReceived', event)
+
+  def _handle_BarrierIn (self, event):
+    self._dispatch(event.ofp.xid, '_handle_BarrierIn', event)
+
+  def _handle_ErrorIn (self, event):
+    self._dispatch(event.ofp.xid, '_handle_ErrorIn', event)
+
+  def _handle_ConnectionDown (self, event):
+    for r in self.requests.values():
+      r._finish(make_error("Switch disconnected"))
+    self.con.removeListeners(self._listeners)
+    del self.con._webservice_dispatcher
+
+
+class OFConRequest (Deferred):
   """
   Superclass for requests that send commands to a connection and
   wait for responses.
+
+  These are Deferreds, so an _exec_ method can return one without
+  waiting.  Replies are matched to requests by XID; set self.xid in
+  _init().
   """
   def __init__ (self, con, *args, **kw):
-    self._response = None
-    self._sync = threading.Event()
+    Deferred.__init__(self)
     self._aborted = False
-    self._listeners = None
     self._con = con
+    self.xid = None
     #self._init(*args, **kw)
     core.callLater(self._do_init, args, kw)
 
   def _do_init (self, args, kw):
-    self._listeners = self._con.addListeners(self)
+    if self.done: return
+    self._dispatcher = _XIDDispatcher.get(self._con)
     self._init(*args, **kw)
+    if self.xid is not None and not self.done:
+      self._dispatcher.requests[self.xid] = self
 
   def _init (self, *args, **kw):
     #log.warn("UNIMPLEMENTED REQUEST INIT")
     pass
 
-  def get_response (self):
-    if not self._sync.wait(5):
-      # Whoops; timeout!
-      self._aborted = True
-      self._finish()
-      raise RuntimeError("Operation timed out")
-    return self._response
+  def _timed_out (self):
+    # Whoops; timeout!
+    self._aborted = True
+    self._finish(make_error("Operation timed out"))
 
   def _finish (self, value = None):
-    if self._response is None:
-      self._response = value
-    self._sync.set()
-    self._con.removeListeners(self._listeners)
+    d = getattr(self, '_dispatcher', None)
+    if d is not None:
+      d.requests.pop(self.xid, None)
+    self.finish(value)
 
   def _result (self, key, value):
     self._finish({'result':{key:value,'dpid':dpidToStr(self._con.dpid)}})
@@ -98,20 +150,36 @@ class OFSwitchDescRequest (OFConRequest):
   def _init (self):
     sr = of.ofp_stats_request()
     sr.type = of.OFPST_DESC
+    self.xid = sr.xid = of.generate_xid()
     self._con.send(sr)
-    self.xid = sr.xid
 
   def _handle_SwitchDescReceived (self, event):
-    if event.ofp.xid != self.xid: return
     r = switch_desc_to_dict(event.stats)
     self._result('switchdesc', r)
 
   def _handle_ErrorIn (self, event):
-    if event.ofp.xid != self.xid: return
     self._finish(make_error("OpenFlow Error", data=event.asString()))
 
 
 class OFFlowStatsRequest (OFConRequest):
+  """
+  Gets flow stats
+
+  Use get() to share a request which is already outstanding for the
+  same flows instead of asking the switch again.
+  """
+  _lock = threading.Lock()
+
+  @classmethod
+  def get (cls, con, match=None, table_id=0xff, out_port=of.OFPP_NONE):
+    key = (con, json.dumps(match, sort_keys=True), table_id, out_port)
+    with cls._lock:
+      r = _pending_flow_stats.get(key)
+      if r is None or r.done:
+        r = _pending_flow_stats[key] = cls(con, match, table_id, out_port)
+        r._key = key
+    return r
+
   def _init (self, match=None, table_id=0xff, out_port=of.OFPP_NONE):
     sr = of.ofp_stats_request()
     sr.body = of.ofp_flow_stats_request()
@@ -122,19 +190,28 @@ class OFFlowStatsRequest (OFConRequest):
     sr.body.match = match
     sr.body.table_id = table_id
     sr.body.out_port = out_port
+    self.xid = sr.xid = of.generate_xid()
     self._con.send(sr)
-    self.xid = sr.xid
+
+  def _finish (self, value = None):
+    key = getattr(self, '_key', None)
+    if key is not None:
+      with self._lock:
+        if _pending_flow_stats.get(key) is self:
+          del _pending_flow_stats[key]
+    super(OFFlowStatsRequest, self)._finish(value)
 
   def _handle_FlowStatsReceived (self, event):
-    if event.ofp[0].xid != self.xid: return
     stats = flow_stats_to_list(event.stats)
 
     self._result('flowstats', stats)
 
   def _handle_ErrorIn (self, event):
-    if event.ofp.xid != self.xid: return
     self._finish(make_error("OpenFlow Error", data=event.asString()))
 
+# (con, match, table_id, out_port) -> outstanding OFFlowStatsRequest
+_pending_flow_stats = {}
+
 
 class OFSetTableRequest (OFConRequest):
 
@@ -149,7 +226,7 @@ class OFSetTableRequest (OFConRequest):
     #TODO: Watch for errors on these
 
   def _init (self, flows = []):
-    self.done = False
+    self._over = False
 
     xid = of.generate_xid()
     self.xid = xid
@@ -165,18 +242,16 @@ class OFSetTableRequest (OFConRequest):
       self._con.send(of.ofp_barrier_request(xid=xid))
 
   def _handle_BarrierIn (self, event):
-    if event.ofp.xid != self.xid: return
-    if self.done: return
+    if self._over: return
     self.count -= 1
     if self.count <= 0:
       self._result('flowmod', True)
-      self.done = True
+      self._over = True
 
   def _handle_ErrorIn (self, event):
-    if event.ofp.xid != self.xid: return
-    if self.done: return
+    if self._over: return
     self.clear_table()
-    self.done = True
+    self._over = True
     self._finish(make_error("OpenFlow Error", data=event.asString()))
 
 
@@ -188,7 +263,7 @@ class OFRequestHandler (JSONRPCHandler):
     if con is None:
       return make_error("No such switch")
 
-    return OFSetTableRequest(con, flows).get_response()
+    return OFSetTableRequest(con, flows)
 
   def _exec_get_switch_desc (self, dpid):
     dpid = strToDPID(dpid)
@@ -196,7 +271,7 @@ class OFRequestHandler (JSONRPCHandler):
     if con is None:
       return make_error("No such switch")
 
-    return OFSwitchDescRequest(con).get_response()
+    return OFSwitchDescRequest(con)
 
   def _exec_get_flow_stats (self, dpid, *args, **kw):
     dpid = strToDPID(dpid)
@@ -204,7 +279,7 @@ class OFRequestHandler (JSONRPCHandler):
     if con is None:
       return make_error("No such switch")
 
-    return OFFlowStatsRequest(con, *args, **kw).get_response()
+    return OFFlowStatsRequest.get(con, *args, **kw)
 
   def _exec_get_switches (self):
     return {'result':list_switches()}
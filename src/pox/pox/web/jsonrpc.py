@@ -23,10 +23,15 @@ It'd be nice to factor the JSON-RPC stuff out so that it could
 be used with something besides just HTTP.
 
 Also, it has some capability for compatibility with Qooxdoo.
+
+Methods whose responses depend on something else (e.g., a switch) can
+return a Deferred so that the requests in a batch don't wait on each
+other.
 """
 
 import json
 import sys
+import threading
 from pox.web.webcore import *
 from pox.core import core
 log = core.getLogger()
@@ -37,6 +42,71 @@ log = core.getLogger()
 ABORT = object()
 
 
+class Deferred (object):
+  """
+  A JSON-RPC response which isn't ready yet
+
+  An _exec_ method can return one of these instead of waiting for its
+  response itself.  The handler starts all of the requests in a batch
+  before waiting on any of them, so they proceed concurrently.  Whatever
+  produces the response calls finish() with it (from any thread).
+  """
+  timeout = 5 # Seconds to wait in get_response()
+
+  def __init__ (self):
+    self._response = None
+    self._sync = threading.Event()
+    self._callbacks = []
+    self._lock = threading.Lock()
+
+  @property
+  def done (self):
+    return self._sync.is_set()
+
+  def finish (self, value = None):
+    """
+    Sets the response (only the first one counts)
+    """
+    with self._lock:
+      if self._sync.is_set(): return
+      self._response = value
+      self._sync.set()
+      callbacks = self._callbacks
+      self._callbacks = None
+    for cb in callbacks:
+      try:
+        cb(self)
+      except:
+        log.exception("While running Deferred callback")
+
+  def add_callback (self, callback):
+    """
+    Calls callback(deferred) once there's a response
+    """
+    with self._lock:
+      if not self._sync.is_set():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def _timed_out (self):
+    """
+    Called when get_response() gives up
+
+    The default makes the response an error.
+    """
+    self.finish(make_error("Operation timed out"))
+
+  def get_response (self, timeout = None):
+    """
+    Waits for and returns the response
+    """
+    if timeout is None: timeout = self.timeout
+    if not self._sync.wait(timeout):
+      self._timed_out()
+    return self._response
+
+
 class JSONRPCHandler (SplitRequestHandler):
   """
   Meant for implementing JSON-RPC web services
@@ -121,6 +191,7 @@ class JSONRPCHandler (SplitRequestHandler):
     if not success:
       self.send_response(401, "Authorization Required")
       self._send_auth_header()
+      self.send_header("Content-Length", "0")
       self.end_headers()
     return success
 
@@ -246,9 +317,16 @@ class JSONRPCHandler (SplitRequestHandler):
 
     responses = []
 
-    for req in data:
-      response = self._handle(req) # Should never raise an exception
+    started = [self._handle(req) for req in data] # Never raise exceptions
+
+    for req,response in zip(data, started):
+      if isinstance(response, Deferred):
+        response = response.get_response()
+        if isinstance(response, dict):
+          # The same response may have gone to other requests
+          response = dict(response)
       if response is ABORT:
+        self.close_connection = 1
         return
       if 'id' in req or 'error' in response:
         response['id'] = req.get('id')
@@ -43,6 +43,7 @@ from SocketServer import ThreadingMixIn
 from BaseHTTPServer import *
 from time import sleep
 import select
+import socket
 import threading
 
 import random
@@ -343,6 +344,16 @@ class SplitCGIRequestHandler (SplitRequestHandler,
 
 
 class SplitterRequestHandler (BaseHTTPRequestHandler):
+  # Connections are kept alive after requests to handlers which speak
+  # HTTP/1.1 (and so always send a Content-Length or close).
+  protocol_version = 'HTTP/1.1'
+
+  # Seconds a connection can sit without the client sending anything
+  # before we close it, so that idle kept-alive connections don't each tie
+  # up a thread.  (Handlers waiting on something else, like long polls,
+  # aren't affected.)
+  timeout = 60
+
   def __init__ (self, *args, **kw):
     #self.rec = Recording(args[0])
     #self.args = args
@@ -361,7 +372,11 @@ class SplitterRequestHandler (BaseHTTPRequestHandler):
     weblog.info('splitter:' + fmt % args)
 
   def handle_one_request(self):
-    self.raw_requestline = self.rfile.readline()
+    try:
+      self.raw_requestline = self.rfile.readline()
+    except socket.timeout:
+      self.close_connection = 1
+      return
     if not self.raw_requestline:
         self.close_connection = 1
         return
@@ -391,12 +406,19 @@ class SplitterRequestHandler (BaseHTTPRequestHandler):
           # Handle splits like directories
           self.send_response(301)
           self.send_header("Location", self.path + "/")
+          self.send_header("Content-Length", "0")
           self.end_headers()
-          break
+          return
 
       break
 
-    return handler._split_dispatch(self.command)
+    try:
+      return handler._split_dispatch(self.command)
+    finally:
+      if handler.protocol_version < 'HTTP/1.1':
+        self.close_connection = 1
+      else:
+        self.close_connection = handler.close_connection
 
 
 class SplitThreadedServer(ThreadingMixIn, HTTPServer):
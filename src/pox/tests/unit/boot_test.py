@@ -0,0 +1,36 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../..")
+
+from pox.boot import _check_params
+
+
+class CheckParamsTest (unittest.TestCase):
+  def test_check_params (self):
+    def launch (port, address = None, __INSTANCE__ = None):
+      pass
+    self.assertEqual(_check_params(launch, {'port':1}), None)
+    self.assertEqual(_check_params(launch, {'port':1, 'address':2,
+                                            '__INSTANCE__':(0,1,True)}),
+                     None)
+    self.assertTrue("'port'" in _check_params(launch, {}))
+    self.assertTrue("'bogus'" in _check_params(launch, {'port':1,
+                                                         'bogus':2}))
+
+  def test_kw (self):
+    def launch (default = False, **kw):
+      pass
+    self.assertEqual(_check_params(launch, {'anything':1}), None)
@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.datapaths.pcap_switch import PCapSwitch
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_table import TableEntry
+from pox.openflow.match_key import match_key
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+
+
+class FakePCap (object):
+  """
+  Stands in for a pxpcap.PCap on a port; keeps each batch injected
+  """
+  def __init__ (self):
+    self.batches = []
+
+  def inject_many (self, frames):
+    self.batches.append(list(frames))
+    return len(frames)
+
+
+def _udp (src_port, dst_port = 53):
+  u = pkt.udp(srcport=src_port, dstport=dst_port, payload="hello")
+  ip = pkt.ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+                protocol=pkt.ipv4.UDP_PROTOCOL, payload=u)
+  e = pkt.ethernet(src=EthAddr("00:00:00:00:00:01"),
+                   dst=EthAddr("00:00:00:00:00:02"),
+                   type=pkt.ethernet.IP_TYPE, payload=ip)
+  return e.pack()
+
+
+class PCapSwitchTest (unittest.TestCase):
+  def setUp (self):
+    self.sw = PCapSwitch(dpid=1, name="test", expire_period=0)
+    self.pcaps = {}
+    for i in (1,2,3):
+      self.sw.add_port(self.sw.generate_port(i))
+      self.pcaps[i] = self.sw.px[i] = FakePCap()
+
+    # Count the frames which have to be parsed
+    self.parsed = 0
+    rx_packet = self.sw.rx_packet
+    def counting_rx_packet (*args, **kw):
+      self.parsed += 1
+      return rx_packet(*args, **kw)
+    self.sw.rx_packet = counting_rx_packet
+
+  def tearDown (self):
+    self.sw._handle_GoingDownEvent(None)
+    self.sw.t.join()
+
+  def _flow (self, port, actions, priority = of.OFP_DEFAULT_PRIORITY,
+             **kw):
+    m = of.ofp_match.from_packet(pkt.ethernet(_udp(port, **kw)), 1)
+    e = TableEntry(match=m, priority=priority, actions=actions)
+    self.sw.table.add_entry(e)
+    return e
+
+  def _rx (self, *frames):
+    self.sw.rx_batch([(f, 1, match_key(f, 1)) for f in frames])
+
+  def _sent (self, port):
+    return sum(self.pcaps[port].batches, [])
+
+  def test_batched_output (self):
+    self.sw.table.add_entry(TableEntry(match=of.ofp_match(),
+        actions=[of.ofp_action_output(port=2)]))
+    frames = [_udp(i) for i in range(1000, 1010)]
+    self._rx(*frames)
+    # One inject call for the whole batch
+    self.assertEqual(self.pcaps[2].batches, [frames])
+    self.assertEqual(self.pcaps[3].batches, [])
+    self.assertEqual(self.sw.port_stats[2].tx_packets, 10)
+
+  def test_flow_cache (self):
+    e = self._flow(1000, [of.ofp_action_output(port=2)])
+    self._rx(_udp(1000))
+    self.assertEqual(self.parsed, 1)
+    self.assertEqual(len(self.sw._flow_cache), 1)
+
+    # Same flow again doesn't get parsed, but does the same thing
+    f = _udp(1000)
+    self._rx(f, f)
+    self.assertEqual(self.parsed, 1)
+    self.assertEqual(self._sent(2)[1:], [f, f])
+    self.assertEqual(e.packet_count, 3)
+    self.assertEqual(self.sw.port_stats[1].rx_packets, 3)
+
+    # A different flow has a different key
+    self._rx(_udp(1001))
+    self.assertEqual(self.parsed, 2)
+
+  def test_flood (self):
+    self._flow(1000, [of.ofp_action_output(port=of.OFPP_FLOOD)])
+    self._rx(_udp(1000), _udp(1000))
+    self.assertEqual(self.parsed, 1)
+    self.assertEqual(len(self._sent(2)), 2)
+    self.assertEqual(len(self._sent(3)), 2)
+    self.assertEqual(self.pcaps[1].batches, [])
+
+  def test_uncacheable (self):
+    # Rewrites have to be done on a parsed packet
+    self._flow(1000, [of.ofp_action_tp_port.set_dst(99),
+                      of.ofp_action_output(port=2)])
+    self._rx(_udp(1000), _udp(1000))
+    self.assertEqual(self.parsed, 2)
+    self.assertEqual(self.sw._flow_cache, {})
+    self.assertEqual(pkt.ethernet(self._sent(2)[0]).find('udp').dstport, 99)
+
+  def test_table_change (self):
+    self._flow(1000, [of.ofp_action_output(port=2)])
+    self._rx(_udp(1000))
+    self.assertEqual(len(self.sw._flow_cache), 1)
+
+    # A new higher priority entry must win from now on
+    e = self._flow(1000, [of.ofp_action_output(port=3)], priority=0xffff)
+    self.assertEqual(self.sw._flow_cache, {})
+    self._rx(_udp(1000))
+    self.assertEqual(len(self._sent(2)), 1)
+    self.assertEqual(len(self._sent(3)), 1)
+
+    # And once it's removed, the frame goes back to the old one
+    self.sw.table.remove_entry(e)
+    self.assertEqual(self.sw._flow_cache, {})
+    self._rx(_udp(1000))
+    self.assertEqual(len(self._sent(2)), 2)
+
+    # Dropping everything leaves a table miss (not a stale cached entry)
+    self.sw.table.remove_matching_entries(of.ofp_match())
+    self.assertEqual(self.sw._flow_cache, {})
+    self._rx(_udp(1000))
+    self.assertEqual(len(self._sent(2)), 2)
+
+  def test_port_down (self):
+    self._flow(1000, [of.ofp_action_output(port=2)])
+    self._rx(_udp(1000))
+    self.sw.ports[1].config |= of.OFPPC_NO_RECV
+    self._rx(_udp(1000))
+    self.assertEqual(len(self._sent(2)), 1)
@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-ins for the parts of POX which components talk to
+
+Components get these through core (core.register("openflow", ...)) or
+are handed them directly, and the tests look at what was sent.
+"""
+
+import time
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import ConnectionDict
+import pox.lib.packet as pkt
+
+
+class FakeEvent (object):
+  """
+  An event with whatever attributes it's given
+  """
+  def __init__ (self, **kw):
+    self.__dict__.update(kw)
+
+
+class FakeClock (object):
+  """
+  Stands in for the time module; set .now to move time
+  """
+  def __init__ (self, now = 1000.0):
+    self.now = now
+
+  def time (self):
+    return self.now
+
+
+class FakePort (object):
+  def __init__ (self, port_no, hw_addr = None):
+    self.port_no = port_no
+    self.hw_addr = hw_addr
+
+
+class FakeConnection (object):
+  """
+  An OpenFlow connection which keeps whatever is sent on it in .sent
+
+  Other attributes (e.g., ports or eth_addr) can be passed as keywords.
+  """
+  def __init__ (self, dpid = 1, **kw):
+    self.dpid = dpid
+    self.sent = []
+    self.idle_time = time.time()
+    self.disconnected = None
+    self.listeners = None
+    self.__dict__.update(kw)
+
+  def send (self, data):
+    self.sent.append(data)
+
+  def disconnect (self, msg = None):
+    self.disconnected = msg
+
+  def addListeners (self, sink, *args, **kw):
+    self.listeners = sink
+    return sink
+
+  def removeListeners (self, listeners):
+    self.listeners = None
+
+
+class FakeOpenFlow (object):
+  """
+  Enough of core.openflow for components which send through it
+
+  Data sent with sendToDPID() is kept in .sent as (dpid, data).  Setting
+  .up to False makes sends fail as if the switch were disconnected.
+  """
+  def __init__ (self, *connections):
+    self.connections = ConnectionDict((c.dpid, c) for c in connections)
+    self.sent = []
+    self.up = True
+
+  def getConnection (self, dpid):
+    return self.connections.get(dpid)
+
+  def sendToDPID (self, dpid, data):
+    if not self.up: return False
+    self.sent.append((dpid, data))
+    return True
+
+  def addListeners (self, *args, **kw):
+    pass
+
+  def addListenerByName (self, *args, **kw):
+    pass
+
+
+class FakeDiscovery (object):
+  """
+  Enough of core.openflow_discovery to tell edge ports from link ports
+
+  Ports in .link_ports (as (dpid, port)) are switch-to-switch ports.
+  """
+  def __init__ (self):
+    self.link_ports = set()
+    self.adjacency = {}
+    self.link_latency = {}
+
+  def is_edge_port (self, dpid, port):
+    return (dpid,port) not in self.link_ports
+
+  def addListeners (self, *args, **kw):
+    pass
+
+
+def packet_in_event (connection, port, frame, buffer_id = None):
+  """
+  A PacketIn event for a frame received on one of a connection's ports
+  """
+  return FakeEvent(connection=connection, dpid=connection.dpid, port=port,
+                   data=frame, parsed=pkt.ethernet(frame),
+                   ofp=of.ofp_packet_in(data=frame, in_port=port,
+                                        buffer_id=buffer_id))
+
+
+def unpack_all (data):
+  """
+  Unpacks a string of OpenFlow messages (or a single message object)
+  """
+  if not isinstance(data, bytes): data = data.pack()
+  r = []
+  while data:
+    msg = of._message_type_to_class[ord(data[1])]()
+    offset,length = msg.unpack(data)
+    r.append(msg)
+    data = data[length:]
+  return r
@@ -0,0 +1,257 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+import pox.forwarding.l2_multi as l2m
+import pox.openflow.link_utilization as lu
+from pox.openflow.discovery import Link
+from pox.lib.graph.shortest_paths import ShortestPaths
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from tests.unit.fakes import (FakeEvent, FakeConnection, FakeDiscovery,
+                              FakeOpenFlow, FakeClock)
+
+
+def _match (src, dst):
+  return of.ofp_match(dl_src=EthAddr(src), dl_dst=EthAddr(dst),
+                      dl_type=0x800)
+
+
+class L2MultiTestBase (unittest.TestCase):
+  """
+  Four switches: 1-2-3 in a line, and 4 hanging off of 1
+
+  Port n of switch a faces switch n; hosts are on port 10.
+  """
+  def setUp (self):
+    for d in (l2m.adjacency, l2m.switches, l2m.mac_map, l2m.installed_paths,
+              l2m.link_paths, l2m.port_paths, l2m.waiting_paths):
+      d.clear()
+    self._globals = (l2m.shortest_paths, l2m.media_paths, l2m.MEDIA_PORTS)
+    l2m.shortest_paths = ShortestPaths()
+    l2m.media_paths = ShortestPaths()
+
+    self.discovery = FakeDiscovery()
+    core.register("openflow_discovery", self.discovery)
+    self.l2 = l2m.l2_multi()
+    self.invalidated = []
+    self.l2.addListenerByName("PathsInvalidated", self.invalidated.append)
+
+    self.sw = {}
+    for dpid in (1,2,3,4):
+      sw = l2m.Switch()
+      sw.dpid = dpid
+      sw.connection = FakeConnection(dpid)
+      l2m.switches[dpid] = self.sw[dpid] = sw
+    for a,b in ((1,2),(2,3),(1,4)):
+      self._link(a, b)
+
+  def tearDown (self):
+    l2m.shortest_paths, l2m.media_paths, l2m.MEDIA_PORTS = self._globals
+
+  def _link (self, a, b):
+    for x,y in ((a,b),(b,a)):
+      l2m.adjacency[self.sw[x]][self.sw[y]] = y
+      self.discovery.adjacency[Link(x, y, y, x)] = 0
+      self.discovery.link_ports.add((x, y))
+    l2m._update_paths(self.sw[a], self.sw[b])
+
+  def _path (self, src, dst, match, media = False):
+    p = l2m._get_path(self.sw[src], self.sw[dst], 10, 10,
+                      l2m.media_paths if media else l2m.shortest_paths)
+    return l2m.InstalledPath(p, match, media)
+
+  def _deleted (self):
+    """
+    Returns {cookie:[flow_mod]} of the deletes sent to all switches
+    """
+    r = {}
+    for sw in self.sw.values():
+      for msg in sw.connection.sent:
+        if msg.command == of.OFPFC_DELETE_STRICT:
+          r.setdefault(msg.cookie, []).append(msg)
+      del sw.connection.sent[:]
+    return r
+
+
+class InvalidationTest (L2MultiTestBase):
+  def setUp (self):
+    L2MultiTestBase.setUp(self)
+    self.p13 = self._path(1, 3, _match("00:00:00:00:00:01",
+                                       "00:00:00:00:00:03"))
+    self.p23 = self._path(2, 3, _match("00:00:00:00:00:02",
+                                       "00:00:00:00:00:03"))
+    self.p14 = self._path(1, 4, _match("00:00:00:00:00:01",
+                                       "00:00:00:00:00:04"))
+
+  def test_indexes (self):
+    sw = self.sw
+    self.assertEqual(l2m.link_paths[frozenset((sw[1],sw[2]))],
+                     set([self.p13.cookie]))
+    self.assertEqual(l2m.link_paths[frozenset((sw[2],sw[3]))],
+                     set([self.p13.cookie, self.p23.cookie]))
+    self.assertEqual(l2m.port_paths[sw[3],10],
+                     set([self.p13.cookie, self.p23.cookie]))
+
+  def test_link_down (self):
+    sw = self.sw
+    self.l2._handle_openflow_discovery_LinkEvent(FakeEvent(
+        link=Link(1, 2, 2, 1), removed=True, added=False))
+
+    deleted = self._deleted()
+    self.assertEqual(deleted.keys(), [self.p13.cookie])
+    # Both directions on each of the path's three switches
+    self.assertEqual(len(deleted[self.p13.cookie]), 6)
+    h1,h3 = EthAddr("00:00:00:00:00:01"),EthAddr("00:00:00:00:00:03")
+    self.assertEqual(set((m.match.in_port, m.match.dl_src)
+                         for m in deleted[self.p13.cookie]),
+                     set([(10,h1), (2,h3),    # Switch 1
+                          (1,h1), (3,h3),     # Switch 2
+                          (2,h1), (10,h3)]))  # Switch 3
+
+    self.assertEqual(sorted(l2m.installed_paths),
+                     sorted([self.p23.cookie, self.p14.cookie]))
+    self.assertNotIn(frozenset((sw[1],sw[2])), l2m.link_paths)
+    self.assertEqual(l2m.link_paths[frozenset((sw[2],sw[3]))],
+                     set([self.p23.cookie]))
+    self.assertNotIn(self.p13.cookie, l2m.port_paths[sw[1],10])
+    self.assertEqual(l2m.port_paths[sw[3],10], set([self.p23.cookie]))
+
+    e, = self.invalidated
+    self.assertEqual((e.paths, e.flows), (1, 6))
+    self.assertEqual(l2m.adjacency[sw[1]][sw[2]], None)
+
+  def test_port_becomes_link (self):
+    # A host port turning out to be a link kills paths ending there
+    sw = self.sw
+    self.l2._handle_openflow_discovery_LinkEvent(FakeEvent(
+        link=Link(4, 11, 3, 10), removed=False, added=True))
+
+    self.assertEqual(sorted(self._deleted()),
+                     sorted([self.p13.cookie, self.p23.cookie]))
+    self.assertEqual(l2m.installed_paths.keys(), [self.p14.cookie])
+    self.assertNotIn((sw[3],10), l2m.port_paths)
+    self.assertNotIn(frozenset((sw[2],sw[3])), l2m.link_paths)
+    self.assertEqual(l2m.port_paths[sw[4],10], set([self.p14.cookie]))
+
+  def test_unrelated_link (self):
+    self.l2._handle_openflow_discovery_LinkEvent(FakeEvent(
+        link=Link(2, 7, 4, 7), removed=True, added=False))
+    self.assertEqual(self._deleted(), {})
+    self.assertEqual(len(l2m.installed_paths), 3)
+    self.assertEqual(self.invalidated, [])
+
+  def test_expiry (self):
+    sw = self.sw
+    self.p13.expires_at = 0
+    l2m.InstalledPath.expire_installed_paths()
+    self.assertEqual(sorted(l2m.installed_paths),
+                     sorted([self.p23.cookie, self.p14.cookie]))
+    self.assertNotIn(frozenset((sw[1],sw[2])), l2m.link_paths)
+    self.assertEqual(l2m.port_paths[sw[1],10], set([self.p14.cookie]))
+
+    # Expired flows are gone from the switches already
+    self.p23.expires_at = 0
+    self.assertEqual(l2m._invalidate_paths([self.p23.cookie]), (1,0))
+    self.assertEqual(self._deleted(), {})
+    self.assertNotIn((sw[3],10), l2m.port_paths)
+
+
+class MediaRoutingTest (L2MultiTestBase):
+  """
+  Adds a second way from 1 to 3 (via 4) which is a bit slower
+  """
+  def setUp (self):
+    L2MultiTestBase.setUp(self)
+    l2m.MEDIA_PORTS = set([1935])
+    self._link(4, 3)
+    self.discovery.link_latency[Link(1, 4, 4, 1)] = 0.002
+    l2m._update_media_weights()
+
+    self.clock = FakeClock()
+    self._time = lu.time
+    lu.time = self.clock
+    core.register("openflow", FakeOpenFlow())
+    self.lu = lu.LinkUtilization(capacity = 10000000)
+    self.lu._timer.cancel()
+    core.register("link_utilization", self.lu)
+    self.lu.addListenerByName("Congestion", self.l2._handle_Congestion)
+    for dpid in (1,2,3,4):
+      ports = [of.ofp_phy_port(port_no=p) for p in (1,2,3,4,10)
+               if p != dpid]
+      self.lu._handle_openflow_ConnectionUp(FakeEvent(dpid=dpid,
+          ofp=FakeEvent(ports=ports)))
+
+  def tearDown (self):
+    lu.time = self._time
+    del core.components["link_utilization"]
+    L2MultiTestBase.tearDown(self)
+
+  def _route (self, paths):
+    p = l2m._get_path(self.sw[1], self.sw[3], 10, 10, paths)
+    return [sw.dpid for sw,_,_ in p]
+
+  def _send (self, dpid, port, mbits):
+    self.clock.now += 1
+    load = self.lu.ports[dpid,port]
+    tx = (load._tx_bytes or 0) + mbits * 1000000 / 8
+    self.lu._handle_openflow_PortStatsReceived(FakeEvent(dpid=dpid,
+        stats=[of.ofp_port_stats(port_no=port, tx_bytes=tx)]))
+
+  def test_latency (self):
+    self.assertEqual(self._route(l2m.media_paths), [1,2,3])
+    self.discovery.link_latency[Link(1, 2, 2, 1)] = 0.01
+    l2m._update_media_weights()
+    self.assertEqual(self._route(l2m.media_paths), [1,4,3])
+    # Other flows just take the fewest hops
+    self.assertEqual(len(self._route(l2m.shortest_paths)), 3)
+
+  def test_load (self):
+    # Half full doubles the weight of a link
+    w = l2m._media_weight(self.sw[1], self.sw[2])
+    self._send(1, 2, 0)
+    self._send(1, 2, 5)
+    self.assertAlmostEqual(l2m._media_weight(self.sw[1], self.sw[2]), w * 2)
+    self.assertEqual(l2m._media_weight(self.sw[2], self.sw[1]), w)
+
+  def test_congestion (self):
+    media = _match("00:00:00:00:00:01", "00:00:00:00:00:03")
+    media.nw_proto = 6
+    media.tp_dst = 1935
+    m = self._path(1, 3, media, media = True)
+    other = self._path(1, 3, _match("00:00:00:00:00:01",
+                                    "00:00:00:00:00:03"))
+    self.assertEqual(self._route(l2m.media_paths), [1,2,3])
+
+    self._send(1, 2, 0)
+    self._send(1, 2, 9)
+    self.assertTrue(self.lu.is_congested(1, 2))
+    self.assertEqual(self._route(l2m.media_paths), [1,4,3])
+    # Only the media path was moved off of the link
+    self.assertEqual(self._deleted().keys(), [m.cookie])
+    self.assertEqual(l2m.installed_paths.keys(), [other.cookie])
+    e, = self.invalidated
+    self.assertEqual(e.link, Link(1, 2, 2, 1))
+
+    # Media can come back once it clears up
+    self._send(1, 2, 0)
+    self.assertFalse(self.lu.is_congested(1, 2))
+    self.assertEqual(self._route(l2m.media_paths), [1,2,3])
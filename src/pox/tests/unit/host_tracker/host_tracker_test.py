@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+import pox.host_tracker.host_tracker as ht
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+from tests.unit.fakes import (FakeEvent, FakeConnection, FakeOpenFlow,
+                              FakeDiscovery, FakeClock, unpack_all)
+
+
+def _arp (mac, ip):
+  a = pkt.arp(opcode=pkt.arp.REQUEST, hwsrc=EthAddr(mac),
+              protosrc=IPAddr(ip), protodst=IPAddr("10.0.0.254"))
+  e = pkt.ethernet(type=pkt.ethernet.ARP_TYPE, src=EthAddr(mac),
+                   dst=pkt.ETHERNET.ETHER_BROADCAST, payload=a)
+  return pkt.ethernet(e.pack())
+
+
+def _frames (data):
+  return [pkt.ethernet(po.data) for po in unpack_all(data)]
+
+
+class HostTrackerTest (unittest.TestCase):
+  def setUp (self):
+    self.clock = FakeClock()
+    self._time = ht.time
+    ht.time = self.clock
+    self.openflow = FakeOpenFlow()
+    core.register("openflow", self.openflow)
+    core.register("openflow_discovery", FakeDiscovery())
+    self.t = ht.host_tracker(probe_limit = 2)
+    self.t._t.cancel()
+
+  def tearDown (self):
+    ht.time = self._time
+
+  def _see (self, dpid, port, mac, ip):
+    self.t._handle_openflow_PacketIn(FakeEvent(
+        connection=FakeConnection(dpid), port=port, parsed=_arp(mac, ip)))
+
+  def _age (self, seconds):
+    self.clock.now += seconds
+
+  def test_indexes (self):
+    self._see(1, 1, "00:00:00:00:00:01", "10.0.0.1")
+    self._see(1, 1, "00:00:00:00:00:02", "10.0.0.2")
+    self._see(2, 3, "00:00:00:00:00:03", "10.0.0.3")
+    t = self.t
+    e = t.getMacEntry(EthAddr("00:00:00:00:00:02"))
+    self.assertEqual((e.dpid,e.port), (1,1))
+    self.assertIs(t.getMacEntryByIP(IPAddr("10.0.0.2")), e)
+    self.assertEqual(len(t.getHostsAt(1,1)), 2)
+    self.assertEqual(len(t.getHostsAt(2,3)), 1)
+
+    # Moves update the port index
+    self._see(2, 4, "00:00:00:00:00:02", "10.0.0.2")
+    self.assertEqual((e.dpid,e.port), (2,4))
+    self.assertEqual([x.macaddr for x in t.getHostsAt(1,1)],
+                     [EthAddr("00:00:00:00:00:01")])
+    self.assertEqual(t.getHostsAt(2,4), [e])
+
+  def test_expiry (self):
+    for i in range(1,6):
+      self._see(1, i, "00:00:00:00:00:0%s" % (i,), "10.0.0.%s" % (i,))
+    self._see(2, 1, "00:00:00:00:01:00", "10.0.1.0")
+    t = self.t
+
+    # Nothing is due yet
+    t._check_timeouts()
+    self.assertEqual(self.openflow.sent, [])
+
+    # Pings are batched per switch and limited per tick
+    self._age(ht.timeoutSec['arpAware'] + 1)
+    t._check_timeouts()
+    self.assertEqual(sorted(d for d,_ in self.openflow.sent), [1,2])
+    for dpid,data in self.openflow.sent:
+      frames = _frames(data)
+      self.assertEqual(len(frames), 2 if dpid == 1 else 1)
+      for f in frames:
+        self.assertEqual(f.src, t.ping_src_mac)
+        self.assertEqual(f.payload.opcode, pkt.arp.REQUEST)
+
+    # The rest are sent over the next ticks
+    del self.openflow.sent[:]
+    t._check_timeouts()
+    t._check_timeouts()
+    self.assertEqual(sum(len(_frames(d)) for _,d in self.openflow.sent), 3)
+    self.assertEqual(t._probes, {})
+
+    # One host answers; the others eventually get dropped
+    self._see(1, 1, "00:00:00:00:00:01", "10.0.0.1")
+    for _ in range(20):
+      self._age(ht.timeoutSec['arpReply'] + 1)
+      t._check_timeouts()
+    self.assertEqual(t.entryByMAC.keys(), [EthAddr("00:00:00:00:00:01")])
+    self.assertEqual(t.entryByIP.keys(), [IPAddr("10.0.0.1")])
+    self.assertEqual(t.entriesByPort.keys(), [(1,1)])
+
+  def test_switch_gone (self):
+    self._see(1, 1, "00:00:00:00:00:01", "10.0.0.1")
+    self.openflow.up = False
+    self._age(ht.timeoutSec['arpAware'] + 1)
+    self.t._check_timeouts()
+    e = self.t.getMacEntry(EthAddr("00:00:00:00:00:01"))
+    self.assertEqual(e.ipAddrs, {})
+    self.assertIsNone(self.t.getMacEntryByIP(IPAddr("10.0.0.1")))
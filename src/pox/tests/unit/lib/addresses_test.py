@@ -36,6 +36,45 @@ class MockEthAddrTest(unittest.TestCase):
     s = e.to_str(resolve_names=True)
     self.assertEqual(s, "Apple Inc:c2:bf:d5")
 
+  def test_oui_cache (self):
+    import pox.lib.addresses
+    import tempfile
+    import shutil
+    import marshal
+    d = tempfile.mkdtemp()
+    try:
+      # The first place can't be written, so it goes in the second
+      cachenames = [os.path.join(d, "file", "oui.cache"),
+                    os.path.join(d, "pox", "oui.cache")]
+      open(os.path.join(d, "file"), "w").close()
+      names = pox.lib.addresses._load_oui_names(cachenames)
+      self.assertTrue(os.path.exists(cachenames[1]))
+      self.assertEqual(pox.lib.addresses._load_oui_names(cachenames), names)
+
+      # It really is used
+      with open(cachenames[1], "rb") as f:
+        stamp,_ = marshal.load(f)
+      with open(cachenames[1], "wb") as f:
+        marshal.dump((stamp, {"abc":"Cached"}), f)
+      self.assertEqual(pox.lib.addresses._load_oui_names(cachenames),
+                       {"abc":"Cached"})
+    finally:
+      shutil.rmtree(d)
+
+  def test_from_raw (self):
+    e = EthAddr("00:11:22:33:44:55")
+    r = EthAddr.from_raw(e.raw)
+    self.assertEqual(r, e)
+    self.assertEqual(hash(r), hash(e))
+    self.assertTrue(EthAddr.from_raw(e.raw) is r, "not interned")
+    self.assertEqual({e:1}[r], 1)
+    self.assertEqual(copy(r), e)
+
+  def test_immutable (self):
+    e = EthAddr("00:11:22:33:44:55")
+    with self.assertRaises(TypeError):
+      e._value = b'\x00' * 6
+
 #  def test_int_ctor(self):
 #    int_val = EthAddr("00:00:00:00:01:00").toInt()
 #    self.assertEqual(int_val, 1<<8)
@@ -64,6 +103,25 @@ class MockIPAddrTest (unittest.TestCase):
     self.assertEqual(IPAddr(IPAddr('1.2.3.4').toSigned()).raw,
         '\x01\x02\x03\x04')
 
+  def test_from_num (self):
+    for s in ('1.2.3.4', '192.168.1.200', '255.255.255.255', '0.0.0.0'):
+      a = IPAddr(s)
+      n = IPAddr.from_num(a.toUnsigned())
+      self.assertEqual(n, a)
+      self.assertEqual(hash(n), hash(a))
+      self.assertEqual(n.toSigned(), a.toSigned())
+      self.assertEqual(n.raw, a.raw)
+      self.assertEqual(copy(n), a)
+
+  def test_in_network_forms (self):
+    a = IPAddr("10.1.2.3")
+    self.assertTrue(a.inNetwork("10.1.0.0", 16))
+    self.assertTrue(a.inNetwork("10.1.0.0/255.255.0.0"))
+    self.assertTrue(a.inNetwork((IPAddr("10.0.0.0"), 8)))
+    self.assertTrue(a.inNetwork("0.0.0.0/0"))
+    self.assertFalse(a.inNetwork("10.2.0.0/16"))
+    self.assertFalse(a.inNetwork("10.2.0.0/16")) # Cached
+
 #TODO: Clean up these IPv6 tests
 class IPv6Tests (unittest.TestCase):
   def test_basics_part1 (self):
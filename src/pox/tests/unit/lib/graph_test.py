@@ -0,0 +1,217 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import random
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.lib.graph.graph import *
+from pox.lib.graph.nom import NOM
+
+
+class A (Node):
+  def __init__ (self, ID, color):
+    self.ID = ID
+    self.color = color
+  def __repr__ (self):
+    return "A(%s)" % (self.ID,)
+
+class B (A):
+  def __repr__ (self):
+    return "B(%s)" % (self.ID,)
+
+class C (Node):
+  def __init__ (self, ID):
+    self.ID = ID
+    self.tags = [ID] # Unhashable
+  def __repr__ (self):
+    return "C(%s)" % (self.ID,)
+
+
+def _scan_find (g, *args, **kw):
+  return [n for n in g._g.nodes() if g._test_node(n, args, kw)]
+
+def _scan_find_links (g, q1=None, q2=()):
+  plan = g._plan
+  g._plan = lambda *a, **k: None
+  try:
+    return g.find_links(q1, q2)
+  finally:
+    g._plan = plan
+
+def _link_set (links):
+  return set((l[0], l[1]) for l in links)
+
+
+class GraphTest (unittest.TestCase):
+  def _build (self, seed, count=60):
+    r = random.Random(seed)
+    g = Graph(indexes=('ID','color','tags'))
+    nodes = []
+    for i in range(count):
+      k = r.choice((A, B, C))
+      n = k(i) if k is C else k(i, r.choice(('red','green','blue')))
+      nodes.append(n)
+      g.add(n)
+    for _ in range(count * 3):
+      a,b = r.sample(nodes, 2)
+      g.link((a,r.randint(0,4)), (b,r.randint(0,4)))
+    for _ in range(count):
+      op = r.random()
+      if op < 0.4:
+        a = r.choice(nodes)
+        g.disconnect_port((a,r.randint(0,4)))
+      elif op < 0.7:
+        a,b = r.sample(nodes, 2)
+        g.unlink(a, b)
+      elif op < 0.8:
+        a = r.choice(nodes)
+        if a in g:
+          g.remove(a)
+          nodes.remove(a)
+      else:
+        a,b = r.sample(nodes, 2)
+        g.link((a,r.randint(0,4)), (b,r.randint(0,4)))
+    return g, nodes, r
+
+  def _queries (self, nodes, r):
+    n = r.choice(nodes)
+    return [
+      ((), dict(type=A)),
+      ((), dict(is_a=A)),
+      ((), dict(ID=n.ID)),
+      ((), dict(color='red', type=B)),
+      ((Equal(F('ID'), n.ID),), {}),
+      ((Equal(n.ID, F('ID')),), {}),
+      ((Or(Equal('DPID', n.ID), Equal(F('ID'), n.ID)),), {}),
+      ((And(IsType(B), Equal(F('color'), 'blue')),), {}),
+      ((IsType('C'),), {}),
+      ((IsInstance(A),), {}),
+      ((Is(n),), {}),
+      ((Equal(F('tags'), [n.ID]),), {}),
+      ((Not(IsType(A)),), {}),
+      ((Equal(F('missing'), 1),), {}),
+    ]
+
+  def test_find_matches_scan (self):
+    for seed in range(10):
+      g,nodes,r = self._build(seed)
+      for args,kw in self._queries(nodes, r):
+        self.assertEqual(set(g.find(*args, **kw)),
+                         set(_scan_find(g, *args, **kw)),
+                         "%s %s" % (args, kw))
+
+  def test_plan_narrows (self):
+    g,nodes,r = self._build(1)
+    n = nodes[5]
+    self.assertEqual(g._plan((Equal(F('ID'), n.ID),)), set([n]))
+    self.assertEqual(g._plan((), dict(ID=n.ID)), set([n]))
+    self.assertEqual(g._plan((Is(n),)), set([n]))
+    self.assertEqual(g._plan((Or(Equal('DPID', n.ID),
+                                 Equal(F('ID'), n.ID)),)), set([n]))
+    self.assertIs(g._plan((Not(IsType(A)),)), None)
+    self.assertIs(g._plan((Equal(F('unindexed'), 1),)), None)
+
+  def test_find_links_matches_scan (self):
+    for seed in range(10):
+      g,nodes,r = self._build(seed)
+      n = r.choice(nodes)
+      queries = [
+        (None, ()),
+        (Equal(F('ID'), n.ID), ()),
+        (Equal(F('ID'), n.ID), None),
+        (IsType(B), IsType('C')),
+        (Equal(F('color'), 'red'), Equal(F('color'), 'blue')),
+        (Not(IsType(A)), IsInstance(A)),
+      ]
+      for q1,q2 in queries:
+        self.assertEqual(_link_set(g.find_links(q1, q2)),
+                         _link_set(_scan_find_links(g, q1, q2)),
+                         "%s %s" % (q1, q2))
+
+  def test_ports (self):
+    g = Graph()
+    a,b,c = A(1,'red'),A(2,'red'),A(3,'red')
+    for n in (a,b,c): g.add(n)
+    g.link((a,1),(b,2))
+    g.link((a,2),(c,1))
+    self.assertEqual(g.find_port(a, b), (1,2))
+    self.assertEqual(g.find_port(c, a), (1,2))
+    self.assertEqual(g.find_port(b, c), None)
+    self.assertEqual(dict(g.ports_for_node(a)), {1:(b,2), 2:(c,1)})
+    self.assertEqual(set(g.neighbors(a)), set([b,c]))
+
+    # Relinking a port replaces whatever was there
+    g.link((a,1),(c,3))
+    self.assertEqual(set(g.neighbors(a)), set([c]))
+    self.assertEqual(dict(g.ports_for_node(b)), {})
+
+    self.assertEqual(g.unlink((a,1),(c,3)), 1)
+    self.assertEqual(g.unlink(a, c), 1)
+    self.assertEqual(g.neighbors(a), [])
+    self.assertEqual(g.find_links(), [])
+
+  def test_remove (self):
+    g = Graph(indexes=('ID',))
+    a,b = A(1,'red'),B(2,'red')
+    g.link((a,1),(b,1))
+    g.remove(b)
+    self.assertEqual(g.find(ID=2), [])
+    self.assertEqual(g.find(type=B), [])
+    self.assertEqual(dict(g.ports_for_node(a)), {})
+    self.assertEqual(g.neighbors(a), [])
+    self.assertEqual(g.find_links(), [])
+
+  def test_reindex (self):
+    g = Graph(indexes=('color',))
+    a = A(1,'red')
+    g.add(a)
+    a.color = 'blue'
+    g.reindex(a)
+    self.assertEqual(g.find(color='red'), [])
+    self.assertEqual(g.find(color='blue'), [a])
+
+    g.add_index('ID')
+    self.assertEqual(g.find(Equal(F('ID'), 1)), [a])
+
+  def test_mutated_field (self):
+    # Without an index, a changed field is seen right away
+    g = Graph()
+    a = A(1,'red')
+    g.add(a)
+    a.ID = 5
+    self.assertEqual(g.find(Equal(F('ID'), 5)), [a])
+    self.assertEqual(g.find(ID=5), [a])
+
+    # The NOM doesn't index unless asked to, so changing an ID is safe
+    nom = NOM()
+    e = A(1,'red')
+    nom.addEntity(e)
+    e.ID = 5
+    self.assertTrue(nom.getEntityByID(5) is e)
+    self.assertEqual(nom.getEntityByID(1), None)
+
+    # With an index, it takes a reindex()
+    nom = NOM(indexes=('ID',))
+    e = A(1,'red')
+    nom.addEntity(e)
+    e.ID = 5
+    self.assertEqual(nom.getEntityByID(5), None)
+    nom.reindex(e)
+    self.assertTrue(nom.getEntityByID(5) is e)
+    self.assertEqual(nom.getEntityByID(1), None)
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import array
+import struct
+from socket import ntohs
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.packet import *
+from pox.lib.packet.packet_utils import (checksum, checksum_adjust,
+                                         checksum_adjust32)
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def _slow_checksum (data, start = 0, skip_word = None):
+  """
+  The old word-at-a-time checksum, as a reference
+  """
+  if len(data) % 2 != 0:
+    arr = array.array('H', data[:-1])
+  else:
+    arr = array.array('H', data)
+  for i in range(0, len(arr)):
+    if i == skip_word: continue
+    start += arr[i]
+  if len(data) % 2 != 0:
+    start += struct.unpack('H', data[-1]+'\0')[0]
+  while start >> 16:
+    start = (start >> 16) + (start & 0xffff)
+  return ntohs(~start & 0xffff)
+
+
+def _frame (tp):
+  if tp is tcp:
+    t = tcp(srcport=1234, dstport=80, seq=7, ack=9, off=5, win=100)
+  else:
+    t = udp(srcport=1234, dstport=5000)
+  t.payload = b'some payload!'
+  i = ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+           protocol=ipv4.TCP_PROTOCOL if tp is tcp else ipv4.UDP_PROTOCOL)
+  i.payload = t
+  e = ethernet(src=EthAddr("00:00:00:00:00:01"),
+               dst=EthAddr("00:00:00:00:00:02"), type=ethernet.IP_TYPE)
+  e.payload = i
+  return e.pack()
+
+
+class ChecksumTest (unittest.TestCase):
+  def test_checksum (self):
+    for data in (b'', b'\x01', b'\x12\x34\x56', b'\xff' * 1001,
+                 bytes(bytearray(range(256))) * 20):
+      self.assertEqual(checksum(data), _slow_checksum(data))
+      self.assertEqual(checksum(data, 0, 1), _slow_checksum(data, 0, 1))
+
+  def test_adjust (self):
+    data = bytearray(b'\x45\x00\x00\x1c\x12\x34\x00\x00\x40\x11'
+                     b'\x00\x00\x0a\x00\x00\x01\x0a\x00\x00\x02')
+    csum = checksum(bytes(data))
+    data[4:6] = b'\xab\xcd'
+    c = checksum_adjust(csum, 0x1234, 0xabcd)
+    self.assertEqual(c, checksum(bytes(data)))
+    data[12:16] = b'\xc0\xa8\x01\x63'
+    c = checksum_adjust32(c, 0x0a000001, 0xc0a80163)
+    self.assertEqual(c, checksum(bytes(data)))
+
+  def _rewrite (self, tp, lazy):
+    e = ethernet(_frame(tp), lazy=lazy)
+    ip = e.find('ipv4')
+    ip.srcip = IPAddr("192.168.1.99")
+    ip.dstip = IPAddr("172.16.0.1")
+    t = e.find(tp.__name__)
+    t.srcport = 4321
+    t.dstport = 8080
+    self.assertIsNotNone(t._adjusted_checksum(t.payload,
+                          *([b''] if tp is tcp else [])))
+    fast = e.pack()
+
+    # Now the same thing without incremental updates
+    t._csum_basis = None
+    slow = e.pack()
+    self.assertEqual(fast, slow)
+
+  def test_tcp_rewrite (self):
+    self._rewrite(tcp, False)
+    self._rewrite(tcp, True)
+
+  def test_udp_rewrite (self):
+    self._rewrite(udp, False)
+    self._rewrite(udp, True)
+
+  def test_payload_change (self):
+    e = ethernet(_frame(tcp))
+    t = e.find('tcp')
+    t.payload = b'different'
+    self.assertIsNone(t._adjusted_checksum(t.payload, b''))
+    p = ethernet(e.pack()).find('tcp')
+    self.assertEqual(p.csum, p.checksum(unparsed=True))
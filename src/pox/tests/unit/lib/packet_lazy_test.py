@@ -0,0 +1,97 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.packet import *
+from pox.lib.packet.packet_base import packet_base
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def _frame (l4, payload = b'hello', vlan_id = None):
+  if l4 == 'tcp':
+    t = tcp(srcport=1234, dstport=80, seq=7, ack=9, off=6, win=100)
+    t.options.append(tcp_opt(tcp_opt.MSS, 1460))
+    p = ipv4.TCP_PROTOCOL
+  else:
+    t = udp(srcport=1234, dstport=5000)
+    p = ipv4.UDP_PROTOCOL
+  t.payload = payload
+  i = ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"), protocol=p)
+  i.payload = t
+  e = ethernet(src=EthAddr("00:00:00:00:00:01"),
+               dst=EthAddr("00:00:00:00:00:02"))
+  if vlan_id is None:
+    e.type = ethernet.IP_TYPE
+    e.payload = i
+  else:
+    e.type = ethernet.VLAN_TYPE
+    v = vlan(id=vlan_id, eth_type=ethernet.IP_TYPE)
+    v.payload = i
+    e.payload = v
+  return e.pack()
+
+
+class LazyParseTest (unittest.TestCase):
+  def _compare (self, raw):
+    eager = ethernet(raw)
+    lazy = ethernet(raw, lazy=True)
+    self.assertEqual(lazy.pack(), eager.pack())
+    a,b = eager,lazy
+    while a is not None:
+      self.assertEqual(type(a), type(b))
+      if not isinstance(a, packet_base):
+        self.assertEqual(a, b)
+        break
+      self.assertEqual(a.parsed, b.parsed)
+      self.assertEqual(str(a), str(b))
+      self.assertEqual(a.raw, b.raw)
+      a,b = a.next,b.next
+    self.assertTrue(b is None or not isinstance(b, packet_base))
+
+  def test_tcp (self):
+    self._compare(_frame('tcp'))
+
+  def test_udp (self):
+    self._compare(_frame('udp'))
+
+  def test_vlan (self):
+    self._compare(_frame('tcp', vlan_id=5))
+
+  def test_truncated (self):
+    raw = _frame('tcp')
+    for n in (10, 20, 30, 40, 56, 60):
+      self._compare(raw[:n])
+
+  def test_deferred (self):
+    e = ethernet(_frame('udp'), lazy=True)
+    self.assertTrue(e._lazy_next)
+    self.assertIsNone(e._raw)
+    u = e.find('udp')
+    self.assertEqual(u.dstport, 5000)
+    self.assertEqual(u.payload, b'hello')
+    self.assertEqual(e.find('ipv4').srcip, IPAddr("10.0.0.1"))
+
+  def test_tcp_options (self):
+    t = ethernet(_frame('tcp'), lazy=True).find('tcp')
+    self.assertTrue(t._lazy_options)
+    self.assertEqual(t.options[0].type, tcp_opt.MSS)
+    self.assertEqual(t.options[0].val, 1460)
+
+  def test_modify (self):
+    e = ethernet(_frame('udp'), lazy=True)
+    u = e.find('udp')
+    u.dstport = 5001
+    self.assertEqual(ethernet(e.pack()).find('udp').dstport, 5001)
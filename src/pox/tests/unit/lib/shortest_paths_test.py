@@ -0,0 +1,96 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import random
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.graph.shortest_paths import ShortestPaths
+
+
+def _floyd_warshall (nodes, links):
+  """
+  The old way, as a reference
+  """
+  inf = float('inf')
+  d = dict(((a,b),inf) for a in nodes for b in nodes)
+  for n in nodes: d[n,n] = 0
+  for (a,b),w in links.iteritems(): d[a,b] = min(d[a,b], w)
+  for k in nodes:
+    for i in nodes:
+      for j in nodes:
+        if d[i,k] + d[k,j] < d[i,j]:
+          d[i,j] = d[i,k] + d[k,j]
+  return d
+
+
+class ShortestPathsTest (unittest.TestCase):
+  def _check (self, sp, nodes, links):
+    ref = _floyd_warshall(nodes, links)
+    for a in nodes:
+      for b in nodes:
+        p = sp.path(a, b)
+        if ref[a,b] == float('inf'):
+          self.assertIsNone(p)
+          self.assertIsNone(sp.distance(a, b))
+          continue
+        self.assertEqual(sp.distance(a, b), ref[a,b])
+        self.assertEqual(p[0], a)
+        self.assertEqual(p[-1], b)
+        self.assertEqual(sum(links[x,y] for x,y in zip(p, p[1:])), ref[a,b])
+
+  def test_simple (self):
+    sp = ShortestPaths()
+    sp.set_link(1, 2)
+    sp.set_link(2, 3)
+    sp.set_link(1, 3, 5)
+    self.assertEqual(sp.path(1, 3), (1, 2, 3))
+    self.assertEqual(sp.path(1, 1), (1,))
+    self.assertIsNone(sp.path(3, 1))
+    sp.remove_link(2, 3)
+    self.assertEqual(sp.path(1, 3), (1, 3))
+    sp.set_link(2, 3)
+    self.assertEqual(sp.path(1, 3), (1, 2, 3))
+    sp.set_link(1, 2, 10)
+    self.assertEqual(sp.path(1, 3), (1, 3))
+    sp.remove_node(3)
+    self.assertIsNone(sp.path(1, 3))
+    self.assertEqual(sp.path(1, 2), (1, 2))
+
+  def test_incremental (self):
+    """
+    Random link changes give the same distances as recomputing
+    """
+    rng = random.Random(31)
+    nodes = range(25)
+    links = {}
+    sp = ShortestPaths()
+    for i in range(300):
+      a,b = rng.sample(nodes, 2)
+      r = rng.random()
+      if r < 0.45:
+        links[a,b] = links[b,a] = rng.randint(0, 5)
+        sp.set_link(a, b, links[a,b])
+        sp.set_link(b, a, links[b,a])
+      elif r < 0.9:
+        if links:
+          a,b = rng.choice(list(links))
+          del links[a,b]
+          sp.remove_link(a, b)
+      else:
+        for l in [l for l in links if a in l]: del links[l]
+        sp.remove_node(a)
+      if i % 20 == 0:
+        self._check(sp, nodes, links)
+    self._check(sp, nodes, links)
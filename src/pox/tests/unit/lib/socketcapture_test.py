@@ -0,0 +1,172 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+from StringIO import StringIO
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+from pox.lib.socketcapture import (PCapWriter, BackgroundPCapWriter,
+                                   _writer_thread)
+from pox.openflow.of_01 import OFPCapWriter
+import pox.openflow.libopenflow_01 as of
+
+
+def _records (data):
+  """
+  Returns [(seconds, frame)] from a pcap trace
+  """
+  assert struct.unpack_from("I", data)[0] == 0xa1b2c3d4
+  off = 24
+  r = []
+  while off < len(data):
+    t,ut,l,l2 = struct.unpack_from("IIII", data, off)
+    off += 16
+    r.append((t + ut / 1000000.0, _no_ip_id(data[off:off+l])))
+    off += l
+  return r
+
+def _no_ip_id (frame):
+  # Zero the IP ID (and so the IP checksum), which is arbitrary
+  return frame[:18] + "\0\0" + frame[20:24] + "\0\0" + frame[26:]
+
+def _expected (src, dst, seq, ack, payload):
+  # What the writer used to produce by packing real packets
+  t = pkt.tcp(srcport=src[2], dstport=dst[2], off=5, win=1, seq=seq, ack=ack)
+  t.ACK = True
+  t.payload = payload
+  i = pkt.ipv4(srcip=src[1], dstip=dst[1], protocol=pkt.ipv4.TCP_PROTOCOL,
+               payload=t)
+  e = pkt.ethernet(src=src[0], dst=dst[0], type=pkt.ethernet.IP_TYPE,
+                   payload=i)
+  return _no_ip_id(e.pack())
+
+
+LOCAL = (EthAddr("02:00:00:00:00:00"), IPAddr("0.0.0.0"), 6633)
+REMOTE = (EthAddr("02:11:11:11:11:11"), IPAddr("1.1.1.1"), 1)
+
+
+class PCapWriterTest (unittest.TestCase):
+  def test_frames (self):
+    out = StringIO()
+    w = PCapWriter(out, local_addrs=(None,None,6633))
+    w.write(True, "hello")
+    w.write(False, "abc")
+    w.write(True, "x" * 3001)
+    r = [f for t,f in _records(out.getvalue())]
+    self.assertEqual(r, [
+      _expected(LOCAL, REMOTE, 0, 0, "hello"),
+      _expected(REMOTE, LOCAL, 0, 5, "abc"),
+      _expected(LOCAL, REMOTE, 5, 3, "x" * 3001),
+    ])
+
+
+class BackgroundPCapWriterTest (unittest.TestCase):
+  def setUp (self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown (self):
+    shutil.rmtree(self.dir)
+
+  def _writer (self, cls = BackgroundPCapWriter, **kw):
+    w = cls(os.path.join(self.dir, "t.pcap"), local_addrs=(None,None,6633),
+            **kw)
+    _writer_thread.remove(w) # We'll flush it ourselves
+    return w
+
+  def _read (self, name = "t.pcap"):
+    with open(os.path.join(self.dir, name), "rb") as f:
+      return _records(f.read())
+
+  def test_write (self):
+    w = self._writer()
+    w.write(True, "hello")
+    w.write(False, "abc")
+    self.assertEqual(len(w._ring), 2)
+    w.close()
+    r = self._read()
+    self.assertEqual([f for t,f in r], [
+      _expected(LOCAL, REMOTE, 0, 0, "hello"),
+      _expected(REMOTE, LOCAL, 0, 5, "abc"),
+    ])
+
+  def test_drop (self):
+    w = self._writer(max_buffer=10)
+    for i in range(4):
+      w.write(True, "12345")
+    self.assertEqual(w.dropped, 1)
+    w.close()
+    self.assertEqual(len(self._read()), 3)
+
+  def test_rotate (self):
+    w = self._writer(rotate_size=100)
+    w.write(True, "x" * 200)
+    w.flush()
+    w.write(True, "y" * 10)
+    w.close()
+    self.assertEqual(len(self._read()), 1)
+    r = self._read("t-1.pcap")
+    self.assertEqual(len(r), 1)
+    self.assertTrue(r[0][1].endswith("y" * 10))
+
+  def test_thread (self):
+    w = BackgroundPCapWriter(os.path.join(self.dir, "t.pcap"))
+    w.write(True, "hello")
+    w.close()
+    self.assertEqual(len(self._read()), 1)
+
+  def test_openflow (self):
+    w = self._writer(OFPCapWriter)
+    data = of.ofp_hello().pack() + of.ofp_echo_request(body="abc").pack()
+    w.write(True, data[:3])
+    w.write(True, data[3:10])
+    w.write(True, data[10:])
+    w.close()
+    r = self._read()
+    self.assertEqual([f[54:] for t,f in r], [data[:8], data[8:]])
+
+  def test_openflow_drop (self):
+    # Losing part of the stream doesn't stop the capture
+    w = self._writer(OFPCapWriter, max_buffer=20)
+    hello = of.ofp_hello().pack()
+    echo = of.ofp_echo_request(body="abc").pack()
+    w.write(False, hello)
+    w.write(False, echo)
+    w.write(True, hello + echo[:2]) # Now over max_buffer
+    w.write(True, "lost")
+    w.write(True, "also lost")
+    self.assertEqual(w.dropped, 2)
+    w.flush()
+    w.write(True, "xyz" + hello)
+    w.write(False, hello + hello)
+    w.close()
+    self.assertTrue(w._enabled)
+    r = self._read()
+    self.assertEqual([f[54:] for t,f in r], [
+      hello,          # Received
+      echo,
+      hello,          # Sent, up to the hole
+      "xyz" + hello,  # After the hole, sent data isn't split
+      hello,          # Received is still split
+      hello,
+    ])
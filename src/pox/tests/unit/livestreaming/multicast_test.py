@@ -0,0 +1,287 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import struct
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+from pox.livestreaming.multicast import (steiner_tree, LivestreamMulticast,
+                                         TREE_PRIORITY)
+from pox.livestreaming.bypass import RTMP_PORT, STREAM_KEY
+from pox.lib.graph.shortest_paths import ShortestPaths
+from pox.openflow.discovery import Link
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+from tests.unit.fakes import (FakeEvent, FakeOpenFlow, FakeDiscovery,
+                              FakeConnection)
+
+
+CDN = (EthAddr("00:00:00:00:00:01"), IPAddr("10.0.0.1"))
+BROADCASTER = (EthAddr("00:00:00:00:00:02"), IPAddr("10.0.0.2"))
+VIEWER3 = (EthAddr("00:00:00:00:00:03"), IPAddr("10.0.0.3"))
+VIEWER4 = (EthAddr("00:00:00:00:00:04"), IPAddr("10.0.0.4"))
+RELAY3 = (EthAddr("00:00:00:00:00:13"), IPAddr("10.0.0.13"))
+
+
+def _rtmp (body):
+  # Full (type 0) chunk header on chunk stream 3, AMF0 command message
+  return (chr(0x03) + "\0\0\0" + struct.pack("!I", len(body))[1:] +
+          chr(0x14) + "\0\0\0\0" + body)
+
+def _frame (src, dst, srcport, dstport, payload):
+  t = pkt.tcp(srcport=srcport, dstport=dstport, off=5)
+  t.payload = payload
+  ip = pkt.ipv4(srcip=src[1], dstip=dst[1], protocol=pkt.ipv4.TCP_PROTOCOL,
+                payload=t)
+  e = pkt.ethernet(src=src[0], dst=dst[0], type=pkt.ethernet.IP_TYPE,
+                   payload=ip)
+  return pkt.ethernet(e.pack())
+
+
+class SteinerTreeTest (unittest.TestCase):
+  def _paths (self, links):
+    p = ShortestPaths()
+    for a,b in links:
+      p.set_link(a, b)
+      p.set_link(b, a)
+    return p
+
+  def test_shares_trunk (self):
+    # 1 - 2 - 3 - 4
+    #         |   |
+    #         5   6
+    p = self._paths([(1,2),(2,3),(3,4),(3,5),(4,6)])
+    parent,unreachable = steiner_tree(p, 1, [5,6])
+    self.assertEqual(unreachable, set())
+    self.assertEqual(parent, {1:None, 2:1, 3:2, 5:3, 4:3, 6:4})
+
+  def test_unreachable (self):
+    p = self._paths([(1,2)])
+    parent,unreachable = steiner_tree(p, 1, [2,3,1])
+    self.assertEqual(parent, {1:None, 2:1})
+    self.assertEqual(unreachable, set([3]))
+
+
+class FakeHostTracker (object):
+  def __init__ (self):
+    self.listeners = []
+
+  def getMacEntry (self, mac):
+    return None
+
+  def addListenerByName (self, name, handler):
+    self.listeners.append(handler)
+
+  def leave (self, mac):
+    for handler in self.listeners:
+      handler(FakeEvent(leave=True, entry=FakeEvent(macaddr=mac)))
+
+
+class MulticastTest (unittest.TestCase):
+  """
+  s1 has the CDN on port 1 and edge switches s2..s4 on ports 2..4.
+  Each edge switch has a relay on port 1, hosts on ports 2 and 3, and
+  its uplink on port 4.  The broadcaster is on s2.
+  """
+  def setUp (self):
+    self.openflow = FakeOpenFlow()
+    self.discovery = FakeDiscovery()
+    core.register("openflow", self.openflow)
+    core.register("openflow_discovery", self.discovery)
+    self._start()
+
+  def tearDown (self):
+    core.components.pop("host_tracker", None)
+
+  def _start (self):
+    self.m = LivestreamMulticast([(2,1),(3,1),(4,1)])
+    for edge in (2,3,4):
+      self._link(Link(edge, 4, 1, edge), True)
+      self._link(Link(1, edge, edge, 4), True)
+    self._packet_in(1, 1, _frame(CDN, BROADCASTER, RTMP_PORT, 5000, ""))
+
+  def _link (self, link, added):
+    for end in link.end:
+      if added:
+        self.discovery.link_ports.add(end)
+      else:
+        self.discovery.link_ports.discard(end)
+    self.m._handle_openflow_discovery_LinkEvent(FakeEvent(link=link,
+        added=added, removed=not added))
+
+  def _packet_in (self, dpid, port, frame):
+    self.m._handle_openflow_PacketIn(FakeEvent(dpid=dpid, port=port,
+        parsed=frame, ofp=of.ofp_packet_in(data=frame.pack(), in_port=port)))
+
+  def _play (self, viewer, dpid):
+    self._packet_in(dpid, 3, _frame(viewer, CDN, 6000, RTMP_PORT,
+                                    _rtmp("\x02\0\x04play" + STREAM_KEY)))
+
+  def _publish (self):
+    self._packet_in(2, 2, _frame(BROADCASTER, CDN, 5000, RTMP_PORT,
+                                 _rtmp("\x02\0\x07publish" + STREAM_KEY)))
+
+  def _sent (self):
+    """
+    Returns {dpid:(command, in_port, set(out ports))} for what was sent
+    """
+    r = {}
+    for dpid,msg in self.openflow.sent:
+      self.assertEqual(msg.priority, TREE_PRIORITY)
+      self.assertEqual(msg.match.nw_src, BROADCASTER[1])
+      self.assertEqual(msg.match.tp_dst, RTMP_PORT)
+      r[dpid] = (msg.command, msg.match.in_port,
+                 set(a.port for a in msg.actions))
+    del self.openflow.sent[:]
+    return r
+
+  def test_tree (self):
+    ADD,DEL = of.OFPFC_ADD,of.OFPFC_DELETE_STRICT
+
+    # Viewers may ask before the stream exists
+    self._play(VIEWER3, 3)
+    self.assertEqual(self._sent(), {})
+
+    self._publish()
+    self.assertEqual(self._sent(), {
+      2: (ADD, 2, set([4])),
+      1: (ADD, 2, set([1, 3])),
+      3: (ADD, 4, set([1])),
+    })
+
+    # Another viewer only touches the branch point and the new branch
+    self._play(VIEWER4, 4)
+    self.assertEqual(self._sent(), {
+      1: (ADD, 2, set([1, 3, 4])),
+      4: (ADD, 4, set([1])),
+    })
+
+    # Losing s3 prunes its branch
+    self._link(Link(1, 3, 3, 4), False)
+    self.assertEqual(self._sent(), {
+      1: (ADD, 2, set([1, 4])),
+      3: (DEL, 4, set()),
+    })
+
+    # The stream idling out at its root tears down the rest
+    fr = of.ofp_flow_removed(match=self.m.streams.values()[0].match(2),
+                             priority=TREE_PRIORITY,
+                             reason=of.OFPRR_IDLE_TIMEOUT)
+    self.m._handle_openflow_FlowRemoved(FakeEvent(dpid=2, ofp=fr,
+                                                  idleTimeout=True))
+    sent = self._sent()
+    self.assertEqual(sent, {1: (DEL, 2, set()), 4: (DEL, 4, set())})
+    self.assertEqual(self.m.streams, {})
+
+  def test_root_entry_expires (self):
+    self._publish()
+    for dpid,msg in self.openflow.sent:
+      if dpid == 2:
+        self.assertTrue(msg.idle_timeout > 0)
+        self.assertTrue(msg.flags & of.OFPFF_SEND_FLOW_REM)
+      else:
+        self.assertEqual(msg.idle_timeout, 0)
+
+  def test_steer_to_relay (self):
+    self.openflow.connections[3] = FakeConnection(3, ports=[1,2,3,4])
+
+    # The relay makes itself known
+    a = pkt.arp(opcode=pkt.arp.REQUEST, hwsrc=RELAY3[0], protosrc=RELAY3[1],
+                protodst=VIEWER3[1])
+    e = pkt.ethernet(src=RELAY3[0], dst=pkt.ETHER_BROADCAST,
+                     type=pkt.ethernet.ARP_TYPE, payload=a)
+    self._packet_in(3, 1, pkt.ethernet(e.pack()))
+    self.assertEqual(self.openflow.sent, [])
+
+    # Once there's a stream, new connections to the CDN on s3's host ports
+    # come to the controller
+    self._publish()
+    catch = [(dpid,msg) for dpid,msg in self.openflow.sent
+             if msg.priority != TREE_PRIORITY]
+    self.assertEqual(sorted((dpid,msg.match.in_port) for dpid,msg in catch),
+                     [(3,2), (3,3)])
+    for dpid,msg in catch:
+      self.assertEqual(msg.match.nw_dst, CDN[1])
+      self.assertEqual(msg.match.tp_dst, RTMP_PORT)
+      self.assertEqual([a.port for a in msg.actions], [of.OFPP_CONTROLLER])
+    del self.openflow.sent[:]
+
+    # A viewer's connection goes to the relay rather than toward s1
+    self._packet_in(3, 3, _frame(VIEWER3, CDN, 6000, RTMP_PORT, ""))
+    steer = [msg for dpid,msg in self.openflow.sent
+             if msg.match.nw_src != BROADCASTER[1]]
+    self.openflow.sent = [(dpid,msg) for dpid,msg in self.openflow.sent
+                          if msg not in steer]
+    self.assertEqual(len(steer), 2)
+    rev,fwd = steer
+    self.assertEqual((fwd.match.in_port, fwd.match.nw_src, fwd.match.nw_dst),
+                     (3, VIEWER3[1], CDN[1]))
+    self.assertEqual([a.port for a in fwd.actions if hasattr(a, 'port')], [1])
+    self.assertEqual(fwd.actions[0].dl_addr, RELAY3[0])
+    self.assertEqual(fwd.actions[1].nw_addr, RELAY3[1])
+    self.assertTrue(fwd.data is not None)
+    self.assertEqual((rev.match.in_port, rev.match.nw_src, rev.match.tp_src),
+                     (1, RELAY3[1], RTMP_PORT))
+    self.assertEqual([a.port for a in rev.actions if hasattr(a, 'port')], [3])
+    self.assertEqual(rev.actions[0].dl_addr, CDN[0])
+    self.assertEqual(rev.actions[1].nw_addr, CDN[1])
+
+    # ...and counts as a viewer there, so the tree now reaches the relay
+    self.assertEqual(self._sent(), {
+      1: (of.OFPFC_ADD, 2, set([1, 3])),
+      3: (of.OFPFC_ADD, 4, set([1])),
+    })
+    fwd.pack()
+
+    # When the stream ends, so does the catching
+    fr = of.ofp_flow_removed(match=self.m.streams.values()[0].match(2),
+                             priority=TREE_PRIORITY,
+                             reason=of.OFPRR_IDLE_TIMEOUT)
+    self.m._handle_openflow_FlowRemoved(FakeEvent(dpid=2, ofp=fr,
+                                                  idleTimeout=True))
+    DEL = of.OFPFC_DELETE_STRICT
+    self.assertEqual(sorted((dpid,msg.command,msg.match.in_port)
+                            for dpid,msg in self.openflow.sent
+                            if msg.priority != TREE_PRIORITY),
+                     [(3,DEL,2), (3,DEL,3)])
+    self.assertEqual(self.m.steering, {})
+
+  def _viewer_leaves (self, host_tracker):
+    self._play(VIEWER3, 3)
+    self._play(VIEWER4, 4)
+    self._publish()
+    self._sent()
+    host_tracker.leave(VIEWER4[0])
+    self.assertEqual(self._sent(), {
+      1: (of.OFPFC_ADD, 2, set([1, 3])),
+      4: (of.OFPFC_DELETE_STRICT, 4, set()),
+    })
+
+  def test_host_tracker_later (self):
+    ht = FakeHostTracker()
+    core.register("host_tracker", ht)
+    self._viewer_leaves(ht)
+
+  def test_host_tracker_first (self):
+    ht = FakeHostTracker()
+    core.register("host_tracker", ht)
+    del self.openflow.sent[:]
+    self._start()
+    self._viewer_leaves(ht)
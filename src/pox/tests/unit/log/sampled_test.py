@@ -0,0 +1,122 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import logging
+import time
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.log.sampled import getLogger, Lazy
+from pox.log.background import QueueHandler
+
+
+class ListHandler (logging.Handler):
+  def __init__ (self):
+    logging.Handler.__init__(self)
+    self.records = []
+
+  def emit (self, record):
+    self.records.append(record)
+
+  @property
+  def messages (self):
+    return [r.getMessage() for r in self.records]
+
+
+class SampledLoggerTest (unittest.TestCase):
+  def setUp (self):
+    self.log = getLogger("sampled_test")
+    self.log.propagate = False
+    self.log.setLevel(logging.DEBUG)
+    self.handler = ListHandler()
+    self.log.addHandler(self.handler)
+
+  def tearDown (self):
+    self.log.removeHandler(self.handler)
+
+  def test_name (self):
+    self.assertEqual(getLogger().name, pox.core.getLogger().name)
+
+  def test_call_site (self):
+    self.log.info("at %s", "here"); line = sys._getframe().f_lineno
+    r = self.handler.records[0]
+    self.assertEqual(r.getMessage(), "at here")
+    self.assertEqual(r.lineno, line)
+    self.assertEqual(r.funcName, "test_call_site")
+    self.assertEqual(r.filename, os.path.basename(__file__).replace(".pyc",
+                                                                   ".py"))
+
+  def test_lazy (self):
+    called = []
+    def describe ():
+      called.append(True)
+      return "expensive"
+    self.log.setLevel(logging.INFO)
+    self.log.debug("%s", Lazy(describe))
+    self.assertEqual(called, [])
+    self.log.info("%s", Lazy(describe))
+    self.assertEqual(self.handler.messages, ["expensive"])
+
+  def test_sample (self):
+    for i in range(7):
+      self.log.debug("n=%i", i, sample=3)
+    self.assertEqual(self.handler.messages,
+                     ["n=0", "n=3 [2 similar messages dropped]",
+                      "n=6 [2 similar messages dropped]"])
+
+  def test_rate (self):
+    def flow (n):
+      self.log.debug("n=%i", n, rate=2)
+    for i in range(5):
+      flow(i)
+    self.log.debug("other")
+    self.assertEqual(self.handler.messages, ["n=0", "n=1", "other"])
+    site = [s for s in self.log._sites.values() if s.tokens is not None][0]
+    site.last -= 1 # As if a second has passed
+    flow(5)
+    self.assertEqual(self.handler.messages[-1],
+                     "n=5 [3 similar messages dropped]")
+
+
+class QueueHandlerTest (unittest.TestCase):
+  def test_queue (self):
+    out = ListHandler()
+    quiet = ListHandler()
+    quiet.setLevel(logging.ERROR)
+    h = QueueHandler([out, quiet])
+    args = {'x':"before"}
+    r = logging.makeLogRecord(dict(msg="%(x)s", args=args,
+                                   levelno=logging.INFO))
+    h.emit(r)
+    args['x'] = "after"
+    h.close()
+    self.assertEqual(out.messages, ["before"])
+    self.assertEqual(quiet.records, [])
+
+  def test_drop (self):
+    out = ListHandler()
+    h = QueueHandler([out], size=3)
+    h._queue.put(None) # Stop the thread so that the queue fills up
+    h._thread.join()
+    for i in range(5):
+      h.emit(logging.makeLogRecord(dict(msg=str(i), levelno=logging.INFO)))
+    self.assertEqual(h.dropped, 2)
+    h._queue.get()
+    h._queue.put(None)
+    h._run()
+    self.assertEqual(out.messages, ["1", "Dropped 2 log messages", "2"])
@@ -0,0 +1,185 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+import threading
+import time
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.messenger import MessengerNexus
+import pox.messenger.ajax_transport as ajax
+from pox.messenger.ajax_transport import _TxLog, AjaxTransport
+
+
+class TxLogTest (unittest.TestCase):
+  def test_log (self):
+    l = _TxLog(5)
+    for i in range(8):
+      self.assertEqual(l.append(i), i)
+    self.assertEqual(l.base, 3)
+    self.assertEqual(l.next_seq, 8)
+    self.assertEqual(l.get(0, 2), [(3,3),(4,4)])
+    self.assertEqual(l.get(6), [(6,6),(7,7)])
+    self.assertEqual(l.get(8), [])
+    l.trim(6)
+    self.assertEqual(len(l), 2)
+    self.assertEqual(l.get(0), [(6,6),(7,7)])
+
+
+class AjaxTransportTest (unittest.TestCase):
+  def setUp (self):
+    self.nexus = MessengerNexus()
+    self.transport = AjaxTransport(self.nexus)
+    self.transport._t.cancel()
+    self.sock,self.other = socket.socketpair()
+
+  def tearDown (self):
+    self.sock.close()
+    self.other.close()
+
+  def _poll (self, con, seq = None, batch_size = None):
+    return con.tx(self.sock, seq, batch_size)['result']
+
+  def _session (self):
+    con = self.transport.create_session()
+    r = self._poll(con, 0)
+    self.assertEqual(r['messages'][0]['cmd'], 'welcome')
+    return con
+
+  def test_ack (self):
+    con = self._session()
+    for i in range(3):
+      con.send({'n':i})
+    r = self._poll(con, 1, 2)
+    self.assertEqual(r['seq'], 1)
+    self.assertEqual([m['n'] for m in r['messages']], [0,1])
+    r = self._poll(con, 3)
+    self.assertEqual([m['n'] for m in r['messages']], [2])
+    self.assertEqual(len(con._tx_log), 1)
+
+  def test_expired (self):
+    con = self._session()
+    for i in range(ajax.MAX_TX_BACKLOG + 1):
+      con.send({'n':i})
+    # We never acked the welcome, but it has already been dropped
+    r = self._poll(con, 0)
+    self.assertEqual(r['failure'], 'expired')
+
+  def test_channel (self):
+    a = self._session()
+    b = self._session()
+    chan = self.nexus.get_channel("test")
+    chan._add_member(a)
+    chan._add_member(b)
+    chan.send({'n':0})
+    a.send({'n':'direct'})
+    chan.send({'n':1})
+
+    # Stored once for both
+    self.assertEqual(len(self.transport._channel_logs), 1)
+    self.assertEqual(len(b._tx_log), 1) # Just the welcome
+
+    r = self._poll(a, 1)
+    self.assertEqual([m['n'] for m in r['messages']], [0,'direct',1])
+    self.assertEqual(r['messages'][0]['CHANNEL'], 'test')
+    r = self._poll(b, 1)
+    self.assertEqual([m['n'] for m in r['messages']], [0,1])
+
+    # Leaving keeps what was already sent
+    chan.send({'n':2})
+    chan._remove_member(b)
+    chan.send({'n':3})
+    r = self._poll(b, 3)
+    self.assertEqual([m['n'] for m in r['messages']], [2])
+    chan._remove_member(a)
+    self.assertEqual(self.transport._channel_logs, {})
+
+  def test_channel_expired (self):
+    con = self._session()
+    chan = self.nexus.get_channel("test")
+    chan._add_member(con)
+    for i in range(ajax.MAX_CHANNEL_BACKLOG + 3):
+      chan.send({'n':i})
+    r = self._poll(con, 1, 1)
+    self.assertEqual(r['expired'], 3)
+    self.assertEqual(r['messages'][0]['n'], 3)
+
+  def test_channel_coalesce (self):
+    con = self._session()
+    chan = self.nexus.get_channel("stats", coalesce = True)
+    chan._add_member(con)
+    for i in range(5):
+      chan.send({'delay':i})
+    r = self._poll(con, 1)
+    self.assertEqual([m['delay'] for m in r['messages']], [4])
+    self.assertNotIn('expired', r)
+
+  def test_wakeup (self):
+    con = self._session()
+    def later ():
+      time.sleep(0.1)
+      con.send({'n':0})
+    t = threading.Thread(target=later)
+    t.start()
+    start = time.time()
+    r = self._poll(con, 1)
+    t.join()
+    self.assertEqual([m['n'] for m in r['messages']], [0])
+    self.assertTrue(time.time() - start < 2)
+
+  def test_close_wakes (self):
+    con = self._session()
+    t = threading.Timer(0.1, con._close)
+    t.start()
+    r = self._poll(con, 1)
+    t.join()
+    self.assertEqual(r['failure'], 'quit')
+
+  def test_overlapping_polls (self):
+    # A browser that aborts a poll and re-polls leaves two waiting.  Both
+    # must be woken, including when the dead one finishes first.
+    con = self._session()
+    dead,gone = socket.socketpair()
+    gone.close()
+    results = {}
+    def poll (name, sock):
+      results[name] = con.tx(sock, 1, None)
+    old_timeout = ajax.CONNECTION_TIMEOUT
+    ajax.CONNECTION_TIMEOUT = 5
+    try:
+      threads = []
+      for name,sock in (("dead", dead), ("live", self.sock)):
+        t = threading.Thread(target=poll, args=(name, sock))
+        t.start()
+        threads.append(t)
+        time.sleep(0.1)
+      self.assertEqual(con._waiters, 2)
+      start = time.time()
+      con.send({'n':0})
+      threads[0].join()
+      con.send({'n':1})
+      threads[1].join()
+    finally:
+      ajax.CONNECTION_TIMEOUT = old_timeout
+      dead.close()
+    self.assertTrue(time.time() - start < 2)
+    self.assertEqual(results["dead"], ajax.ABORT)
+    r = results["live"]['result']
+    self.assertEqual(r['messages'][0]['n'], 0)
+    self.assertEqual(con._waiters, 0)
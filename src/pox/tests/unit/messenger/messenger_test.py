@@ -0,0 +1,184 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import json
+import struct
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.messenger import (MessengerNexus, Transport, Connection,
+                           framed_encodings, MAX_FRAME_SIZE)
+
+
+class FakeTransport (Transport):
+  def __init__ (self, nexus, framings = (), framing_request = None):
+    Transport.__init__(self, nexus)
+    self._set_framings(framings)
+    self._framing_request = framing_request
+
+  def _forget (self, connection):
+    pass
+
+class FakeConnection (Connection):
+  def __init__ (self, transport):
+    Connection.__init__(self, transport)
+    self.sent = []
+    self.received = []
+    self.peer = None
+    self.pending = []
+    self.addListenerByName("MessageReceived", self._got)
+
+  def _got (self, event, msg):
+    self.received.append(msg)
+
+  def send_raw (self, data):
+    self.sent.append(data)
+    if self.peer is not None:
+      self.peer.pending.append(data)
+
+  def pump (self):
+    """
+    Delivers what each side sent to the other until both are quiet
+    """
+    while self.pending or self.peer.pending:
+      for c in (self, self.peer):
+        while c.pending:
+          c._rx_raw(c.pending.pop(0))
+
+
+def _frame (msg):
+  s = json.dumps(msg)
+  return struct.pack("!I", len(s)) + s
+
+
+class MessengerTest (unittest.TestCase):
+  def setUp (self):
+    self.nexus = MessengerNexus()
+
+  def test_stream (self):
+    con = FakeConnection(FakeTransport(self.nexus))
+    msgs = [{"n":i, "s":"x" * i} for i in range(20)]
+    data = "  " + "\n".join(json.dumps(m) for m in msgs) + " "
+    for i in range(0, len(data), 7):
+      con._rx_raw(data[i:i+7])
+    self.assertEqual(con.received, msgs)
+    self.assertEqual(con._buf, "")
+
+  def test_welcome_offers_framing (self):
+    con = FakeConnection(FakeTransport(self.nexus, "json"))
+    con._send_welcome()
+    self.assertEqual(json.loads(con.sent[0])['framing'], ["json"])
+
+    con = FakeConnection(FakeTransport(self.nexus))
+    con._send_welcome()
+    self.assertNotIn('framing', json.loads(con.sent[0]))
+
+  def test_switch (self):
+    con = FakeConnection(FakeTransport(self.nexus, "json"))
+    req = {"CHANNEL":"","cmd":"framing","encoding":"json"}
+    msgs = [{"n":i} for i in range(5)]
+    # The request and the first frames can arrive in one piece
+    data = json.dumps(req) + "\n" + "".join(_frame(m) for m in msgs)
+    con._rx_raw(data[:30])
+    con._rx_raw(data[30:])
+    self.assertEqual(con.received, [req] + msgs)
+
+    # The answer is the last unframed message
+    self.assertEqual(json.loads(con.sent[-1]), req)
+    con.send({"hello":1})
+    self.assertEqual(con.sent[-1], _frame({"hello":1}))
+
+  def test_split_frames (self):
+    con = FakeConnection(FakeTransport(self.nexus, "json"))
+    con._rx_framing({"encoding":"json"})
+    msgs = [{"n":i, "s":"y" * (i * 100)} for i in range(30)]
+    data = "".join(_frame(m) for m in msgs)
+    for i in range(0, len(data), 13):
+      con._rx_raw(data[i:i+13])
+    self.assertEqual(con.received, msgs)
+    self.assertEqual(len(con._rbuf) - con._rpos, 0)
+
+  def test_negotiate (self):
+    server = FakeConnection(FakeTransport(self.nexus, True))
+    client = FakeConnection(FakeTransport(self.nexus,
+                                          framing_request = "json"))
+    server.peer = client
+    client.peer = server
+    server._send_welcome()
+    client.pump()
+    self.assertIsNotNone(client._rx_codec)
+    self.assertIsNotNone(server._rx_codec)
+
+    client.send({"CHANNEL":"x", "a":1})
+    server.send({"CHANNEL":"x", "b":2})
+    client.pump()
+    self.assertEqual(server.received[-1], {"CHANNEL":"x", "a":1})
+    self.assertEqual(client.received[-1], {"CHANNEL":"x", "b":2})
+    self.assertTrue(server.sent[-1].startswith("\0"))
+
+  def test_refused (self):
+    con = FakeConnection(FakeTransport(self.nexus))
+    con._rx_raw(json.dumps({"CHANNEL":"","cmd":"framing",
+                            "encoding":"json"}))
+    self.assertFalse(con.is_connected)
+
+  def test_oversized (self):
+    con = FakeConnection(FakeTransport(self.nexus, "json"))
+    con._rx_framing({"encoding":"json"})
+    con._rx_raw(struct.pack("!I", MAX_FRAME_SIZE + 1))
+    self.assertFalse(con.is_connected)
+
+  @unittest.skipUnless("msgpack" in framed_encodings, "msgpack unavailable")
+  def test_msgpack (self):
+    server = FakeConnection(FakeTransport(self.nexus, "msgpack"))
+    client = FakeConnection(FakeTransport(self.nexus,
+                                          framing_request = "msgpack"))
+    server.peer = client
+    client.peer = server
+    server._send_welcome()
+    client.pump()
+    client.send({"CHANNEL":"x", "a":[1,2,3]})
+    client.pump()
+    self.assertEqual(server.received[-1], {"CHANNEL":"x", "a":[1,2,3]})
+
+  def test_channel_encodes_once (self):
+    encoded = []
+    class CountingConnection (FakeConnection):
+      def _encode (self, msg):
+        encoded.append(msg)
+        return FakeConnection._encode(self, msg)
+
+    transport = FakeTransport(self.nexus, "json")
+    plain = [CountingConnection(transport) for i in range(3)]
+    framed = [CountingConnection(transport) for i in range(2)]
+    for con in framed:
+      con._rx_framing({"encoding":"json"})
+    chan = self.nexus.get_channel("stats")
+    for con in plain + framed:
+      chan._add_member(con)
+    del encoded[:]
+
+    chan.send({"delay":1})
+    self.assertEqual(len(encoded), 2)
+    msg = {"CHANNEL":"stats", "delay":1}
+    for con in plain:
+      self.assertEqual(json.loads(con.sent[-1]), msg)
+    for con in framed:
+      self.assertEqual(con.sent[-1], _frame(msg))
+    # Everyone got the very same string
+    self.assertTrue(plain[0].sent[-1] is plain[2].sent[-1])
@@ -0,0 +1,116 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import json
+import socket
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.messenger import MessengerNexus, Transport
+import pox.messenger.tcp_transport as tcp
+from pox.messenger.tcp_transport import TCPConnection
+
+
+class FakeTransport (Transport):
+  def _forget (self, connection):
+    pass
+
+class ManualTCPConnection (TCPConnection):
+  """
+  Only flushes when the test says so
+  """
+  def _start_tx_task (self):
+    self._tx_task = True
+
+  def _get_socket_name (self, socket):
+    return "test"
+
+
+class TCPConnectionTest (unittest.TestCase):
+  def setUp (self):
+    self.nexus = MessengerNexus()
+    self.sock,self.peer = socket.socketpair()
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    self.peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    self.con = ManualTCPConnection(FakeTransport(self.nexus), self.sock)
+    self.peer.setblocking(0)
+
+  def tearDown (self):
+    self.sock.close()
+    self.peer.close()
+
+  def _fill (self):
+    """
+    Sends until the socket stops taking data
+    """
+    while not self.con._tx_queue:
+      self.con.send({"filler":"x" * 1000})
+
+  def _drain (self):
+    data = ""
+    while True:
+      self.con._flush()
+      try:
+        d = self.peer.recv(65536)
+      except socket.error:
+        if not self.con._tx_queue: break
+        continue
+      data += d
+    return data
+
+  def _messages (self, data):
+    decoder = json.JSONDecoder()
+    r = []
+    pos = 0
+    while pos < len(data):
+      msg,pos = decoder.raw_decode(data, pos)
+      r.append(msg)
+    return r
+
+  def test_buffers (self):
+    self._fill()
+    for i in range(5):
+      self.con.send({"n":i})
+    msgs = self._messages(self._drain())
+    self.assertEqual([m["n"] for m in msgs if "n" in m], range(5))
+    self.assertTrue(self.con.is_connected)
+    self.assertEqual(self.con._tx_size, 0)
+
+  def test_coalesce (self):
+    stats = self.nexus.get_channel("stats", coalesce = True)
+    log = self.nexus.get_channel("log")
+    stats._add_member(self.con)
+    log._add_member(self.con)
+    self._fill()
+    for i in range(10):
+      stats.send({"delay":i})
+      log.send({"n":i})
+    msgs = self._messages(self._drain())
+    self.assertEqual([m["delay"] for m in msgs if "delay" in m], [9])
+    self.assertEqual([m["n"] for m in msgs if "n" in m], range(10))
+
+  def test_too_slow (self):
+    old = tcp.MAX_TX_BUFFER
+    tcp.MAX_TX_BUFFER = 10000
+    try:
+      self._fill()
+      for i in range(20):
+        self.con.send({"filler":"x" * 1000})
+    finally:
+      tcp.MAX_TX_BUFFER = old
+    self.assertFalse(self.con.is_connected)
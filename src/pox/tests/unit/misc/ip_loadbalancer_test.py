@@ -0,0 +1,140 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.misc.ip_loadbalancer import maglev_table, hashlb
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+from tests.unit.fakes import FakeConnection, packet_in_event, unpack_all
+
+
+SERVICE_IP = IPAddr("10.0.0.100")
+SERVERS = [IPAddr("10.0.1.%s" % (i,)) for i in (1,2,3)]
+SWITCH_MAC = EthAddr("00:00:00:00:00:fe")
+
+
+class MaglevTest (unittest.TestCase):
+  names = ["server%s" % (i,) for i in range(5)]
+
+  def test_balanced (self):
+    t = maglev_table(self.names, size = 1021)
+    self.assertEqual(t, maglev_table(self.names, size = 1021))
+    self.assertNotIn(None, t)
+    for i in range(len(self.names)):
+      self.assertTrue(abs(t.count(i) - 1021/5.0) <= 1)
+
+  def test_weights (self):
+    t = maglev_table(self.names, [1,2,4,4,1], size = 1201)
+    for i,w in enumerate([1,2,4,4,1]):
+      self.assertTrue(abs(t.count(i) - 100 * w) <= 1)
+
+  def test_disruption (self):
+    t = maglev_table(self.names, size = 4099)
+    t2 = maglev_table(self.names[:3] + self.names[4:], size = 4099)
+    t2 = [i if i < 3 else i + 1 for i in t2]
+    moved = sum(1 for a,b in zip(t,t2) if a != 3 and a != b)
+    # Only the removed server's entries really need to move
+    self.assertTrue(moved < 4099 * 0.05)
+
+
+class HashLBTest (unittest.TestCase):
+  def setUp (self):
+    self.con = FakeConnection(eth_addr = SWITCH_MAC)
+    self.lb = hashlb(self.con, SERVICE_IP, SERVERS, bucket_bits = 24)
+    self.lb._weight_timer.cancel()
+    del self.con.sent[:]
+    for i,server in enumerate(SERVERS):
+      self._arp_reply(server, 10 + i)
+
+  def _arp_reply (self, server, port):
+    a = pkt.arp(opcode = pkt.arp.REPLY, protosrc = server,
+                protodst = SERVICE_IP, hwdst = self.con.eth_addr,
+                hwsrc = EthAddr("00:00:00:00:01:%02x" % (port,)))
+    e = pkt.ethernet(type = pkt.ethernet.ARP_TYPE, src = a.hwsrc,
+                     dst = a.hwdst, payload = a)
+    self.lb._handle_PacketIn(packet_in_event(self.con, port, e.pack(),
+                                             buffer_id = 1))
+
+  def _tcp (self, src, dst, port):
+    tcpp = pkt.tcp(srcport = 5000, dstport = 80, off = 5)
+    ipp = pkt.ipv4(srcip = IPAddr(src), dstip = IPAddr(dst),
+                   protocol = pkt.ipv4.TCP_PROTOCOL, payload = tcpp)
+    e = pkt.ethernet(type = pkt.ethernet.IP_TYPE,
+                     src = EthAddr("00:00:00:00:02:01"),
+                     dst = self.con.eth_addr, payload = ipp)
+    self.lb._handle_PacketIn(packet_in_event(self.con, port, e.pack(),
+                                             buffer_id = 1))
+
+  def test_buckets (self):
+    lb = self.lb
+    self.assertEqual(len(lb._table), lb.table_size)
+    self._tcp("192.168.5.1", SERVICE_IP, 1)
+    rev,fwd = unpack_all(self.con.sent.pop())
+    self.assertEqual(fwd.buffer_id, 1)
+    self.assertIsNone(rev.buffer_id)
+    entry = lb.buckets.values()[0]
+    self.assertIn(entry.server, SERVERS)
+    self.assertEqual(fwd.match.get_nw_src(), (IPAddr("192.168.5.0"), 24))
+    self.assertEqual(fwd.match.nw_dst, SERVICE_IP)
+    self.assertEqual(fwd.actions[1].nw_addr, entry.server)
+    self.assertEqual(rev.match.nw_src, entry.server)
+    self.assertEqual(rev.actions[-1].port, 1)
+
+    # Same bucket, same server, no new bucket
+    self._tcp("192.168.5.77", SERVICE_IP, 1)
+    self.assertEqual(len(lb.buckets), 1)
+    fwd = unpack_all(self.con.sent.pop())[1]
+    self.assertEqual(fwd.actions[1].nw_addr, entry.server)
+
+    # Other buckets spread over the servers
+    for i in range(60):
+      self._tcp("172.16.%s.1" % (i,), SERVICE_IP, 2)
+    used = set(e.server for e in lb.buckets.values())
+    self.assertEqual(used, set(SERVERS))
+
+    # A new balancer picks the same servers
+    lb2 = hashlb(FakeConnection(eth_addr = SWITCH_MAC), SERVICE_IP, SERVERS,
+                 bucket_bits = 24)
+    lb2._weight_timer.cancel()
+    lb2.live_servers = dict(lb.live_servers)
+    lb2._rebuild_table()
+    for bucket,entry in lb.buckets.items():
+      self.assertEqual(lb2._pick_server(bucket, 1), entry.server)
+
+  def test_server_down (self):
+    lb = self.lb
+    for i in range(30):
+      self._tcp("172.16.%s.1" % (i,), SERVICE_IP, 2)
+    del self.con.sent[:]
+    dead = SERVERS[0]
+    n = sum(1 for e in lb.buckets.values() if e.server == dead)
+    self.assertTrue(n > 0)
+
+    lb.outstanding_probes[dead] = 0
+    lb._do_expire()
+    self.assertNotIn(dead, lb.live_servers)
+    msgs = unpack_all(self.con.sent.pop())
+    self.assertEqual(len(msgs), n + 1)
+    for m in msgs:
+      self.assertEqual(m.command, of.OFPFC_DELETE)
+    self.assertNotIn(dead, [e.server for e in lb.buckets.values()])
+    self.assertEqual(len(lb.buckets), 30 - n)
+    self.assertNotIn(dead, lb._table_servers)
@@ -0,0 +1,195 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+import pox.misc.nat as nat
+from pox.misc.nat import NAT, PortPool
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+from tests.unit.fakes import (FakeConnection, FakePort, packet_in_event,
+                              unpack_all)
+
+
+INSIDE_MAC = EthAddr("00:00:00:00:00:01")
+SWITCH_MAC = EthAddr("00:00:00:00:00:fe")
+OUTSIDE_MAC = EthAddr("00:00:00:00:01:fe")
+GATEWAY_MAC = EthAddr("00:00:00:00:02:01")
+OUTSIDE_PORT = 1
+INSIDE_PORT = 2
+
+
+def _tcp (src_mac, dst_mac, src_ip, dst_ip, src_port, dst_port,
+          proto = pkt.ipv4.TCP_PROTOCOL):
+  if proto == pkt.ipv4.TCP_PROTOCOL:
+    l4 = pkt.tcp(srcport=src_port, dstport=dst_port, off=5)
+  else:
+    l4 = pkt.udp(srcport=src_port, dstport=dst_port)
+  ip = pkt.ipv4(srcip=IPAddr(src_ip), dstip=IPAddr(dst_ip), protocol=proto,
+                payload=l4)
+  e = pkt.ethernet(src=src_mac, dst=dst_mac, type=pkt.ethernet.IP_TYPE,
+                   payload=ip)
+  return e.pack()
+
+
+class PortPoolTest (unittest.TestCase):
+  def test_take_release (self):
+    pool = PortPool(100, 103)
+    self.assertEqual(pool.take(5000), 5000)
+    self.assertEqual(pool.take(101), 101)
+    got = set(pool.take(101) for _ in range(3))
+    self.assertEqual(got, set([100, 102, 103]))
+    self.assertIsNone(pool.take())
+    self.assertIsNone(pool.take(5000))
+    pool.release(102)
+    pool.release(5000)
+    self.assertEqual(pool.take(5000), 5000)
+    self.assertEqual(pool.take(), 102)
+    self.assertIsNone(pool.take())
+
+  def test_release_taken_directly (self):
+    pool = PortPool(100, 101)
+    for _ in range(10):
+      self.assertEqual(pool.take(100), 100)
+      pool.release(100)
+    self.assertEqual(len(pool._free), 2)
+
+
+class NATTest (unittest.TestCase):
+  def setUp (self):
+    self.nat = NAT(IPAddr("172.16.1.1"), IPAddr("1.2.3.4"),
+                   IPAddr("1.2.3.1"), IPAddr("8.8.8.8"), "eth0", 1,
+                   subnet = "172.16.1.0/24")
+    self.con = FakeConnection(
+        ports={OUTSIDE_PORT:FakePort(OUTSIDE_PORT, OUTSIDE_MAC)})
+    self.nat._connection = self.con
+    self.nat._outside_portno = OUTSIDE_PORT
+    self.nat._gateway_eth = GATEWAY_MAC
+
+  def _out (self, src_port, dst_ip = "5.6.7.8", dst_port = 80, **kw):
+    frame = _tcp(INSIDE_MAC, SWITCH_MAC, "172.16.1.100", dst_ip, src_port,
+                 dst_port, **kw)
+    self.nat._handle_PacketIn(packet_in_event(self.con, INSIDE_PORT, frame,
+                                              buffer_id = 7))
+
+  def _in (self, dst_port, src_ip = "5.6.7.8", src_port = 80):
+    frame = _tcp(GATEWAY_MAC, OUTSIDE_MAC, src_ip, "1.2.3.4", src_port,
+                 dst_port)
+    self.nat._handle_PacketIn(packet_in_event(self.con, OUTSIDE_PORT, frame))
+
+  def test_flow_mods (self):
+    self._out(1000)
+    raw = self.con.sent.pop()
+    incoming, outgoing = unpack_all(raw)
+    r = self.nat._record_by_outgoing.values()[0]
+    fake = r.fake_srcport
+    self.assertTrue(49152 <= fake <= 65533)
+
+    # These are built the way NAT used to build them
+    fm = of.ofp_flow_mod(xid = incoming.xid)
+    fm.flags |= of.OFPFF_SEND_FLOW_REM
+    fm.hard_timeout = nat.FLOW_TIMEOUT
+    fm.match = of.ofp_match(in_port=OUTSIDE_PORT, dl_src=GATEWAY_MAC,
+                            dl_type=0x800, nw_proto=6,
+                            nw_src=IPAddr("5.6.7.8"), nw_dst=IPAddr("1.2.3.4"),
+                            tp_src=80, tp_dst=fake)
+    fm.actions.append(of.ofp_action_dl_addr.set_src(SWITCH_MAC))
+    fm.actions.append(of.ofp_action_dl_addr.set_dst(INSIDE_MAC))
+    fm.actions.append(of.ofp_action_nw_addr.set_dst(IPAddr("172.16.1.100")))
+    fm.actions.append(of.ofp_action_tp_port.set_dst(1000))
+    fm.actions.append(of.ofp_action_output(port = INSIDE_PORT))
+    expected = fm.pack()
+
+    fm = of.ofp_flow_mod(xid = outgoing.xid)
+    fm.flags |= of.OFPFF_SEND_FLOW_REM
+    fm.hard_timeout = nat.FLOW_TIMEOUT
+    fm.buffer_id = 7
+    fm.match = of.ofp_match(in_port=INSIDE_PORT, dl_src=INSIDE_MAC,
+                            dl_dst=SWITCH_MAC, dl_type=0x800, nw_proto=6,
+                            nw_src=IPAddr("172.16.1.100"),
+                            nw_dst=IPAddr("5.6.7.8"), tp_src=1000, tp_dst=80)
+    fm.actions.append(of.ofp_action_dl_addr.set_src(OUTSIDE_MAC))
+    fm.actions.append(of.ofp_action_nw_addr.set_src(IPAddr("1.2.3.4")))
+    fm.actions.append(of.ofp_action_tp_port.set_src(fake))
+    fm.actions.append(of.ofp_action_dl_addr.set_dst(GATEWAY_MAC))
+    fm.actions.append(of.ofp_action_output(port = OUTSIDE_PORT))
+    expected += fm.pack()
+
+    self.assertEqual(raw, expected)
+
+  def test_reinstall (self):
+    self._out(2000)
+    first = self.con.sent.pop()
+    r = self.nat._record_by_outgoing.values()[0]
+    self.assertEqual(r.fake_srcport, 2000)
+
+    # The return traffic finds the record and brings its packet along
+    self._in(2000)
+    msgs = unpack_all(self.con.sent.pop())
+    self.assertEqual([type(m) for m in msgs],
+                     [of.ofp_flow_mod, of.ofp_flow_mod,
+                      of.ofp_barrier_request, of.ofp_packet_out])
+    self.assertEqual(msgs[0].match, unpack_all(first)[1].match)
+    self.assertEqual(msgs[1].match, unpack_all(first)[0].match)
+    self.assertEqual(msgs[3].in_port, OUTSIDE_PORT)
+
+    # Unknown return traffic is ignored for a while
+    self._in(2001)
+    msgs = unpack_all(self.con.sent.pop())
+    self.assertEqual(len(msgs), 1)
+    self.assertEqual(msgs[0].actions, [])
+    self.assertEqual(msgs[0].idle_timeout, 1)
+    self.assertEqual(len(self.nat._record_by_outgoing), 1)
+
+  def test_ports_and_expiry (self):
+    # Same source port to different places needs different outside ports
+    for i in range(3):
+      self._out(3000, dst_ip = "5.6.7.%s" % (i,))
+    self._out(3000, proto = pkt.ipv4.UDP_PROTOCOL)
+    fakes = sorted(r.fake_srcport
+                   for r in self.nat._record_by_outgoing.values())
+    self.assertEqual(fakes[:2], [3000, 3000])
+    self.assertEqual(len(set(fakes[2:])), 2)
+
+    # Local destinations aren't NATed
+    self._out(3001, dst_ip = "172.16.1.5")
+    self.assertEqual(len(self.nat._record_by_outgoing), 4)
+
+    now = [nat.time.time()]
+    class FakeTime (object):
+      def time (self):
+        return now[0]
+    real_time = nat.time
+    nat.time = FakeTime()
+    try:
+      now[0] += nat.FLOW_MEMORY_TIMEOUT / 2
+      self._out(3000, dst_ip = "5.6.7.0") # Touch one
+      now[0] += nat.FLOW_MEMORY_TIMEOUT / 2 + 1
+      self.nat._expire()
+      self.assertEqual(len(self.nat._record_by_outgoing), 1)
+      self.assertEqual(len(self.nat._record_by_incoming), 1)
+      self.assertEqual(self.nat._ports[6].used, set([3000]))
+      self.assertEqual(self.nat._ports[17].used, set())
+      now[0] += nat.FLOW_MEMORY_TIMEOUT + 1
+      self.nat._expire()
+      self.assertEqual(self.nat._record_by_outgoing, {})
+      self.assertEqual(self.nat._ports[6].used, set())
+    finally:
+      nat.time = real_time
@@ -0,0 +1,53 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.discovery import LLDPSender, parse_discovery_frame
+from pox.openflow.libopenflow_01 import *
+from pox.lib.addresses import EthAddr
+import pox.lib.packet as pkt
+
+
+class DiscoveryFrameTest (unittest.TestCase):
+  def test_frame (self):
+    """
+    Packed frames are the same as ones built from packet objects
+    """
+    for dpid,port in ((1,1), (0x123456789abc,65279), (0xffffffffffffff,7)):
+      addr = EthAddr("00:11:22:33:44:55")
+      eth = LLDPSender._create_discovery_packet(dpid, port, addr, 120)
+      frame = LLDPSender._create_discovery_frame(dpid, port, addr, 120)
+      self.assertEqual(frame, eth.pack())
+      self.assertEqual(parse_discovery_frame(frame), (dpid,port))
+
+  def test_packet_out (self):
+    frame = LLDPSender._create_discovery_frame(5, 3, EthAddr("1:2:3:4:5:6"),
+                                               120)
+    raw = LLDPSender._pack_packet_out(3, frame)
+    po = ofp_packet_out()
+    po.unpack(raw)
+    self.assertEqual(po.data, frame)
+    self.assertEqual(raw, ofp_packet_out(action=ofp_action_output(port=3),
+                                         data=frame, xid=po.xid).pack())
+
+  def test_not_ours (self):
+    frame = LLDPSender._create_discovery_frame(5, 3, EthAddr("1:2:3:4:5:6"),
+                                               120)
+    self.assertIsNone(parse_discovery_frame(frame[:30]))
+    self.assertIsNone(parse_discovery_frame(b'\x00' * 60))
+    lldph = pkt.ethernet(frame).find('lldp')
+    lldph.tlvs[3].payload = b'something else'
+    self.assertIsNone(parse_discovery_frame(lldph.prev.pack()))
@@ -0,0 +1,167 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import json
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.flow_stats as flow_stats
+from pox.openflow.flow_stats import (FlowTable, flow_delta, cookie_key,
+                                     FlowStatsCollector)
+from pox.messenger import MessengerNexus, Transport, Connection
+from tests.unit.fakes import FakeEvent, FakeConnection, FakeOpenFlow
+
+
+def _stats (cookie, packets, bytes, duration = 10, port = None):
+  return of.ofp_flow_stats(cookie=cookie, packet_count=packets,
+                           byte_count=bytes, duration_sec=duration,
+                           match=of.ofp_match(tp_dst=port))
+
+
+class FakeTransport (Transport):
+  def _forget (self, connection):
+    pass
+
+class FakeMessengerConnection (Connection):
+  def __init__ (self, transport):
+    Connection.__init__(self, transport)
+    self.sent = []
+
+  def send_raw (self, data):
+    self.sent.append(json.loads(data))
+
+
+class DeltaTest (unittest.TestCase):
+  def _check (self):
+    t1 = FlowTable.from_stats([_stats(1, 10, 1000), _stats(2, 5, 500),
+                               _stats(3, 1, 100)], cookie_key, now=100)
+    d = flow_delta(None, t1)
+    # The first time, everything is new and rates are over the lifetime
+    self.assertEqual(d.keys, [1,2,3])
+    self.assertEqual(list(d.byte_rate), [100,50,10])
+
+    t2 = FlowTable.from_stats([_stats(1, 30, 3000, 12),
+                               _stats(2, 5, 500, 12),
+                               _stats(4, 2, 200, 1),
+                               _stats(4, 1, 100, 1), # Same cookie; summed
+                               _stats(3, 1, 100, 0)], # Replaced
+                              cookie_key, now=102)
+    d = flow_delta(t1, t2)
+    self.assertEqual(d.keys, [1,4,3])
+    self.assertEqual(list(d.packets), [20,3,1])
+    self.assertEqual(list(d.bytes), [2000,300,100])
+    self.assertEqual(list(d.byte_rate), [1000,150,50])
+    self.assertEqual(d.removed, [])
+    self.assertEqual(list(t2.byte_rate), [1000,0,150,50])
+
+    t3 = FlowTable.from_stats([_stats(1, 30, 3000, 14)], cookie_key, now=104)
+    d = flow_delta(t2, t3)
+    self.assertEqual(len(d), 0)
+    self.assertEqual(d.removed, [2,4,3])
+
+  def test_python (self):
+    numpy = flow_stats.numpy
+    flow_stats.numpy = None
+    try:
+      self._check()
+    finally:
+      flow_stats.numpy = numpy
+
+  @unittest.skipIf(flow_stats.numpy is None, "NumPy unavailable")
+  def test_numpy (self):
+    self._check()
+
+
+class CollectorTest (unittest.TestCase):
+  def setUp (self):
+    self.openflow = FakeOpenFlow()
+    core.register("openflow", self.openflow)
+    self.nexus = MessengerNexus()
+    core.register("MessengerNexus", self.nexus)
+    self.c = FlowStatsCollector(interval=10, key='cookie', retention=25)
+    self.c._timer.cancel()
+
+  def tearDown (self):
+    core.components.pop("MessengerNexus", None)
+
+  def _up (self, dpid):
+    self.openflow.connections[dpid] = FakeConnection(dpid)
+    self.c._handle_openflow_ConnectionUp(FakeEvent(dpid=dpid))
+
+  def _reply (self, dpid, *stats):
+    con = self.openflow.connections[dpid]
+    sr = con.sent.pop()
+    reply = of.ofp_stats_reply(xid=sr.xid, type=of.OFPST_FLOW,
+                               body=list(stats))
+    self.c._handle_openflow_FlowStatsReceived(FakeEvent(dpid=dpid,
+        ofp=[reply], stats=list(stats)))
+
+  def test_staggered (self):
+    for dpid in range(1, 6):
+      self._up(dpid)
+    due = sorted(self.c._due.values())
+    self.assertTrue(due[-1] - due[0] > 5)
+    # Each switch is polled once per interval
+    self.c._tick()
+    self.assertTrue(sum(len(c.sent) for c in
+                        self.openflow.connections.values()) <= 1)
+    for t in self.c._due:
+      self.c._due[t] -= 10
+    self.c._schedule = [(d,t) for t,d in self.c._due.items()]
+    self.c._tick()
+    for con in self.openflow.connections.values():
+      self.assertEqual(len(con.sent), 1)
+
+  def test_deltas (self):
+    transport = FakeTransport(self.nexus)
+    early = FakeMessengerConnection(transport)
+    chan = self.nexus.get_channel("flow_stats")
+    chan._add_member(early)
+    deltas = []
+    self.c.addListenerByName("FlowStatsDelta", deltas.append)
+
+    self._up(1)
+    self.c._poll(1)
+    self._reply(1, _stats(7, 10, 1000), _stats(8, 1, 100))
+    self.c._poll(1)
+    self._reply(1, _stats(7, 20, 2000, 11), _stats(8, 1, 100, 11))
+    self.assertEqual(len(deltas), 2)
+    self.assertEqual(deltas[1].keys, [7])
+    self.assertEqual(len(self.c.history(1)), 2)
+
+    first,second = early.sent
+    self.assertEqual([l[1] for l in first['new']],
+                     [{'cookie':7}, {'cookie':8}])
+    fid = first['new'][0][0]
+    self.assertNotIn('new', second)
+    self.assertEqual(second['flows'][0][:3], [fid, 10, 1000])
+
+    # Latecomers get a snapshot
+    late = FakeMessengerConnection(transport)
+    chan._add_member(late)
+    snap = late.sent[0]
+    self.assertTrue(snap['full'])
+    self.assertEqual(sorted(f[1] for f in snap['flows']), [1,20])
+    self.assertEqual(len(snap['new']), 2)
+
+    self.c._handle_openflow_ConnectionDown(FakeEvent(dpid=1))
+    self.assertEqual(len(deltas[-1].removed), 2)
+    self.assertEqual(self.c.tables, {})
+    self.assertEqual(self.c._labels, {})
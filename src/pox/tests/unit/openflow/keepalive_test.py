@@ -0,0 +1,121 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import time
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import EchoReply
+from pox.openflow.keepalive import Keepalive, RTTHistogram
+from tests.unit.fakes import FakeEvent, FakeConnection, FakeOpenFlow
+
+
+class RTTHistogramTest (unittest.TestCase):
+  def test_histogram (self):
+    h = RTTHistogram()
+    self.assertEqual(h.percentile(50), None)
+    for rtt in [0.0001, 0.0009, 0.0011, 0.0012, 30]:
+      h.add(rtt)
+    self.assertEqual(h.counts[0], 1) # Under 0.125ms
+    self.assertEqual(h.counts[3], 1) # 0.5 to 1ms
+    self.assertEqual(h.counts[4], 2) # 1 to 2ms
+    self.assertEqual(h.counts[-1], 1)
+    self.assertEqual(h.min, 0.0001)
+    self.assertEqual(h.max, 30)
+    self.assertEqual(h.percentile(50), 0.002)
+    self.assertEqual(h.percentile(100), 30)
+
+
+class KeepaliveTest (unittest.TestCase):
+  def setUp (self):
+    self.openflow = FakeOpenFlow()
+    core.register("openflow", self.openflow)
+    self.k = Keepalive(interval=20, timeout=3)
+    self.k._timer.cancel()
+    self.rtts = []
+    self.k.addListenerByName("EchoRTT", lambda e: self.rtts.append(e.rtt))
+
+  def _up (self, dpid):
+    con = self.openflow.connections[dpid] = FakeConnection(dpid)
+    self.k._handle_openflow_ConnectionUp(FakeEvent(dpid=dpid))
+    return con
+
+  def _run (self, dpid, ago = 0):
+    # Make the next check for dpid due (ago seconds ago) and tick
+    self.k._check_at(dpid, time.time() - ago)
+    self.k._tick()
+
+  def test_stagger (self):
+    for dpid in range(1, 11):
+      self._up(dpid)
+    due = sorted(self.k._due.values())
+    self.assertTrue(due[-1] - due[0] > 10)
+    self.k._tick()
+    self.assertTrue(sum(len(c.sent) for c in self.openflow.connections) < 3)
+
+  def test_skip_busy (self):
+    con = self._up(1)
+    self._run(1)
+    self.assertEqual(con.sent, [])
+    self.assertTrue(self.k._due[1] > time.time() + 19)
+
+  def test_rtt (self):
+    con = self._up(1)
+    con.idle_time -= 25
+    self._run(1)
+    self.assertEqual(len(con.sent), 1)
+    echo = of.ofp_echo_request()
+    echo.unpack(con.sent[0])
+    # Reusing the same bytes for the next one
+    other = self._up(2)
+    other.idle_time -= 25
+    self._run(2)
+    self.assertTrue(other.sent[0] is con.sent[0])
+
+    self.k._sent[1] -= 0.002
+    reply = of.ofp_echo_reply(xid=echo.xid)
+    self.k._handle_openflow_EchoReply(EchoReply(con, reply))
+    # Someone else's echo
+    reply = of.ofp_echo_reply(xid=echo.xid + 1)
+    self.k._handle_openflow_EchoReply(EchoReply(other, reply))
+
+    self.assertEqual(len(self.rtts), 1)
+    self.assertTrue(0.002 <= self.rtts[0] < 1)
+    self.assertEqual(self.k.rtt[1].count, 1)
+    self.assertFalse(2 in self.k.rtt)
+
+  def test_timeout (self):
+    con = self._up(1)
+    con.idle_time -= 25
+    self._run(1)
+    self.assertEqual(con.disconnected, None)
+    self.k._sent[1] -= 3
+    self._run(1)
+    self.assertEqual(con.disconnected, "timed out")
+
+  def test_alive (self):
+    con = self._up(1)
+    con.idle_time -= 25
+    self._run(1)
+    self.k._sent[1] -= 3
+    con.idle_time = time.time() # It said something
+    self._run(1)
+    self.assertEqual(con.disconnected, None)
+    self.assertEqual(len(con.sent), 1)
@@ -0,0 +1,114 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+import pox.openflow.link_utilization as lu
+from pox.openflow.link_utilization import LinkUtilization, PortLoad
+import pox.openflow.libopenflow_01 as of
+from tests.unit.fakes import FakeEvent, FakeOpenFlow, FakeClock
+
+
+MBIT = 1000000 / 8 # Bytes in a megabit
+
+
+class PortLoadTest (unittest.TestCase):
+  def test_rate (self):
+    load = PortLoad(10000000)
+    self.assertEqual(load.utilization, None)
+    load.update(0, 1000.0, 0.5)
+    self.assertEqual(load.rate, None)
+    load.update(10 * MBIT, 1001.0, 0.5)
+    self.assertEqual(load.rate, 10000000)
+    self.assertEqual(load.utilization, 1.0)
+    load.update(10 * MBIT, 1002.0, 0.5) # Idle for a second
+    self.assertEqual(load.rate, 5000000)
+    load.update(0, 1003.0, 0.5) # Counter reset; no sample
+    self.assertEqual(load.rate, 5000000)
+
+  def test_unknown_capacity (self):
+    load = PortLoad(None)
+    load.update(0, 1000.0, 0.5)
+    load.update(MBIT, 1001.0, 0.5)
+    self.assertEqual(load.rate, 1000000)
+    self.assertEqual(load.utilization, None)
+
+
+class LinkUtilizationTest (unittest.TestCase):
+  def setUp (self):
+    self.clock = FakeClock()
+    self._time = lu.time
+    lu.time = self.clock
+    core.register("openflow", FakeOpenFlow())
+    self.lu = LinkUtilization(capacity = 10000000)
+    self.lu._timer.cancel()
+    self.events = []
+    self.lu.addListenerByName("Congestion", self.events.append)
+    ports = [of.ofp_phy_port(port_no=p) for p in (1, 2, of.OFPP_LOCAL)]
+    self.lu._handle_openflow_ConnectionUp(FakeEvent(dpid=1,
+        ofp=FakeEvent(ports=ports)))
+    self.tx = 0
+
+  def tearDown (self):
+    lu.time = self._time
+
+  def _stats (self, mbits, seconds = 1):
+    """
+    Reports that port 1 sent mbits more in the last few seconds
+    """
+    self.clock.now += seconds
+    self.tx += int(mbits * MBIT)
+    self.lu._handle_openflow_PortStatsReceived(FakeEvent(dpid=1,
+        stats=[of.ofp_port_stats(port_no=1, tx_bytes=self.tx),
+               of.ofp_port_stats(port_no=2, tx_bytes=0)]))
+
+  def test_ports (self):
+    self.assertEqual(sorted(self.lu.ports), [(1,1),(1,2)])
+    self.assertEqual(self.lu.utilization(1, 1), None)
+
+  def test_congestion (self):
+    self._stats(0)
+    self._stats(5)
+    self.assertEqual(self.lu.utilization(1, 1), 0.5)
+    self.assertEqual(self.lu.utilization(1, 2), 0)
+    self.assertEqual(self.events, [])
+
+    self._stats(11) # Smoothed to 8Mbps
+    e, = self.events
+    self.assertEqual((e.dpid, e.port, e.congested), (1, 1, True))
+    self.assertEqual(e.utilization, 0.8)
+    self.assertTrue(self.lu.is_congested(1, 1))
+    self.assertFalse(self.lu.is_congested(1, 2))
+
+    # A little below the threshold isn't enough to clear it...
+    self._stats(6.8) # 7.4Mbps
+    self.assertEqual(len(self.events), 1)
+    # ...but well below it is
+    self._stats(0)
+    e = self.events[-1]
+    self.assertEqual((e.port, e.congested), (1, False))
+    self.assertFalse(self.lu.is_congested(1, 1))
+
+  def test_port_gone (self):
+    self.lu._handle_openflow_PortStatus(FakeEvent(dpid=1, port=2,
+                                                  deleted=True))
+    self.assertEqual(sorted(self.lu.ports), [(1,1)])
+    self.lu._handle_openflow_ConnectionDown(FakeEvent(dpid=1))
+    self.assertEqual(self.lu.ports, {})
@@ -0,0 +1,114 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+from pox.openflow.libopenflow_01 import *
+from pox.openflow.match_key import *
+from pox.openflow.flow_table import TableEntry, FlowTable
+from pox.lib.packet import *
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def _eth (payload, eth_type, vlan_id = None):
+  e = ethernet(src=EthAddr("00:00:00:00:00:01"),
+               dst=EthAddr("00:00:00:00:00:02"))
+  if vlan_id is None:
+    e.type = eth_type
+    e.payload = payload
+  else:
+    e.type = ethernet.VLAN_TYPE
+    v = vlan(id=vlan_id, pcp=3, eth_type=eth_type)
+    v.payload = payload
+    e.payload = v
+  return e
+
+
+def _ip (proto, tp, frag = 0):
+  i = ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.1.2"),
+           protocol=proto, tos=4, frag=frag)
+  i.payload = tp
+  return i
+
+
+def _frames ():
+  t = tcp(srcport=1234, dstport=80, off=5)
+  t.payload = b'x' * 10
+  u = udp(srcport=53, dstport=5353)
+  u.payload = b'y' * 10
+  c = icmp(type=8, code=0)
+  c.payload = b'z' * 10
+  a = arp(opcode=arp.REQUEST, hwsrc=EthAddr("00:00:00:00:00:01"),
+          protosrc=IPAddr("10.0.0.1"), protodst=IPAddr("10.0.0.9"))
+  yield _eth(_ip(ipv4.TCP_PROTOCOL, t), ethernet.IP_TYPE).pack()
+  yield _eth(_ip(ipv4.UDP_PROTOCOL, u), ethernet.IP_TYPE).pack()
+  yield _eth(_ip(ipv4.ICMP_PROTOCOL, c), ethernet.IP_TYPE).pack()
+  yield _eth(_ip(ipv4.TCP_PROTOCOL, t), ethernet.IP_TYPE, 7).pack()
+  yield _eth(_ip(ipv4.TCP_PROTOCOL, t, frag=100), ethernet.IP_TYPE).pack()
+  yield _eth(_ip(47, b'gre'), ethernet.IP_TYPE).pack()
+  yield _eth(a, ethernet.ARP_TYPE).pack()
+  yield _eth(b'whatever', 0x88b5).pack()
+
+
+class MatchKeyTest (unittest.TestCase):
+  def test_from_packet (self):
+    """
+    Keys turn into the same matches as ofp_match.from_packet()
+    """
+    for data in _frames():
+      for spec_frags in (True, False):
+        key = match_key(data, 3, spec_frags=spec_frags)
+        if key is None:
+          self.assertFalse(spec_frags)
+          continue
+        m = ofp_match.from_packet(ethernet(data), 3, spec_frags=spec_frags)
+        self.assertEqual(key_to_match(key), m)
+        self.assertEqual(len(key), len(KEY_FIELDS))
+        hash(key)
+
+  def test_not_handled (self):
+    self.assertIsNone(match_key(b'\x00' * 10))
+    llc_frame = _eth(b'\xaa\xaa\x03\x00\x00\x00\x08\x00', 8).pack()
+    self.assertIsNone(match_key(llc_frame))
+
+  def test_matcher (self):
+    """
+    key_matcher() agrees with matches_with_wildcards()
+    """
+    matches = [ofp_match(),
+               ofp_match(in_port=3),
+               ofp_match(in_port=4),
+               ofp_match(dl_type=0x800, nw_dst="10.0.1.0/24"),
+               ofp_match(dl_type=0x800, nw_src="10.0.0.0/16", tp_dst=80),
+               ofp_match(dl_type=0x800, nw_src="10.1.0.0/16"),
+               ofp_match(dl_src=EthAddr("00:00:00:00:00:01"), dl_vlan=7),
+               ofp_match(nw_proto=arp.REQUEST, dl_type=0x806),
+               ofp_match(tp_src=8, tp_dst=0)]
+    for data in _frames():
+      key = match_key(data, 3)
+      pm = ofp_match.from_packet(ethernet(data), 3, spec_frags=True)
+      for m in matches:
+        self.assertEqual(key_matcher(m)(key),
+                         m.matches_with_wildcards(pm,
+                                consider_other_wildcards=False), str(m))
+
+  def test_flow_table (self):
+    table = FlowTable()
+    table.add_entry(TableEntry(priority=5, match=ofp_match(tp_dst=80)))
+    table.add_entry(TableEntry(priority=1, match=ofp_match()))
+    for data in _frames():
+      packet = ethernet(data)
+      self.assertIs(table.entry_for_packet(packet, 1, data),
+                    table.entry_for_packet(packet, 1))
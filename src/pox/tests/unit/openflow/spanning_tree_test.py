@@ -0,0 +1,169 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import random
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.openflow.spanning_tree as st
+from pox.openflow.spanning_tree import SpanningTree
+from pox.openflow.discovery import Link
+from tests.unit.fakes import FakeEvent, FakeClock
+
+
+def _components (nodes, adj):
+  comp = {}
+  for n in nodes:
+    if n in comp: continue
+    comp[n] = n
+    todo = [n]
+    while todo:
+      x = todo.pop()
+      for y in adj.get(x, ()):
+        if y not in comp:
+          comp[y] = n
+          todo.append(y)
+  return comp
+
+
+class SpanningTreeTest (unittest.TestCase):
+  def _check (self, st, nodes):
+    adj = dict((n,dict(st.adj[n])) for n in nodes)
+    tree = dict((n,dict(st.tree[n])) for n in nodes)
+    edges = set()
+    for n in nodes:
+      for m,port in tree[n].items():
+        # Tree links are real links
+        self.assertEqual(adj[n][m], port)
+        self.assertIn(n, tree[m])
+        edges.add(frozenset((n,m)))
+    # A spanning forest has exactly (nodes - components) edges and the
+    # same components as the graph
+    ac = _components(nodes, adj)
+    tc = _components(nodes, tree)
+    self.assertEqual(len(edges), len(nodes) - len(set(ac.values())))
+    for a in nodes:
+      for b in nodes:
+        self.assertEqual(ac[a] == ac[b], tc[a] == tc[b])
+
+  def test_ring (self):
+    st = SpanningTree()
+    for i in range(1, 5):
+      j = i % 4 + 1
+      st.add_link(Link(i, 2, j, 1))
+      st.add_link(Link(j, 1, i, 2))
+    self._check(st, range(1, 5))
+    flooding = [st.should_flood(i, p) for i in range(1, 5) for p in (1,2)]
+    self.assertEqual(flooding.count(False), 2)
+    self.assertTrue(st.should_flood(1, 3)) # Edge port
+
+    # Break a tree link; the spare one should take over
+    for n,neighbors in st.tree.items():
+      if neighbors:
+        m,port = neighbors.items()[0]
+        break
+    for l in list(st._links):
+      if set((l.dpid1,l.dpid2)) == set((n,m)): st.remove_link(l)
+    self._check(st, range(1, 5))
+    self.assertEqual(len(st.changed) > 0, True)
+
+  def test_random (self):
+    rng = random.Random(35)
+    nodes = range(20)
+    st = SpanningTree()
+    live = set()
+    for i in range(400):
+      a,b = rng.sample(nodes, 2)
+      pa,pb = rng.randint(1,3),rng.randint(1,3)
+      if rng.random() < 0.55:
+        for l in (Link(a,pa,b,pb), Link(b,pb,a,pa)):
+          st.add_link(l)
+          live.add(l)
+      elif live:
+        l = rng.choice(list(live))
+        live.discard(l)
+        st.remove_link(l)
+      self._check(st, nodes)
+      connected = set((l.dpid1,l.dpid2) for l in live
+                      if Link(l.dpid2,l.port2,l.dpid1,l.port1) in live)
+      self.assertEqual(connected, set((a,b) for a in nodes
+                                      for b in st.adj[a]))
+
+
+class FakeTimer (object):
+  def __init__ (self, delay, callback):
+    self.delay = delay
+    self.callback = callback
+    self.cancelled = False
+    FakeTimer.timers.append(self)
+
+  def cancel (self):
+    self.cancelled = True
+
+
+class DebounceTest (unittest.TestCase):
+  def setUp (self):
+    self._saved = (st.Timer, st.time, st._update_tree, st._tree,
+                   st._update_timer)
+    FakeTimer.timers = []
+    self.clock = FakeClock()
+    self.updates = 0
+    def update ():
+      self.updates += 1
+      st._update_timer = None
+    st.Timer = FakeTimer
+    st.time = self.clock
+    st._update_tree = update
+    st._tree = SpanningTree()
+    st._update_timer = None
+
+  def tearDown (self):
+    (st.Timer, st.time, st._update_tree, st._tree,
+     st._update_timer) = self._saved
+
+  def _flap (self, count, spacing):
+    for i in range(count):
+      st._handle_LinkEvent(FakeEvent(link=Link(1, 1, 2, 1),
+                                     added=i % 2 == 0))
+      self.clock.now += spacing
+
+  def _live (self):
+    return [t for t in FakeTimer.timers if not t.cancelled]
+
+  def _fire (self):
+    for t in self._live():
+      t.cancelled = True
+      t.callback()
+
+  def test_quiet_period (self):
+    # Events closer together than the period keep putting the update off
+    self._flap(8, st._debounce_period * 0.6)
+    self.assertEqual(len(FakeTimer.timers), 8)
+    self.assertEqual(self._live(), [FakeTimer.timers[-1]])
+    self._fire()
+    self.assertEqual(self.updates, 1)
+
+  def test_limit (self):
+    # ... but not forever
+    spacing = st._debounce_period * 0.6
+    self._flap(int(st._debounce_limit / spacing) + 5, spacing)
+    self.assertEqual(len(self._live()), 1)
+    self.assertLess(len(FakeTimer.timers) * spacing,
+                    st._debounce_limit + spacing * 2)
+    self._fire()
+    self.assertEqual(self.updates, 1)
+
+    # Then it starts over
+    self._flap(1, 0)
+    self.assertEqual(self._live(), [FakeTimer.timers[-1]])
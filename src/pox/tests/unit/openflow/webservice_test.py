@@ -0,0 +1,135 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import json
+import threading
+from StringIO import StringIO
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.webservice import (OFFlowStatsRequest, OFSwitchDescRequest,
+                                     OFRequestHandler)
+from tests.unit.fakes import FakeEvent, FakeConnection, FakeOpenFlow
+
+
+class FakeParent (object):
+  """
+  Just enough of a request for a handler to work with
+  """
+  def __init__ (self, body):
+    self.command = "POST"
+    self.request_version = "HTTP/1.1"
+    self.close_connection = 0
+    self.raw_requestline = "POST / HTTP/1.1"
+    self.requestline = self.raw_requestline
+    self.path = "/"
+    self.headers = {"Content-Length":str(len(body))}
+    self.rfile = StringIO(body)
+    self.wfile = StringIO()
+    self.server = None
+    self.client_address = ("127.0.0.1", 0)
+
+
+def _flow_stats_reply (xid, *cookies):
+  stats = []
+  for c in cookies:
+    s = of.ofp_flow_stats(cookie=c, match=of.ofp_match())
+    stats.append(s)
+  r = of.ofp_stats_reply(xid=xid, type=of.OFPST_FLOW, body=stats)
+  return FakeEvent(ofp=[r], stats=stats)
+
+
+class WebserviceTest (unittest.TestCase):
+  def setUp (self):
+    # Run requests' setup right away instead of on the cooperative thread
+    core.callLater = lambda f, *args, **kw: f(*args, **kw)
+    self.cons = [FakeConnection(dpid) for dpid in (1,2)]
+    core.register("openflow", FakeOpenFlow(*self.cons))
+
+  def tearDown (self):
+    del core.callLater
+
+  def _reply_all (self):
+    for con in self.cons:
+      for msg in con.sent:
+        con.listeners._handle_FlowStatsReceived(
+            _flow_stats_reply(msg.xid, con.dpid))
+      del con.sent[:]
+
+  def test_coalesce (self):
+    con = self.cons[0]
+    a = OFFlowStatsRequest.get(con)
+    b = OFFlowStatsRequest.get(con)
+    c = OFFlowStatsRequest.get(con, out_port=3)
+    self.assertTrue(a is b)
+    self.assertFalse(a is c)
+    self.assertEqual(len(con.sent), 2)
+    self._reply_all()
+    self.assertTrue(a.done and c.done)
+    r = a.get_response()['result']
+    self.assertEqual(r['flowstats'][0]['cookie'], 1)
+    self.assertEqual(r['dpid'], "00-00-00-00-00-01")
+
+    # Finished requests aren't reused
+    self.assertFalse(OFFlowStatsRequest.get(con) is a)
+
+  def test_xid (self):
+    con = self.cons[0]
+    a = OFSwitchDescRequest(con)
+    b = OFFlowStatsRequest.get(con)
+    con.listeners._handle_FlowStatsReceived(_flow_stats_reply(a.xid, 1))
+    self.assertFalse(a.done or b.done)
+    con.listeners._handle_FlowStatsReceived(_flow_stats_reply(b.xid, 1))
+    self.assertTrue(b.done)
+    self.assertFalse(a.done)
+    self.assertEqual(list(con.listeners.requests), [a.xid])
+
+  def test_disconnect (self):
+    con = self.cons[0]
+    a = OFFlowStatsRequest.get(con)
+    con.listeners._handle_ConnectionDown(FakeEvent(connection=con))
+    self.assertTrue('error' in a.get_response())
+    self.assertEqual(con.listeners, None)
+
+  def test_timeout (self):
+    a = OFFlowStatsRequest.get(self.cons[0])
+    self.assertTrue('error' in a.get_response(timeout=0))
+    self.assertEqual(self.cons[0]._webservice_dispatcher.requests, {})
+
+  def test_batch (self):
+    # Everything in a batch is sent before waiting on any of it
+    body = json.dumps([{"method":"get_flow_stats", "id":i,
+                        "params":{"dpid":"00-00-00-00-00-0%s" % (i%2+1)}}
+                       for i in range(4)])
+    parent = FakeParent(body)
+    handler = OFRequestHandler(parent, "/OF/", {})
+    sent = []
+    def reply ():
+      sent.append(sum(len(c.sent) for c in self.cons))
+      self._reply_all()
+    t = threading.Timer(0.1, reply)
+    t.start()
+    handler.do_POST()
+    t.join()
+    self.assertEqual(sent, [2])
+    out = parent.wfile.getvalue()
+    r = json.loads(out[out.index("\r\n\r\n"):])
+    self.assertEqual([x['id'] for x in r], range(4))
+    self.assertEqual([x['result']['dpid'][-1] for x in r], list("1212"))
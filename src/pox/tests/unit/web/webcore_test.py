@@ -0,0 +1,80 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+import sys
+import os.path
+import socket
+import threading
+import time
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+
+from pox.web.webcore import (SplitThreadedServer, SplitterRequestHandler,
+                             SplitRequestHandler)
+
+
+class HelloHandler (SplitRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET (self):
+    self.send_response(200)
+    self.send_header("Content-Length", "5")
+    self.end_headers()
+    self.wfile.write("hello")
+
+  def log_request (self, *args):
+    pass
+
+
+class ShortTimeoutHandler (SplitterRequestHandler):
+  timeout = 0.5
+
+
+class KeepAliveTest (unittest.TestCase):
+  def setUp (self):
+    self.server = SplitThreadedServer(("127.0.0.1", 0), ShortTimeoutHandler)
+    self.server.daemon_threads = True
+    self.server.set_handler("/hello", HelloHandler)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.sock = socket.create_connection(self.server.socket.getsockname())
+    self.sock.settimeout(5)
+
+  def tearDown (self):
+    self.sock.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _get (self):
+    self.sock.sendall("GET /hello/ HTTP/1.1\r\nHost: x\r\n\r\n")
+    data = ""
+    while not data.endswith("hello"):
+      d = self.sock.recv(4096)
+      self.assertTrue(d, "Connection closed early")
+      data += d
+    self.assertTrue(data.startswith("HTTP/1.1 200"))
+
+  def test_kept_alive (self):
+    self._get()
+    self._get()
+
+  def test_idle_closed (self):
+    self._get()
+    start = time.time()
+    self.assertEqual(self.sock.recv(4096), "")
+    self.assertLess(time.time() - start, 3)
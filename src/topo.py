@@ -59,8 +59,47 @@ class LivestreamingMultiTopo(Topo):
         self.addLink(s2, hs, **cdn_link_opts)
 
 
+class LivestreamingTreeTopo(Topo):
+    """
+    Viewers behind several edge switches, which share one aggregation switch
+    and one CDN uplink:
+
+                            hs (CDN)
+                             |
+                             | 2Mbps, 300ms
+                             |
+                            s1
+                          /  |  \
+                        s2  s3 ... (num_edges edge switches)
+                       /|\
+                 hr2 hb hv2_1 ...
+
+    Every edge switch has a relay host hr<i> on port 1 for use with
+    `livestreaming.multicast --relays=2.1,3.1,...`. The broadcaster is on s2.
+    """
+
+    def build(self, num_edges=2, num_viewers=1):
+        lan_link_opts = dict(bw=4, delay='100ms')
+        cdn_link_opts = dict(bw=2, delay='300ms')
+
+        s1 = self.addSwitch('s1')
+        hs = self.addHost('hs')
+        self.addLink(s1, hs, **cdn_link_opts)
+
+        for i in range(2, num_edges+2):
+            edge = self.addSwitch('s'+str(i))
+            self.addLink(edge, self.addHost('hr'+str(i)), **lan_link_opts)
+            if i == 2:
+                self.addLink(edge, self.addHost('hb'), **lan_link_opts)
+            for j in range(1, num_viewers+1):
+                hv = self.addHost('hv'+str(i)+'_'+str(j))
+                self.addLink(edge, hv, **lan_link_opts)
+            self.addLink(edge, s1, **lan_link_opts)
+
+
 # Add to `topos` dict to make it visible to CLI.
 # Usage: `sudo mn --custom src/topo.py --topo <Name>[,Param] --link=tc --mac
 #         --controller remote --switch ovsk`.
 topos = {'livestreaming_single': (lambda n=1: LivestreamingSingleTopo(num_viewers=n)),
-         'livestreaming_multi':  (lambda: LivestreamingMultiTopo())}
+         'livestreaming_multi':  (lambda: LivestreamingMultiTopo()),
+         'livestreaming_tree':   (lambda e=2, n=1: LivestreamingTreeTopo(num_edges=e, num_viewers=n))}